@@ -0,0 +1,159 @@
+# backend-event-listener/benchmarks/change_serialization.py
+"""
+Confronta il costo per evento della costruzione del messaggio Redis a partire da un evento
+Change Stream, senza MongoDB né Redis:
+
+  legacy     documento completo (come con full_document='updateLookup' e nessun $project),
+             visita chiave per chiave per convertire ObjectId/datetime/bytes, poi json.dumps
+  current    documento ridotto ai campi della $project di CHANGE_STREAM_PIPELINE (come
+             inviato dal server) e build_change_message con il serializzatore in un passaggio
+
+Per gli update confronta anche la dimensione del messaggio con updateLookup e con il solo
+delta (updateDescription.updatedFields).
+
+    python benchmarks/change_serialization.py --events 50000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--events", type=int, default=50000)
+args = parser.parse_args()
+
+os.environ.setdefault("SCIENTIFIC_CONTENT_NFT_CONTRACT_ADDRESS", "0x" + "11" * 20)
+os.environ.setdefault("SCIENTIFIC_CONTENT_MARKETPLACE_CONTRACT_ADDRESS", "0x" + "22" * 20)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.INFO)
+
+from bson.objectid import ObjectId
+
+from message_serializer import orjson
+from mongodb_listener import CHANGE_STREAM_PIPELINE, build_change_message
+
+
+def synthetic_event_document(index):
+    """Documento come quelli scritti da handle_event per un evento NFTPurchased."""
+    return {
+        "_id": ObjectId(),
+        "args": {
+            "tokenId": index,
+            "buyer": "0x" + f"{index:040x}",
+            "seller": "0x" + "33" * 20,
+            "price": str(10**18 + index),
+        },
+        "event": "NFTPurchased",
+        "logIndex": index % 50,
+        "transactionIndex": index % 20,
+        "transactionHash": f"{index:064x}",
+        "address": "0x" + "22" * 20,
+        "blockHash": os.urandom(32),
+        "blockNumber": 176973973 + index,
+        "blockTimestamp": datetime.utcnow(),
+        "timestamp_processed": datetime.utcnow(),
+    }
+
+
+def synthetic_status_document(index):
+    """Record frontend_tx_status come quelli salvati da /api/transactions."""
+    return {
+        "_id": f"{index:064x}_frontend_tx_status",
+        "transactionHash": f"{index:064x}",
+        "from": "0x" + "44" * 20,
+        "to": "0x" + "22" * 20,
+        "value": "0",
+        "gasPrice": "100000000",
+        "gasUsed": "210000",
+        "blockNumber": None,
+        "timestamp": datetime.utcnow().isoformat(),
+        "methodName": "purchaseNFT",
+        "contractName": "DnAContentMarketplace",
+        "chainId": 421614,
+        "status": "pending",
+        "errorMessage": None,
+        "metadata_frontend_tx": {"methodName": "purchaseNFT", "args": [str(index)], "description": "x" * 200},
+        "source": "frontend_tx_status",
+        "createdAt": datetime.utcnow().isoformat(),
+    }
+
+
+def legacy_build_message(change):
+    full_document = change["fullDocument"]
+    if isinstance(full_document.get("_id"), ObjectId):
+        full_document["_id"] = str(full_document["_id"])
+    for key, value in full_document.items():
+        if isinstance(value, datetime):
+            full_document[key] = value.isoformat()
+        elif isinstance(value, bytes):
+            try:
+                full_document[key] = value.decode("utf-8")
+            except UnicodeDecodeError:
+                full_document[key] = value.hex()
+    return json.dumps({
+        "operationType": change["operationType"],
+        "fullDocument": full_document,
+        "wallClockTime": datetime.utcnow().isoformat(),
+        "eventName": full_document.get("event") or "N/A",
+    })
+
+
+# Campi di fullDocument mantenuti dalla $project del server
+PROJECTED_FIELDS = {
+    path.split(".", 1)[1] for path in CHANGE_STREAM_PIPELINE[-1]["$project"] if path.startswith("fullDocument.")
+}
+
+
+def projected(document):
+    return {key: value for key, value in document.items() if key in PROJECTED_FIELDS}
+
+
+def measure(build, changes):
+    started = time.perf_counter()
+    total_bytes = 0
+    for change in changes:
+        total_bytes += len(build(change))
+    elapsed = time.perf_counter() - started
+    return {
+        "events_per_second": round(len(changes) / elapsed),
+        "microseconds_per_event": round(elapsed / len(changes) * 1e6, 2),
+        "bytes_per_event": round(total_bytes / len(changes), 1),
+    }
+
+
+def main():
+    documents = [synthetic_event_document(i) for i in range(args.events)]
+    legacy_inserts = [{"operationType": "insert", "fullDocument": dict(document)} for document in documents]
+    current_inserts = [{"operationType": "insert", "fullDocument": projected(document)} for document in documents]
+
+    status_documents = [synthetic_status_document(i) for i in range(args.events)]
+    lookup_updates = [{"operationType": "update", "fullDocument": projected(document)} for document in status_documents]
+    delta_updates = [{
+        "operationType": "update",
+        "documentKey": {"_id": document["_id"]},
+        "updateDescription": {"updatedFields": {"status": "confirmed", "gasUsed": "53211", "blockNumber": 176973999}},
+    } for document in status_documents]
+
+    result = {
+        "benchmark": "change_event_serialization",
+        "events": args.events,
+        "serializer": "orjson" if orjson is not None else "json",
+        "insert": {
+            "legacy": measure(legacy_build_message, legacy_inserts),
+            "current": measure(build_change_message, current_inserts),
+        },
+        "update": {
+            "update_lookup": measure(build_change_message, lookup_updates),
+            "delta_only": measure(build_change_message, delta_updates),
+        },
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# backend-event-listener/benchmarks/changestream_latency.py
+"""
+Misura il ritardo Change Stream -> Redis (inserimento in MongoDB -> messaggio ricevuto
+sul canale Redis) mentre nello stesso event loop gira un carico di ingest simulato.
+
+Richiede un mongod locale avviato come replica set (i Change Stream non funzionano su
+un'istanza standalone) e un redis-server locale, ad esempio:
+
+    mongod --replSet rs0 --dbpath /tmp/mongo-bench &
+    mongosh --eval "rs.initiate()"
+    redis-server &
+
+    python benchmarks/changestream_latency.py --load async
+    python benchmarks/changestream_latency.py --load blocking
+
+--load none      nessun carico concorrente (baseline)
+--load async     ingest come nel listener attuale: Motor + insert_many a batch, RPC simulate con await
+--load blocking  ingest come prima della migrazione: insert_one pymongo e RPC simulate con time.sleep
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017/?replicaSet=rs0&directConnection=true")
+parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+parser.add_argument("--db-name", default="DnaBenchmarkDB")
+parser.add_argument("--probes", type=int, default=200, help="numero di documenti sonda da inserire")
+parser.add_argument("--probe-interval", type=float, default=0.02, help="secondi tra due sonde")
+parser.add_argument("--load", choices=["none", "async", "blocking"], default="async")
+parser.add_argument("--rpc-latency", type=float, default=0.05, help="latenza simulata di una chiamata RPC (s)")
+parser.add_argument("--events-per-window", type=int, default=200, help="eventi sintetici per finestra di backfill")
+args = parser.parse_args()
+
+# config.py legge le variabili d'ambiente all'import: vanno impostate prima
+os.environ["MONGODB_URI"] = args.mongodb_uri
+os.environ["REDIS_URL"] = args.redis_url
+os.environ["DB_NAME"] = args.db_name
+os.environ["COLLECTION_NAME"] = "events"
+os.environ["REDIS_CHANNEL"] = "benchmark_events"
+os.environ["CHANGE_STREAM_DOCUMENT_FIELDS"] = "event,bench_sent_at"  # campi letti dal benchmark
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.INFO)
+
+import redis.asyncio as redis
+from pymongo import MongoClient
+
+from config import REDIS_CHANNEL
+from event_writer import EventBatchWriter
+from mongo_client import get_mongo_client
+from mongodb_listener import listen_for_db_changes
+from reorg_guard import CHECKPOINT_ID, checkpoint_collection
+
+
+def synthetic_event_documents(window_index, count):
+    return [
+        {
+            "event": "Transfer",
+            "args": {"from": "0x" + "00" * 20, "to": "0x" + "11" * 20, "tokenId": window_index * count + i},
+            "blockNumber": window_index,
+            "transactionHash": f"{window_index:064x}",
+            "logIndex": i,
+        }
+        for i in range(count)
+    ]
+
+
+async def async_backfill_load(collection, stop):
+    async def save_checkpoint(db_collection, block_number, scan_range_size, block_hash=None):
+        await checkpoint_collection(db_collection).update_one({"_id": CHECKPOINT_ID}, {"$set": {"block_number": block_number}}, upsert=True)
+
+    writer = EventBatchWriter(collection, save_checkpoint, max_batch_size=500, max_batch_seconds=1)
+    window_index = 0
+    while not stop.is_set():
+        await asyncio.sleep(args.rpc_latency)  # eth_getLogs
+        for document in synthetic_event_documents(window_index, args.events_per_window):
+            await writer.add(document)
+        writer.set_checkpoint(window_index)
+        window_index += 1
+    await writer.flush()
+
+
+async def blocking_backfill_load(stop):
+    collection = MongoClient(args.mongodb_uri)[args.db_name]["events"]
+    window_index = 0
+    while not stop.is_set():
+        time.sleep(args.rpc_latency)  # eth_getLogs sincrona
+        for document in synthetic_event_documents(window_index, args.events_per_window):
+            collection.insert_one(document)
+        collection.update_one({"_id": "last_processed_block"}, {"$set": {"block_number": window_index}}, upsert=True)
+        window_index += 1
+        await asyncio.sleep(0)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def main():
+    client = get_mongo_client()
+    database = client.get_database(args.db_name)
+    await database.drop_collection("events")
+    collection = database.get_collection("events")
+    await collection.create_index([("blockNumber", 1), ("transactionHash", 1), ("logIndex", 1)], unique=True, name="unique_event_log")
+
+    subscriber = redis.from_url(args.redis_url, decode_responses=True)
+    pubsub = subscriber.pubsub()
+    await pubsub.subscribe(REDIS_CHANNEL)
+
+    latencies = []
+    received_all = asyncio.Event()
+
+    async def collect_latencies():
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            document = json.loads(message["data"]).get("fullDocument", {})
+            if "bench_sent_at" in document:
+                latencies.append((time.time() - document["bench_sent_at"]) * 1000)
+                if len(latencies) >= args.probes:
+                    received_all.set()
+                    return
+
+    listener_task = asyncio.create_task(listen_for_db_changes())
+    collector_task = asyncio.create_task(collect_latencies())
+    await asyncio.sleep(2)  # attende l'apertura del Change Stream
+
+    stop_load = asyncio.Event()
+    load_task = None
+    if args.load == "async":
+        load_task = asyncio.create_task(async_backfill_load(collection, stop_load))
+    elif args.load == "blocking":
+        load_task = asyncio.create_task(blocking_backfill_load(stop_load))
+
+    for probe_index in range(args.probes):
+        await collection.insert_one({"event": "BenchProbe", "probe": probe_index, "bench_sent_at": time.time()})
+        await asyncio.sleep(args.probe_interval)
+
+    try:
+        await asyncio.wait_for(received_all.wait(), timeout=60)
+    except asyncio.TimeoutError:
+        pass
+
+    stop_load.set()
+    if load_task:
+        await load_task
+    for task in (listener_task, collector_task):
+        task.cancel()
+    await subscriber.close()
+
+    result = {
+        "benchmark": "changestream_to_redis_latency",
+        "load": args.load,
+        "probes_sent": args.probes,
+        "probes_received": len(latencies),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(max(latencies), 2),
+            "mean": round(statistics.mean(latencies), 2),
+        } if latencies else None,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+# backend-event-listener/benchmarks/changestream_resume.py
+"""
+Verifica la ripresa del Change Stream dal resume token e misura il recupero dell'arretrato:
+il listener viene fermato, si inseriscono --backlog documenti mentre è spento, poi lo si
+riavvia e si conta quanti documenti arrivano su Redis (persi, duplicati) e in quanto tempo.
+
+Richiede un mongod locale avviato come replica set e un redis-server locale (vedi
+changestream_latency.py), ad esempio:
+
+    python benchmarks/changestream_resume.py --backlog 20000
+    python benchmarks/changestream_resume.py --backlog 20000 --catchup-batch-size 1
+
+--catchup-batch-size 1 pubblica l'arretrato un evento alla volta (un round trip Redis
+per evento) e serve da confronto con la pubblicazione a batch.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017/?replicaSet=rs0&directConnection=true")
+parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+parser.add_argument("--db-name", default="DnaBenchmarkDB")
+parser.add_argument("--live", type=int, default=100, help="documenti inseriti con il listener attivo, prima dell'arresto")
+parser.add_argument("--backlog", type=int, default=10000, help="documenti inseriti con il listener fermo")
+parser.add_argument("--catchup-batch-size", type=int, default=500)
+args = parser.parse_args()
+
+# config.py legge le variabili d'ambiente all'import: vanno impostate prima
+os.environ["MONGODB_URI"] = args.mongodb_uri
+os.environ["REDIS_URL"] = args.redis_url
+os.environ["DB_NAME"] = args.db_name
+os.environ["COLLECTION_NAME"] = "events"
+os.environ["REDIS_CHANNEL"] = "benchmark_events"
+os.environ["CHANGE_STREAM_DOCUMENT_FIELDS"] = "event,probe"  # campi letti dal benchmark
+os.environ["REDIS_TRANSPORT"] = "pubsub"
+os.environ["CHANGE_STREAM_CATCHUP_BATCH_SIZE"] = str(args.catchup_batch_size)
+os.environ["CHANGE_STREAM_TOKEN_SAVE_SECONDS"] = "0.5"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.INFO)
+
+import redis.asyncio as redis
+
+from config import REDIS_CHANNEL, LISTENER_STATE_COLLECTION
+from mongo_client import get_mongo_client
+from mongodb_listener import listen_for_db_changes
+
+
+def benchmark_documents(start, count):
+    return [{"event": "BenchResume", "probe": start + i} for i in range(count)]
+
+
+async def stop_listener(listener_task):
+    listener_task.cancel()
+    try:
+        await listener_task
+    except asyncio.CancelledError:
+        pass
+
+
+async def main():
+    client = get_mongo_client()
+    database = client.get_database(args.db_name)
+    await database.drop_collection("events")
+    await database.drop_collection(LISTENER_STATE_COLLECTION)
+    collection = database.get_collection("events")
+
+    subscriber = redis.from_url(args.redis_url, decode_responses=True)
+    pubsub = subscriber.pubsub()
+    await pubsub.subscribe(REDIS_CHANNEL)
+
+    received = []
+    expected = args.live + args.backlog
+    received_all = asyncio.Event()
+
+    async def collect_probes():
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            document = json.loads(message["data"]).get("fullDocument", {})
+            if "probe" in document:
+                received.append(document["probe"])
+                if len(set(received)) >= expected:
+                    received_all.set()
+
+    collector_task = asyncio.create_task(collect_probes())
+
+    listener_task = asyncio.create_task(listen_for_db_changes())
+    await asyncio.sleep(2)  # attende l'apertura del Change Stream
+    await collection.insert_many(benchmark_documents(0, args.live))
+    await asyncio.sleep(2)  # pubblicazione e salvataggio del resume token
+    await stop_listener(listener_task)
+
+    # Arretrato: documenti inseriti mentre il listener è fermo (failover, riavvio, deploy...)
+    await collection.insert_many(benchmark_documents(args.live, args.backlog))
+
+    restarted_at = time.perf_counter()
+    listener_task = asyncio.create_task(listen_for_db_changes())
+    try:
+        await asyncio.wait_for(received_all.wait(), timeout=300)
+    except asyncio.TimeoutError:
+        pass
+    catchup_seconds = time.perf_counter() - restarted_at
+
+    await stop_listener(listener_task)
+    collector_task.cancel()
+    await subscriber.close()
+
+    distinct = set(received)
+    result = {
+        "benchmark": "changestream_resume_catchup",
+        "catchup_batch_size": args.catchup_batch_size,
+        "documents_inserted": expected,
+        "documents_received": len(distinct),
+        "documents_lost": expected - len(distinct),
+        "duplicates": len(received) - len(distinct),
+        "catchup_seconds": round(catchup_seconds, 3),
+        "catchup_events_per_second": round(args.backlog / catchup_seconds, 1) if catchup_seconds else None,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
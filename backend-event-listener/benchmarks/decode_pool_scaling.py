@@ -0,0 +1,109 @@
+# backend-event-listener/benchmarks/decode_pool_scaling.py
+"""
+Misura i log decodificati al secondo dallo stadio di decodifica (decode_pool.LogDecodeStage)
+al variare del numero di processi worker, su un corpus sintetico (synthetic_logs.py):
+
+  workers=0   decodifica nell'event loop (percorso predefinito, DECODE_WORKERS=0)
+  workers=N   ProcessPoolExecutor con N processi; le finestre vengono inviate con al più
+              2*N finestre in volo e i documenti raccolti nell'ordine di invio, come in
+              replay_archive (l'ordine finale viene verificato contro workers=0)
+
+Viene misurata anche la latenza di un heartbeat asyncio (ogni 10 ms) durante la
+decodifica: con i worker l'event loop resta libero per RPC e MongoDB.
+
+    python benchmarks/decode_pool_scaling.py --logs 200000 --workers 0,1,2,4,8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--logs", type=int, default=200_000)
+parser.add_argument("--workers", default="0,1,2,4", help="numeri di worker da confrontare")
+parser.add_argument("--window-logs", type=int, default=5000, help="log per finestra inviata allo stadio")
+parser.add_argument("--chunk-size", type=int, default=2000, help="log per blocco inviato a un worker")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.WARNING)
+
+from collections import deque
+
+from decode_pool import LogDecodeStage
+from synthetic_logs import synthetic_corpus
+
+
+async def heartbeat(stop, delays):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        delays.append((time.perf_counter() - started - 0.01) * 1000)
+
+
+async def run(stage, logs):
+    windows = [logs[start:start + args.window_logs] for start in range(0, len(logs), args.window_logs)]
+    max_in_flight = max(1, 2 * stage.workers)
+    in_flight = deque()
+    positions = []
+
+    stop = asyncio.Event()
+    delays = []
+    heartbeat_task = asyncio.create_task(heartbeat(stop, delays))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    for window in windows:
+        in_flight.append(stage.submit(window))
+        if len(in_flight) >= max_in_flight:
+            positions.extend((document["blockNumber"], document["logIndex"]) for document in await in_flight.popleft())
+    while in_flight:
+        positions.extend((document["blockNumber"], document["logIndex"]) for document in await in_flight.popleft())
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await heartbeat_task
+    delays.sort()
+    return positions, elapsed, delays[-1] if delays else 0.0
+
+
+async def main():
+    contracts_and_event_names, logs = synthetic_corpus(args.logs)
+    results = {}
+    reference_positions = None
+    for workers in (int(value) for value in args.workers.split(",")):
+        stage = LogDecodeStage(contracts_and_event_names, workers, args.chunk_size, min_pool_logs=1)
+        try:
+            if workers:
+                # Avvio dei processi (spawn + import + tabella eventi) escluso dalla misura
+                await asyncio.gather(*(stage.decode(logs[:args.chunk_size]) for _ in range(workers)))
+            positions, elapsed, max_heartbeat_delay = await run(stage, logs)
+        finally:
+            stage.close()
+        if reference_positions is None:
+            reference_positions = positions
+        results[f"workers_{workers}"] = {
+            "seconds": round(elapsed, 3),
+            "logs_per_second": round(len(logs) / elapsed),
+            "max_event_loop_stall_ms": round(max_heartbeat_delay, 1),
+            "order_preserved": positions == reference_positions and positions == sorted(positions),
+        }
+
+    baseline = results[next(iter(results))]["logs_per_second"]
+    for result in results.values():
+        result["speedup"] = round(result["logs_per_second"] / baseline, 2)
+    print(json.dumps({
+        "benchmark": "decode_pool_scaling",
+        "logs": args.logs,
+        "cpu_count": os.cpu_count(),
+        "window_logs": args.window_logs,
+        "chunk_size": args.chunk_size,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
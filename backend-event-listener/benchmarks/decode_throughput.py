@@ -0,0 +1,109 @@
+# backend-event-listener/benchmarks/decode_throughput.py
+"""
+Confronta la decodifica dei log grezzi nel documento MongoDB finale:
+
+  web3      percorso precedente: contract.events[...].process_log(log) + dict(event),
+            conversione di args e transactionHash.hex() per ogni evento
+  compiled  tabella precompilata topic0 -> EventSpec (log_scanner.decode_logs):
+            decodifica eth_abi in un solo passaggio direttamente nel documento
+
+Non richiede nodo, MongoDB né Redis: i log sono sintetici (Transfer, NewBid,
+NFTPurchased, NFTMinted) e gli ABI vengono letti dagli artifact Hardhat o, se non
+compilati, da frontend-dapp/src/lib/abi.
+
+    python benchmarks/decode_throughput.py --logs 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--logs", type=int, default=20000, help="numero di log sintetici da decodificare")
+parser.add_argument("--rounds", type=int, default=3, help="ripetizioni per percorso (si riporta la migliore)")
+args = parser.parse_args()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import logging
+logging.disable(logging.ERROR)
+
+from web3 import Web3
+
+from event_decoder import load_event_abis
+from log_scanner import build_event_topic_map, decode_logs
+from synthetic_logs import MARKETPLACE_ADDRESS, NFT_ADDRESS, abi_path, synthetic_logs
+
+
+def web3_path(logs, contract_events):
+    documents = []
+    for log in logs:
+        event = contract_events[(log["address"], Web3.to_hex(log["topics"][0]))].process_log(log)
+        event_data = dict(event)
+        event_data['event'] = event.event
+        event_data['args'] = dict(event.args) if hasattr(event.args, '__dict__') else event.args
+        event_data['blockNumber'] = event.blockNumber
+        event_data['transactionHash'] = event.transactionHash.hex()
+        event_data['logIndex'] = event.logIndex
+        event_data['blockTimestamp'] = None
+        event_data['timestamp_processed'] = datetime.utcnow()
+        documents.append(event_data)
+    return documents
+
+
+def compiled_path(logs, topic_map):
+    documents = decode_logs(logs, topic_map)
+    for document in documents:
+        document['blockTimestamp'] = None
+        document['timestamp_processed'] = datetime.utcnow()
+    return documents
+
+
+def best_rate(function, *function_args):
+    best_elapsed = float("inf")
+    for _ in range(args.rounds):
+        started_at = time.perf_counter()
+        function(*function_args)
+        best_elapsed = min(best_elapsed, time.perf_counter() - started_at)
+    return args.logs / best_elapsed, best_elapsed
+
+
+def main():
+    nft_abi = load_event_abis(abi_path("ScientificContentNFT"))
+    marketplace_abi = load_event_abis(abi_path("DnAContentMarketplace"))
+    w3 = Web3()
+    nft_contract = w3.eth.contract(address=NFT_ADDRESS, abi=nft_abi)
+    marketplace_contract = w3.eth.contract(address=MARKETPLACE_ADDRESS, abi=marketplace_abi)
+    event_names = ["Transfer", "NewBid", "NFTPurchased", "NFTMinted"]
+
+    contract_events = {}
+    for contract in (nft_contract, marketplace_contract):
+        for event_name in event_names:
+            if any(item["name"] == event_name for item in contract.abi):
+                contract_events[(contract.address, contract.events[event_name].topic)] = contract.events[event_name]()
+    topic_map = build_event_topic_map([
+        (NFT_ADDRESS, nft_abi, ["Transfer", "NFTMinted"]),
+        (MARKETPLACE_ADDRESS, marketplace_abi, ["NewBid", "NFTPurchased"]),
+    ])
+
+    logs = synthetic_logs(nft_contract, marketplace_contract, args.logs)
+    web3_rate, web3_elapsed = best_rate(web3_path, logs, contract_events)
+    compiled_rate, compiled_elapsed = best_rate(compiled_path, logs, topic_map)
+
+    result = {
+        "benchmark": "event_decode_throughput",
+        "logs": args.logs,
+        "web3": {"logs_per_second": round(web3_rate), "seconds": round(web3_elapsed, 4)},
+        "compiled": {"logs_per_second": round(compiled_rate), "seconds": round(compiled_elapsed, 4)},
+        "speedup": round(compiled_rate / web3_rate, 2),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
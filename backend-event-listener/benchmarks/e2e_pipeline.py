@@ -0,0 +1,532 @@
+# backend-event-listener/benchmarks/e2e_pipeline.py
+"""
+Benchmark end-to-end della pipeline: nodo locale (Hardhat o anvil) -> backend-event-listener
+-> MongoDB -> Change Stream -> Redis -> websocket-server -> client WebSocket.
+
+In una directory temporanea vengono avviati mongod (replica set a un nodo, necessario per i
+Change Stream), redis-server e il nodo; il deploy dei contratti avviene con
+scripts/benchmarkLoad.ts (che riusa scripts/deployWithMock.ts), poi main.py dei due servizi
+parte come processo separato e --clients client WebSocket si collegano al websocket-server.
+Una transazione di prova deve attraversare l'intera pipeline prima della misura; quindi il
+generatore di carico produce mint, vendite (messa in vendita + acquisto), aste con offerte e
+trasferimenti.
+
+Misure (JSON su stdout, e in --output se indicato):
+  ingest       eventi scritti in MongoDB al secondo, dalla prima transazione all'ultimo evento
+  latency_ms   inclusione nel blocco -> ricezione sul client WebSocket (percentili complessivi
+               e per tipo di transazione; una misura per ogni coppia client/transazione)
+  memory_mb    RSS iniziale, di picco e finale di listener e websocket-server
+
+Richiede node/npx con le dipendenze del repository (npm install) e mongod/redis-server nel PATH:
+
+    python benchmarks/e2e_pipeline.py --mints 200 --listings 50 --bids 100 --transfers 100 --clients 50
+    python benchmarks/e2e_pipeline.py --node anvil --ingest polling --polling-interval 1
+    python benchmarks/e2e_pipeline.py --service-env EVENT_WRITE_BATCH_SIZE=100 --service-env REDIS_TRANSPORT=stream
+
+Con --mongodb-uri / --redis-url si usano istanze già avviate (MongoDB deve essere un replica set).
+Il nodo deve ascoltare su 127.0.0.1:8545, l'indirizzo della rete "localhost" di Hardhat.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--node", choices=["hardhat", "anvil"], default="hardhat")
+parser.add_argument("--ingest", choices=["subscription", "polling"], default="subscription",
+                    help="eth_subscribe('logs') (ENABLE_LOG_SUBSCRIPTION=1) o solo scansione a intervalli")
+parser.add_argument("--polling-interval", type=float, default=5, help="POLLING_INTERVAL_SECONDS del listener")
+parser.add_argument("--mints", type=int, default=100)
+parser.add_argument("--listings", type=int, default=25, help="token messi in vendita e acquistati")
+parser.add_argument("--bids", type=int, default=50)
+parser.add_argument("--bids-per-auction", type=int, default=5)
+parser.add_argument("--transfers", type=int, default=50)
+parser.add_argument("--accounts", type=int, default=8, help="account partecipanti (oltre all'owner)")
+parser.add_argument("--tx-per-second", type=int, default=0, help="ritmo del generatore di carico (0 = massimo)")
+parser.add_argument("--clients", type=int, default=20, help="client WebSocket collegati al websocket-server")
+parser.add_argument("--mongodb-uri", help="MongoDB già avviato (replica set); default: mongod temporaneo")
+parser.add_argument("--redis-url", help="Redis già avviato; default: redis-server temporaneo")
+parser.add_argument("--mongod-bin", default="mongod")
+parser.add_argument("--redis-server-bin", default="redis-server")
+parser.add_argument("--service-env", action="append", default=[], metavar="KEY=VALUE",
+                    help="variabile d'ambiente aggiuntiva per listener e websocket-server (ripetibile)")
+parser.add_argument("--warmup-timeout", type=float, default=120, help="attesa massima della transazione di prova (s)")
+parser.add_argument("--drain-timeout", type=float, default=60, help="attesa massima delle consegne dopo il carico (s)")
+parser.add_argument("--work-dir", help="directory per dati e log dei processi (default: temporanea, eliminata alla fine)")
+parser.add_argument("--output", help="file in cui salvare anche il risultato JSON")
+args = parser.parse_args()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+WEBSOCKET_DIR = os.path.join(REPO_DIR, "websocket-server")
+sys.path.insert(0, BACKEND_DIR)
+
+import logging
+logging.disable(logging.WARNING)
+
+import redis.asyncio as redis
+import websockets
+from motor.motor_asyncio import AsyncIOMotorClient
+from web3 import AsyncWeb3, Web3
+from web3.providers.rpc import AsyncHTTPProvider
+
+NODE_RPC_URL = "http://127.0.0.1:8545"
+NODE_WS_URL = "ws://127.0.0.1:8545"
+LOAD_SCRIPT = os.path.join("scripts", "benchmarkLoad.ts")
+
+
+def artifact_path(contract_name):
+    return os.path.join(REPO_DIR, "artifacts", "contracts", f"{contract_name}.sol", f"{contract_name}.json")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def port_in_use(port):
+    with socket.socket() as sock:
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def rss_megabytes(pid):
+    """RSS del processo e dei suoi figli diretti (es. worker di decodifica), da /proc."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    total_kb = 0
+    for process_id in pids:
+        try:
+            with open(f"/proc/{process_id}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total_kb / 1024, 1)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 1),
+        "p50": round(percentile(values, 0.50), 1),
+        "p90": round(percentile(values, 0.90), 1),
+        "p99": round(percentile(values, 0.99), 1),
+        "max": round(max(values), 1),
+    }
+
+
+def normalize_hash(value):
+    if not isinstance(value, str):
+        return None
+    return value.lower().removeprefix("0x")
+
+
+class Processes:
+    """Processi avviati dal benchmark, con log su file e arresto in ordine inverso."""
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.started = []
+
+    def start(self, name, command, cwd=None, env=None):
+        log_file = open(os.path.join(self.work_dir, f"{name}.log"), "w")
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        self.started.append((name, process, log_file))
+        return process
+
+    def check_alive(self):
+        for name, process, _ in self.started:
+            if process.poll() is not None:
+                raise RuntimeError(f"Il processo {name} è terminato (codice {process.returncode}); "
+                                   f"vedi {os.path.join(self.work_dir, name + '.log')}")
+
+    def stop_all(self):
+        for _, process, _ in reversed(self.started):
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+        for _, process, log_file in reversed(self.started):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+            log_file.close()
+
+
+async def wait_until(check, timeout, what, processes):
+    deadline = time.monotonic() + timeout
+    while True:
+        processes.check_alive()
+        try:
+            if await check():
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{what} non pronto entro {timeout}s")
+        await asyncio.sleep(0.25)
+
+
+async def start_mongodb(processes, work_dir):
+    if args.mongodb_uri:
+        return args.mongodb_uri
+    port = free_port()
+    db_path = os.path.join(work_dir, "mongodb")
+    os.makedirs(db_path)
+    processes.start("mongod", [args.mongod_bin, "--replSet", "rs0", "--port", str(port), "--bind_ip", "127.0.0.1",
+                               "--dbpath", db_path, "--quiet"])
+    uri = f"mongodb://127.0.0.1:{port}/?directConnection=true"
+    client = AsyncIOMotorClient(uri, serverSelectionTimeoutMS=1000)
+
+    async def ping():
+        return (await client.admin.command("ping")).get("ok") == 1
+
+    await wait_until(ping, 30, "mongod", processes)
+    await client.admin.command("replSetInitiate", {"_id": "rs0", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]})
+
+    async def is_primary():
+        return (await client.admin.command("hello")).get("isWritablePrimary")
+
+    await wait_until(is_primary, 30, "replica set MongoDB", processes)
+    client.close()
+    return uri
+
+
+async def start_redis(processes):
+    if args.redis_url:
+        return args.redis_url
+    port = free_port()
+    processes.start("redis-server", [args.redis_server_bin, "--port", str(port), "--bind", "127.0.0.1",
+                                     "--save", "", "--appendonly", "no"])
+    url = f"redis://127.0.0.1:{port}/0"
+    client = redis.from_url(url)
+    await wait_until(client.ping, 30, "redis-server", processes)
+    await client.aclose()
+    return url
+
+
+async def start_node(processes):
+    if port_in_use(8545):
+        raise RuntimeError("La porta 8545 è già occupata: fermare il nodo esistente prima del benchmark")
+    if args.node == "anvil":
+        command = ["anvil", "--host", "127.0.0.1", "--port", "8545", "--accounts", str(args.accounts + 2), "--silent"]
+    else:
+        command = ["npx", "hardhat", "node", "--hostname", "127.0.0.1", "--port", "8545"]
+    processes.start("node", command, cwd=REPO_DIR)
+    w3 = AsyncWeb3(AsyncHTTPProvider(NODE_RPC_URL))
+
+    async def has_blocks():
+        return await w3.eth.block_number >= 0
+
+    await wait_until(has_blocks, 120, f"nodo {args.node}", processes)
+    return w3
+
+
+async def run_load_script(mode, deployment_file, work_dir, on_line=None):
+    """Esegue scripts/benchmarkLoad.ts; le righe di output sono passate a on_line e salvate nel log."""
+    env = {
+        **os.environ,
+        "BENCH_MODE": mode,
+        "BENCH_DEPLOYMENT_FILE": deployment_file,
+        "BENCH_MINTS": str(args.mints),
+        "BENCH_LISTINGS": str(args.listings),
+        "BENCH_BIDS": str(args.bids),
+        "BENCH_BIDS_PER_AUCTION": str(args.bids_per_auction),
+        "BENCH_TRANSFERS": str(args.transfers),
+        "BENCH_ACCOUNTS": str(args.accounts),
+        "BENCH_TX_PER_SECOND": str(args.tx_per_second),
+    }
+    process = await asyncio.create_subprocess_exec(
+        "npx", "hardhat", "run", "--network", "localhost", LOAD_SCRIPT, cwd=REPO_DIR, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    with open(os.path.join(work_dir, f"load-{mode}.log"), "w") as log_file:
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors="replace").rstrip("\n")
+            log_file.write(line + "\n")
+            if on_line is not None:
+                on_line(line)
+    if await process.wait() != 0:
+        raise RuntimeError(f"{LOAD_SCRIPT} ({mode}) terminato con codice {process.returncode}; "
+                           f"vedi {os.path.join(work_dir, f'load-{mode}.log')}")
+
+
+def service_env(extra):
+    # Valori vuoti invece di assenti: load_dotenv() non sovrascrive le variabili già impostate
+    env = {**os.environ, "LOG_LEVEL": "WARNING", "METRICS_PORT": "0", "LOG_ARCHIVE_DIR": ""}
+    env.update(extra)
+    for item in args.service_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def run_client(uri, stats, arrivals, connected):
+    seen = set()
+    async with websockets.connect(uri, max_size=None) as websocket:
+        connected.release()
+        try:
+            async for frame in websocket:
+                received_at = time.time() * 1000
+                data = json.loads(frame)
+                messages = data.get("messages", []) if data.get("type") == "batch" else [data]
+                for message in messages:
+                    document = message.get("fullDocument") or {}
+                    tx_hash = normalize_hash(document.get("transactionHash"))
+                    if tx_hash is None:
+                        continue
+                    stats["messages"] += 1
+                    if tx_hash not in seen:
+                        seen.add(tx_hash)
+                        arrivals.setdefault(tx_hash, []).append(received_at)
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def sample_memory(pids, memory, stop):
+    while not stop.is_set():
+        for name, pid in pids.items():
+            rss = rss_megabytes(pid)
+            if rss:
+                entry = memory.setdefault(name, {"start": rss, "peak": rss})
+                entry["peak"] = max(entry["peak"], rss)
+                entry["end"] = rss
+        await asyncio.sleep(0.5)
+
+
+async def sample_ingest(collection, start_block, samples, stop):
+    while not stop.is_set():
+        count = await collection.count_documents({"blockNumber": {"$gt": start_block}})
+        samples.append((time.time() * 1000, count))
+        await asyncio.sleep(0.25)
+
+
+async def warm_up(w3, deployment, arrivals, processes):
+    """Invia ApprovalForAll finché tutti i client non ricevono l'evento: la pipeline è pronta."""
+    with open(artifact_path("ScientificContentNFT")) as f:
+        nft_abi = json.load(f)["abi"]
+    nft = w3.eth.contract(address=deployment["nft"], abi=nft_abi)
+    account = (await w3.eth.accounts)[-1]
+    deadline = time.monotonic() + args.warmup_timeout
+    while time.monotonic() < deadline:
+        tx_hash = await nft.functions.setApprovalForAll(deployment["marketplace"], True).transact({"from": account})
+        retry_at = time.monotonic() + 5
+        while time.monotonic() < min(retry_at, deadline):
+            processes.check_alive()
+            if len(arrivals.get(normalize_hash(tx_hash.hex()), [])) >= args.clients:
+                return
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"La transazione di prova non ha raggiunto tutti i client entro {args.warmup_timeout}s")
+
+
+async def run(work_dir, processes):
+    mongodb_uri = await start_mongodb(processes, work_dir)
+    redis_url = await start_redis(processes)
+    w3 = await start_node(processes)
+
+    deployment_file = os.path.join(work_dir, "deployment.json")
+    await run_load_script("deploy", deployment_file, work_dir)
+    with open(deployment_file) as f:
+        deployment = json.load(f)
+    for key in ("nft", "marketplace"):
+        deployment[key] = Web3.to_checksum_address(deployment[key])
+
+    db_name = f"e2e_benchmark_{int(time.time())}"
+    ws_port = free_port()
+    websocket_server = processes.start("websocket-server", [sys.executable, "main.py"], cwd=WEBSOCKET_DIR, env=service_env({
+        "REDIS_URL": redis_url,
+        "PORT": str(ws_port),
+    }))
+    listener = processes.start("backend-event-listener", [sys.executable, "main.py"], cwd=BACKEND_DIR, env=service_env({
+        "ENABLE_BLOCKCHAIN_LISTENER": "1",
+        "ARBITRUM_SEPOLIA_RPC_URL": NODE_RPC_URL,
+        "ARBITRUM_SEPOLIA_RPC_URLS": NODE_RPC_URL,
+        "ARBITRUM_SEPOLIA_WS_RPC_URL": NODE_WS_URL,
+        "ENABLE_LOG_SUBSCRIPTION": "1" if args.ingest == "subscription" else "0",
+        "ENABLE_PARALLEL_BACKFILL": "0",
+        "POLLING_INTERVAL_SECONDS": str(args.polling_interval),
+        "CONFIRMATION_DEPTH": "0",
+        "OVERRIDE_START_BLOCK": str(deployment["blockNumber"]),
+        "SCIENTIFIC_CONTENT_NFT_CONTRACT_ADDRESS": deployment["nft"],
+        "SCIENTIFIC_CONTENT_MARKETPLACE_CONTRACT_ADDRESS": deployment["marketplace"],
+        "NFT_ABI_PATH": artifact_path("ScientificContentNFT"),
+        "MARKETPLACE_ABI_PATH": artifact_path("DnAContentMarketplace"),
+        "EVENT_ABI_CACHE_PATH": os.path.join(work_dir, "event_abi_cache.json"),
+        "MONGODB_URI": mongodb_uri,
+        "DB_NAME": db_name,
+        "REDIS_URL": redis_url,
+    }))
+
+    uri = f"ws://127.0.0.1:{ws_port}"
+
+    async def websocket_ready():
+        async with websockets.connect(uri):
+            return True
+
+    await wait_until(websocket_ready, 30, "websocket-server", processes)
+
+    stats = {"messages": 0}
+    arrivals = {}
+    connected = asyncio.Semaphore(0)
+    client_tasks = [asyncio.create_task(run_client(uri, stats, arrivals, connected)) for _ in range(args.clients)]
+    for _ in range(args.clients):
+        await connected.acquire()
+
+    mongo_client = AsyncIOMotorClient(mongodb_uri)
+    collection = mongo_client[db_name]["events"]
+    stop = asyncio.Event()
+    memory = {}
+    memory_task = asyncio.create_task(sample_memory(
+        {"backend-event-listener": listener.pid, "websocket-server": websocket_server.pid}, memory, stop))
+    try:
+        await warm_up(w3, deployment, arrivals, processes)
+        start_block = await w3.eth.block_number
+
+        transactions = {}
+        load_summary = {}
+
+        def on_line(line):
+            if line.startswith("BENCH_TX "):
+                transaction = json.loads(line[len("BENCH_TX "):])
+                transactions[normalize_hash(transaction["hash"])] = transaction
+            elif line.startswith("BENCH_DONE "):
+                load_summary.update(json.loads(line[len("BENCH_DONE "):]))
+
+        ingest_samples = []
+        ingest_task = asyncio.create_task(sample_ingest(collection, start_block, ingest_samples, stop))
+        await run_load_script("load", deployment_file, work_dir, on_line)
+
+        # Attesa delle consegne mancanti e della fine dell'ingest (conteggio stabile per 3s)
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline:
+            processes.check_alive()
+            delivered = all(len(arrivals.get(tx_hash, [])) >= args.clients for tx_hash in transactions)
+            stable = len(ingest_samples) > 12 and ingest_samples[-12][1] == ingest_samples[-1][1]
+            if delivered and stable:
+                break
+            await asyncio.sleep(0.25)
+        stop.set()
+        await ingest_task
+    finally:
+        stop.set()
+        await memory_task
+        for task in client_tasks:
+            task.cancel()
+        await asyncio.gather(*client_tasks, return_exceptions=True)
+
+    events_by_type = {
+        item["_id"]: item["count"] async for item in collection.aggregate([
+            {"$match": {"blockNumber": {"$gt": start_block}}},
+            {"$group": {"_id": "$event", "count": {"$sum": 1}}},
+        ])
+    }
+    mongo_client.close()
+
+    latencies, latencies_by_kind = [], {}
+    for tx_hash, transaction in transactions.items():
+        for received_at in arrivals.get(tx_hash, []):
+            latency = received_at - transaction["minedAtMs"]
+            latencies.append(latency)
+            latencies_by_kind.setdefault(transaction["kind"], []).append(latency)
+
+    first_mined = min((transaction["minedAtMs"] for transaction in transactions.values()), default=None)
+    last_mined = max((transaction["minedAtMs"] for transaction in transactions.values()), default=None)
+    events_ingested = ingest_samples[-1][1] if ingest_samples else 0
+    ingest_completed_at = next((at for at, count in ingest_samples if count == events_ingested), None)
+    ingest_seconds = (ingest_completed_at - first_mined) / 1000 if first_mined and ingest_completed_at else None
+
+    return {
+        "benchmark": "e2e_pipeline",
+        "version": git_version(),
+        "node": args.node,
+        "ingest_mode": args.ingest,
+        "config": {
+            "mints": args.mints, "listings": args.listings, "bids": args.bids,
+            "bids_per_auction": args.bids_per_auction, "transfers": args.transfers, "accounts": args.accounts,
+            "tx_per_second": args.tx_per_second, "clients": args.clients, "polling_interval": args.polling_interval,
+            "service_env": args.service_env,
+        },
+        "load": {
+            "transactions": len(transactions),
+            "by_kind": load_summary.get("counts", {}),
+            "seconds": load_summary.get("seconds"),
+            "tx_per_second": round(len(transactions) / load_summary["seconds"], 1) if load_summary.get("seconds") else None,
+        },
+        "ingest": {
+            "events": events_ingested,
+            "by_event": events_by_type,
+            "seconds": round(ingest_seconds, 3) if ingest_seconds else None,
+            "events_per_second": round(events_ingested / ingest_seconds, 1) if ingest_seconds else None,
+            "tail_lag_ms": round(ingest_completed_at - last_mined, 1) if ingest_completed_at and last_mined else None,
+        },
+        "latency_ms": {
+            "all": latency_summary(latencies),
+            "by_kind": {kind: latency_summary(values) for kind, values in sorted(latencies_by_kind.items())},
+        },
+        "websocket": {
+            "clients": args.clients,
+            "messages_received": stats["messages"],
+            "deliveries_expected": len(transactions) * args.clients,
+            "deliveries_missing": len(transactions) * args.clients - len(latencies),
+        },
+        "memory_mb": memory,
+    }
+
+
+def main():
+    for binary in ["npx"] + (["anvil"] if args.node == "anvil" else []) \
+            + ([] if args.mongodb_uri else [args.mongod_bin]) + ([] if args.redis_url else [args.redis_server_bin]):
+        if shutil.which(binary) is None:
+            sys.exit(f"Eseguibile non trovato nel PATH: {binary}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="e2e-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    processes = Processes(work_dir)
+    try:
+        result = asyncio.run(run(work_dir, processes))
+    except RuntimeError as e:
+        # La directory con i log dei processi resta disponibile per capire l'errore
+        sys.exit(f"Benchmark interrotto: {e} (log in {work_dir})")
+    finally:
+        processes.stop_all()
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
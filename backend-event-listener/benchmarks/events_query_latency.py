@@ -0,0 +1,258 @@
+# backend-event-listener/benchmarks/events_query_latency.py
+"""
+Popola un mongod locale con milioni di eventi sintetici (distribuzione di tipi, token e
+indirizzi simile a quella del marketplace) e misura la latenza p50/p99 delle query tipiche
+di frontend e listener, con gli indici dichiarati in mongo_indexes.py o con il solo indice
+unico usato in precedenza:
+
+    mongod --dbpath /tmp/mongo-bench &
+    python benchmarks/events_query_latency.py --events 5000000 --indexes declared
+    python benchmarks/events_query_latency.py --events 5000000 --indexes baseline --reuse
+
+Con --reuse i dati già presenti vengono mantenuti (vengono solo riallineati gli indici).
+Per ogni query vengono riportati anche gli indici scelti e i documenti esaminati (explain),
+per verificare che nessuna query tipica faccia una scansione completa della collection.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017")
+parser.add_argument("--db-name", default="DnaBenchmarkDB")
+parser.add_argument("--events", type=int, default=2_000_000)
+parser.add_argument("--indexes", choices=["declared", "baseline"], default="declared",
+                    help="declared: indici di mongo_indexes.py; baseline: solo unique_event_log")
+parser.add_argument("--samples", type=int, default=300, help="esecuzioni per query")
+parser.add_argument("--seed-batch-size", type=int, default=10_000)
+parser.add_argument("--reuse", action="store_true", help="non ripopolare se la collection ha già --events documenti")
+args = parser.parse_args()
+
+# config.py legge le variabili d'ambiente all'import: vanno impostate prima
+os.environ["MONGODB_URI"] = args.mongodb_uri
+os.environ["DB_NAME"] = args.db_name
+os.environ["COLLECTION_NAME"] = "events"
+os.environ["MONGODB_DROP_UNDECLARED_INDEXES"] = "1"
+os.environ.setdefault("SCIENTIFIC_CONTENT_NFT_CONTRACT_ADDRESS", "0x" + "11" * 20)
+os.environ.setdefault("SCIENTIFIC_CONTENT_MARKETPLACE_CONTRACT_ADDRESS", "0x" + "22" * 20)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.INFO)
+
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+from mongo_client import get_mongo_client
+from mongo_indexes import DECLARED_INDEXES, ensure_indexes
+from reorg_guard import CHECKPOINT_ID, checkpoint_collection
+
+NFT_ADDRESS = os.environ["SCIENTIFIC_CONTENT_NFT_CONTRACT_ADDRESS"]
+MARKETPLACE_ADDRESS = os.environ["SCIENTIFIC_CONTENT_MARKETPLACE_CONTRACT_ADDRESS"]
+FIRST_BLOCK = 176_000_000
+
+# (evento, peso, contratto, argomenti indirizzo)
+EVENT_MIX = [
+    ("Transfer", 30, NFT_ADDRESS, ("from", "to")),
+    ("NFTMinted", 10, NFT_ADDRESS, ("owner",)),
+    ("NewBid", 22, MARKETPLACE_ADDRESS, ("bidder",)),
+    ("NFTListedForSale", 10, MARKETPLACE_ADDRESS, ("seller",)),
+    ("NFTPurchased", 8, MARKETPLACE_ADDRESS, ("buyer", "seller")),
+    ("AuctionStarted", 6, MARKETPLACE_ADDRESS, ("seller",)),
+    ("AuctionEnded", 5, MARKETPLACE_ADDRESS, ("winner",)),
+    ("NFTSaleRemoved", 4, MARKETPLACE_ADDRESS, ("seller",)),
+    ("NFTClaimed", 3, MARKETPLACE_ADDRESS, ("recipient",)),
+]
+FRONTEND_STATUS_SHARE = 0.02
+DECLARED_INDEX_NAMES = {model.document["name"] for model in DECLARED_INDEXES["events"]} | {"_id_"}
+
+
+def address(index):
+    return "0x" + f"{index:040x}"
+
+
+def synthetic_documents(start, count, rng, token_count, address_count):
+    """Eventi in ordine di blocco (circa 4 log per blocco) più qualche record frontend_tx_status."""
+    names = [name for name, _, _, _ in EVENT_MIX]
+    weights = [weight for _, weight, _, _ in EVENT_MIX]
+    mix = {name: (contract, address_args) for name, _, contract, address_args in EVENT_MIX}
+    base_time = datetime(2025, 1, 1)
+    documents = []
+    for index in range(start, start + count):
+        block_number = FIRST_BLOCK + index // 4
+        transaction_hash = f"{index:064x}"
+        if rng.random() < FRONTEND_STATUS_SHARE:
+            documents.append({
+                "_id": f"{transaction_hash}_frontend_tx_status",
+                "transactionHash": transaction_hash,
+                "from": address(rng.randrange(address_count)),
+                "blockNumber": block_number,
+                "methodName": "purchaseNFT",
+                "status": "confirmed",
+                "source": "frontend_tx_status",
+            })
+            continue
+        event_name = rng.choices(names, weights)[0]
+        contract, address_args = mix[event_name]
+        event_args = {"tokenId": rng.randrange(token_count)}
+        for arg_name in address_args:
+            event_args[arg_name] = address(rng.randrange(address_count))
+        if event_name in ("NewBid", "NFTPurchased", "NFTListedForSale"):
+            event_args["price" if event_name != "NewBid" else "amount"] = str(10**16 * rng.randrange(1, 500))
+        documents.append({
+            "args": event_args,
+            "event": event_name,
+            "logIndex": index % 4,
+            "transactionIndex": index % 4,
+            "transactionHash": transaction_hash,
+            "address": contract,
+            "blockHash": f"{block_number:064x}",
+            "blockNumber": block_number,
+            "blockTimestamp": base_time + timedelta(seconds=index // 4),
+        })
+    return documents
+
+
+def seed(collection, rng, token_count, address_count):
+    collection.drop()
+    started = time.perf_counter()
+    for start in range(0, args.events, args.seed_batch_size):
+        count = min(args.seed_batch_size, args.events - start)
+        collection.insert_many(synthetic_documents(start, count, rng, token_count, address_count), ordered=False)
+        if (start // args.seed_batch_size) % 50 == 0:
+            print(f"  seed: {start + count}/{args.events}", file=sys.stderr)
+    return time.perf_counter() - started
+
+
+def typical_queries(rng, token_count, address_count, last_block):
+    """Query del frontend (storico, pagine token e profilo) e del listener (checkpoint, reorg)."""
+    def any_address():
+        return address(rng.randrange(address_count))
+
+    def transfers_of_any_address():
+        who = any_address()
+        return {"$or": [{"args.from": who}, {"args.to": who}]}
+
+    feed_sort = [("blockNumber", -1), ("logIndex", -1)]
+    return {
+        # /api/events/history
+        "history_feed": lambda: ({"$or": [{"event": {"$exists": True}}, {"methodName": {"$exists": True}}]}, feed_sort, 20),
+        # feed di un solo tipo di evento (es. ultimi acquisti)
+        "event_feed": lambda: ({"event": "NFTPurchased"}, feed_sort, 20),
+        # eventi di un tipo in un intervallo di blocchi (ricostruzione rollup/proiezioni)
+        "event_block_range": lambda: ({"event": "NewBid", "blockNumber": {"$gte": last_block - 5000, "$lte": last_block - 4000}}, None, 0),
+        # storico di un token
+        "token_history": lambda: ({"args.tokenId": rng.randrange(token_count)}, feed_sort, 50),
+        # trasferimenti di un indirizzo (in entrata o in uscita)
+        "address_transfers": lambda: (transfers_of_any_address(), feed_sort, 50),
+        # offerte di un indirizzo
+        "bidder_history": lambda: ({"args.bidder": any_address()}, feed_sort, 50),
+        # eventi oltre un blocco (rollback di un reorg)
+        "after_block": lambda: ({"blockNumber": {"$gt": last_block - 20}, "event": {"$exists": True}, "source": {"$exists": False}}, None, 0),
+        # upsert dei record di stato delle transazioni (/api/transactions)
+        "transaction_lookup": lambda: ({"transactionHash": f"{rng.randrange(args.events):064x}"}, None, 0),
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def explain_summary(collection, query_filter, sort, limit):
+    cursor = collection.find(query_filter)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    explanation = cursor.explain()
+    stats = explanation.get("executionStats", {})
+    plan = json.dumps(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+    used_indexes = sorted(name for name in DECLARED_INDEX_NAMES if f'"{name}"' in plan)
+    return {
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "indexes": used_indexes or ["COLLSCAN"],
+        "blocking_sort": '"SORT"' in plan,
+    }
+
+
+def measure(collection, build_query):
+    latencies = []
+    for _ in range(args.samples):
+        query_filter, sort, limit = build_query()
+        started = time.perf_counter()
+        cursor = collection.find(query_filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        list(cursor)
+        latencies.append((time.perf_counter() - started) * 1000)
+    query_filter, sort, limit = build_query()
+    return {
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        **explain_summary(collection, query_filter, sort, limit),
+    }
+
+
+async def align_indexes(database):
+    if args.indexes == "declared":
+        await ensure_indexes(database, ["events"])
+        return
+    collection = database.get_collection("events")
+    async for index in collection.list_indexes():
+        if index["name"] not in ("_id_", "unique_event_log"):
+            await collection.drop_index(index["name"])
+    await collection.create_index([("blockNumber", 1), ("transactionHash", 1), ("logIndex", 1)], unique=True, name="unique_event_log")
+
+
+def main():
+    rng = random.Random(42)
+    token_count = max(100, args.events // 20)
+    address_count = max(100, args.events // 200)
+    sync_database = MongoClient(args.mongodb_uri)[args.db_name]
+    collection = sync_database["events"]
+
+    seed_seconds = None
+    if not (args.reuse and collection.estimated_document_count() == args.events):
+        seed_seconds = round(seed(collection, rng, token_count, address_count), 1)
+
+    # Gli indici si creano dopo il popolamento (build unica, più veloce di migliaia di insert indicizzati)
+    index_started = time.perf_counter()
+    motor_database = get_mongo_client().get_database(args.db_name)
+    asyncio.run(align_indexes(motor_database))
+    index_seconds = round(time.perf_counter() - index_started, 1)
+
+    # Lettura del checkpoint dalla stessa collection di stato usata dal listener
+    state = sync_database[checkpoint_collection(motor_database.get_collection("events")).name]
+    state.update_one({"_id": CHECKPOINT_ID}, {"$set": {"block_number": FIRST_BLOCK + args.events // 4}}, upsert=True)
+
+    last_block = FIRST_BLOCK + (args.events - 1) // 4
+    results = {name: measure(collection, build_query)
+               for name, build_query in typical_queries(rng, token_count, address_count, last_block).items()}
+    results["checkpoint_read"] = measure(state, lambda: ({"_id": CHECKPOINT_ID}, None, 0))
+
+    collection_stats = sync_database.command("collStats", "events")
+    print(json.dumps({
+        "benchmark": "events_query_latency",
+        "events": args.events,
+        "indexes": args.indexes,
+        "samples": args.samples,
+        "seed_seconds": seed_seconds,
+        "index_build_seconds": index_seconds,
+        "index_size_mb": round(collection_stats.get("totalIndexSize", 0) / 2**20, 1),
+        "data_size_mb": round(collection_stats.get("size", 0) / 2**20, 1),
+        "queries": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# backend-event-listener/benchmarks/log_archive_replay.py
+"""
+Misura l'archivio locale dei log (log_archive.py) su un corpus sintetico:
+
+  write    append delle finestre di scansione (come farebbero loop e backfill)
+  verify   verifica dei checksum di tutti i segmenti
+  replay   lettura tramite mmap + decodifica nei documenti evento (la parte di
+           re-indicizzazione che sostituisce le chiamate eth_getLogs; la scrittura
+           su MongoDB è misurata da events_query_latency/changestream_latency)
+
+    python benchmarks/log_archive_replay.py --logs 500000 --window-blocks 2000
+
+Riporta dimensione su disco (con e senza compressione zlib) e log al secondo in JSON.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--logs", type=int, default=200_000)
+parser.add_argument("--window-blocks", type=int, default=2000, help="blocchi per finestra di scansione archiviata")
+parser.add_argument("--segment-blocks", type=int, default=100_000)
+parser.add_argument("--compression-levels", default="0,1", help="livelli zlib da confrontare (0 = nessuna compressione)")
+parser.add_argument("--directory", help="directory dell'archivio (default: temporanea, eliminata alla fine)")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.WARNING)
+
+from event_decoder import build_event_document
+from log_archive import LogArchive
+from log_scanner import build_event_topic_map, decode_logs
+from synthetic_logs import FIRST_BLOCK, synthetic_corpus
+
+
+def write_archive(directory, logs, compression_level):
+    archive = LogArchive(directory, args.segment_blocks, compression_level).open()
+    last_block = logs[-1]["blockNumber"]
+    base_time = datetime(2024, 1, 1)
+    started = time.perf_counter()
+    log_position = 0
+    for from_block in range(FIRST_BLOCK, last_block + 1, args.window_blocks):
+        to_block = min(last_block, from_block + args.window_blocks - 1)
+        window_logs = []
+        while log_position < len(logs) and logs[log_position]["blockNumber"] <= to_block:
+            window_logs.append(logs[log_position])
+            log_position += 1
+        block_timestamps = {log["blockNumber"]: base_time + timedelta(seconds=log["blockNumber"]) for log in window_logs}
+        archive.append_window(from_block, to_block, window_logs, block_timestamps)
+    return archive, time.perf_counter() - started
+
+
+def replay(archive, topic_map, chunk_size=5000):
+    started = time.perf_counter()
+    document_count = 0
+    chunk = []
+    for item in archive.iter_logs():
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            document_count += replay_chunk(chunk, topic_map)
+            chunk = []
+    if chunk:
+        document_count += replay_chunk(chunk, topic_map)
+    return document_count, time.perf_counter() - started
+
+
+def replay_chunk(chunk, topic_map):
+    block_timestamps = {log["blockNumber"]: block_timestamp for log, block_timestamp in chunk}
+    documents = decode_logs([log for log, _ in chunk], topic_map)
+    for document in documents:
+        build_event_document(document, block_timestamps.get(document["blockNumber"]))
+    return len(documents)
+
+
+def main():
+    contracts_and_event_names, logs = synthetic_corpus(args.logs)
+    topic_map = build_event_topic_map(contracts_and_event_names)
+    # Dimensione della risposta JSON-RPC equivalente (stima sui primi 1000 log)
+    raw_json_bytes = len(json.dumps([
+        {**{key: ("0x" + value.hex() if isinstance(value, bytes) else value) for key, value in log.items() if key != "topics"},
+         "topics": ["0x" + topic.hex() for topic in log["topics"]]}
+        for log in logs[:1000]
+    ]))
+    results = {}
+    for compression_level in (int(level) for level in args.compression_levels.split(",")):
+        if args.directory:
+            directory = os.path.join(args.directory, f"zlib_{compression_level}")
+        else:
+            directory = tempfile.mkdtemp(prefix="log-archive-bench-")
+        try:
+            archive, write_seconds = write_archive(directory, logs, compression_level)
+            started = time.perf_counter()
+            errors = [error for error in archive.verify().values() if error]
+            verify_seconds = time.perf_counter() - started
+            # Riapertura come al riavvio del listener (lettura dell'indice) prima del replay
+            archive = LogArchive(directory, args.segment_blocks, compression_level).open()
+            document_count, replay_seconds = replay(archive, topic_map)
+            stats = archive.stats()
+            results[f"zlib_{compression_level}"] = {
+                "archive_mb": round(stats["bytes"] / 2 ** 20, 2),
+                "bytes_per_log": round(stats["bytes"] / len(logs), 1),
+                "segments": stats["segments"],
+                "records": stats["records"],
+                "write_logs_per_second": round(len(logs) / write_seconds),
+                "verify_seconds": round(verify_seconds, 3),
+                "verify_errors": len(errors),
+                "replay_documents": document_count,
+                "replay_seconds": round(replay_seconds, 3),
+                "replay_logs_per_second": round(len(logs) / replay_seconds),
+            }
+        finally:
+            if not args.directory:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps({
+        "benchmark": "log_archive_replay",
+        "logs": args.logs,
+        "window_blocks": args.window_blocks,
+        "segment_blocks": args.segment_blocks,
+        "json_bytes_per_log_estimate": round(raw_json_bytes / 1000, 1),
+        "archives": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# backend-event-listener/benchmarks/rpc_pool_stub.py
+"""
+Confronta un singolo AsyncHTTPProvider con RpcProviderPool (rpc_pool.py) su server
+JSON-RPC stub locali (aiohttp), senza nodo né chiavi API:
+
+  batching   un endpoint sano; --calls chiamate concorrenti (come i timestamp dei blocchi
+             o gli shard del backfill): richieste HTTP inviate e durata totale
+  tail       endpoint primario con il --slow-fraction delle risposte lente (--slow-ms) e
+             un secondo endpoint sano: p50/p99 senza e con hedging
+  failover   endpoint primario spento (connessione rifiutata) e uno sano: chiamate riuscite
+  ratelimit  endpoint primario con budget di --budget richieste al secondo (risponde
+             con l'errore JSON-RPC 429 oltre il budget) e uno sano: chiamate riuscite
+
+    python benchmarks/rpc_pool_stub.py --calls 400
+    python benchmarks/rpc_pool_stub.py --scenarios tail --slow-fraction 0.05 --slow-ms 2000
+
+Il risultato è stampato in JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--scenarios", default="batching,tail,failover,ratelimit")
+parser.add_argument("--calls", type=int, default=400, help="chiamate per scenario")
+parser.add_argument("--concurrency", type=int, default=20, help="chiamate in volo contemporaneamente")
+parser.add_argument("--latency-ms", type=float, default=20, help="latenza di base degli stub")
+parser.add_argument("--slow-ms", type=float, default=1000, help="latenza delle risposte lente (scenario tail)")
+parser.add_argument("--slow-fraction", type=float, default=0.05, help="frazione di risposte lente (scenario tail)")
+parser.add_argument("--budget", type=float, default=50, help="richieste al secondo dello stub limitato (scenario ratelimit)")
+parser.add_argument("--hedge-after-ms", type=float, default=100)
+parser.add_argument("--batch-window-ms", type=float, default=2)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.disable(logging.WARNING)
+
+from aiohttp import web
+from web3 import AsyncHTTPProvider
+
+from rpc_pool import RpcProviderPool
+
+
+class StubRpcServer:
+    """Server JSON-RPC minimo: risponde a qualsiasi metodo con un blocco fittizio."""
+
+    def __init__(self, latency_ms, slow_ms=0.0, slow_fraction=0.0, requests_per_second=0.0, seed=0):
+        self.latency_seconds = latency_ms / 1000
+        self.slow_seconds = slow_ms / 1000
+        self.slow_fraction = slow_fraction
+        self.requests_per_second = requests_per_second
+        self.rng = random.Random(seed)
+        self.http_requests = 0
+        self.calls = 0
+        self.rate_limited = 0
+        self._window_started_at = time.monotonic()
+        self._window_calls = 0
+        self._runner = None
+        self.url = None
+
+    def _over_budget(self, cost):
+        if not self.requests_per_second:
+            return False
+        now = time.monotonic()
+        if now - self._window_started_at >= 1:
+            self._window_started_at, self._window_calls = now, 0
+        self._window_calls += cost
+        return self._window_calls > self.requests_per_second
+
+    def _answer(self, request, rate_limited):
+        if rate_limited:
+            self.rate_limited += 1
+            return {"jsonrpc": "2.0", "id": request.get("id"),
+                    "error": {"code": 429, "message": "Your app has exceeded its compute units per second capacity"}}
+        block_number = int(request.get("params", ["0x0"])[0], 16) if request.get("params") else 0
+        return {"jsonrpc": "2.0", "id": request.get("id"),
+                "result": {"number": hex(block_number), "timestamp": hex(1_700_000_000 + block_number)}}
+
+    async def handle(self, request):
+        self.http_requests += 1
+        payload = await request.json()
+        requests = payload if isinstance(payload, list) else [payload]
+        self.calls += len(requests)
+        rate_limited = self._over_budget(len(requests))
+        slow = self.slow_fraction and self.rng.random() < self.slow_fraction
+        await asyncio.sleep(self.slow_seconds if slow else self.latency_seconds)
+        answers = [self._answer(item, rate_limited) for item in requests]
+        return web.json_response(answers if isinstance(payload, list) else answers[0])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def closed_port_url():
+    """URL di un endpoint spento: porta libera su cui nessuno è in ascolto."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_calls(provider):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    failures = 0
+
+    async def call(block_number):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await provider.make_request("eth_getBlockByNumber", [hex(block_number), False])
+                if "error" in response:
+                    failures += 1
+            except Exception:
+                failures += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(block_number) for block_number in range(args.calls)))
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "ok": args.calls - failures,
+        "failed": failures,
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+    }
+
+
+def single_provider(url):
+    return AsyncHTTPProvider(url, exception_retry_configuration=None)
+
+
+def pool(urls, **kwargs):
+    options = dict(batch_window_seconds=0.0, hedge_after_seconds=0.0, cooldown_seconds=0.5)
+    options.update(kwargs)
+    return RpcProviderPool(urls, **options)
+
+
+async def measure(provider, servers):
+    for server in servers:
+        server.http_requests = server.calls = server.rate_limited = 0
+    result = await run_calls(provider)
+    await provider.disconnect()
+    result["http_requests"] = [server.http_requests for server in servers]
+    result["rate_limited_responses"] = sum(server.rate_limited for server in servers)
+    return result
+
+
+async def scenario_batching():
+    server = await StubRpcServer(args.latency_ms).start()
+    try:
+        return {
+            "single": await measure(single_provider(server.url), [server]),
+            "pool_batched": await measure(pool([server.url], batch_window_seconds=args.batch_window_ms / 1000), [server]),
+        }
+    finally:
+        await server.stop()
+
+
+async def scenario_tail():
+    primary = await StubRpcServer(args.latency_ms, args.slow_ms, args.slow_fraction, seed=1).start()
+    secondary = await StubRpcServer(args.latency_ms * 1.5, seed=2).start()
+    try:
+        return {
+            "single": await measure(single_provider(primary.url), [primary, secondary]),
+            "pool_hedged": await measure(pool([primary.url, secondary.url], hedge_after_seconds=args.hedge_after_ms / 1000,
+                                              hedge_latency_factor=0.0), [primary, secondary]),
+        }
+    finally:
+        await primary.stop()
+        await secondary.stop()
+
+
+async def scenario_failover():
+    secondary = await StubRpcServer(args.latency_ms).start()
+    dead_url = closed_port_url()
+    try:
+        return {
+            "single": await measure(single_provider(dead_url), [secondary]),
+            "pool_failover": await measure(pool([dead_url, secondary.url]), [secondary]),
+        }
+    finally:
+        await secondary.stop()
+
+
+async def scenario_ratelimit():
+    primary = await StubRpcServer(args.latency_ms, requests_per_second=args.budget).start()
+    secondary = await StubRpcServer(args.latency_ms * 1.5).start()
+    try:
+        return {
+            "single": await measure(single_provider(primary.url), [primary, secondary]),
+            "pool_failover": await measure(pool([primary.url, secondary.url]), [primary, secondary]),
+            "pool_budgeted": await measure(pool([primary.url, secondary.url], requests_per_second=[args.budget * 0.9, 0]),
+                                           [primary, secondary]),
+        }
+    finally:
+        await primary.stop()
+        await secondary.stop()
+
+
+SCENARIOS = {
+    "batching": scenario_batching,
+    "tail": scenario_tail,
+    "failover": scenario_failover,
+    "ratelimit": scenario_ratelimit,
+}
+
+
+async def main():
+    results = {}
+    for name in args.scenarios.split(","):
+        results[name.strip()] = await SCENARIOS[name.strip()]()
+    print(json.dumps({
+        "benchmark": "rpc_pool_stub",
+        "calls": args.calls,
+        "concurrency": args.concurrency,
+        "latency_ms": args.latency_ms,
+        "scenarios": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+# backend-event-listener/benchmarks/synthetic_logs.py
+"""
+Log grezzi sintetici (Transfer, NewBid, NFTPurchased, NFTMinted) nel formato restituito
+da eth_getLogs, condivisi dai benchmark di decodifica, archivio e decodifica parallela.
+Gli ABI vengono letti dagli artifact Hardhat o, se non compilati, da frontend-dapp/src/lib/abi.
+"""
+
+import os
+
+from eth_abi import encode
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+
+NFT_ADDRESS = Web3.to_checksum_address("0x" + "11" * 20)
+MARKETPLACE_ADDRESS = Web3.to_checksum_address("0x" + "22" * 20)
+EVENT_NAMES = {
+    NFT_ADDRESS: ["Transfer", "NFTMinted"],
+    MARKETPLACE_ADDRESS: ["NewBid", "NFTPurchased"],
+}
+LOGS_PER_BLOCK = 10
+FIRST_BLOCK = 1_000_000
+
+
+def abi_path(contract_name):
+    artifact = os.path.join(REPO_DIR, "artifacts", "contracts", f"{contract_name}.sol", f"{contract_name}.json")
+    if os.path.exists(artifact):
+        return artifact
+    return os.path.join(REPO_DIR, "frontend-dapp", "src", "lib", "abi", f"{contract_name}.json")
+
+
+def synthetic_logs(nft_contract, marketplace_contract, count):
+    def word(abi_type, value):
+        return HexBytes(encode([abi_type], [value]))
+
+    logs = []
+    for i in range(count):
+        block_number, kind = FIRST_BLOCK + i // LOGS_PER_BLOCK, i % 4
+        tx_hash = HexBytes(i.to_bytes(32, "big"))
+        if kind == 0:
+            address, topics, data = NFT_ADDRESS, [
+                HexBytes(nft_contract.events.Transfer.topic), word("address", "0x" + "00" * 20),
+                word("address", "0x" + "44" * 20), word("uint256", i)], b""
+        elif kind == 1:
+            address, topics, data = MARKETPLACE_ADDRESS, [
+                HexBytes(marketplace_contract.events.NewBid.topic), word("uint256", i),
+                word("address", "0x" + "33" * 20)], encode(["uint256", "uint256"], [10 ** 17 + i, 1_700_000_000 + i])
+        elif kind == 2:
+            address, topics, data = MARKETPLACE_ADDRESS, [
+                HexBytes(marketplace_contract.events.NFTPurchased.topic), word("uint256", i),
+                word("address", "0x" + "55" * 20), word("address", "0x" + "66" * 20)], encode(
+                ["uint256", "uint256", "uint256"], [10 ** 18, 25 * 10 ** 15, 1_700_000_000 + i])
+        else:
+            address, topics, data = NFT_ADDRESS, [
+                HexBytes(nft_contract.events.NFTMinted.topic), word("uint256", i), word("uint256", i % 100),
+                word("address", "0x" + "44" * 20)], encode(
+                ["bool", "uint256", "string"], [i % 7 == 0, i % 10, f"ipfs://bafy{i:040d}/metadata.json"])
+        logs.append(AttributeDict({
+            "address": address, "topics": topics, "data": HexBytes(data), "blockNumber": block_number,
+            "logIndex": i % LOGS_PER_BLOCK, "transactionHash": tx_hash, "transactionIndex": 0,
+            "blockHash": HexBytes(block_number.to_bytes(32, "big")), "removed": False,
+        }))
+    return logs
+
+
+def synthetic_corpus(count):
+    """Restituisce (abi_eventi_per_contratto, log) con `count` log sintetici."""
+    from event_decoder import load_event_abis
+
+    nft_abi = load_event_abis(abi_path("ScientificContentNFT"))
+    marketplace_abi = load_event_abis(abi_path("DnAContentMarketplace"))
+    w3 = Web3()
+    nft_contract = w3.eth.contract(address=NFT_ADDRESS, abi=nft_abi)
+    marketplace_contract = w3.eth.contract(address=MARKETPLACE_ADDRESS, abi=marketplace_abi)
+    contracts_and_event_names = [
+        (NFT_ADDRESS, nft_abi, EVENT_NAMES[NFT_ADDRESS]),
+        (MARKETPLACE_ADDRESS, marketplace_abi, EVENT_NAMES[MARKETPLACE_ADDRESS]),
+    ]
+    return contracts_and_event_names, synthetic_logs(nft_contract, marketplace_contract, count)
@@ -0,0 +1,57 @@
+# backend-event-listener/block_timestamps.py
+
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class BlockTimestampCache:
+    """
+    Cache LRU limitata dei timestamp dei blocchi.
+
+    I blocchi mancanti vengono richiesti con richieste JSON-RPC batch (eth_getBlockByNumber
+    senza transazioni) di al più `batch_size` elementi, e solo per i blocchi che
+    contengono effettivamente log da salvare.
+    """
+
+    def __init__(self, max_entries=10000, batch_size=50):
+        self.max_entries = max(1, max_entries)
+        self.batch_size = max(1, batch_size)
+        self._timestamps = OrderedDict()
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def _remember(self, block_number, timestamp):
+        self._timestamps[block_number] = timestamp
+        self._timestamps.move_to_end(block_number)
+        while len(self._timestamps) > self.max_entries:
+            self._timestamps.popitem(last=False)
+
+    async def get_timestamps(self, w3, block_numbers):
+        """Restituisce {numero_blocco: datetime UTC} per i blocchi richiesti."""
+        result = {}
+        missing_blocks = []
+        for block_number in sorted(set(block_numbers)):
+            if block_number in self._timestamps:
+                self._timestamps.move_to_end(block_number)
+                result[block_number] = self._timestamps[block_number]
+            else:
+                missing_blocks.append(block_number)
+
+        for start in range(0, len(missing_blocks), self.batch_size):
+            chunk = missing_blocks[start:start + self.batch_size]
+            async with w3.batch_requests() as batch:
+                for block_number in chunk:
+                    batch.add(w3.eth.get_block(block_number))
+                blocks = await batch.async_execute()
+            for block_number, block in zip(chunk, blocks):
+                timestamp = datetime.fromtimestamp(block["timestamp"], tz=timezone.utc).replace(tzinfo=None)
+                self._remember(block_number, timestamp)
+                result[block_number] = timestamp
+
+        if missing_blocks:
+            logger.debug("Timestamp di %s blocchi recuperati via batch JSON-RPC (%s in cache).", len(missing_blocks), len(self._timestamps))
+        return result
@@ -6,6 +6,36 @@ load_dotenv() # Carica le variabili d'ambiente dal file .env
 # Configurazione Blockchain
 RPC_URL = os.getenv("ARBITRUM_SEPOLIA_RPC_URL", "https://sepolia-rollup.arbitrum.io/rpc")
 
+# ********************************************************************************
+# POOL DI ENDPOINT RPC (rpc_pool.py)
+# ********************************************************************************
+# ARBITRUM_SEPOLIA_RPC_URLS: più endpoint separati da virgola (es. Alchemy, Infura, nodo
+# pubblico); se assente si usa solo RPC_URL. Le richieste vanno all'endpoint sano più
+# veloce; dopo errori o rate limit l'endpoint resta in pausa (da RPC_ENDPOINT_COOLDOWN_SECONDS
+# a RPC_ENDPOINT_MAX_COOLDOWN_SECONDS) e la richiesta passa al successivo. Una risposta più
+# lenta di max(RPC_HEDGE_AFTER_MS, RPC_HEDGE_LATENCY_FACTOR × latenza media del metodo) viene
+# richiesta anche a un secondo endpoint (RPC_HEDGE_AFTER_MS=0 disattiva l'hedging).
+RPC_URLS = [url.strip() for url in os.getenv("ARBITRUM_SEPOLIA_RPC_URLS", "").split(",") if url.strip()] or [RPC_URL]
+# Richieste al secondo per endpoint, nello stesso ordine di RPC_URLS (0 = nessun limite)
+RPC_URLS_REQUESTS_PER_SECOND = [
+    float(value) for value in os.getenv("RPC_URLS_REQUESTS_PER_SECOND", "").split(",") if value.strip()
+] or [float(os.getenv("RPC_ENDPOINT_REQUESTS_PER_SECOND", "0"))] * len(RPC_URLS)
+RPC_HEDGE_AFTER_MS = int(os.getenv("RPC_HEDGE_AFTER_MS", "750"))
+RPC_HEDGE_LATENCY_FACTOR = float(os.getenv("RPC_HEDGE_LATENCY_FACTOR", "3"))
+RPC_ENDPOINT_COOLDOWN_SECONDS = float(os.getenv("RPC_ENDPOINT_COOLDOWN_SECONDS", "2"))
+RPC_ENDPOINT_MAX_COOLDOWN_SECONDS = float(os.getenv("RPC_ENDPOINT_MAX_COOLDOWN_SECONDS", "60"))
+RPC_REQUEST_TIMEOUT_SECONDS = float(os.getenv("RPC_REQUEST_TIMEOUT_SECONDS", "30"))
+# Le chiamate indipendenti fatte entro RPC_BATCH_WINDOW_MS ms vengono unite in una richiesta
+# JSON-RPC batch di al massimo RPC_MAX_BATCH_SIZE chiamate (0 = nessuna attesa, niente batch automatici)
+RPC_BATCH_WINDOW_MS = float(os.getenv("RPC_BATCH_WINDOW_MS", "2"))
+RPC_MAX_BATCH_SIZE = int(os.getenv("RPC_MAX_BATCH_SIZE", "20"))
+
+# Endpoint WebSocket per eth_subscribe("logs") (es. wss://... di Alchemy o ws://127.0.0.1:8545 per Hardhat)
+WS_RPC_URL = os.getenv("ARBITRUM_SEPOLIA_WS_RPC_URL")
+# Con ENABLE_LOG_SUBSCRIPTION=1 gli eventi vengono scritti appena arrivano dalla sottoscrizione;
+# la scansione a intervalli resta attiva per il checkpoint e come fallback in caso di disconnessione.
+ENABLE_LOG_SUBSCRIPTION = os.getenv("ENABLE_LOG_SUBSCRIPTION", "0") == "1"
+
 # Indirizzi dei Contratti
 NFT_CONTRACT_ADDRESS = os.getenv("SCIENTIFIC_CONTENT_NFT_CONTRACT_ADDRESS")
 MARKETPLACE_CONTRACT_ADDRESS = os.getenv("SCIENTIFIC_CONTENT_MARKETPLACE_CONTRACT_ADDRESS")
@@ -14,8 +44,12 @@ MARKETPLACE_CONTRACT_ADDRESS = os.getenv("SCIENTIFIC_CONTENT_MARKETPLACE_CONTRAC
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Modifica: Percorsi relativi corretti basati su /app/artifacts nel container
-NFT_ABI_PATH = os.path.join(CURRENT_DIR, "artifacts", "contracts", "ScientificContentNFT.sol", "ScientificContentNFT.json")
-MARKETPLACE_ABI_PATH = os.path.join(CURRENT_DIR, "artifacts", "contracts", "DnAContentMarketplace.sol", "DnAContentMarketplace.json")
+# (sovrascrivibili per l'esecuzione fuori dal container, es. con gli artifact nella root del repository)
+NFT_ABI_PATH = os.getenv("NFT_ABI_PATH", os.path.join(CURRENT_DIR, "artifacts", "contracts", "ScientificContentNFT.sol", "ScientificContentNFT.json"))
+MARKETPLACE_ABI_PATH = os.getenv("MARKETPLACE_ABI_PATH", os.path.join(CURRENT_DIR, "artifacts", "contracts", "DnAContentMarketplace.sol", "DnAContentMarketplace.json"))
+
+# Cache precompilata dei soli ABI degli eventi (evita di rileggere gli artifact completi a ogni avvio)
+EVENT_ABI_CACHE_PATH = os.getenv("EVENT_ABI_CACHE_PATH", os.path.join(CURRENT_DIR, "event_abi_cache.json"))
 
 # Nomi degli eventi da monitorare
 NFT_EVENT_NAMES_TO_MONITOR = [
@@ -51,11 +85,84 @@ MARKETPLACE_EVENT_NAMES_TO_MONITOR = [
 MONGODB_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("DB_NAME", "DnaContentMarketplaceDB")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "events")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "20")) # pool condiviso tra ingest e Change Stream
+# Gli indici sono dichiarati in mongo_indexes.py: con 1 quelli non dichiarati vengono eliminati all'avvio
+MONGODB_DROP_UNDECLARED_INDEXES = os.getenv("MONGODB_DROP_UNDECLARED_INDEXES", "0") == "1"
 
 # Altre configurazioni
-POLLING_INTERVAL_SECONDS = 1500
+POLLING_INTERVAL_SECONDS = float(os.getenv("POLLING_INTERVAL_SECONDS", "1500"))
 MAX_BLOCKS_TO_SCAN_PER_CYCLE = 100 # non lo imposto a 1000 per non saturare il free tier di Alchemy
 
+# ********************************************************************************
+# FINESTRA ADATTIVA DI SCANSIONE (eth_getLogs)
+# ********************************************************************************
+# MAX_BLOCKS_TO_SCAN_PER_CYCLE è ora solo la dimensione iniziale della finestra:
+# la finestra cresce quando le risposte sono piccole e veloci e si dimezza quando
+# il provider risponde con "too many results"/timeout. L'ultima dimensione valida
+# viene salvata insieme a last_processed_block e riutilizzata al riavvio.
+SCAN_RANGE_MIN_BLOCKS = int(os.getenv("SCAN_RANGE_MIN_BLOCKS", "1"))
+SCAN_RANGE_MAX_BLOCKS = int(os.getenv("SCAN_RANGE_MAX_BLOCKS", "100000"))
+SCAN_RANGE_TARGET_LOGS = int(os.getenv("SCAN_RANGE_TARGET_LOGS", "2000")) # oltre questo numero di log la finestra non cresce
+SCAN_RANGE_TARGET_SECONDS = float(os.getenv("SCAN_RANGE_TARGET_SECONDS", "3")) # oltre questa durata la finestra si riduce
+SCAN_WINDOW_PAUSE_SECONDS = float(os.getenv("SCAN_WINDOW_PAUSE_SECONDS", "0.2")) # pausa tra due finestre durante il catch-up
+
+# ********************************************************************************
+# BACKFILL PARALLELO (AsyncWeb3)
+# ********************************************************************************
+# Con ENABLE_PARALLEL_BACKFILL=1, all'avvio l'intervallo [inizio, blocco corrente]
+# viene diviso in shard scansionati in parallelo; il checkpoint avanza solo fino
+# all'ultimo shard contiguo completato. BACKFILL_START_BLOCK permette di ripartire
+# da un blocco arbitrario (es. re-indicizzazione dopo aver svuotato la collection).
+ENABLE_PARALLEL_BACKFILL = os.getenv("ENABLE_PARALLEL_BACKFILL", "0") == "1"
+BACKFILL_START_BLOCK = os.getenv("BACKFILL_START_BLOCK")
+BACKFILL_SHARD_BLOCKS = int(os.getenv("BACKFILL_SHARD_BLOCKS", "50000"))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+BACKFILL_REQUESTS_PER_SECOND = float(os.getenv("BACKFILL_REQUESTS_PER_SECOND", "10"))
+BACKFILL_MAX_RETRIES = int(os.getenv("BACKFILL_MAX_RETRIES", "5"))
+
+# ********************************************************************************
+# FINALITÀ E REORG
+# ********************************************************************************
+# La scansione a intervalli si ferma CONFIRMATION_DEPTH blocchi sotto la testa della catena.
+# Per le finestre vicine alla testa (entro REORG_TRACKING_BLOCKS) l'hash del blocco di
+# checkpoint viene salvato in un anello di REORG_BLOCK_HASH_RING_SIZE elementi, usato a ogni
+# ciclo per rilevare un reorg ed eseguire rollback e re-ingest degli eventi interessati.
+CONFIRMATION_DEPTH = int(os.getenv("CONFIRMATION_DEPTH", "20"))
+REORG_BLOCK_HASH_RING_SIZE = int(os.getenv("REORG_BLOCK_HASH_RING_SIZE", "64"))
+REORG_TRACKING_BLOCKS = int(os.getenv("REORG_TRACKING_BLOCKS", "5000"))
+
+# ********************************************************************************
+# ARCHIVIO LOCALE DEI LOG GREZZI (log_archive.py)
+# ********************************************************************************
+# Con LOG_ARCHIVE_DIR impostata, ogni finestra scansionata (loop e backfill) viene salvata
+# anche su disco in segmenti append-only di LOG_ARCHIVE_SEGMENT_BLOCKS blocchi, con checksum
+# per record. La collection degli eventi si può poi ricostruire senza chiamate RPC:
+#   python log_archive.py replay [--from-block N] [--to-block M]
+# Su Fly.io la directory deve stare su un volume persistente.
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR")
+LOG_ARCHIVE_SEGMENT_BLOCKS = int(os.getenv("LOG_ARCHIVE_SEGMENT_BLOCKS", "1000000"))
+LOG_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("LOG_ARCHIVE_COMPRESSION_LEVEL", "1")) # zlib, 0 = nessuna compressione
+LOG_ARCHIVE_FSYNC = os.getenv("LOG_ARCHIVE_FSYNC", "0") == "1"
+
+# ********************************************************************************
+# DECODIFICA DEI LOG SU PIÙ PROCESSI (decode_pool.py)
+# ********************************************************************************
+# Con DECODE_WORKERS > 0 (o "auto" = core disponibili - 1) la decodifica ABI dei log di
+# backfill, scansione e re-indicizzazione dall'archivio avviene in un ProcessPoolExecutor,
+# a blocchi di DECODE_CHUNK_SIZE log; le finestre con meno di DECODE_POOL_MIN_LOGS log
+# restano decodificate nell'event loop. 0 = nessun processo aggiuntivo.
+DECODE_WORKERS = os.getenv("DECODE_WORKERS", "0")
+DECODE_CHUNK_SIZE = int(os.getenv("DECODE_CHUNK_SIZE", "2000"))
+DECODE_POOL_MIN_LOGS = int(os.getenv("DECODE_POOL_MIN_LOGS", "500"))
+
+# Scrittura a batch degli eventi: flush ogni N eventi o dopo T secondi dal primo evento in attesa
+EVENT_WRITE_BATCH_SIZE = int(os.getenv("EVENT_WRITE_BATCH_SIZE", "500"))
+EVENT_WRITE_BATCH_SECONDS = float(os.getenv("EVENT_WRITE_BATCH_SECONDS", "5"))
+
+# Cache LRU dei timestamp dei blocchi (campo blockTimestamp degli eventi)
+BLOCK_TIMESTAMP_CACHE_SIZE = int(os.getenv("BLOCK_TIMESTAMP_CACHE_SIZE", "10000"))
+BLOCK_HEADER_BATCH_SIZE = int(os.getenv("BLOCK_HEADER_BATCH_SIZE", "50")) # richieste per batch JSON-RPC
+
 # BLOCCHI INIZIALI DI DEPLOY DEI CONTRATTI
 INITIAL_START_BLOCKS = {
     NFT_CONTRACT_ADDRESS: 176973932,
@@ -77,6 +184,77 @@ OVERRIDE_START_BLOCK = os.getenv("OVERRIDE_START_BLOCK")
 REDIS_URL = os.getenv("REDIS_URL")
 REDIS_CHANNEL = os.getenv("REDIS_CHANNEL", "blockchain_events") # Canale Pub/Sub su Redis
 
+# Trasporto verso i websocket-server: "pubsub" (PUBLISH su REDIS_CHANNEL), "stream"
+# (XADD su uno Stream limitato, letto da ogni istanza con il proprio cursore) o "both"
+# (entrambi, utile durante la migrazione delle istanze websocket-server).
+REDIS_TRANSPORT = os.getenv("REDIS_TRANSPORT", "pubsub")
+REDIS_STREAM_KEY = os.getenv("REDIS_STREAM_KEY", "blockchain_events_stream")
+REDIS_STREAM_MAXLEN = int(os.getenv("REDIS_STREAM_MAXLEN", "10000")) # trim approssimato (~)
 
+# ********************************************************************************
+# CHANGE STREAM RIPRISTINABILE
+# ********************************************************************************
+# LISTENER_STATE_COLLECTION contiene lo stato del listener, separato dagli eventi: il
+# checkpoint della scansione (last_processed_block) e il resume token del Change Stream.
+# Il resume token dell'ultimo evento pubblicato su Redis viene salvato in
+# LISTENER_STATE_COLLECTION ogni CHANGE_STREAM_TOKEN_SAVE_EVENTS eventi o ogni
+# CHANGE_STREAM_TOKEN_SAVE_SECONDS secondi: dopo un errore o un riavvio il Change Stream
+# riparte da lì (start_after) invece che da "adesso". Gli eventi più vecchi di
+# CHANGE_STREAM_CATCHUP_LAG_SECONDS sono considerati arretrato e pubblicati a batch.
+LISTENER_STATE_COLLECTION = os.getenv("LISTENER_STATE_COLLECTION", "listener_state")
+CHANGE_STREAM_TOKEN_SAVE_EVENTS = int(os.getenv("CHANGE_STREAM_TOKEN_SAVE_EVENTS", "100"))
+CHANGE_STREAM_TOKEN_SAVE_SECONDS = float(os.getenv("CHANGE_STREAM_TOKEN_SAVE_SECONDS", "5"))
+CHANGE_STREAM_CATCHUP_BATCH_SIZE = int(os.getenv("CHANGE_STREAM_CATCHUP_BATCH_SIZE", "500"))
+CHANGE_STREAM_CATCHUP_LAG_SECONDS = float(os.getenv("CHANGE_STREAM_CATCHUP_LAG_SECONDS", "2"))
+# Finestra di micro-batching per gli eventi in tempo reale: dopo il primo evento si attendono
+# gli altri per al massimo CHANGE_STREAM_PUBLISH_WINDOW_MS ms (o CHANGE_STREAM_CATCHUP_BATCH_SIZE
+# eventi) e si pubblicano in un unico pipeline Redis. 0 = nessuna attesa.
+CHANGE_STREAM_PUBLISH_WINDOW_MS = int(os.getenv("CHANGE_STREAM_PUBLISH_WINDOW_MS", "0"))
 
+# Pipeline del Change Stream: solo i campi elencati in CHANGE_STREAM_DOCUMENT_FIELDS
+# (quelli mostrati dal feed del frontend) vengono inviati dal server, letti e pubblicati.
+# Con CHANGE_STREAM_FULL_DOCUMENT=default gli update inoltrano solo i campi modificati
+# (il frontend li unisce al documento con lo stesso _id); "updateLookup" ripristina la
+# rilettura dell'intero documento a ogni update.
+CHANGE_STREAM_FULL_DOCUMENT = os.getenv("CHANGE_STREAM_FULL_DOCUMENT", "default")
+CHANGE_STREAM_DOCUMENT_FIELDS = [
+    field.strip() for field in os.getenv(
+        "CHANGE_STREAM_DOCUMENT_FIELDS",
+        "event,methodName,source,status,errorMessage,args,address,transactionHash,blockNumber,logIndex,"
+        "blockTimestamp,timestamp,timestamp_processed,createdAt,from,to,value,gasUsed,gasPrice,"
+        "chainId,contractName,type,metadata_frontend_tx"
+    ).split(",") if field.strip()
+]
 
+# ********************************************************************************
+# PROIEZIONI DELLO STATO DEL MARKETPLACE
+# ********************************************************************************
+# Collection aggiornate a ogni batch di eventi (vedi projections.py): proprietario corrente
+# di ogni token (Transfer/NFTMinted), vendite a prezzo fisso e aste. _id = tokenId.
+# Ricostruzione completa: python projections.py
+ENABLE_STATE_PROJECTIONS = os.getenv("ENABLE_STATE_PROJECTIONS", "1") == "1"
+TOKEN_OWNERSHIP_COLLECTION = os.getenv("TOKEN_OWNERSHIP_COLLECTION", "token_ownership")
+LISTINGS_COLLECTION = os.getenv("LISTINGS_COLLECTION", "marketplace_listings")
+AUCTIONS_COLLECTION = os.getenv("AUCTIONS_COLLECTION", "marketplace_auctions")
+
+# ********************************************************************************
+# ROLLUP ANALITICI DEL MARKETPLACE
+# ********************************************************************************
+# Contatori per intervallo di tempo (ROLLUP_GRANULARITIES) e per marketplace, token e
+# contenuto (vedi rollups.py): vendite, volumi, fee, offerte, aste chiuse, mint e prelievi
+# delle fee, incrementati con $inc nello stesso batch degli eventi appena inseriti.
+# Ricostruzione completa: python rollups.py
+ENABLE_MARKETPLACE_ROLLUPS = os.getenv("ENABLE_MARKETPLACE_ROLLUPS", "1") == "1"
+ROLLUPS_COLLECTION = os.getenv("ROLLUPS_COLLECTION", "marketplace_rollups")
+ROLLUP_GRANULARITIES = [
+    granularity.strip() for granularity in os.getenv("ROLLUP_GRANULARITIES", "minute,hour,day").split(",") if granularity.strip()
+]
+
+# ********************************************************************************
+# METRICHE E LOGGING
+# ********************************************************************************
+# Metriche Prometheus (metrics.py) in GET http://METRICS_HOST:METRICS_PORT/metrics; 0 = disattivate.
+# Il dettaglio per singolo evento è loggato solo con LOG_LEVEL=DEBUG.
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9091"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -0,0 +1,110 @@
+# backend-event-listener/decode_pool.py
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from config import DECODE_WORKERS, DECODE_CHUNK_SIZE, DECODE_POOL_MIN_LOGS
+from log_archive import decode_logs_payload, encode_logs
+from log_scanner import build_event_topic_map, decode_logs, decode_logs_counting_errors
+from metrics import LOG_DECODE_ERRORS, LOGS_DECODED
+
+logger = logging.getLogger(__name__)
+
+# Tabella (indirizzo, topic0) -> EventSpec di ogni processo worker: i decoder precompilati
+# contengono funzioni locali (non serializzabili) e vengono quindi ricostruiti nel worker.
+_worker_topic_map = None
+
+
+def _init_worker(contracts_and_event_names, log_level):
+    global _worker_topic_map
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(process)d - %(message)s')
+    _worker_topic_map = build_event_topic_map(contracts_and_event_names)
+
+
+def _decode_chunk(payload, log_count):
+    """Eseguita nel worker: rilegge i log dal formato binario e li decodifica nei documenti evento."""
+    raw_logs = [log for log, _ in decode_logs_payload(payload, log_count)]
+    return decode_logs_counting_errors(raw_logs, _worker_topic_map)
+
+
+class LogDecodeStage:
+    """
+    Stadio di decodifica dei log grezzi nei documenti evento (ABI + normalizzazione BSON).
+
+    Con `workers` = 0 la decodifica avviene nell'event loop (log_scanner.decode_logs).
+    Con `workers` > 0 i log di una finestra vengono divisi in blocchi di `chunk_size`,
+    serializzati nel formato binario di log_archive (molto più economico da trasferire
+    degli AttributeDict di web3) e decodificati da un ProcessPoolExecutor: l'event loop
+    resta libero per RPC e MongoDB. Le finestre con meno di `min_pool_logs` log vengono
+    decodificate in linea, perché il trasferimento al processo costerebbe più della decodifica.
+
+    `decode()` restituisce sempre i documenti ordinati per (blockNumber, logIndex); per
+    decodificare più finestre in parallelo mantenendo l'ordine di scrittura si usano
+    `submit()` e l'attesa dei future nell'ordine di invio.
+    """
+
+    def __init__(self, contracts_and_event_names, workers=0, chunk_size=2000, min_pool_logs=500):
+        self.topic_map = build_event_topic_map(contracts_and_event_names)
+        self.workers = max(0, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.min_pool_logs = min_pool_logs
+        self._executor = None
+        if self.workers:
+            # spawn: il processo principale ha già thread attivi (Motor, asyncio.to_thread)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(contracts_and_event_names, logging.getLogger().getEffectiveLevel())
+            )
+            logger.info(f"Decodifica dei log su {self.workers} processi (blocchi di {self.chunk_size} log).")
+
+    async def decode(self, raw_logs):
+        """Decodifica i log grezzi di una finestra; restituisce i documenti ordinati per (blockNumber, logIndex)."""
+        if self._executor is None or len(raw_logs) < self.min_pool_logs:
+            return decode_logs(raw_logs, self.topic_map)
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for start in range(0, len(raw_logs), self.chunk_size):
+            chunk = raw_logs[start:start + self.chunk_size]
+            futures.append(loop.run_in_executor(self._executor, _decode_chunk, encode_logs(chunk, {}), len(chunk)))
+        documents = []
+        error_count = 0
+        # I blocchi vengono riuniti nell'ordine di invio, qualunque sia l'ordine di completamento
+        for chunk_documents, chunk_errors in await asyncio.gather(*futures):
+            documents.extend(chunk_documents)
+            error_count += chunk_errors
+        LOGS_DECODED.inc(len(documents))
+        if error_count:
+            LOG_DECODE_ERRORS.inc(error_count)
+        documents.sort(key=lambda document: (document["blockNumber"], document["logIndex"]))
+        return documents
+
+    def submit(self, raw_logs):
+        """Avvia la decodifica di una finestra e restituisce il future dei documenti."""
+        return asyncio.ensure_future(self.decode(raw_logs))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def configured_decode_workers():
+    """Numero di worker da DECODE_WORKERS ("auto" = core disponibili meno quello dell'event loop)."""
+    if DECODE_WORKERS.strip().lower() == "auto":
+        return max(1, (os.cpu_count() or 2) - 1)
+    try:
+        return max(0, int(DECODE_WORKERS))
+    except ValueError:
+        logger.error(f"Valore non valido per DECODE_WORKERS: '{DECODE_WORKERS}'. Decodifica nell'event loop.")
+        return 0
+
+
+def create_log_decode_stage(contracts_and_event_names):
+    """Stadio di decodifica configurato con DECODE_WORKERS, DECODE_CHUNK_SIZE e DECODE_POOL_MIN_LOGS."""
+    return LogDecodeStage(contracts_and_event_names, configured_decode_workers(), DECODE_CHUNK_SIZE, DECODE_POOL_MIN_LOGS)
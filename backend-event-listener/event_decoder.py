@@ -0,0 +1,152 @@
+# backend-event-listener/event_decoder.py
+
+import json
+import logging
+import os
+from datetime import datetime
+from functools import lru_cache
+
+from eth_abi import decode as abi_decode
+from eth_utils import event_abi_to_log_topic, to_checksum_address
+
+logger = logging.getLogger(__name__)
+
+# Limiti dell'intero con segno a 64 bit di BSON: oltre questi valori un uint256
+# (prezzi, offerte, fee in wei) viene salvato come stringa decimale, formato già
+# gestito dal frontend (formatPriceInWeiToEth).
+BSON_INT64_MIN = -(2 ** 63)
+BSON_INT64_MAX = 2 ** 63 - 1
+
+
+def load_event_abis(artifact_path, cache_path=None):
+    """
+    Restituisce le sole definizioni degli eventi dall'artifact Hardhat (o da un file ABI).
+
+    Se `cache_path` è indicato, gli eventi estratti vengono salvati in un piccolo file
+    JSON indicizzato per percorso, dimensione e data di modifica dell'artifact: ai riavvii
+    successivi non serve rileggere l'artifact completo (bytecode incluso).
+    """
+    if not os.path.exists(artifact_path):
+        logger.error(f"File ABI non trovato nel percorso specificato: {artifact_path}. Assicurati che il file esista nell'immagine Docker.")
+        raise FileNotFoundError(f"ABI file not found: {artifact_path}")
+
+    stat = os.stat(artifact_path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    cache = _read_cache(cache_path) if cache_path else {}
+    cached_entry = cache.get(artifact_path)
+    if cached_entry and cached_entry.get("fingerprint") == fingerprint:
+        logger.info(f"ABI degli eventi caricato dalla cache precompilata per: {artifact_path}")
+        return cached_entry["events"]
+
+    with open(artifact_path, 'r') as f:
+        content = json.load(f)
+    abi = content['abi'] if isinstance(content, dict) and 'abi' in content else content
+    event_abis = [item for item in abi if item.get("type") == "event"]
+    logger.info(f"Estratti {len(event_abis)} eventi dall'ABI in: {artifact_path}")
+
+    if cache_path:
+        cache[artifact_path] = {"fingerprint": fingerprint, "events": event_abis}
+        try:
+            with open(cache_path, 'w') as f:
+                json.dump(cache, f, separators=(",", ":"))
+        except OSError as e:
+            logger.warning(f"Impossibile scrivere la cache degli ABI in {cache_path}: {e}")
+    return event_abis
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@lru_cache(maxsize=4096)
+def checksum_address(address):
+    """to_checksum_address con cache: gli indirizzi (contratti, utenti) si ripetono di continuo."""
+    return to_checksum_address(address)
+
+
+def _as_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+
+
+def topic_to_hex(topic):
+    """Topic (HexBytes o stringa) in forma esadecimale minuscola con prefisso 0x."""
+    if isinstance(topic, str):
+        return topic.lower() if topic.startswith("0x") else "0x" + topic.lower()
+    return "0x" + bytes(topic).hex()
+
+
+def normalize_value(abi_type, value):
+    """Converte un valore decodificato in una rappresentazione sicura per MongoDB."""
+    if abi_type.endswith("]"):
+        item_type = abi_type[:abi_type.rindex("[")]
+        return [normalize_value(item_type, item) for item in value]
+    if abi_type == "address":
+        return checksum_address(value)
+    if abi_type.startswith(("uint", "int")):
+        return value if BSON_INT64_MIN <= value <= BSON_INT64_MAX else str(value)
+    return value
+
+
+def _topic_decoder(abi_type):
+    """Decoder per un argomento indicizzato (un singolo topic di 32 byte)."""
+    if abi_type == "address":
+        return lambda topic: checksum_address("0x" + topic[-20:].hex())
+    if abi_type.startswith("uint"):
+        return lambda topic: normalize_value(abi_type, int.from_bytes(topic, "big"))
+    if abi_type == "bool":
+        return lambda topic: topic[-1] == 1
+    if abi_type in ("string", "bytes") or abi_type.endswith("]") or abi_type.startswith("tuple"):
+        # Per i tipi dinamici il topic contiene solo l'hash keccak del valore
+        return lambda topic: topic
+    return lambda topic: normalize_value(abi_type, abi_decode([abi_type], topic)[0])
+
+
+class EventSpec:
+    """Evento precompilato: nome, indirizzo del contratto e decoder di topic e data."""
+
+    __slots__ = ("name", "address", "topic0", "arg_names", "indexed", "data_names", "data_types")
+
+    def __init__(self, address, event_abi):
+        inputs = event_abi.get("inputs", [])
+        self.name = event_abi["name"]
+        self.address = checksum_address(address)
+        self.topic0 = "0x" + event_abi_to_log_topic(event_abi).hex()
+        self.arg_names = [item["name"] for item in inputs]
+        self.indexed = [(item["name"], _topic_decoder(item["type"])) for item in inputs if item.get("indexed")]
+        self.data_names = [item["name"] for item in inputs if not item.get("indexed")]
+        self.data_types = [item["type"] for item in inputs if not item.get("indexed")]
+
+    def decode(self, log):
+        """Decodifica un log grezzo direttamente nel documento da salvare (senza campi di ingest)."""
+        decoded = {}
+        topics = log["topics"]
+        for (name, decode_topic), topic in zip(self.indexed, topics[1:]):
+            decoded[name] = decode_topic(_as_bytes(topic))
+        if self.data_types:
+            values = abi_decode(self.data_types, _as_bytes(log["data"]))
+            for name, abi_type, value in zip(self.data_names, self.data_types, values):
+                decoded[name] = normalize_value(abi_type, value)
+
+        return {
+            "args": {name: decoded[name] for name in self.arg_names},
+            "event": self.name,
+            "logIndex": log["logIndex"],
+            "transactionIndex": log["transactionIndex"],
+            "transactionHash": _as_bytes(log["transactionHash"]).hex(),
+            "address": self.address,
+            "blockHash": _as_bytes(log["blockHash"]),
+            "blockNumber": log["blockNumber"],
+        }
+
+
+def build_event_document(document, block_timestamp=None):
+    """Completa il documento prodotto dal decoder con i campi di ingest."""
+    document['blockTimestamp'] = block_timestamp # tempo della catena (UTC), non di ingest
+    document['timestamp_processed'] = datetime.utcnow()
+    return document
@@ -0,0 +1,189 @@
+# backend-event-listener/event_writer.py
+
+import asyncio
+import logging
+import time
+
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from metrics import EVENTS_WRITTEN, MONGO_WRITE_BATCH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+class EventBatchWriter:
+    """
+    Accumula i documenti evento e li scrive (Motor) con un'unica insert_many(ordered=False).
+
+    Il flush avviene quando il buffer raggiunge `max_batch_size` documenti, quando il
+    documento più vecchio in attesa supera `max_batch_seconds`, oppure esplicitamente
+    con `flush()`. Mentre un flush è in corso, i produttori che superano un limite
+    attendono in `add()`: il buffer resta entro `max_batch_size` più un documento per produttore. Il checkpoint registrato con `set_checkpoint()` viene salvato una sola
+    volta per flush e solo dopo che gli eventi che lo precedono sono stati scritti.
+    Se indicata, `after_write(documents)` viene attesa dopo ogni insert_many con gli stessi
+    documenti (es. aggiornamento delle proiezioni): se fallisce il batch viene ritentato.
+    `after_insert(documents)` riceve invece solo i documenti inseriti per la prima volta
+    (esclusi i duplicati scartati dall'indice unico), per aggiornamenti non idempotenti
+    come gli incrementi dei rollup: se fallisce, gli stessi documenti le vengono passati
+    di nuovo, come un'unica lista, all'inizio del flush successivo. Anche i documenti scritti
+    da una insert_many fallita a metà le vengono passati (al nuovo tentativo risulterebbero
+    duplicati): ricavati dall'errore o, se l'esito è ignoto, cercati per _id.
+    """
+
+    def __init__(self, db_collection, save_checkpoint, max_batch_size=500, max_batch_seconds=5.0,
+                 after_write=None, after_insert=None):
+        self.db_collection = db_collection
+        self.save_checkpoint = save_checkpoint
+        self.after_write = after_write
+        self.after_insert = after_insert
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_seconds = max_batch_seconds
+        self._documents = []
+        self._oldest_document_at = None
+        self._pending_checkpoint = None
+        # Documenti già inseriti non ancora passati con successo ad after_insert
+        self._unapplied_documents = []
+        # Documenti di una insert_many fallita con esito ignoto (es. connessione persa)
+        self._unverified_documents = []
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    async def add(self, document):
+        """Aggiunge un documento al buffer, eseguendo il flush se uno dei limiti è superato."""
+        if not self._documents:
+            self._oldest_document_at = time.monotonic()
+        self._documents.append(document)
+        # Con un flush già in corso il produttore ne attende la fine (backpressure) invece di far
+        # crescere il buffer senza limite, poi esegue il flush solo se i limiti sono ancora superati
+        while self._limit_reached():
+            if self._flush_lock.locked():
+                async with self._flush_lock:
+                    pass
+            else:
+                await self.flush()
+
+    def _limit_reached(self):
+        if not self._documents:
+            return False
+        return len(self._documents) >= self.max_batch_size or time.monotonic() - self._oldest_document_at >= self.max_batch_seconds
+
+    def set_checkpoint(self, block_number, scan_range_size=None, block_hash=None):
+        """Registra il checkpoint da salvare al prossimo flush."""
+        self._pending_checkpoint = (block_number, scan_range_size, block_hash)
+
+    async def flush(self):
+        """
+        Scrive i documenti in attesa e poi l'eventuale checkpoint.
+        In caso di errore diverso da chiave duplicata i documenti tornano nel buffer
+        (verranno ritentati al prossimo flush) e il checkpoint non viene salvato.
+        """
+        async with self._flush_lock:
+            # Buffer e checkpoint vengono "fotografati" prima di attendere MongoDB:
+            # gli eventi aggiunti nel frattempo da altri task finiscono nel batch successivo.
+            documents, self._documents = self._documents, []
+            oldest_document_at, self._oldest_document_at = self._oldest_document_at, None
+            checkpoint, self._pending_checkpoint = self._pending_checkpoint, None
+
+            if documents or self._unapplied_documents or self._unverified_documents:
+                started_at = time.monotonic()
+                try:
+                    # Un after_insert fallito in precedenza viene ritentato con la stessa lista:
+                    # una nuova insert_many la scarterebbe come duplicata.
+                    if self._unapplied_documents:
+                        await self.after_insert(self._unapplied_documents)
+                        self._unapplied_documents = []
+                    if self._unverified_documents:
+                        self._unapplied_documents = await self._find_landed_documents(self._unverified_documents)
+                        self._unverified_documents = []
+                        if self._unapplied_documents:
+                            await self.after_insert(self._unapplied_documents)
+                            self._unapplied_documents = []
+                    try:
+                        inserted_documents, duplicate_count = await self._insert_documents(documents) if documents else ([], 0)
+                    except Exception as e:
+                        self._track_partial_insert(documents, e)
+                        raise
+                    if self.after_insert is not None:
+                        self._unapplied_documents = inserted_documents
+                    if self.after_write is not None:
+                        await self.after_write(documents)
+                    if self._unapplied_documents:
+                        await self.after_insert(self._unapplied_documents)
+                        self._unapplied_documents = []
+                except Exception:
+                    self._documents = documents + self._documents
+                    self._oldest_document_at = oldest_document_at
+                    if self._pending_checkpoint is None:
+                        self._pending_checkpoint = checkpoint
+                    raise
+                inserted_count = len(inserted_documents)
+                elapsed_seconds = time.monotonic() - started_at
+                MONGO_WRITE_BATCH_LATENCY.observe(elapsed_seconds)
+                EVENTS_WRITTEN.labels("inserted").inc(inserted_count)
+                EVENTS_WRITTEN.labels("duplicate").inc(duplicate_count)
+                if documents:
+                    logger.info("Batch di %s eventi scritto in %.3fs: %s inseriti, %s duplicati ignorati.",
+                                len(documents), elapsed_seconds, inserted_count, duplicate_count)
+
+            if checkpoint is not None:
+                await self.save_checkpoint(self.db_collection, *checkpoint)
+
+    def _track_partial_insert(self, documents, error):
+        """Annota i documenti che una insert_many fallita può aver già scritto, per after_insert."""
+        if self.after_insert is None:
+            return
+        if isinstance(error, BulkWriteError) and not error.details.get('writeConcernErrors'):
+            # Con ordered=False sono stati scritti tutti i documenti senza un errore associato
+            rejected_indexes = {write_error['index'] for write_error in error.details.get('writeErrors', [])}
+            self._unapplied_documents = [document for index, document in enumerate(documents) if index not in rejected_indexes]
+        else:
+            self._unverified_documents = documents
+
+    async def _find_landed_documents(self, documents):
+        """
+        Documenti effettivamente scritti tra quelli di una insert_many dall'esito ignoto.
+        L'_id è assegnato dal driver prima dell'invio, quindi identifica questo inserimento
+        e non un eventuale evento identico già presente.
+        """
+        document_ids = [document['_id'] for document in documents if '_id' in document]
+        if not document_ids:
+            return []
+        landed_ids = set(await self.db_collection.distinct('_id', {'_id': {'$in': document_ids}}))
+        return [document for document in documents if document.get('_id') in landed_ids]
+
+    async def _insert_documents(self, documents):
+        """Restituisce (documenti inseriti, numero di duplicati ignorati)."""
+        try:
+            await self.db_collection.insert_many(documents, ordered=False)
+            return documents, 0
+        except (InvalidDocument, OverflowError) as e:
+            # Un documento non codificabile in BSON farebbe fallire l'intero batch a ogni tentativo:
+            # si ripiega sull'inserimento singolo scartando (e loggando) solo i documenti invalidi.
+            logger.error(f"Batch non codificabile in BSON ({e}). Inserimento documento per documento.")
+            return await self._insert_documents_one_by_one(documents)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            other_errors = [error for error in write_errors if error.get('code') != DUPLICATE_KEY_ERROR_CODE]
+            if other_errors or e.details.get('writeConcernErrors'):
+                logger.error(f"Errore nella scrittura del batch di eventi: {other_errors[:3] or e.details.get('writeConcernErrors')}")
+                raise
+            rejected_indexes = {error['index'] for error in write_errors}
+            return [document for index, document in enumerate(documents) if index not in rejected_indexes], len(write_errors)
+
+    async def _insert_documents_one_by_one(self, documents):
+        inserted_documents, duplicate_count = [], 0
+        for document in documents:
+            try:
+                await self.db_collection.insert_one(document)
+                inserted_documents.append(document)
+            except DuplicateKeyError:
+                duplicate_count += 1
+            except (InvalidDocument, OverflowError) as e:
+                logger.error(f"Evento {document.get('event')} dal blocco {document.get('blockNumber')} "
+                             f"(tx: {document.get('transactionHash')}) scartato: documento non valido ({e}).")
+        return inserted_documents, duplicate_count
@@ -0,0 +1,610 @@
+# backend-event-listener/log_archive.py
+
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from config import (
+    LOG_ARCHIVE_DIR,
+    LOG_ARCHIVE_SEGMENT_BLOCKS,
+    LOG_ARCHIVE_COMPRESSION_LEVEL,
+    LOG_ARCHIVE_FSYNC
+)
+
+logger = logging.getLogger(__name__)
+
+# ********************************************************************************
+# FORMATO DEI SEGMENTI
+# ********************************************************************************
+# Ogni segmento copre un intervallo allineato di `segment_blocks` blocchi ed è un file
+# append-only: intestazione SEGMENT_MAGIC seguita da record. Ogni record ha un'intestazione
+# fissa (RECORD_HEADER) con il CRC32 di intestazione e payload, e descrive una finestra di
+# scansione [from_block, to_block] (record DATA, payload = log grezzi, compresso con zlib se
+# RECORD_FLAG_ZLIB) oppure l'annullamento dei blocchi da from_block in poi dopo un reorg
+# (record TOMBSTONE, senza payload). I log di un record DATA vengono ignorati in lettura se
+# un TOMBSTONE successivo nello stesso segmento li copre.
+# index.json (riscritto atomicamente dopo ogni append) contiene dimensione committata dei
+# segmenti e intervalli di blocchi coperti: i byte oltre la dimensione indicizzata sono una
+# scrittura interrotta e vengono troncati all'apertura. Se index.json manca o non è valido
+# viene ricostruito rileggendo i segmenti.
+
+SEGMENT_MAGIC = b"DNALOGS\x01"
+SEGMENT_SUFFIX = ".logseg"
+INDEX_FILE_NAME = "index.json"
+INDEX_VERSION = 1
+
+# crc32, tipo, flag, riservato, from_block, to_block, numero di log, lunghezza payload
+RECORD_HEADER = struct.Struct("<IBBHQQII")
+RECORD_DATA = 0
+RECORD_TOMBSTONE = 1
+RECORD_FLAG_ZLIB = 1
+
+# blockNumber, blockTimestamp (0 = sconosciuto), logIndex, transactionIndex, numero di topic,
+# lunghezza di data; seguono address (20 byte), blockHash e transactionHash (32), topic e data
+LOG_ENTRY_HEADER = struct.Struct("<QQIIBI")
+
+
+class ArchiveCorruptionError(Exception):
+    """Record con checksum o struttura non validi all'interno della parte committata di un segmento."""
+
+
+def _to_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+
+
+def _to_unix_seconds(block_timestamp):
+    if block_timestamp is None:
+        return 0
+    return int(block_timestamp.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _from_unix_seconds(seconds):
+    if not seconds:
+        return None
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+
+def encode_logs(raw_logs, block_timestamps):
+    """Serializza i log grezzi (formato eth_getLogs di web3) nel formato binario dei record."""
+    parts = []
+    for log in raw_logs:
+        topics = [_to_bytes(topic) for topic in log["topics"]]
+        data = _to_bytes(log["data"])
+        parts.append(LOG_ENTRY_HEADER.pack(
+            log["blockNumber"],
+            _to_unix_seconds(block_timestamps.get(log["blockNumber"])),
+            log["logIndex"],
+            log["transactionIndex"],
+            len(topics),
+            len(data)
+        ))
+        parts.append(_to_bytes(log["address"]))
+        parts.append(_to_bytes(log["blockHash"]))
+        parts.append(_to_bytes(log["transactionHash"]))
+        parts.extend(topics)
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode_logs_payload(payload, log_count):
+    """
+    Rilegge i log di un record: restituisce coppie (log, block_timestamp) con il log nella
+    stessa forma accettata da log_scanner.decode_logs.
+    """
+    logs = []
+    offset = 0
+    for _ in range(log_count):
+        block_number, timestamp, log_index, transaction_index, topic_count, data_length = LOG_ENTRY_HEADER.unpack_from(payload, offset)
+        offset += LOG_ENTRY_HEADER.size
+        address = bytes(payload[offset:offset + 20])
+        block_hash = bytes(payload[offset + 20:offset + 52])
+        transaction_hash = bytes(payload[offset + 52:offset + 84])
+        offset += 84
+        topics = [bytes(payload[offset + 32 * i:offset + 32 * (i + 1)]) for i in range(topic_count)]
+        offset += 32 * topic_count
+        data = bytes(payload[offset:offset + data_length])
+        offset += data_length
+        logs.append(({
+            "address": "0x" + address.hex(),
+            "topics": topics,
+            "data": data,
+            "blockNumber": block_number,
+            "logIndex": log_index,
+            "transactionIndex": transaction_index,
+            "transactionHash": transaction_hash,
+            "blockHash": block_hash,
+            "removed": False,
+        }, _from_unix_seconds(timestamp)))
+    return logs
+
+
+def _subtract_intervals(from_block, to_block, covered):
+    """Parti di [from_block, to_block] non incluse negli intervalli ordinati e disgiunti `covered`."""
+    missing = []
+    start = from_block
+    for covered_start, covered_end in covered:
+        if covered_end < start:
+            continue
+        if covered_start > to_block:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start - 1))
+        start = max(start, covered_end + 1)
+        if start > to_block:
+            break
+    if start <= to_block:
+        missing.append((start, to_block))
+    return missing
+
+
+def _merge_interval(covered, from_block, to_block):
+    intervals = sorted(covered + [[from_block, to_block]])
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class LogArchive:
+    """
+    Archivio locale dei log grezzi restituiti da eth_getLogs, in segmenti append-only
+    con checksum per record e un piccolo indice JSON degli intervalli coperti.
+
+    Il loop di scansione e il backfill vi aggiungono ogni finestra scansionata (anche
+    vuota: la copertura dice a `iter_logs` quali blocchi sono già noti) tramite
+    `append_window`; le finestre già coperte non vengono riscritte. La re-indicizzazione
+    (`replay_archive`) rilegge i segmenti tramite mmap senza nessuna chiamata RPC.
+    I metodi sono sincroni e protetti da un lock: dal codice asincrono vanno chiamati
+    con asyncio.to_thread.
+    """
+
+    def __init__(self, directory, segment_blocks=1_000_000, compression_level=1, fsync=False):
+        self.directory = directory
+        self.segment_blocks = max(1, segment_blocks)
+        self.compression_level = compression_level
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._index = None
+
+    # -- indice -- #
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE_NAME)
+
+    def open(self):
+        """Carica (o ricostruisce) l'indice e tronca le scritture interrotte oltre la parte committata."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                if index.get("version") != INDEX_VERSION:
+                    raise ValueError(f"versione dell'indice {index.get('version')} non supportata")
+                if index["segment_blocks"] != self.segment_blocks:
+                    # I segmenti già scritti restano validi solo con la dimensione con cui sono stati creati
+                    logger.warning(f"Archivio dei log creato con segmenti di {index['segment_blocks']} blocchi: "
+                                   f"LOG_ARCHIVE_SEGMENT_BLOCKS={self.segment_blocks} ignorato.")
+                    self.segment_blocks = index["segment_blocks"]
+                self._index = index
+                self._truncate_uncommitted()
+            except FileNotFoundError:
+                self._index = self._scan_segments()
+                self._write_index()
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Indice dell'archivio dei log non valido ({e}): ricostruzione dai segmenti.")
+                self._index = self._scan_segments()
+                self._write_index()
+        logger.info(f"Archivio dei log aperto in {self.directory}: {len(self._index['segments'])} segmenti, "
+                    f"{len(self._index['covered'])} intervalli coperti.")
+        return self
+
+    def _write_index(self):
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self._index, f, separators=(",", ":"))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary_path, self.index_path)
+
+    def _truncate_uncommitted(self):
+        for name, segment in self._index["segments"].items():
+            path = os.path.join(self.directory, name)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < segment["size"]:
+                raise ValueError(f"segmento {name} più corto della dimensione indicizzata ({size} < {segment['size']})")
+            if size > segment["size"]:
+                logger.warning(f"Segmento {name}: {size - segment['size']} byte di una scrittura interrotta troncati.")
+                with open(path, "r+b") as f:
+                    f.truncate(segment["size"])
+
+    def _segment_name(self, block_number):
+        first_block = block_number - block_number % self.segment_blocks
+        return f"{first_block:012d}-{first_block + self.segment_blocks - 1:012d}{SEGMENT_SUFFIX}"
+
+    def _scan_segments(self):
+        """Ricostruisce l'indice rileggendo i segmenti; ogni segmento si ferma al primo record non valido."""
+        index = {"version": INDEX_VERSION, "segment_blocks": self.segment_blocks, "segments": {}, "covered": []}
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            records, valid_size, error = self._read_record_headers(path, stop_on_error=True)
+            if error is not None:
+                logger.warning(f"Segmento {name}: {error}. Troncato a {valid_size} byte.")
+                with open(path, "r+b") as f:
+                    f.truncate(valid_size)
+            first_block, last_block = (int(part) for part in name[:-len(SEGMENT_SUFFIX)].split("-"))
+            index["segments"][name] = {
+                "first_block": first_block,
+                "last_block": last_block,
+                "size": valid_size,
+                "records": len(records),
+                "logs": sum(record[5] for record in records if record[1] == RECORD_DATA),
+            }
+            for _, kind, _, from_block, to_block, _, _ in records:
+                if kind == RECORD_DATA:
+                    index["covered"] = _merge_interval(index["covered"], from_block, to_block)
+                else:
+                    index["covered"] = self._trim_covered(index["covered"], from_block - 1, to_block)
+        return index
+
+    @staticmethod
+    def _trim_covered(covered, last_valid_block, to_block):
+        """Toglie da `covered` i blocchi in (last_valid_block, to_block]."""
+        trimmed = []
+        for start, end in covered:
+            if end <= last_valid_block or start > to_block:
+                trimmed.append([start, end])
+                continue
+            if start <= last_valid_block:
+                trimmed.append([start, last_valid_block])
+            if end > to_block:
+                trimmed.append([to_block + 1, end])
+        return trimmed
+
+    # -- scrittura -- #
+
+    def _append_record(self, name, kind, from_block, to_block, log_count, payload, flags=0):
+        header_fields = RECORD_HEADER.pack(0, kind, flags, 0, from_block, to_block, log_count, len(payload))[4:]
+        checksum = zlib.crc32(payload, zlib.crc32(header_fields))
+        path = os.path.join(self.directory, name)
+        segment = self._index["segments"].get(name)
+        with open(path, "ab") as f:
+            if segment is None:
+                f.truncate(0)
+                f.write(SEGMENT_MAGIC)
+            f.write(struct.pack("<I", checksum) + header_fields)
+            f.write(payload)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+            size = f.tell()
+        if segment is None:
+            first_block = int(name.split("-")[0])
+            segment = self._index["segments"][name] = {
+                "first_block": first_block, "last_block": first_block + self.segment_blocks - 1,
+                "size": 0, "records": 0, "logs": 0,
+            }
+        segment["size"] = size
+        segment["records"] += 1
+        if kind == RECORD_DATA:
+            segment["logs"] += log_count
+
+    def append_window(self, from_block, to_block, raw_logs, block_timestamps=None):
+        """
+        Aggiunge i log grezzi di una finestra scansionata [from_block, to_block].
+        Le parti della finestra già coperte vengono saltate (ri-scansioni dopo un riavvio).
+        Restituisce il numero di log scritti.
+        """
+        block_timestamps = block_timestamps or {}
+        with self._lock:
+            written = 0
+            for start, end in _subtract_intervals(from_block, to_block, self._index["covered"]):
+                # Un record non attraversa mai il confine di un segmento
+                segment_start = start
+                while segment_start <= end:
+                    segment_end = min(end, segment_start - segment_start % self.segment_blocks + self.segment_blocks - 1)
+                    logs = sorted(
+                        (log for log in raw_logs if segment_start <= log["blockNumber"] <= segment_end),
+                        key=lambda log: (log["blockNumber"], log["logIndex"])
+                    )
+                    payload = encode_logs(logs, block_timestamps)
+                    flags = 0
+                    if self.compression_level and payload:
+                        payload = zlib.compress(payload, self.compression_level)
+                        flags = RECORD_FLAG_ZLIB
+                    self._append_record(self._segment_name(segment_start), RECORD_DATA, segment_start, segment_end,
+                                        len(logs), payload, flags)
+                    self._index["covered"] = _merge_interval(self._index["covered"], segment_start, segment_end)
+                    written += len(logs)
+                    segment_start = segment_end + 1
+            self._write_index()
+            return written
+
+    def invalidate_after(self, block_number):
+        """
+        Annulla i blocchi successivi a `block_number` (reorg): un record TOMBSTONE in ogni
+        segmento interessato e la copertura ridotta, così le ri-scansioni vengono riarchiviate.
+        """
+        with self._lock:
+            affected = [name for name, segment in self._index["segments"].items() if segment["last_block"] > block_number]
+            if not affected:
+                return
+            for name in affected:
+                segment = self._index["segments"][name]
+                self._append_record(name, RECORD_TOMBSTONE, max(block_number + 1, segment["first_block"]),
+                                    segment["last_block"], 0, b"")
+            self._index["covered"] = self._trim_covered(self._index["covered"], block_number, float("inf"))
+            self._write_index()
+        logger.warning(f"Archivio dei log: blocchi successivi a {block_number} annullati in {len(affected)} segmenti.")
+
+    # -- lettura -- #
+
+    def coverage(self, from_block=None, to_block=None):
+        """Intervalli di blocchi presenti nell'archivio, limitati a [from_block, to_block]."""
+        with self._lock:
+            covered = [list(interval) for interval in self._index["covered"]]
+        result = []
+        for start, end in covered:
+            start = max(start, from_block) if from_block is not None else start
+            end = min(end, to_block) if to_block is not None else end
+            if start <= end:
+                result.append((start, end))
+        return result
+
+    def _read_record_headers(self, path, stop_on_error=False, committed_size=None):
+        """
+        Legge (tramite mmap) le intestazioni dei record di un segmento, verificando i checksum.
+        Restituisce (record, dimensione valida, errore) con record = (offset del payload, tipo,
+        flag, from_block, to_block, numero di log, lunghezza del payload).
+        """
+        records = []
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size if committed_size is None else committed_size
+            if size < len(SEGMENT_MAGIC):
+                return records, 0, "segmento vuoto"
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                    return records, 0, "intestazione del segmento non valida"
+                view = memoryview(mapped)
+                try:
+                    offset = len(SEGMENT_MAGIC)
+                    while offset < size:
+                        if offset + RECORD_HEADER.size > size:
+                            error = f"intestazione del record troncata all'offset {offset}"
+                            if stop_on_error:
+                                return records, offset, error
+                            raise ArchiveCorruptionError(error)
+                        checksum, kind, flags, _, from_block, to_block, log_count, payload_length = RECORD_HEADER.unpack_from(view, offset)
+                        payload_offset = offset + RECORD_HEADER.size
+                        end = payload_offset + payload_length
+                        if end > size or zlib.crc32(view[payload_offset:end], zlib.crc32(view[offset + 4:payload_offset])) != checksum:
+                            error = f"checksum non valido nel record all'offset {offset}"
+                            if stop_on_error:
+                                return records, offset, error
+                            raise ArchiveCorruptionError(error)
+                        records.append((payload_offset, kind, flags, from_block, to_block, log_count, payload_length))
+                        offset = end
+                finally:
+                    view.release()
+        return records, size, None
+
+    def iter_logs(self, from_block=None, to_block=None):
+        """
+        Restituisce i log archiviati (coppie log, block_timestamp) in ordine di
+        (blockNumber, logIndex), segmento per segmento, leggendo i file tramite mmap.
+        """
+        with self._lock:
+            segments = sorted(self._index["segments"].items(), key=lambda item: item[1]["first_block"])
+            segments = [(name, dict(segment)) for name, segment in segments]
+        for name, segment in segments:
+            if (to_block is not None and segment["first_block"] > to_block) or (from_block is not None and segment["last_block"] < from_block):
+                continue
+            path = os.path.join(self.directory, name)
+            records, _, _ = self._read_record_headers(path, committed_size=segment["size"])
+            # Un record DATA vale solo per i blocchi precedenti al primo TOMBSTONE scritto dopo di lui
+            valid_records = []
+            cutoff = float("inf")
+            for record in reversed(records):
+                if record[1] == RECORD_TOMBSTONE:
+                    cutoff = min(cutoff, record[3])
+                elif record[3] < cutoff:
+                    valid_records.append((record, cutoff))
+            valid_records.sort(key=lambda item: item[0][3])
+
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for (payload_offset, _, flags, record_from, record_to, log_count, payload_length), cutoff in valid_records:
+                    if not log_count:
+                        continue
+                    if (to_block is not None and record_from > to_block) or (from_block is not None and record_to < from_block):
+                        continue
+                    payload = mapped[payload_offset:payload_offset + payload_length]
+                    if flags & RECORD_FLAG_ZLIB:
+                        payload = zlib.decompress(payload)
+                    for log, block_timestamp in decode_logs_payload(payload, log_count):
+                        block_number = log["blockNumber"]
+                        if block_number >= cutoff:
+                            break
+                        if (from_block is None or block_number >= from_block) and (to_block is None or block_number <= to_block):
+                            yield log, block_timestamp
+
+    def verify(self):
+        """Verifica i checksum di tutti i record committati. Restituisce {segmento: errore o None}."""
+        with self._lock:
+            segments = dict(self._index["segments"])
+        results = {}
+        for name, segment in sorted(segments.items()):
+            try:
+                self._read_record_headers(os.path.join(self.directory, name), committed_size=segment["size"])
+                results[name] = None
+            except (ArchiveCorruptionError, OSError) as e:
+                results[name] = str(e)
+        return results
+
+    def stats(self):
+        with self._lock:
+            segments = self._index["segments"].values()
+            return {
+                "segments": len(self._index["segments"]),
+                "records": sum(segment["records"] for segment in segments),
+                "logs": sum(segment["logs"] for segment in segments),
+                "bytes": sum(segment["size"] for segment in segments),
+                "covered": [list(interval) for interval in self._index["covered"]],
+            }
+
+
+def open_log_archive():
+    """Apre l'archivio configurato in LOG_ARCHIVE_DIR (None se l'archivio è disattivato)."""
+    if not LOG_ARCHIVE_DIR:
+        return None
+    return LogArchive(LOG_ARCHIVE_DIR, LOG_ARCHIVE_SEGMENT_BLOCKS, LOG_ARCHIVE_COMPRESSION_LEVEL, LOG_ARCHIVE_FSYNC).open()
+
+
+# ********************************************************************************
+# RE-INDICIZZAZIONE DALL'ARCHIVIO
+# ********************************************************************************
+
+async def replay_archive(archive, db_collection, log_decode_stage, from_block=None, to_block=None, replace_existing=True,
+                         chunk_size=5000):
+    """
+    Ridecodifica i log archiviati e riscrive i documenti evento, senza chiamate RPC.
+
+    Con `replace_existing` gli eventi del listener nei blocchi coperti dall'archivio vengono
+    prima eliminati (altrimenti l'indice unico scarterebbe i documenti ricostruiti come
+    duplicati). La decodifica dei blocchi di `chunk_size` log avviene tramite
+    `log_decode_stage` (decode_pool.LogDecodeStage): con più processi worker più blocchi
+    sono in decodifica contemporaneamente, ma vengono scritti nell'ordine dell'archivio.
+    Le proiezioni e i rollup vengono ricostruiti alla fine. Il checkpoint non cambia.
+    Restituisce il numero di eventi scritti.
+    """
+    from collections import deque
+
+    from event_decoder import build_event_document
+    from event_writer import EventBatchWriter
+    from projections import rebuild_projections
+    from rollups import rebuild_rollups
+    from reorg_guard import listener_events_filter
+    from config import ENABLE_STATE_PROJECTIONS, ENABLE_MARKETPLACE_ROLLUPS, EVENT_WRITE_BATCH_SIZE
+
+    started_at = time.monotonic()
+    intervals = archive.coverage(from_block, to_block)
+    if replace_existing:
+        deleted_count = 0
+        for start, end in intervals:
+            result = await db_collection.delete_many(listener_events_filter({"$gte": start, "$lte": end}))
+            deleted_count += result.deleted_count
+        logger.info(f"Re-indicizzazione: {deleted_count} eventi esistenti eliminati in {len(intervals)} intervalli archiviati.")
+
+    async def keep_checkpoint(*_):
+        pass
+
+    event_writer = EventBatchWriter(db_collection, save_checkpoint=keep_checkpoint, max_batch_size=EVENT_WRITE_BATCH_SIZE,
+                                    max_batch_seconds=float("inf"))
+    event_count = 0
+    # (future dei documenti, timestamp dei blocchi) nell'ordine di lettura dall'archivio
+    in_flight = deque()
+    max_in_flight = max(1, 2 * log_decode_stage.workers)
+
+    async def write_oldest():
+        documents_future, block_timestamps = in_flight.popleft()
+        documents = await documents_future
+        for document in documents:
+            await event_writer.add(build_event_document(document, block_timestamps.get(document["blockNumber"])))
+        return len(documents)
+
+    def submit(chunk):
+        block_timestamps = {log["blockNumber"]: block_timestamp for log, block_timestamp in chunk}
+        in_flight.append((log_decode_stage.submit([log for log, _ in chunk]), block_timestamps))
+
+    chunk = []
+    for item in archive.iter_logs(from_block, to_block):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            submit(chunk)
+            chunk = []
+            if len(in_flight) >= max_in_flight:
+                event_count += await write_oldest()
+    if chunk:
+        submit(chunk)
+    while in_flight:
+        event_count += await write_oldest()
+    await event_writer.flush()
+
+    if ENABLE_STATE_PROJECTIONS:
+        await rebuild_projections(db_collection)
+    if ENABLE_MARKETPLACE_ROLLUPS:
+        await rebuild_rollups(db_collection)
+    logger.info(f"Re-indicizzazione dall'archivio completata: {event_count} eventi in {time.monotonic() - started_at:.1f}s.")
+    return event_count
+
+
+async def main(command_args):
+    from config import (
+        DB_NAME,
+        COLLECTION_NAME,
+        NFT_CONTRACT_ADDRESS,
+        MARKETPLACE_CONTRACT_ADDRESS,
+        NFT_ABI_PATH,
+        MARKETPLACE_ABI_PATH,
+        EVENT_ABI_CACHE_PATH,
+        NFT_EVENT_NAMES_TO_MONITOR,
+        MARKETPLACE_EVENT_NAMES_TO_MONITOR
+    )
+    from decode_pool import create_log_decode_stage
+    from event_decoder import load_event_abis
+    from mongo_client import get_mongo_client
+
+    archive = open_log_archive()
+    if archive is None:
+        logger.error("LOG_ARCHIVE_DIR non impostata: nessun archivio dei log da usare.")
+        return
+
+    if command_args.command == "verify":
+        errors = {name: error for name, error in archive.verify().items() if error}
+        for name, error in errors.items():
+            logger.error(f"Segmento {name}: {error}")
+        logger.info(f"Verifica completata: {len(errors)} segmenti con errori. {json.dumps(archive.stats()['covered'])}")
+        return
+    if command_args.command == "stats":
+        print(json.dumps(archive.stats(), indent=2))
+        return
+
+    log_decode_stage = create_log_decode_stage([
+        (NFT_CONTRACT_ADDRESS, load_event_abis(NFT_ABI_PATH, EVENT_ABI_CACHE_PATH), NFT_EVENT_NAMES_TO_MONITOR),
+        (MARKETPLACE_CONTRACT_ADDRESS, load_event_abis(MARKETPLACE_ABI_PATH, EVENT_ABI_CACHE_PATH), MARKETPLACE_EVENT_NAMES_TO_MONITOR)
+    ])
+    collection = get_mongo_client().get_database(DB_NAME).get_collection(COLLECTION_NAME)
+    try:
+        await replay_archive(archive, collection, log_decode_stage, command_args.from_block, command_args.to_block,
+                             replace_existing=not command_args.keep_existing)
+    finally:
+        log_decode_stage.close()
+
+
+if __name__ == "__main__":
+    # Re-indicizzazione della collection degli eventi dai log archiviati (es. dopo aver cambiato
+    # i campi salvati da handle_event), senza chiamate RPC:
+    #   python log_archive.py replay [--from-block N] [--to-block M] [--keep-existing]
+    #   python log_archive.py verify | stats
+    # Con DECODE_WORKERS=auto la decodifica usa tutti i core disponibili.
+    parser = argparse.ArgumentParser(description="Archivio locale dei log grezzi (LOG_ARCHIVE_DIR)")
+    parser.add_argument("command", choices=["replay", "verify", "stats"])
+    parser.add_argument("--from-block", type=int)
+    parser.add_argument("--to-block", type=int)
+    parser.add_argument("--keep-existing", action="store_true", help="non eliminare gli eventi già presenti prima della riscrittura")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(parser.parse_args()))
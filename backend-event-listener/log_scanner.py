@@ -0,0 +1,182 @@
+# backend-event-listener/log_scanner.py
+
+import logging
+
+from event_decoder import EventSpec, checksum_address, topic_to_hex
+from metrics import LOG_DECODE_ERRORS, LOGS_DECODED
+
+logger = logging.getLogger(__name__)
+
+
+def build_event_topic_map(contracts_and_event_names):
+    """
+    Precalcola la tabella (indirizzo, topic0) -> EventSpec (decoder precompilato).
+
+    `contracts_and_event_names` è una lista di terne (indirizzo, abi_eventi, [nomi evento]).
+    La chiave include l'indirizzo perché eventi con la stessa firma possono
+    esistere su più contratti (es. OwnershipTransferred su NFT e Marketplace).
+    """
+    topic_map = {}
+    for contract_address, event_abis, event_names in contracts_and_event_names:
+        address = checksum_address(contract_address)
+        abis_by_name = {event_abi["name"]: event_abi for event_abi in event_abis}
+        for event_name in event_names:
+            event_abi = abis_by_name.get(event_name)
+            if event_abi is None:
+                logger.error(f"Evento '{event_name}' non presente nell'ABI del contratto {address}. Ignorato.")
+                continue
+            event_spec = EventSpec(address, event_abi)
+            topic_map[(address, event_spec.topic0)] = event_spec
+    logger.info(f"Tabella firme eventi costruita: {len(topic_map)} coppie (indirizzo, topic0) monitorate.")
+    return topic_map
+
+
+def build_subscription_filter(topic_map):
+    """Filtro indirizzi + OR-set di topic0, comune a eth_getLogs ed eth_subscribe("logs")."""
+    return {
+        "address": sorted({address for address, _ in topic_map}),
+        "topics": [sorted({topic for _, topic in topic_map})],
+    }
+
+
+def build_logs_filter(topic_map, from_block, to_block):
+    """Costruisce un unico filtro eth_getLogs: lista di indirizzi + OR-set di topic0."""
+    return {"fromBlock": from_block, "toBlock": to_block, **build_subscription_filter(topic_map)}
+
+
+def decode_logs_counting_errors(raw_logs, topic_map):
+    """
+    Decodifica localmente i log grezzi usando la tabella topic0 -> EventSpec.
+    Restituisce (documenti, numero di log non decodificabili); i documenti sono quelli da
+    salvare (senza blockTimestamp e timestamp_processed), ordinati per (blockNumber, logIndex).
+    """
+    documents = []
+    error_count = 0
+    for log in raw_logs:
+        topics = log.get("topics")
+        if not topics:
+            continue
+        address = checksum_address(log["address"])
+        topic0 = topic_to_hex(topics[0])
+        event_spec = topic_map.get((address, topic0))
+        if event_spec is None:
+            logger.debug("Log ignorato: firma %s non monitorata per il contratto %s.", topic0, address)
+            continue
+        try:
+            documents.append(event_spec.decode(log))
+        except Exception as e:
+            error_count += 1
+            logger.error(f"Errore nella decodifica del log (blocco {log.get('blockNumber')}, logIndex {log.get('logIndex')}): {e}")
+    documents.sort(key=lambda document: (document["blockNumber"], document["logIndex"]))
+    return documents, error_count
+
+
+def decode_logs(raw_logs, topic_map):
+    """Come decode_logs_counting_errors, ma restituisce solo i documenti e aggiorna le metriche."""
+    documents, error_count = decode_logs_counting_errors(raw_logs, topic_map)
+    LOGS_DECODED.inc(len(documents))
+    if error_count:
+        LOG_DECODE_ERRORS.inc(error_count)
+    return documents
+
+
+async def fetch_logs_in_range_async(async_w3, topic_map, from_block, to_block):
+    """
+    Recupera con una sola chiamata eth_getLogs (AsyncWeb3) tutti i log grezzi dei
+    contratti monitorati nell'intervallo [from_block, to_block].
+    """
+    return await async_w3.eth.get_logs(build_logs_filter(topic_map, from_block, to_block))
+
+
+async def fetch_events_in_range_async(async_w3, topic_map, from_block, to_block):
+    """Come fetch_logs_in_range_async, ma restituisce i log già decodificati localmente."""
+    return decode_logs(await fetch_logs_in_range_async(async_w3, topic_map, from_block, to_block), topic_map)
+
+
+# Codici JSON-RPC con cui i provider rifiutano un eth_getLogs troppo ampio
+# (-32005 "limit exceeded": Infura, Erigon, nodo pubblico Arbitrum, ...).
+RANGE_LIMIT_ERROR_CODES = (-32005,)
+
+# Frammenti dei messaggi d'errore con cui i provider (Alchemy, Infura, QuickNode, Ankr,
+# geth, ...) segnalano che l'intervallo di eth_getLogs è troppo ampio. I timeout di
+# trasporto e gli altri errori non ne fanno parte: vanno ritentati, non dimezzati.
+RANGE_LIMIT_ERROR_MARKERS = (
+    "query returned more than",
+    "log response size exceeded",
+    "block range is too wide",
+    "block range too large",
+    "range is too large",
+    "block range limit exceeded",
+    "exceed maximum block range",
+    "query timeout exceeded",
+    "-32005",
+)
+
+
+def is_range_limit_error(error):
+    """Indica se il provider ha rifiutato l'intervallo perché troppo ampio (troppi risultati o query troppo lunga)."""
+    rpc_error = (getattr(error, "rpc_response", None) or {}).get("error")
+    if isinstance(rpc_error, dict) and rpc_error.get("code") in RANGE_LIMIT_ERROR_CODES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RANGE_LIMIT_ERROR_MARKERS)
+
+
+class AdaptiveRangeController:
+    """
+    Regola la dimensione della finestra di blocchi passata a eth_getLogs.
+
+    La finestra raddoppia quando una finestra piena restituisce pochi log in poco
+    tempo, si dimezza quando la risposta è lenta o affollata e, tramite `shrink()`,
+    quando il provider rifiuta l'intervallo. Dopo un rifiuto la finestra non
+    cresce oltre la dimensione ridotta per `ceiling_windows` finestre, così da non
+    oscillare continuamente attorno al limite del provider.
+    """
+
+    def __init__(self, initial_size, min_size, max_size, target_logs, target_seconds, grow_factor=2, ceiling_windows=50):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.target_logs = target_logs
+        self.target_seconds = target_seconds
+        self.grow_factor = grow_factor
+        self.ceiling_windows = ceiling_windows
+        self.size = min(self.max_size, max(self.min_size, int(initial_size)))
+        self._ceiling = None
+        self._windows_under_ceiling = 0
+
+    def window_end(self, from_block, head_block):
+        """Ultimo blocco della prossima finestra che parte da `from_block`."""
+        return min(head_block, from_block + self.size - 1)
+
+    def record_success(self, block_span, log_count, elapsed_seconds):
+        """Aggiorna la dimensione in base all'esito di una finestra scansionata."""
+        previous_size = self.size
+        if self._ceiling is not None:
+            self._windows_under_ceiling += 1
+            if self._windows_under_ceiling >= self.ceiling_windows:
+                self._ceiling = None
+        max_size = self._ceiling or self.max_size
+        if log_count > self.target_logs or elapsed_seconds > self.target_seconds:
+            self.size = max(self.min_size, self.size // 2)
+        elif block_span >= self.size and log_count <= self.target_logs // 2 and elapsed_seconds <= self.target_seconds / 2:
+            # Si cresce solo se la finestra era piena (non troncata dalla testa della catena)
+            self.size = max(self.size, min(max_size, int(self.size * self.grow_factor)))
+        if self.size != previous_size:
+            logger.info("Finestra di scansione adattata: %s -> %s blocchi (%s log in %.2fs).", previous_size, self.size, log_count, elapsed_seconds)
+
+    def shrink(self, failed_span):
+        """
+        Dimezza la finestra dopo che il provider ha rifiutato un intervallo di `failed_span` blocchi.
+        Con più richieste in volo la dimensione si basa sull'intervallo fallito, così più
+        errori simultanei sulla stessa dimensione non la dimezzano più volte.
+        Restituisce False se l'intervallo fallito era già alla dimensione minima.
+        """
+        if failed_span <= self.min_size:
+            return False
+        new_size = max(self.min_size, failed_span // 2)
+        if new_size < self.size:
+            logger.warning(f"Finestra di scansione dimezzata dopo errore del provider: {self.size} -> {new_size} blocchi.")
+            self.size = new_size
+            self._ceiling = new_size
+            self._windows_under_ceiling = 0
+        return True
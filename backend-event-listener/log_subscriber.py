@@ -0,0 +1,52 @@
+# backend-event-listener/log_subscriber.py
+
+import asyncio
+import logging
+
+from web3 import AsyncWeb3, WebSocketProvider
+
+from log_scanner import build_subscription_filter, decode_logs
+
+logger = logging.getLogger(__name__)
+
+
+async def subscribe_to_contract_logs(ws_rpc_url, topic_map, on_events, request_range_poll, on_removed_log, reconnect_delay_seconds=5):
+    """
+    Riceve in tempo quasi reale i log dei contratti monitorati tramite eth_subscribe("logs").
+
+    `on_events(events)` è una coroutine che salva subito gli eventi decodificati;
+    `on_removed_log(log)` elimina l'evento di un log annullato da un reorg (removed=true).
+    `request_range_poll()` chiede al loop di scansione a intervalli di ripartire
+    immediatamente dall'ultimo checkpoint: viene chiamata dopo ogni (ri)sottoscrizione,
+    per coprire i blocchi prodotti mentre la connessione non era attiva, e a ogni
+    disconnessione, così che il polling faccia da fallback finché la WebSocket è giù.
+    I log ricevuti due volte (sottoscrizione + polling) sono scartati dall'indice unico.
+
+    Per i test locali: `npx hardhat node` espone anche ws://127.0.0.1:8545.
+    """
+    subscription_filter = build_subscription_filter(topic_map)
+
+    while True:
+        try:
+            logger.info(f"Apertura sottoscrizione eth_subscribe('logs') su {ws_rpc_url}...")
+            async with AsyncWeb3(WebSocketProvider(ws_rpc_url)) as ws_w3:
+                subscription_id = await ws_w3.eth.subscribe("logs", subscription_filter)
+                logger.info(f"Sottoscrizione ai log attiva (id: {subscription_id}).")
+                request_range_poll()
+
+                async for response in ws_w3.socket.process_subscriptions():
+                    log = response.get("result")
+                    if not log:
+                        continue
+                    if log.get("removed"):
+                        await on_removed_log(log)
+                        continue
+                    events = decode_logs([log], topic_map)
+                    if events:
+                        await on_events(events)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Sottoscrizione ai log interrotta: {e}. Fallback sul polling dal checkpoint, nuovo tentativo tra {reconnect_delay_seconds}s.")
+        request_range_poll()
+        await asyncio.sleep(reconnect_delay_seconds)
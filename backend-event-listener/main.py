@@ -1,10 +1,11 @@
 # backend-event-listener/main.py
 
 import logging
+import os
 
 # Configurazione iniziale del logging (sincrono, prima di qualsiasi import)
-# Imposta a DEBUG per avere un output molto più verboso che ci aiuterà
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# LOG_LEVEL=DEBUG per avere un output molto più verboso (anche una riga per ogni evento)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 logger.info("Script main.py avviato. Importazioni in corso...")
 
@@ -12,11 +13,11 @@ logger.info("Script main.py avviato. Importazioni in corso...")
 try:
     import asyncio
     import json
-    import os
+    import time
     from datetime import datetime
-    from web3 import Web3
+    from web3 import AsyncWeb3
     from web3.middleware import ExtraDataToPOAMiddleware
-    from pymongo import MongoClient, errors as pymongo_errors
+    from pymongo import errors as pymongo_errors
     logger.info("Import di base completati con successo.")
 except Exception as e:
     logger.error(f"Errore negli import di base: {e}")
@@ -26,10 +27,20 @@ try:
     # Importa le configurazioni dal file config.py
     from config import (
         RPC_URL,
+        RPC_URLS,
+        RPC_URLS_REQUESTS_PER_SECOND,
+        RPC_HEDGE_AFTER_MS,
+        RPC_HEDGE_LATENCY_FACTOR,
+        RPC_ENDPOINT_COOLDOWN_SECONDS,
+        RPC_ENDPOINT_MAX_COOLDOWN_SECONDS,
+        RPC_REQUEST_TIMEOUT_SECONDS,
+        RPC_BATCH_WINDOW_MS,
+        RPC_MAX_BATCH_SIZE,
         NFT_CONTRACT_ADDRESS,
         MARKETPLACE_CONTRACT_ADDRESS,
         NFT_ABI_PATH,
         MARKETPLACE_ABI_PATH,
+        EVENT_ABI_CACHE_PATH,
         NFT_EVENT_NAMES_TO_MONITOR,
         MARKETPLACE_EVENT_NAMES_TO_MONITOR,
         MONGODB_URI,
@@ -38,7 +49,29 @@ try:
         POLLING_INTERVAL_SECONDS,
         INITIAL_START_BLOCKS,
         MAX_BLOCKS_TO_SCAN_PER_CYCLE,
-        OVERRIDE_START_BLOCK
+        OVERRIDE_START_BLOCK,
+        SCAN_RANGE_MIN_BLOCKS,
+        SCAN_RANGE_MAX_BLOCKS,
+        SCAN_RANGE_TARGET_LOGS,
+        SCAN_RANGE_TARGET_SECONDS,
+        SCAN_WINDOW_PAUSE_SECONDS,
+        ENABLE_PARALLEL_BACKFILL,
+        BACKFILL_START_BLOCK,
+        EVENT_WRITE_BATCH_SIZE,
+        EVENT_WRITE_BATCH_SECONDS,
+        WS_RPC_URL,
+        ENABLE_LOG_SUBSCRIPTION,
+        CONFIRMATION_DEPTH,
+        REORG_BLOCK_HASH_RING_SIZE,
+        REORG_TRACKING_BLOCKS,
+        BLOCK_TIMESTAMP_CACHE_SIZE,
+        BLOCK_HEADER_BATCH_SIZE,
+        ENABLE_STATE_PROJECTIONS,
+        ENABLE_MARKETPLACE_ROLLUPS,
+        ROLLUPS_COLLECTION,
+        LOG_ARCHIVE_DIR,
+        METRICS_HOST,
+        METRICS_PORT
     )
     logger.info("Config importato con successo.")
 except Exception as e:
@@ -48,28 +81,51 @@ except Exception as e:
 try:
     # Assicurati che questo import sia corretto come da ultima discussione (senza backend_event_listener)
     from mongodb_listener import listen_for_db_changes
+    from mongo_client import get_mongo_client
     logger.info("mongodb_listener importato con successo.")
 except Exception as e:
     logger.error(f"Errore import mongodb_listener: {e}")
     raise
 
+try:
+    from log_scanner import (
+        AdaptiveRangeController,
+        fetch_logs_in_range_async,
+        is_range_limit_error
+    )
+    from event_decoder import build_event_document, load_event_abis
+    from parallel_backfill import run_parallel_backfill
+    from event_writer import EventBatchWriter
+    from projections import apply_projections, rebuild_projections, PROJECTION_COLLECTIONS
+    from rollups import apply_rollups, rebuild_rollups
+    from mongo_indexes import ensure_indexes
+    from block_timestamps import BlockTimestampCache
+    from metrics import record_chain_head, record_checkpoint, serve_metrics
+    from log_subscriber import subscribe_to_contract_logs
+    from log_archive import open_log_archive
+    from decode_pool import create_log_decode_stage
+    from rpc_pool import RpcProviderPool
+    from reorg_guard import (
+        CHECKPOINT_ID,
+        checkpoint_collection,
+        delete_orphaned_events,
+        delete_removed_log,
+        detect_reorg,
+        get_block_hash,
+        migrate_legacy_checkpoint,
+        rollback_to_block
+    )
+    logger.info("log_scanner importato con successo.")
+except Exception as e:
+    logger.error(f"Errore import log_scanner: {e}")
+    raise
+
 # --- Funzioni di supporto ---
 def load_abi(filepath):
-    """Carica un ABI da un file JSON."""
+    """Carica dal file (o dalla cache precompilata) le sole definizioni degli eventi dell'ABI."""
     logger.info(f"Tentativo di caricare ABI da: {filepath}")
     try:
-        if not os.path.exists(filepath):
-            logger.error(f"File ABI non trovato nel percorso specificato: {filepath}. Assicurati che il file esista nell'immagine Docker.")
-            raise FileNotFoundError(f"ABI file not found: {filepath}")
-        
-        with open(filepath, 'r') as f:
-            content = json.load(f)
-            if 'abi' in content:
-                logger.info(f"ABI caricato con successo dal campo 'abi' in: {filepath}")
-                return content['abi']
-            else:
-                logger.info(f"ABI caricato con successo direttamente da: {filepath}")
-                return content
+        return load_event_abis(filepath, EVENT_ABI_CACHE_PATH)
     except FileNotFoundError:
         logger.error(f"File ABI non trovato: {filepath}.")
         raise
@@ -80,47 +136,62 @@ def load_abi(filepath):
         logger.error(f"Errore inatteso durante il caricamento dell'ABI da {filepath}: {e}")
         raise
 
-def connect_to_blockchain():
-    """Connette a una nodeline blockchain."""
-    logger.info(f"Tentativo di connessione alla blockchain tramite RPC_URL: {RPC_URL}")
+async def connect_to_blockchain():
+    """
+    Connette alla blockchain tramite AsyncWeb3 (nessuna chiamata bloccante sull'event loop)
+    usando il pool di endpoint RPC_URLS: batch automatici, hedging e failover tra endpoint.
+    """
+    rpc_pool = RpcProviderPool(
+        RPC_URLS,
+        requests_per_second=RPC_URLS_REQUESTS_PER_SECOND,
+        batch_window_seconds=RPC_BATCH_WINDOW_MS / 1000,
+        max_batch_size=RPC_MAX_BATCH_SIZE,
+        hedge_after_seconds=RPC_HEDGE_AFTER_MS / 1000,
+        hedge_latency_factor=RPC_HEDGE_LATENCY_FACTOR,
+        cooldown_seconds=RPC_ENDPOINT_COOLDOWN_SECONDS,
+        max_cooldown_seconds=RPC_ENDPOINT_MAX_COOLDOWN_SECONDS,
+        request_timeout_seconds=RPC_REQUEST_TIMEOUT_SECONDS
+    )
+    logger.info(f"Tentativo di connessione alla blockchain tramite {rpc_pool}")
     try:
-        w3 = Web3(Web3.HTTPProvider(RPC_URL))
+        w3 = AsyncWeb3(rpc_pool)
         w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
 
-        if not w3.is_connected():
-            logger.error("Impossibile connettersi alla blockchain. Controlla il tuo RPC_URL.")
+        if not await w3.is_connected():
+            logger.error("Impossibile connettersi alla blockchain. Controlla RPC_URL / ARBITRUM_SEPOLIA_RPC_URLS.")
+            await rpc_pool.disconnect()
             return None
-        current_block = w3.eth.block_number
-        logger.info(f"Connesso alla blockchain: {RPC_URL}. Blocco corrente: {current_block}")
+        current_block = await w3.eth.block_number
+        logger.info(f"Connesso alla blockchain: {rpc_pool}. Blocco corrente: {current_block}")
         return w3
     except Exception as e:
         logger.error(f"Errore durante la connessione alla blockchain: {e}")
+        await rpc_pool.disconnect()
         return None
 
-def connect_to_mongodb_for_blockchain_events(): # Rinominata per chiarezza
-    """Connette a MongoDB Atlas e crea l'indice unico per gli eventi blockchain."""
+async def connect_to_mongodb_for_blockchain_events(): # Rinominata per chiarezza
+    """Connette a MongoDB Atlas (client Motor condiviso) e crea gli indici dichiarati per gli eventi blockchain."""
     logger.info(f"Tentativo di connessione a MongoDB Atlas per eventi blockchain. URI: {MONGODB_URI}") 
     try:
-        client = MongoClient(MONGODB_URI)
-        client.admin.command('ping')
+        client = get_mongo_client()
+        await client.admin.command('ping')
         logger.info("Connesso a MongoDB Atlas per eventi blockchain.")
         db = client.get_database(DB_NAME)
         collection = db.get_collection(COLLECTION_NAME)
 
-        logger.info(f"Verifica/Creazione indice unico 'unique_event_log' sulla collection '{COLLECTION_NAME}' nel DB '{DB_NAME}'.")
+        logger.info(f"Verifica/Creazione degli indici dichiarati (mongo_indexes.py) nel DB '{DB_NAME}'.")
+        index_collections = [COLLECTION_NAME] + (list(PROJECTION_COLLECTIONS) if ENABLE_STATE_PROJECTIONS else [])
+        if ENABLE_MARKETPLACE_ROLLUPS:
+            index_collections.append(ROLLUPS_COLLECTION)
         try:
-            collection.create_index(
-                [
-                    ("blockNumber", 1),
-                    ("transactionHash", 1),
-                    ("logIndex", 1)
-                ],
-                unique=True,
-                name="unique_event_log"
-            )
-            logger.info("Indice unico 'unique_event_log' creato o già esistente.")
+            await ensure_indexes(db, index_collections)
         except Exception as e:
-            logger.error(f"Errore nella creazione dell'indice unico: {e}. I duplicati potrebbero non essere gestiti correttamente.")
+            logger.error(f"Errore nella creazione degli indici: {e}. I duplicati potrebbero non essere gestiti correttamente.")
+
+        try:
+            await migrate_legacy_checkpoint(collection)
+        except Exception as e:
+            logger.error(f"Errore nello spostamento del checkpoint nella collection di stato: {e}")
 
         return collection
     except pymongo_errors.ConnectionFailure as e:
@@ -130,7 +201,7 @@ def connect_to_mongodb_for_blockchain_events(): # Rinominata per chiarezza
         logger.critical(f"CRITICO: Errore generico durante la connessione a MongoDB per eventi blockchain: {e}")
         return None
 
-def get_last_processed_block(db_collection, contract_addresses):
+async def get_last_processed_block(w3, db_collection, contract_addresses):
     """
     Recupera l'ultimo blocco processato dal database o determina il blocco iniziale.
     Priorità: OVERRIDE_START_BLOCK (env var) > last_processed_block (DB) > INITIAL_START_BLOCKS (config).
@@ -149,9 +220,10 @@ def get_last_processed_block(db_collection, contract_addresses):
                             "IGNORATO. Procedo con la logica normale.")
 
     try:
-        last_block_doc = db_collection.find_one({"_id": "last_processed_block"})
+        last_block_doc = await checkpoint_collection(db_collection).find_one({"_id": CHECKPOINT_ID})
         if last_block_doc and 'block_number' in last_block_doc:
             logger.info(f"Ultimo blocco processato trovato nel DB: {last_block_doc['block_number']}")
+            record_checkpoint(last_block_doc['block_number'])
             return last_block_doc['block_number']
 
         logger.info("Nessun ultimo blocco processato trovato nel DB. Determino il blocco iniziale dalle configurazioni o recente.")
@@ -166,16 +238,11 @@ def get_last_processed_block(db_collection, contract_addresses):
         if min_deploy_block == float('inf'):
             # Fallback se non ci sono blocchi di deploy configurati
             try:
-                # Tentiamo di connetterci di nuovo per ottenere il blocco corrente, nel caso la 'w3' passata non sia aggiornata o sia None
-                temp_w3 = connect_to_blockchain() 
-                if temp_w3:
-                    current_chain_block = temp_w3.eth.block_number
-                    initial_block_fallback = max(0, current_chain_block - 100)
-                    logger.warning(f"Nessun blocco di deploy configurato per i contratti e nessun blocco salvato. Inizio la scansione da un blocco recente: {initial_block_fallback} (attuale: {current_chain_block}).")
-                    return initial_block_fallback
-                else:
-                    logger.error("Impossibile connettersi alla blockchain per ottenere il blocco corrente. Fallback a 0.")
-                    return 0 # Ultima spiaggia
+                # Si riusa la connessione (e il pool di endpoint) del listener invece di aprirne una nuova
+                current_chain_block = await w3.eth.block_number
+                initial_block_fallback = max(0, current_chain_block - 100)
+                logger.warning(f"Nessun blocco di deploy configurato per i contratti e nessun blocco salvato. Inizio la scansione da un blocco recente: {initial_block_fallback} (attuale: {current_chain_block}).")
+                return initial_block_fallback
             except Exception as e:
                 logger.error(f"Errore nel recupero del blocco corrente per fallback: {e}. Fallback a 0.")
                 return 0 # Ultima spiaggia
@@ -187,129 +254,285 @@ def get_last_processed_block(db_collection, contract_addresses):
         logger.error(f"Errore nel recupero dell'ultimo blocco processato da MongoDB o nel determinare il blocco iniziale: {e}. Uso un blocco iniziale prudente (attuale_chain_block - 100).")
         # Tentiamo di ottenere il blocco corrente in caso di errore generico qui
         try:
-            temp_w3 = connect_to_blockchain() 
-            if temp_w3:
-                current_chain_block = temp_w3.eth.block_number
-                return max(0, current_chain_block - 100)
-            else:
-                return 0
+            current_chain_block = await w3.eth.block_number
+            return max(0, current_chain_block - 100)
         except Exception:
             return 0
 
-def save_last_processed_block(db_collection, block_number):
-    """Salva l'ultimo blocco processato nel database."""
+async def get_saved_scan_range_size(db_collection):
+    """Recupera l'ultima dimensione valida della finestra di scansione salvata nel DB (o None)."""
+    try:
+        last_block_doc = await checkpoint_collection(db_collection).find_one({"_id": CHECKPOINT_ID})
+        if last_block_doc and last_block_doc.get('scan_range_size'):
+            logger.info(f"Dimensione finestra di scansione ripristinata dal DB: {last_block_doc['scan_range_size']} blocchi.")
+            return last_block_doc['scan_range_size']
+    except Exception as e:
+        logger.error(f"Errore nel recupero della dimensione della finestra di scansione da MongoDB: {e}")
+    return None
+
+async def save_last_processed_block(db_collection, block_number, scan_range_size=None, block_hash=None):
+    """
+    Salva l'ultimo blocco processato (e la dimensione corrente della finestra di scansione) nel database.
+    Se è noto l'hash del blocco, lo aggiunge all'anello `recent_block_hashes` usato per rilevare i reorg.
+    """
+    update_fields = {"block_number": block_number, "timestamp": datetime.utcnow()}
+    if scan_range_size is not None:
+        update_fields["scan_range_size"] = scan_range_size
+    update = {"$set": update_fields}
+    if block_hash is not None:
+        update["$push"] = {
+            "recent_block_hashes": {
+                "$each": [{"block_number": block_number, "block_hash": block_hash}],
+                "$slice": -REORG_BLOCK_HASH_RING_SIZE
+            }
+        }
     try:
-        db_collection.update_one(
-            {"_id": "last_processed_block"},
-            {"$set": {"block_number": block_number, "timestamp": datetime.utcnow()}},
+        await checkpoint_collection(db_collection).update_one(
+            {"_id": CHECKPOINT_ID},
+            update,
             upsert=True
         )
-        # logging.debug(f"Ultimo blocco processato salvato: {block_number}") # Troppo verboso per INFO, decommenta per DEBUG
+        record_checkpoint(block_number)
+        logger.debug("Ultimo blocco processato salvato: %s", block_number)
     except Exception as e:
         logger.error(f"Errore nel salvataggio dell'ultimo blocco processato in MongoDB: {e}")
 
-async def handle_event(event, db_collection):
-    """Processa un singolo evento e lo salva nel database."""
-    # ********************************************************************************
-    # DEBUG: Logga l'oggetto event completo prima della manipolazione
-    logger.debug(f"Oggetto event ricevuto in handle_event: {event}")
-    # ********************************************************************************
-
-    logger.info(f"Evento rilevato: {event.event} nel blocco {event.blockNumber} (tx: {event.transactionHash.hex()}).")
-    event_data = dict(event)
-    
-    # ********************************************************************************
-    # MODIFICA FONDAMENTALE: Aggiungiamo esplicitamente la chiave 'event'
-    # Questo risolve il problema del listener che non trova il nome dell'evento
-    # ********************************************************************************
-    event_data['event'] = event.event
-    # ********************************************************************************
-
-    event_data['args'] = dict(event.args) if hasattr(event.args, '__dict__') else event.args
-    event_data['blockNumber'] = event.blockNumber
-    event_data['transactionHash'] = event.transactionHash.hex()
-    event_data['logIndex'] = event.logIndex
-
+async def handle_event(document, event_writer, block_timestamp=None):
+    """Processa un singolo evento decodificato e lo accoda al batch di scrittura nel database."""
+    logger.debug("Evento rilevato: %s nel blocco %s (tx: %s).", document['event'], document['blockNumber'], document['transactionHash'])
     try:
-        event_data['timestamp_processed'] = datetime.utcnow()
-        db_collection.insert_one(event_data)
-        logger.info(f"Evento {event.event} dal blocco {event.blockNumber} (tx: {event.transactionHash.hex()}) salvato nel database.")
-    except pymongo_errors.DuplicateKeyError:
-        logger.warning(f"Evento duplicato rilevato e ignorato: {event.event} dal blocco {event.blockNumber} (tx: {event.transactionHash.hex()}).")
+        await event_writer.add(build_event_document(document, block_timestamp))
     except Exception as e:
         logger.error(f"Errore nel salvataggio dell'evento nel database: {e}")
+        raise
+
+async def handle_events(w3, documents, event_writer, block_timestamp_cache):
+    """
+    Recupera (cache o batch JSON-RPC) i timestamp dei blocchi coinvolti e accoda gli eventi.
+    Restituisce i timestamp usati ({numero_blocco: datetime}).
+    """
+    if not documents:
+        return {}
+    block_timestamps = await block_timestamp_cache.get_timestamps(w3, [document['blockNumber'] for document in documents])
+    for document in documents:
+        await handle_event(document, event_writer, block_timestamps.get(document['blockNumber']))
+    return block_timestamps
+
+async def archive_window(log_archive, from_block, to_block, raw_logs, block_timestamps):
+    """Salva la finestra scansionata nell'archivio locale dei log (se attivo) senza bloccare l'event loop."""
+    if log_archive is None:
+        return
+    try:
+        await asyncio.to_thread(log_archive.append_window, from_block, to_block, raw_logs, block_timestamps)
+    except Exception as e:
+        # L'intervallo resta fuori dalla copertura dell'archivio: l'ingest su MongoDB prosegue
+        logger.error(f"Errore nella scrittura dei blocchi {from_block}-{to_block} nell'archivio dei log: {e}")
 
-async def scan_for_blockchain_events(w3, db_collection, nft_contract, marketplace_contract):
+async def backfill_in_parallel(w3, event_writer, block_timestamp_cache, log_decode_stage, last_block_processed, initial_range_size, log_archive=None):
+    """
+    Esegue il backfill parallelo fino al blocco corrente e restituisce l'ultimo blocco
+    sicuro da cui il loop sequenziale deve proseguire.
+    """
+    start_block = last_block_processed + 1
+    if BACKFILL_START_BLOCK is not None:
+        try:
+            start_block = int(BACKFILL_START_BLOCK)
+            logger.warning(f"BACKFILL_START_BLOCK='{BACKFILL_START_BLOCK}' rilevato. Backfill forzato dal blocco {start_block}.")
+        except ValueError:
+            logger.error(f"Valore non valido per BACKFILL_START_BLOCK: '{BACKFILL_START_BLOCK}'. IGNORATO.")
+
+    async def store_window(from_block, to_block, raw_logs, events):
+        block_timestamps = await handle_events(w3, events, event_writer, block_timestamp_cache)
+        await archive_window(log_archive, from_block, to_block, raw_logs, block_timestamps)
+
+    try:
+        chain_head = await w3.eth.block_number
+        record_chain_head(chain_head)
+        head_block = chain_head - CONFIRMATION_DEPTH
+        safe_block = await run_parallel_backfill(
+            w3,
+            log_decode_stage.topic_map,
+            start_block,
+            head_block,
+            on_window=store_window,
+            on_checkpoint=event_writer.set_checkpoint,
+            initial_range_size=initial_range_size,
+            log_decode_stage=log_decode_stage
+        )
+        await event_writer.flush()
+        if ENABLE_STATE_PROJECTIONS and safe_block > last_block_processed:
+            # Gli shard vengono scritti nell'ordine in cui terminano: le proiezioni aggiornate
+            # batch per batch possono aver scartato eventi più vecchi, quindi si ricostruiscono
+            await rebuild_projections(event_writer.db_collection)
+        if ENABLE_MARKETPLACE_ROLLUPS and safe_block > last_block_processed:
+            # Una vendita scritta prima del mint del suo token non trova il contentId: rollup da rifare
+            await rebuild_rollups(event_writer.db_collection)
+        return safe_block
+    except Exception as e:
+        logger.error(f"Errore durante il backfill parallelo: {e}. Proseguo con la scansione sequenziale.")
+        return last_block_processed
+
+async def wait_for_next_poll(poll_requested, timeout_seconds):
+    """Attende l'intervallo di polling, interrompendosi prima se la sottoscrizione richiede una scansione."""
+    try:
+        await asyncio.wait_for(poll_requested.wait(), timeout=timeout_seconds)
+        logger.info("Scansione anticipata richiesta dalla sottoscrizione ai log.")
+    except asyncio.TimeoutError:
+        pass
+    poll_requested.clear()
+
+async def scan_for_blockchain_events(w3, db_collection, nft_event_abis, marketplace_event_abis):
     """Scansiona la blockchain per nuovi eventi e li salva."""
 
     contract_addresses_to_monitor = [NFT_CONTRACT_ADDRESS, MARKETPLACE_CONTRACT_ADDRESS]
-    last_block_processed = get_last_processed_block(db_collection, contract_addresses_to_monitor)     
+    last_block_processed = await get_last_processed_block(w3, db_collection, contract_addresses_to_monitor)     
+
+    # Tabella precompilata (indirizzo, topic0) -> decoder, usata per decodificare localmente i log
+    # (nell'event loop o, con DECODE_WORKERS > 0, su più processi)
+    log_decode_stage = create_log_decode_stage([
+        (NFT_CONTRACT_ADDRESS, nft_event_abis, NFT_EVENT_NAMES_TO_MONITOR),
+        (MARKETPLACE_CONTRACT_ADDRESS, marketplace_event_abis, MARKETPLACE_EVENT_NAMES_TO_MONITOR)
+    ])
+    topic_map = log_decode_stage.topic_map
+
+    # Gli eventi vengono scritti a batch; il checkpoint è salvato una volta per flush
+    event_writer = EventBatchWriter(
+        db_collection,
+        save_checkpoint=save_last_processed_block,
+        max_batch_size=EVENT_WRITE_BATCH_SIZE,
+        max_batch_seconds=EVENT_WRITE_BATCH_SECONDS,
+        # Le proiezioni (proprietari, vendite, aste) si aggiornano con lo stesso batch degli eventi
+        after_write=(lambda documents: apply_projections(db_collection.database, documents)) if ENABLE_STATE_PROJECTIONS else None,
+        # I rollup ($inc) ricevono solo gli eventi inseriti per la prima volta
+        after_insert=(lambda documents: apply_rollups(db_collection.database, documents)) if ENABLE_MARKETPLACE_ROLLUPS else None
+    )
+
+    # Timestamp dei blocchi richiesti solo per i blocchi che contengono log
+    block_timestamp_cache = BlockTimestampCache(BLOCK_TIMESTAMP_CACHE_SIZE, BLOCK_HEADER_BATCH_SIZE)
+
+    # Finestra adattiva: parte dall'ultima dimensione valida salvata (o da MAX_BLOCKS_TO_SCAN_PER_CYCLE)
+    range_controller = AdaptiveRangeController(
+        initial_size=await get_saved_scan_range_size(db_collection) or MAX_BLOCKS_TO_SCAN_PER_CYCLE,
+        min_size=SCAN_RANGE_MIN_BLOCKS,
+        max_size=SCAN_RANGE_MAX_BLOCKS,
+        target_logs=SCAN_RANGE_TARGET_LOGS,
+        target_seconds=SCAN_RANGE_TARGET_SECONDS
+    )
+
+    # Archivio locale dei log grezzi (LOG_ARCHIVE_DIR) per re-indicizzare senza chiamate RPC
+    log_archive = None
+    try:
+        log_archive = await asyncio.to_thread(open_log_archive)
+    except Exception as e:
+        logger.error(f"Impossibile aprire l'archivio dei log in {LOG_ARCHIVE_DIR}: {e}. Archivio disattivato.")
 
-    logger.info(f"Inizio ciclo di scansione blockchain. Ultimo blocco processato inizialmente: {last_block_processed}")
+    if ENABLE_PARALLEL_BACKFILL:
+        last_block_processed = await backfill_in_parallel(w3, event_writer, block_timestamp_cache, log_decode_stage, last_block_processed, range_controller.size, log_archive)
+
+    # Evento usato dalla sottoscrizione WebSocket per anticipare la prossima scansione a intervalli
+    poll_requested = asyncio.Event()
+    subscription_task = None
+    if ENABLE_LOG_SUBSCRIPTION:
+        if WS_RPC_URL:
+            async def store_subscribed_events(events):
+                await handle_events(w3, events, event_writer, block_timestamp_cache)
+                await event_writer.flush()
+
+            async def remove_reorged_log(log):
+                await delete_removed_log(db_collection, log)
+
+            subscription_task = asyncio.create_task(
+                subscribe_to_contract_logs(WS_RPC_URL, topic_map, store_subscribed_events, poll_requested.set, remove_reorged_log)
+            )
+        else:
+            logger.error("ENABLE_LOG_SUBSCRIPTION è '1' ma ARBITRUM_SEPOLIA_WS_RPC_URL non è impostata. Uso solo il polling.")
+
+    logger.info(f"Inizio ciclo di scansione blockchain. Ultimo blocco processato inizialmente: {last_block_processed}. Finestra iniziale: {range_controller.size} blocchi.")
 
     while True:
         try:
-            current_block = w3.eth.block_number
-            if current_block is None:
+            chain_head = await w3.eth.block_number
+            if chain_head is None:
                 logger.error("Impossibile recuperare il numero del blocco corrente dalla blockchain. Riprovo...")
                 await asyncio.sleep(POLLING_INTERVAL_SECONDS)
                 continue
-
-            target_block_for_this_cycle = min(current_block, last_block_processed + MAX_BLOCKS_TO_SCAN_PER_CYCLE)
-
-            if target_block_for_this_cycle > last_block_processed:
-                logger.info(f"Scansione blocchi da {last_block_processed + 1} a {target_block_for_this_cycle}. Blocchi rimanenti per mettersi al passo: {current_block - target_block_for_this_cycle}")         
-                for block_num in range(last_block_processed + 1, target_block_for_this_cycle + 1):       
-                    logger.info(f"Processing block: {block_num}")
-                    try:
-                        # Ottieni gli eventi dal contratto NFT
-                        for event_name in NFT_EVENT_NAMES_TO_MONITOR:
-                            logger.debug(f"Tentativo di ottenere eventi '{event_name}' del contratto NFT per blocco {block_num}")
-                            try:
-                                events = nft_contract.events[event_name].get_logs(
-                                    from_block=block_num,
-                                    to_block=block_num
-                                )
-                                for event in events:
-                                    await handle_event(event, db_collection)
-                            except Exception as e:
-                                logger.error(f"Errore nel recupero eventi '{event_name}' del contratto NFT per il blocco {block_num}: {e}")
-
-                        # Ottieni gli eventi dal contratto Marketplace
-                        for event_name in MARKETPLACE_EVENT_NAMES_TO_MONITOR:
-                            logger.debug(f"Tentativo di ottenere eventi '{event_name}' del contratto Marketplace per blocco {block_num}")
-                            try:
-                                events = marketplace_contract.events[event_name].get_logs(
-                                    from_block=block_num,
-                                    to_block=block_num
-                                )
-                                for event in events:
-                                    await handle_event(event, db_collection)
-                            except Exception as e:
-                                logger.error(f"Errore nel recupero eventi '{event_name}' del contratto Marketplace per il blocco {block_num}: {e}")
-
-                        save_last_processed_block(db_collection, block_num)
-                        last_block_processed = block_num
-                        logger.debug(f"Terminato processing blocco {block_num}. Nuovo last_block_processed: {last_block_processed}")
-
-                    except Exception as e:
-                        logger.error(f"Errore durante la scansione del blocco {block_num}: {e}. Riproverò al prossimo ciclo.")
-                        break # Esci dal loop interno per ritentare il ciclo principale dopo il sleep          
-
-            else:
+            record_chain_head(chain_head)
+            # Si indicizzano solo i blocchi con almeno CONFIRMATION_DEPTH conferme
+            current_block = chain_head - CONFIRMATION_DEPTH
+
+            reorg_ancestor_block = await detect_reorg(w3, db_collection, REORG_TRACKING_BLOCKS)
+            if reorg_ancestor_block is not None:
+                await rollback_to_block(db_collection, reorg_ancestor_block)
+                if log_archive is not None:
+                    await asyncio.to_thread(log_archive.invalidate_after, reorg_ancestor_block)
+                last_block_processed = reorg_ancestor_block
+
+            if current_block <= last_block_processed:
                 logger.info(f"Nessun nuovo blocco da processare al momento. Blocco attuale: {current_block}. Ultimo processato: {last_block_processed}.")
 
+            # Catch-up: si scansionano finestre consecutive fino alla testa della catena
+            while last_block_processed < current_block:
+                from_block = last_block_processed + 1
+                to_block = range_controller.window_end(from_block, current_block)
+                logger.info("Scansione blocchi da %s a %s. Blocchi rimanenti per mettersi al passo: %s", from_block, to_block, current_block - to_block)
+                started_at = time.monotonic()
+                try:
+                    # Una sola eth_getLogs per l'intera finestra: entrambi gli indirizzi e tutte le firme monitorate
+                    raw_logs = await fetch_logs_in_range_async(w3, topic_map, from_block, to_block)
+                    events = await log_decode_stage.decode(raw_logs)
+                except Exception as e:
+                    if is_range_limit_error(e) and range_controller.shrink(to_block - from_block + 1):
+                        # Split-on-error: si ritenta subito la stessa partenza con una finestra dimezzata
+                        continue
+                    logger.error(f"Errore durante la scansione dei blocchi {from_block}-{to_block}: {e}. Riproverò al prossimo ciclo.")
+                    break
+                elapsed_seconds = time.monotonic() - started_at
+
+                logger.info("Trovati %s eventi nei blocchi %s-%s.", len(events), from_block, to_block)
+
+                # Vicino alla testa si traccia l'hash del blocco di checkpoint per rilevare i reorg
+                checkpoint_block_hash = None
+                if to_block >= chain_head - REORG_TRACKING_BLOCKS:
+                    checkpoint_block_hash = await get_block_hash(w3, to_block)
+                    if subscription_task is not None:
+                        await delete_orphaned_events(db_collection, from_block, to_block, {event['blockHash'] for event in events})
+
+                block_timestamps = await handle_events(w3, events, event_writer, block_timestamp_cache)
+                await archive_window(log_archive, from_block, to_block, raw_logs, block_timestamps)
+
+                range_controller.record_success(to_block - from_block + 1, len(events), elapsed_seconds)
+                event_writer.set_checkpoint(to_block, range_controller.size, checkpoint_block_hash)
+                last_block_processed = to_block
+                logger.debug("Terminata scansione finestra. Nuovo last_block_processed: %s", last_block_processed)
+
+                await asyncio.sleep(SCAN_WINDOW_PAUSE_SECONDS)
+
+            # Prima della pausa si scrivono gli eventi rimasti nel buffer e l'ultimo checkpoint
+            await event_writer.flush()
+
         except Exception as e:
             logger.error(f"Errore generale nel loop di scansione della blockchain: {e}")
 
         logger.info(f"Pausa di {POLLING_INTERVAL_SECONDS} secondi prima della prossima scansione.")        
-        await asyncio.sleep(POLLING_INTERVAL_SECONDS)
+        await wait_for_next_poll(poll_requested, POLLING_INTERVAL_SECONDS)
+
+
+def log_metrics_task_failure(task):
+    """Segnala l'arresto imprevisto dell'endpoint delle metriche (i listener restano attivi)."""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logger.error(f"Endpoint delle metriche terminato per un errore: {error}", exc_info=error)
+
 
 async def main():
     logger.info("Avvio dell'applicazione principale: Event DNA Platform Listener.")
 
     # Debugging: Stampa i valori delle variabili d'ambiente e config importanti
     logger.info(f"Configurazione RPC_URL: {RPC_URL}")
+    logger.info(f"Configurazione pool RPC: {len(RPC_URLS)} endpoint, hedging dopo {RPC_HEDGE_AFTER_MS}ms, "
+                f"batch automatici entro {RPC_BATCH_WINDOW_MS}ms (max {RPC_MAX_BATCH_SIZE} chiamate)")
     logger.info(f"Configurazione MONGODB_URI (prime 20 char): {MONGODB_URI[:20]}...")
     logger.info(f"Configurazione DB_NAME: {DB_NAME}, COLLECTION_NAME: {COLLECTION_NAME}")
     logger.info(f"Configurazione NFT_CONTRACT_ADDRESS: {NFT_CONTRACT_ADDRESS}")
@@ -317,8 +540,19 @@ async def main():
     logger.info(f"Configurazione NFT_ABI_PATH: {NFT_ABI_PATH}")
     logger.info(f"Configurazione MARKETPLACE_ABI_PATH: {MARKETPLACE_ABI_PATH}")
     logger.info(f"Configurazione POLLING_INTERVAL_SECONDS: {POLLING_INTERVAL_SECONDS}")
-    logger.info(f"Configurazione MAX_BLOCKS_TO_SCAN_PER_CYCLE: {MAX_BLOCKS_TO_SCAN_PER_CYCLE}")         
+    logger.info(f"Configurazione MAX_BLOCKS_TO_SCAN_PER_CYCLE (finestra iniziale): {MAX_BLOCKS_TO_SCAN_PER_CYCLE}")
+    logger.info(f"Configurazione finestra adattiva: min {SCAN_RANGE_MIN_BLOCKS}, max {SCAN_RANGE_MAX_BLOCKS} blocchi, target {SCAN_RANGE_TARGET_LOGS} log / {SCAN_RANGE_TARGET_SECONDS}s")         
     logger.info(f"Configurazione OVERRIDE_START_BLOCK: {OVERRIDE_START_BLOCK}")
+    logger.info(f"Configurazione CONFIRMATION_DEPTH: {CONFIRMATION_DEPTH}, anello hash reorg: {REORG_BLOCK_HASH_RING_SIZE} elementi")
+    logger.info(f"Configurazione ENABLE_LOG_SUBSCRIPTION: {ENABLE_LOG_SUBSCRIPTION} (WS_RPC_URL impostata: {bool(WS_RPC_URL)})")
+
+    logger.info(f"Configurazione archivio dei log: {LOG_ARCHIVE_DIR or 'disattivato'}")
+    logger.info(f"Configurazione metriche: {'porta ' + str(METRICS_PORT) if METRICS_PORT else 'disattivate'}")
+
+    # Endpoint delle metriche: resta attivo finché lo sono i listener
+    metrics_task = asyncio.create_task(serve_metrics(METRICS_HOST, METRICS_PORT)) if METRICS_PORT else None
+    if metrics_task is not None:
+        metrics_task.add_done_callback(log_metrics_task_failure)
 
     # Inizializza sempre il listener di MongoDB Change Stream
     # Questo è il "listener veloce" che vuoi sempre attivo
@@ -334,11 +568,11 @@ async def main():
     if enable_blockchain_listener == "1":
         logger.info("ENABLE_BLOCKCHAIN_LISTENER è '1'. Preparo l'avvio del listener blockchain.")       
 
-        w3 = connect_to_blockchain()
+        w3 = await connect_to_blockchain()
         if w3 is None:
             logger.critical("Impossibile connettersi alla blockchain. Il listener blockchain non sarà attivo. Verificare RPC_URL.")
         else:
-            db_collection = connect_to_mongodb_for_blockchain_events()
+            db_collection = await connect_to_mongodb_for_blockchain_events()
             if db_collection is None:
                 logger.critical("Impossibile connettersi a MongoDB per eventi blockchain. Il listener blockchain non sarà attivo. Verificare MONGODB_URI.")
             else:
@@ -358,12 +592,10 @@ async def main():
                         logger.critical("Uno o entrambi gli ABI non sono stati caricati correttamente. Il listener blockchain non sarà attivo.")
                     else:
                         try:
-                            nft_contract = w3.eth.contract(address=Web3.to_checksum_address(NFT_CONTRACT_ADDRESS), abi=nft_abi)
-                            marketplace_contract = w3.eth.contract(address=Web3.to_checksum_address(MARKETPLACE_CONTRACT_ADDRESS), abi=marketplace_abi)
-                            blockchain_task = asyncio.create_task(scan_for_blockchain_events(w3, db_collection, nft_contract, marketplace_contract))
+                            blockchain_task = asyncio.create_task(scan_for_blockchain_events(w3, db_collection, nft_abi, marketplace_abi))
                             logger.info("Listener blockchain avviato con successo.")
                         except Exception as e:
-                            logger.critical(f"Errore nella creazione dell'istanza del contratto o avvio listener blockchain: {e}. Il listener blockchain non sarà attivo.")
+                            logger.critical(f"Errore nell'avvio del listener blockchain: {e}. Il listener blockchain non sarà attivo.")
     else:
         logger.info("ENABLE_BLOCKCHAIN_LISTENER non è '1' o non è impostato. Il listener blockchain non sarà avviato.")
 
@@ -387,12 +619,3 @@ if __name__ == "__main__":
         logger.info("Applicazione interrotta dall'utente.")
     except Exception as e:
         logger.critical(f"Errore fatale nell'applicazione principale: {e}", exc_info=True)
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,62 @@
+# backend-event-listener/message_serializer.py
+
+import json
+from datetime import date, datetime
+
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: senza, si usa il modulo json della libreria standard
+    orjson = None
+
+
+def _json_default(value):
+    """
+    Conversione dei tipi BSON/Python non JSON. Viene chiamata dal serializzatore solo per i
+    valori che non sa gestire, durante l'unica visita del messaggio (a qualsiasi profondità).
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # Sempre esadecimale con 0x, come hash e bytes32 decodificati da event_decoder: una
+        # decodifica UTF-8 "quando riesce" darebbe un formato diverso per lo stesso campo
+        return "0x" + bytes(value).hex()
+    if isinstance(value, Decimal128):
+        return str(value)
+    raise TypeError(f"Tipo non serializzabile in JSON: {type(value).__name__}")
+
+
+def _stringify_big_ints(value):
+    """Interi fuori dall'intervallo int64 come stringhe decimali (stessa convenzione di event_decoder)."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return value if -2**63 <= value < 2**63 else str(value)
+    if isinstance(value, dict):
+        return {key: _stringify_big_ints(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stringify_big_ints(item) for item in value]
+    return value
+
+
+def serialize_message(message):
+    """
+    Serializza in JSON compatto un messaggio per Redis convertendo ObjectId, datetime, bytes
+    e Decimal128 durante la serializzazione stessa, senza una visita preliminare del documento.
+
+    Con orjson gli interi oltre i 64 bit (che orjson rifiuta) vengono convertiti in stringa
+    con una seconda passata, solo per i messaggi che li contengono; con il modulo json
+    standard restano numeri.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(message, default=_json_default).decode('utf-8')
+        except orjson.JSONEncodeError as e:
+            if "64-bit" not in str(e):
+                raise
+            return orjson.dumps(_stringify_big_ints(message), default=_json_default).decode('utf-8')
+    return json.dumps(message, default=_json_default, separators=(',', ':'))
@@ -0,0 +1,108 @@
+# backend-event-listener/metrics.py
+
+import asyncio
+import logging
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+# ********************************************************************************
+# METRICHE (formato Prometheus, esposte da serve_metrics su /metrics)
+# ********************************************************************************
+# Aggiornare un contatore costa molto meno di formattare una riga di log: gli eventi
+# del percorso caldo (ogni log, ogni messaggio) si contano qui e si loggano solo a DEBUG.
+
+RPC_REQUESTS = Counter(
+    "listener_rpc_requests_total", "Chiamate JSON-RPC per metodo ed esito", ["method", "outcome"])
+RPC_LATENCY = Histogram(
+    "listener_rpc_request_seconds", "Durata delle richieste JSON-RPC (method='batch' per le richieste batch)", ["method"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+LOGS_DECODED = Counter(
+    "listener_logs_decoded_total", "Log grezzi decodificati in documenti evento")
+LOG_DECODE_ERRORS = Counter(
+    "listener_log_decode_errors_total", "Log grezzi non decodificabili")
+EVENTS_WRITTEN = Counter(
+    "listener_events_written_total", "Eventi scritti su MongoDB per esito", ["result"])
+MONGO_WRITE_BATCH_LATENCY = Histogram(
+    "listener_mongo_write_batch_seconds", "Durata di una scrittura a batch degli eventi (insert_many e proiezioni)",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+CHAIN_HEAD_BLOCK = Gauge(
+    "listener_chain_head_block", "Ultimo blocco della catena letto dal listener")
+CHECKPOINT_BLOCK = Gauge(
+    "listener_checkpoint_block", "Ultimo blocco processato salvato (last_processed_block)")
+CHECKPOINT_LAG = Gauge(
+    "listener_checkpoint_lag_blocks", "Blocchi tra la testa della catena e il checkpoint salvato")
+RPC_ENDPOINT_REQUESTS = Counter(
+    "listener_rpc_endpoint_requests_total", "Richieste HTTP per endpoint RPC del pool ed esito", ["endpoint", "outcome"])
+RPC_ENDPOINT_HEALTHY = Gauge(
+    "listener_rpc_endpoint_healthy", "1 se l'endpoint RPC è utilizzabile, 0 se è in pausa dopo errori o rate limit", ["endpoint"])
+RPC_HEDGED_REQUESTS = Counter(
+    "listener_rpc_hedged_requests_total", "Richieste ripetute su un secondo endpoint perché la prima risposta tardava")
+RPC_FAILOVERS = Counter(
+    "listener_rpc_failovers_total", "Richieste ritentate su un altro endpoint dopo un errore o un rate limit")
+RPC_BATCH_SIZE = Histogram(
+    "listener_rpc_batch_size", "Chiamate per richiesta JSON-RPC batch",
+    buckets=(2, 5, 10, 20, 50, 100))
+CHANGESTREAM_PUBLISHED = Counter(
+    "changestream_messages_published_total", "Messaggi del Change Stream pubblicati su Redis")
+CHANGESTREAM_PUBLISH_LATENCY = Histogram(
+    "changestream_publish_latency_seconds", "Ritardo tra la scrittura su MongoDB e la pubblicazione su Redis",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+_chain_head = None
+_checkpoint = None
+
+
+def _update_checkpoint_lag():
+    if _chain_head is not None and _checkpoint is not None:
+        CHECKPOINT_LAG.set(max(0, _chain_head - _checkpoint))
+
+
+def record_chain_head(block_number):
+    global _chain_head
+    _chain_head = block_number
+    CHAIN_HEAD_BLOCK.set(block_number)
+    _update_checkpoint_lag()
+
+
+def record_checkpoint(block_number):
+    global _checkpoint
+    _checkpoint = block_number
+    CHECKPOINT_BLOCK.set(block_number)
+    _update_checkpoint_lag()
+
+
+async def _handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass  # intestazioni ignorate
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE_LATEST, generate_latest()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host, port):
+    """
+    Espone le metriche in GET /metrics con un server HTTP minimo nello stesso event loop
+    (le metriche vengono lette senza thread aggiuntivi). Resta in esecuzione finché il task
+    non viene cancellato.
+    """
+    try:
+        server = await asyncio.start_server(_handle_metrics_request, host, port)
+    except OSError as e:
+        logger.error(f"Impossibile esporre le metriche su {host}:{port}: {e}")
+        return
+    logger.info(f"Metriche esposte su http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
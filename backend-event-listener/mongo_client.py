@@ -0,0 +1,21 @@
+# backend-event-listener/mongo_client.py
+
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from config import MONGODB_URI, MONGODB_MAX_POOL_SIZE
+
+_shared_client = None
+
+
+def get_mongo_client():
+    """
+    Restituisce il client Motor condiviso dal listener blockchain e dal Change Stream,
+    così che entrambi usino un unico pool di connessioni verso MongoDB Atlas.
+    """
+    global _shared_client
+    if _shared_client is None:
+        logging.info(f"Creazione del client MongoDB condiviso (maxPoolSize={MONGODB_MAX_POOL_SIZE}).")
+        _shared_client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000, maxPoolSize=MONGODB_MAX_POOL_SIZE)
+    return _shared_client
@@ -0,0 +1,93 @@
+# backend-event-listener/mongo_indexes.py
+
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from config import (
+    COLLECTION_NAME,
+    TOKEN_OWNERSHIP_COLLECTION,
+    LISTINGS_COLLECTION,
+    AUCTIONS_COLLECTION,
+    ROLLUPS_COLLECTION,
+    MONGODB_DROP_UNDECLARED_INDEXES
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _address_arg_index(arg_name):
+    """Indice parziale su un argomento indirizzo: contiene solo gli eventi che hanno quel campo."""
+    return IndexModel(
+        [(f"args.{arg_name}", ASCENDING), ("blockNumber", DESCENDING), ("logIndex", DESCENDING)],
+        name=f"args_{arg_name}_block",
+        partialFilterExpression={f"args.{arg_name}": {"$exists": True}}
+    )
+
+
+# ********************************************************************************
+# INDICI DICHIARATI
+# ********************************************************************************
+# Unica fonte degli indici delle collection del listener: all'avvio vengono creati quelli
+# mancanti e segnalati (o eliminati, con MONGODB_DROP_UNDECLARED_INDEXES=1) quelli non dichiarati.
+# Le query servite da ogni indice sono misurate da benchmarks/events_query_latency.py.
+DECLARED_INDEXES = {
+    COLLECTION_NAME: [
+        # Deduplicazione degli eventi (insert_many ordered=False ignora le chiavi duplicate)
+        IndexModel([("blockNumber", ASCENDING), ("transactionHash", ASCENDING), ("logIndex", ASCENDING)],
+                   unique=True, name="unique_event_log"),
+        # Feed e storico (/api/events/history): ordinamento per blocco e logIndex decrescenti
+        IndexModel([("blockNumber", DESCENDING), ("logIndex", DESCENDING)], name="block_log"),
+        # Feed per tipo di evento e ricostruzione di proiezioni/rollup
+        IndexModel([("event", ASCENDING), ("blockNumber", DESCENDING), ("logIndex", DESCENDING)], name="event_block"),
+        # Storico di un token
+        IndexModel([("args.tokenId", ASCENDING), ("blockNumber", DESCENDING), ("logIndex", DESCENDING)],
+                   name="args_tokenId_block", partialFilterExpression={"args.tokenId": {"$exists": True}}),
+        # Attività di un indirizzo (trasferimenti e offerte)
+        _address_arg_index("from"),
+        _address_arg_index("to"),
+        _address_arg_index("bidder"),
+        # Upsert dei record di stato delle transazioni scritti dal frontend (/api/transactions)
+        IndexModel([("transactionHash", ASCENDING)], name="transaction_hash"),
+    ],
+    # Proiezioni (projections.py): "NFT di un indirizzo", "vendite/aste attive"
+    TOKEN_OWNERSHIP_COLLECTION: [
+        IndexModel([("owner", ASCENDING)], name="owner"),
+    ],
+    LISTINGS_COLLECTION: [
+        IndexModel([("active", ASCENDING), ("seller", ASCENDING)], name="active_seller"),
+    ],
+    AUCTIONS_COLLECTION: [
+        IndexModel([("active", ASCENDING), ("endTime", ASCENDING)], name="active_end_time"),
+    ],
+    # Rollup (rollups.py): serie temporale del marketplace, di un token o di un contenuto
+    ROLLUPS_COLLECTION: [
+        IndexModel([("scope", ASCENDING), ("key", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+                   name="scope_key_granularity_bucket"),
+    ],
+}
+
+
+async def ensure_indexes(database, collection_names=None):
+    """
+    Allinea gli indici delle collection (tutte quelle dichiarate se `collection_names` è None)
+    all'elenco DECLARED_INDEXES. La creazione di un indice già esistente non ha effetto.
+    """
+    for collection_name, index_models in DECLARED_INDEXES.items():
+        if collection_names is not None and collection_name not in collection_names:
+            continue
+        collection = database.get_collection(collection_name)
+        created = await collection.create_indexes(index_models)
+        logger.info(f"Indici della collection '{collection_name}' verificati: {', '.join(created)}.")
+
+        declared_names = {index_model.document["name"] for index_model in index_models} | {"_id_"}
+        existing_names = [index["name"] async for index in collection.list_indexes()]
+        for index_name in existing_names:
+            if index_name in declared_names:
+                continue
+            if MONGODB_DROP_UNDECLARED_INDEXES:
+                await collection.drop_index(index_name)
+                logger.warning(f"Indice non dichiarato '{index_name}' eliminato dalla collection '{collection_name}'.")
+            else:
+                logger.warning(f"Indice non dichiarato '{index_name}' presente nella collection '{collection_name}' "
+                               "(MONGODB_DROP_UNDECLARED_INDEXES=1 per eliminarlo).")
@@ -1,16 +1,15 @@
 # backend-event-listener/mongodb_listener.py
 
-import os
 import logging
 import json
 import asyncio
 from datetime import datetime
-from bson.objectid import ObjectId
 import sys
+import time
 
 # **********************************************
 # MODIFICA IMPORTANTE: Usiamo Motor per MongoDB asincrono
-from motor.motor_asyncio import AsyncIOMotorClient
+# (il client è condiviso con il listener blockchain, vedi mongo_client.py)
 from pymongo.errors import ConnectionFailure, OperationFailure, ConfigurationError
 # **********************************************
 
@@ -19,11 +18,22 @@ import redis.asyncio as redis
 # Importa le configurazioni dal file config.py
 try:
     from config import (
-        MONGODB_URI,
         DB_NAME,
         COLLECTION_NAME,
         REDIS_URL,
-        REDIS_CHANNEL
+        REDIS_CHANNEL,
+        REDIS_TRANSPORT,
+        REDIS_STREAM_KEY,
+        REDIS_STREAM_MAXLEN,
+        LISTENER_STATE_COLLECTION,
+        CHANGE_STREAM_TOKEN_SAVE_EVENTS,
+        CHANGE_STREAM_TOKEN_SAVE_SECONDS,
+        CHANGE_STREAM_CATCHUP_BATCH_SIZE,
+        CHANGE_STREAM_CATCHUP_LAG_SECONDS,
+        CHANGE_STREAM_PUBLISH_WINDOW_MS,
+        CHANGE_STREAM_FULL_DOCUMENT,
+        CHANGE_STREAM_DOCUMENT_FIELDS,
+        LOG_LEVEL
     )
     logging.info("Configurazioni importate con successo da config.py.")
 except ImportError as e:
@@ -33,17 +43,59 @@ except Exception as e:
     logging.critical(f"ERRORE CRITICO: Errore durante l'importazione delle configurazioni: {e}", exc_info=True)
     sys.exit(1)
 
+from message_serializer import serialize_message
+from metrics import CHANGESTREAM_PUBLISHED, CHANGESTREAM_PUBLISH_LATENCY
+from mongo_client import get_mongo_client
+
+if REDIS_TRANSPORT not in ("pubsub", "stream", "both"):
+    logging.error(f"REDIS_TRANSPORT non valido: '{REDIS_TRANSPORT}'. Valori ammessi: pubsub, stream, both. Uso 'pubsub'.")
+    REDIS_TRANSPORT = "pubsub"
+
 # Configurazione del logging
-# Imposta a INFO per l'output in produzione, usa DEBUG per il debug
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# LOG_LEVEL=INFO per l'output in produzione, DEBUG per una riga per ogni evento pubblicato
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info("Logging configurato.")
 
+# Codici di errore del server per cui il resume token salvato non è più utilizzabile
+# (oplog ruotato oltre il token o token non valido): si riparte da "adesso".
+RESUME_TOKEN_UNUSABLE_ERROR_CODES = {
+    260,  # InvalidResumeToken
+    280,  # ChangeStreamFatalError
+    286,  # ChangeStreamHistoryLost
+}
+
+# _id del documento di stato con il resume token del Change Stream
+RESUME_TOKEN_STATE_ID = f"changestream_resume_token:{COLLECTION_NAME}"
+
+# Filtro e proiezione eseguiti dal server: dei documenti arrivano solo i campi usati dal feed
+# (il checkpoint del listener è in LISTENER_STATE_COLLECTION, non nella collection osservata).
+# Il campo _id dell'evento (resume token) non va mai escluso.
+CHANGE_STREAM_PIPELINE = [
+    {
+        '$match': {
+            'operationType': { '$in': ['insert', 'update'] }
+        }
+    },
+    {
+        '$project': {
+            'operationType': 1,
+            'clusterTime': 1,
+            'wallTime': 1,
+            'documentKey': 1,
+            'updateDescription.updatedFields': 1,
+            # Solo l'_id di primo livello è incluso in automatico: quello del documento serve
+            # al frontend per scartare i duplicati e unire gli update alla riga giusta
+            'fullDocument._id': 1,
+            **{f'fullDocument.{field}': 1 for field in CHANGE_STREAM_DOCUMENT_FIELDS}
+        }
+    }
+]
+
 async def connect_to_mongodb_changestream():
     """Connette a MongoDB Atlas e restituisce un client per Change Stream."""
     logging.info("Tentativo di connessione a MongoDB Atlas per Change Stream (con Motor)...")
-    client = None
     try:
-        client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+        client = get_mongo_client()
         await client.admin.command('ping')
         logging.info("Connessione a MongoDB Atlas riuscita.")
         db = client.get_database(DB_NAME)
@@ -52,19 +104,15 @@ async def connect_to_mongodb_changestream():
         return collection
     except ConnectionFailure as e:
         logging.critical(f"CRITICO: Impossibile connettersi a MongoDB Atlas per Change Stream. Errore: {e}", exc_info=True)
-        if client: client.close()
         return None
     except OperationFailure as e:
         logging.critical(f"CRITICO: Errore di operazione MongoDB. Errore: {e}. Controlla credenziali, ruoli e che il DB sia un replica set.", exc_info=True)
-        if client: client.close()
         return None
     except ConfigurationError as e:
         logging.critical(f"CRITICO: Errore di configurazione MongoDB. Spesso indica che il DB non è un replica set. Errore: {e}", exc_info=True)
-        if client: client.close()
         return None
     except Exception as e:
         logging.critical(f"CRITICO: Errore generico durante la connessione a MongoDB per Change Stream. Errore: {e}", exc_info=True)
-        if client: client.close()
         return None
 
 async def connect_to_redis():
@@ -81,80 +129,191 @@ async def connect_to_redis():
         if r: await r.close()
         return None
 
+async def load_resume_token(state_collection):
+    """Legge il resume token salvato (None se assente: il Change Stream parte da "adesso")."""
+    try:
+        state_doc = await state_collection.find_one({"_id": RESUME_TOKEN_STATE_ID})
+    except Exception as e:
+        logging.error(f"Errore durante la lettura del resume token del Change Stream: {e}", exc_info=True)
+        return None
+    if state_doc and state_doc.get("resume_token"):
+        logging.info(f"Resume token del Change Stream trovato (salvato il {state_doc.get('updated_at')}): riprendo da lì.")
+        return state_doc["resume_token"]
+    logging.info("Nessun resume token salvato: il Change Stream parte dagli eventi nuovi.")
+    return None
+
+async def save_resume_token(state_collection, resume_token):
+    """Salva il resume token dell'ultimo evento pubblicato su Redis (None per azzerarlo)."""
+    try:
+        await state_collection.update_one(
+            {"_id": RESUME_TOKEN_STATE_ID},
+            {"$set": {"resume_token": resume_token, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        logging.debug("Resume token del Change Stream salvato.")
+        return True
+    except Exception as e:
+        logging.error(f"Errore durante il salvataggio del resume token del Change Stream: {e}", exc_info=True)
+        return False
+
+async def publish_message(redis_client, json_message):
+    """
+    Invia il messaggio ai websocket-server con il trasporto configurato (REDIS_TRANSPORT):
+    Pub/Sub (fire-and-forget) e/o Stream limitato, che ogni istanza legge con il proprio
+    cursore senza perdere messaggi durante riconnessioni e riavvii.
+    """
+    if REDIS_TRANSPORT in ("stream", "both"):
+        await redis_client.xadd(REDIS_STREAM_KEY, {"data": json_message}, maxlen=REDIS_STREAM_MAXLEN, approximate=True)
+    if REDIS_TRANSPORT in ("pubsub", "both"):
+        await redis_client.publish(REDIS_CHANNEL, json_message)
+
+async def publish_messages(redis_client, json_messages):
+    """
+    Come publish_message, ma per un gruppo di messaggi: i comandi vengono inviati in un
+    unico pipeline (un solo round trip verso Redis), mantenendo l'ordine. Usato per
+    l'arretrato accumulato dopo una riconnessione del Change Stream.
+    """
+    if len(json_messages) == 1:
+        await publish_message(redis_client, json_messages[0])
+        return
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for json_message in json_messages:
+            if REDIS_TRANSPORT in ("stream", "both"):
+                pipe.xadd(REDIS_STREAM_KEY, {"data": json_message}, maxlen=REDIS_STREAM_MAXLEN, approximate=True)
+            if REDIS_TRANSPORT in ("pubsub", "both"):
+                pipe.publish(REDIS_CHANNEL, json_message)
+        await pipe.execute()
+
+def build_change_message(change):
+    """
+    Costruisce il messaggio JSON per il frontend a partire da un evento Change Stream.
+    Per gli update senza fullDocument (CHANGE_STREAM_FULL_DOCUMENT=default) il documento
+    inoltrato contiene solo _id e i campi modificati.
+    Restituisce None se l'evento non va pubblicato (es. errore di serializzazione).
+    """
+    logging.debug("Ricevuto evento Change Stream: %s", change.get('operationType', 'N/A'))
+    operation_type = change.get('operationType')
+    full_document = change.get('fullDocument')
+    if full_document is None and operation_type == 'update':
+        updated_fields = (change.get('updateDescription') or {}).get('updatedFields') or {}
+        full_document = {'_id': (change.get('documentKey') or {}).get('_id'), **updated_fields}
+
+    if full_document:
+        # --- NUOVA LOGICA: DARE PRIORITÀ AL CAMPO 'event' O A 'methodName' ---
+        event_name = full_document.get('event')
+        if not event_name and full_document.get('source') == 'frontend_tx_status':
+            event_name = full_document.get('methodName')
+            logging.debug("Usando 'methodName' come nome evento di fallback: %s", event_name)
+        
+        if not event_name:
+            event_name = 'N/A'
+        # ********************************************************************
+
+        # Costruisci l'oggetto JSON per il frontend, usando le chiavi corrette
+        message = {
+            "operationType": operation_type,
+            "fullDocument": full_document,
+            "wallClockTime": datetime.utcnow().isoformat(),
+            "eventName": event_name # Aggiungi esplicitamente il nome dell'evento per il frontend
+        }
+
+        # ObjectId, datetime e bytes (anche annidati) vengono convertiti durante la serializzazione
+        try:
+            return serialize_message(message)
+        except TypeError as e:
+            logging.error(f"ERRORE DI SERIALIZZAZIONE JSON: Controlla i tipi di dati. Errore: {e}. Evento: {message}", exc_info=True)
+            return None
+    else:
+        logging.warning(f"Evento Change Stream senza 'fullDocument' per operationType: {operation_type}. Evento completo: {change}")
+        error_message = {
+            "operationType": operation_type,
+            "fullDocument": {
+                "_id": "N/A",
+                "transactionHash": "N/A",
+                "event": "FullDocumentMancante"
+            },
+            "wallClockTime": datetime.utcnow().isoformat(),
+            "eventName": "FullDocumentMancante"
+        }
+        return json.dumps(error_message)
+
+async def publish_changes(changes, redis_client):
+    """
+    Pubblica su Redis un gruppo di eventi Change Stream (nell'ordine ricevuto).
+    Gli errori di Redis vengono propagati: il chiamante non avanza il resume token e
+    riapre il Change Stream dall'ultimo evento pubblicato (consegna at-least-once).
+    """
+    json_messages = []
+    for change in changes:
+        if change.get('operationType') == 'invalidate':
+            continue  # la collection è stata eliminata/rinominata: nulla da inoltrare
+        try:
+            json_message = build_change_message(change)
+        except Exception as e:
+            logging.error(f"Errore generico nel processare l'evento Change Stream: {e}. Evento: {change}", exc_info=True)
+            continue
+        if json_message is not None:
+            json_messages.append(json_message)
+    if not json_messages:
+        return 0
+
+    await publish_messages(redis_client, json_messages)
+    record_publish_latency(changes)
+    CHANGESTREAM_PUBLISHED.inc(len(json_messages))
+    if len(changes) == 1:
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            full_document = changes[0].get('fullDocument') or changes[0].get('documentKey') or {}
+            logging.debug(f"Pubblicato evento '{full_document.get('event') or full_document.get('methodName') or 'N/A'}' su Redis ({REDIS_TRANSPORT}) per transazione: {full_document.get('transactionHash', 'N/A')} (ID: {full_document.get('_id', 'N/A')}).")
+    else:
+        logging.info("Pubblicati %s eventi del Change Stream su Redis (%s) in un unico batch.", len(json_messages), REDIS_TRANSPORT)
+    return len(json_messages)
+
+def record_publish_latency(changes):
+    """
+    Registra il ritardo scrittura su MongoDB -> pubblicazione su Redis di ogni evento:
+    wallTime (MongoDB 6.0+, millisecondi) o, in mancanza, clusterTime (secondi).
+    """
+    now = datetime.utcnow()
+    for change in changes:
+        wall_time = change.get('wallTime')
+        if wall_time is not None:
+            CHANGESTREAM_PUBLISH_LATENCY.observe(max(0.0, (now - wall_time.replace(tzinfo=None)).total_seconds()))
+        elif change.get('clusterTime') is not None:
+            CHANGESTREAM_PUBLISH_LATENCY.observe(max(0.0, time.time() - change['clusterTime'].time))
+
 async def process_change_event(change, redis_client):
     """
     Processa un evento Change Stream e pubblica i dati su Redis.
     """
-    logging.debug(f"Ricevuto evento Change Stream: {change.get('operationType', 'N/A')}")
     try:
-        operation_type = change.get('operationType')
-        full_document = change.get('fullDocument')
-
-        if full_document:
-            # Serializzazione di ObjectId in stringa
-            if '_id' in full_document and isinstance(full_document['_id'], ObjectId):
-                full_document['_id'] = str(full_document['_id'])
-                logging.debug(f"Convertito ObjectId a stringa per _id: {full_document['_id']}")      
-
-            # Gestione di altri tipi non serializzabili JSON, se presenti
-            for key, value in full_document.items():
-                if isinstance(value, datetime):
-                    full_document[key] = value.isoformat()
-                elif isinstance(value, bytes):
-                    try:
-                        full_document[key] = value.decode('utf-8')
-                    except UnicodeDecodeError:
-                        full_document[key] = value.hex()
-
-            # --- NUOVA LOGICA: DARE PRIORITÀ AL CAMPO 'event' O A 'methodName' ---
-            event_name = full_document.get('event')
-            if not event_name and full_document.get('source') == 'frontend_tx_status':
-                event_name = full_document.get('methodName')
-                logging.info(f"Usando 'methodName' come nome evento di fallback: {event_name}")
-            
-            if not event_name:
-                event_name = 'N/A'
-            # ********************************************************************
-
-            # Costruisci l'oggetto JSON per il frontend, usando le chiavi corrette
-            message = {
-                "operationType": operation_type,
-                "fullDocument": full_document,
-                "wallClockTime": datetime.utcnow().isoformat(),
-                "eventName": event_name # Aggiungi esplicitamente il nome dell'evento per il frontend
-            }
-
-            try:
-                json_message = json.dumps(message)
-                await redis_client.publish(REDIS_CHANNEL, json_message)
-
-                logging.info(f"Pubblicato evento '{event_name}' su Redis Channel '{REDIS_CHANNEL}' per transazione: {full_document.get('transactionHash', 'N/A')} (ID: {full_document.get('_id', 'N/A')}).")
-            except TypeError as e:
-                logging.error(f"ERRORE DI SERIALIZZAZIONE JSON: Controlla i tipi di dati. Errore: {e}. Evento: {message}", exc_info=True)
-            except Exception as e:
-                logging.error(f"Errore durante la pubblicazione su Redis: {e}. Messaggio: {message}", exc_info=True)
-        else:
-            logging.warning(f"Evento Change Stream senza 'fullDocument' per operationType: {operation_type}. Evento completo: {change}")
-            error_message = {
-                "operationType": operation_type,
-                "fullDocument": {
-                    "_id": "N/A",
-                    "transactionHash": "N/A",
-                    "event": "FullDocumentMancante"
-                },
-                "wallClockTime": datetime.utcnow().isoformat(),
-                "eventName": "FullDocumentMancante"
-            }
-            await redis_client.publish(REDIS_CHANNEL, json.dumps(error_message))
-
+        await publish_changes([change], redis_client)
     except Exception as e:
-        logging.error(f"Errore generico nel processare l'evento Change Stream: {e}. Evento: {change}", exc_info=True)
+        logging.error(f"Errore durante la pubblicazione su Redis: {e}. Evento: {change}", exc_info=True)
+
+def is_backlog_change(change):
+    """True se l'evento è più vecchio di CHANGE_STREAM_CATCHUP_LAG_SECONDS (arretrato da recuperare)."""
+    cluster_time = change.get('clusterTime')
+    if cluster_time is None:
+        return False
+    return time.time() - cluster_time.time > CHANGE_STREAM_CATCHUP_LAG_SECONDS
 
 
 async def listen_for_db_changes():
-    """Ascolta i cambiamenti nel database MongoDB e li pubblica su Redis."""
+    """
+    Ascolta i cambiamenti nel database MongoDB e li pubblica su Redis.
+
+    Il resume token dell'ultimo evento pubblicato resta in memoria tra un errore e l'altro
+    ed è salvato periodicamente in LISTENER_STATE_COLLECTION: dopo un failover di Atlas,
+    un errore di Redis o un riavvio del processo il Change Stream riprende da lì
+    (start_after), quindi gli inserimenti avvenuti nel frattempo vengono pubblicati
+    (almeno una volta: il frontend scarta i duplicati per _id). L'arretrato viene letto
+    e pubblicato a batch di CHANGE_STREAM_CATCHUP_BATCH_SIZE eventi.
+    """
     collection = None
+    state_collection = None
     redis_client = None
+    resume_token = None
+    resume_token_loaded = False
 
     while True:
         if collection is None:
@@ -163,6 +322,7 @@ async def listen_for_db_changes():
                 logging.error("Connessione a MongoDB fallita. Riprovo tra 10 secondi...")
                 await asyncio.sleep(10)
                 continue
+            state_collection = collection.database.get_collection(LISTENER_STATE_COLLECTION)
 
         if redis_client is None:
             redis_client = await connect_to_redis()
@@ -171,21 +331,55 @@ async def listen_for_db_changes():
                 await asyncio.sleep(10)
                 continue
 
-        pipeline = [
-            {
-                '$match': {
-                    'operationType': { '$in': ['insert', 'update'] }
-                }
-            }
-        ]
-        logging.info(f"Tentativo di avviare il Change Stream su '{DB_NAME}.{COLLECTION_NAME}'...")
+        if not resume_token_loaded:
+            resume_token = await load_resume_token(state_collection)
+            resume_token_loaded = True
+
+        logging.info(f"Tentativo di avviare il Change Stream su '{DB_NAME}.{COLLECTION_NAME}' ({'ripresa dal resume token' if resume_token else 'da adesso'})...")
 
+        saved_token = resume_token
+        unsaved_events = 0
+        last_save_time = time.monotonic()
         try:
-            async with collection.watch(pipeline=pipeline, full_document='updateLookup') as stream:
+            # Con la finestra di micro-batching l'attesa del server per un getMore vuoto è limitata
+            # alla finestra stessa, così la raccolta degli eventi non la supera di molto
+            async with collection.watch(pipeline=CHANGE_STREAM_PIPELINE, full_document=CHANGE_STREAM_FULL_DOCUMENT,
+                                        start_after=resume_token,
+                                        max_await_time_ms=CHANGE_STREAM_PUBLISH_WINDOW_MS or None) as stream:
                 logging.info("Change Stream listener avviato con successo.")
-                async for change in stream:
-                    await process_change_event(change, redis_client)
+                while stream.alive:
+                    change = await stream.try_next()
+                    if change is not None:
+                        changes = [change]
+                        # Arretrato (es. dopo una riconnessione) o finestra di micro-batching: si
+                        # leggono altri eventi e si pubblicano insieme, invece di un round trip per evento
+                        window_deadline = time.monotonic() + CHANGE_STREAM_PUBLISH_WINDOW_MS / 1000
+                        while len(changes) < CHANGE_STREAM_CATCHUP_BATCH_SIZE and (
+                                is_backlog_change(changes[-1]) or time.monotonic() < window_deadline):
+                            change = await stream.try_next()
+                            if change is None:
+                                break
+                            changes.append(change)
+                        await publish_changes(changes, redis_client)
+                        unsaved_events += len(changes)
+
+                    # Il token avanza anche senza eventi (postBatchResumeToken): salvarlo
+                    # periodicamente evita che esca dalla finestra dell'oplog nei periodi di quiete
+                    resume_token = stream.resume_token
+                    if resume_token != saved_token and (
+                            unsaved_events >= CHANGE_STREAM_TOKEN_SAVE_EVENTS
+                            or time.monotonic() - last_save_time >= CHANGE_STREAM_TOKEN_SAVE_SECONDS):
+                        if await save_resume_token(state_collection, resume_token):
+                            saved_token = resume_token
+                            unsaved_events = 0
+                        last_save_time = time.monotonic()
+            logging.warning("Change Stream chiuso dal server (invalidate). Lo riapro dopo l'ultimo evento ricevuto.")
         except (OperationFailure, ConnectionFailure, ConfigurationError) as e:
+            if isinstance(e, OperationFailure) and e.code in RESUME_TOKEN_UNUSABLE_ERROR_CODES and resume_token is not None:
+                logging.error(f"Resume token del Change Stream non più utilizzabile (codice {e.code}): gli eventi successivi all'ultimo salvataggio non saranno ripubblicati. Riparto da adesso. Errore: {e}")
+                resume_token = None
+                await save_resume_token(state_collection, None)
+                continue
             logging.error(f"Errore di connessione/operazione Change Stream: {e}. Riprovo tra 5 secondi...", exc_info=True)
             collection = None
             await asyncio.sleep(5)
@@ -194,6 +388,10 @@ async def listen_for_db_changes():
             collection = None
             redis_client = None
             await asyncio.sleep(5)
+        finally:
+            # L'ultimo token pubblicato si salva anche in uscita (errore o arresto del processo)
+            if resume_token is not None and resume_token != saved_token and state_collection is not None:
+                await save_resume_token(state_collection, resume_token)
 
 async def main():
     logging.info("Avvio del processo principale listen_for_db_changes.")
@@ -0,0 +1,135 @@
+# backend-event-listener/parallel_backfill.py
+
+import asyncio
+import logging
+import time
+
+from config import (
+    BACKFILL_SHARD_BLOCKS,
+    BACKFILL_CONCURRENCY,
+    BACKFILL_REQUESTS_PER_SECOND,
+    BACKFILL_MAX_RETRIES,
+    SCAN_RANGE_MIN_BLOCKS,
+    SCAN_RANGE_MAX_BLOCKS,
+    SCAN_RANGE_TARGET_LOGS,
+    SCAN_RANGE_TARGET_SECONDS
+)
+from log_scanner import AdaptiveRangeController, decode_logs, fetch_logs_in_range_async, is_range_limit_error
+
+logger = logging.getLogger(__name__)
+
+
+class RequestRateLimiter:
+    """Distribuisce le richieste RPC di tutti i worker a non più di `requests_per_second`."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = time.monotonic()
+            self._next_slot = max(now, self._next_slot) + self.interval
+
+
+def split_into_shards(start_block, end_block, shard_blocks):
+    """Divide [start_block, end_block] in intervalli contigui di al più `shard_blocks` blocchi."""
+    shard_blocks = max(1, shard_blocks)
+    return [
+        (shard_start, min(end_block, shard_start + shard_blocks - 1))
+        for shard_start in range(start_block, end_block + 1, shard_blocks)
+    ]
+
+
+async def scan_shard(async_w3, topic_map, shard, range_controller, rate_limiter, on_window, log_decode_stage=None):
+    """Scansiona uno shard a finestre adattive, ritentando con backoff in caso di errore."""
+    shard_start, shard_end = shard
+    from_block = shard_start
+    failures = 0
+    while from_block <= shard_end:
+        to_block = range_controller.window_end(from_block, shard_end)
+        await rate_limiter.acquire()
+        started_at = time.monotonic()
+        try:
+            raw_logs = await fetch_logs_in_range_async(async_w3, topic_map, from_block, to_block)
+        except Exception as e:
+            if is_range_limit_error(e) and range_controller.shrink(to_block - from_block + 1):
+                continue
+            failures += 1
+            if failures > BACKFILL_MAX_RETRIES:
+                raise
+            backoff_seconds = min(30, 2 ** failures)
+            logger.warning(f"Backfill: errore sui blocchi {from_block}-{to_block} ({e}). Tentativo {failures}/{BACKFILL_MAX_RETRIES} tra {backoff_seconds}s.")
+            await asyncio.sleep(backoff_seconds)
+            continue
+        range_controller.record_success(to_block - from_block + 1, len(raw_logs), time.monotonic() - started_at)
+        if log_decode_stage is not None:
+            events = await log_decode_stage.decode(raw_logs)
+        else:
+            events = decode_logs(raw_logs, topic_map)
+        await on_window(from_block, to_block, raw_logs, events)
+        failures = 0
+        from_block = to_block + 1
+
+
+async def run_parallel_backfill(async_w3, topic_map, start_block, end_block, on_window, on_checkpoint, initial_range_size,
+                                log_decode_stage=None):
+    """
+    Scansiona [start_block, end_block] con BACKFILL_CONCURRENCY worker concorrenti.
+
+    `on_window(from_block, to_block, raw_logs, events)` è una coroutine chiamata per ogni
+    finestra scansionata (anche vuota) con i log grezzi e gli eventi decodificati;
+    `on_checkpoint(block_number, scan_range_size)` viene chiamata ogni volta che il
+    blocco "sicuro" avanza, cioè quando tutti gli shard fino a quel blocco sono completati.
+    Con `log_decode_stage` (decode_pool.LogDecodeStage) la decodifica delle finestre dei
+    diversi shard avviene in parallelo su più processi mentre gli altri shard attendono l'RPC.
+    Restituisce l'ultimo blocco sicuro raggiunto (start_block - 1 se nessuno shard è stato completato).
+    """
+    if end_block < start_block:
+        return start_block - 1
+
+    shards = split_into_shards(start_block, end_block, BACKFILL_SHARD_BLOCKS)
+    logger.info(f"Backfill parallelo: blocchi {start_block}-{end_block} in {len(shards)} shard, "
+                f"concorrenza {BACKFILL_CONCURRENCY}, limite {BACKFILL_REQUESTS_PER_SECOND} richieste/s.")
+
+    range_controller = AdaptiveRangeController(
+        initial_size=initial_range_size,
+        min_size=SCAN_RANGE_MIN_BLOCKS,
+        max_size=SCAN_RANGE_MAX_BLOCKS,
+        target_logs=SCAN_RANGE_TARGET_LOGS,
+        target_seconds=SCAN_RANGE_TARGET_SECONDS
+    )
+    rate_limiter = RequestRateLimiter(BACKFILL_REQUESTS_PER_SECOND)
+    semaphore = asyncio.Semaphore(max(1, BACKFILL_CONCURRENCY))
+    completed = [False] * len(shards)
+    next_unsafe_index = 0
+    safe_block = start_block - 1
+    started_at = time.monotonic()
+
+    async def worker(index):
+        nonlocal next_unsafe_index, safe_block
+        async with semaphore:
+            await scan_shard(async_w3, topic_map, shards[index], range_controller, rate_limiter, on_window, log_decode_stage)
+        completed[index] = True
+        # Il checkpoint avanza solo sulla parte contigua di shard completati
+        while next_unsafe_index < len(shards) and completed[next_unsafe_index]:
+            next_unsafe_index += 1
+        new_safe_block = shards[next_unsafe_index - 1][1] if next_unsafe_index else start_block - 1
+        if new_safe_block > safe_block:
+            safe_block = new_safe_block
+            on_checkpoint(safe_block, range_controller.size)
+            logger.info(f"Backfill: blocco sicuro {safe_block} ({next_unsafe_index}/{len(shards)} shard completati).")
+
+    results = await asyncio.gather(*(worker(index) for index in range(len(shards))), return_exceptions=True)
+    for shard, result in zip(shards, results):
+        if isinstance(result, Exception):
+            logger.error(f"Backfill: shard {shard[0]}-{shard[1]} fallito definitivamente: {result}")
+
+    logger.info(f"Backfill parallelo terminato in {time.monotonic() - started_at:.1f}s. Ultimo blocco sicuro: {safe_block}.")
+    return safe_block
@@ -0,0 +1,248 @@
+# backend-event-listener/projections.py
+
+import asyncio
+import logging
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from mongo_indexes import ensure_indexes
+
+from config import (
+    DB_NAME,
+    COLLECTION_NAME,
+    TOKEN_OWNERSHIP_COLLECTION,
+    LISTINGS_COLLECTION,
+    AUCTIONS_COLLECTION
+)
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+ZERO_ADDRESS = "0x" + "00" * 20
+
+
+def event_position(document):
+    """Posizione dell'evento nella catena come singolo intero confrontabile (blocco, logIndex)."""
+    return document['blockNumber'] * 1_000_000 + document['logIndex']
+
+
+# ********************************************************************************
+# STATO DERIVATO DA OGNI EVENTO
+# ********************************************************************************
+# Ogni funzione restituisce i campi da impostare sul documento del token nella proiezione.
+# I documenti delle proiezioni hanno _id = tokenId, come le mapping dei contratti.
+
+def _ownership_from_transfer(args, document):
+    return {
+        "owner": args.get('to'),
+        "previousOwner": args.get('from'),
+        "burned": args.get('to') == ZERO_ADDRESS,
+    }
+
+
+def _ownership_from_mint(args, document):
+    return {
+        "contentId": args.get('contentId'),
+        "copyNumber": args.get('copyNumber'),
+        "isSpecial": args.get('isSpecial'),
+        "metadataURI": args.get('metadataURI'),
+        "minter": args.get('owner'),
+    }
+
+
+def _listing_from_listed(args, document):
+    return {
+        "seller": args.get('seller'),
+        "price": args.get('price'),
+        "active": True,
+        "status": "active",
+        "listedAt": args.get('timestamp'),
+        "buyer": None,
+        "protocolFee": None,
+        "closedAt": None,
+    }
+
+
+def _listing_from_removed(args, document):
+    return {"active": False, "status": "removed", "closedAt": args.get('timestamp')}
+
+
+def _listing_from_purchased(args, document):
+    return {
+        "seller": args.get('seller'),
+        "price": args.get('price'),
+        "active": False,
+        "status": "sold",
+        "buyer": args.get('buyer'),
+        "protocolFee": args.get('protocolFee'),
+        "closedAt": args.get('timestamp'),
+    }
+
+
+def _auction_from_started(args, document):
+    return {
+        "seller": args.get('seller'),
+        "minPrice": args.get('minPrice'),
+        "startTime": args.get('startTime'),
+        "endTime": args.get('endTime'),
+        "highestBid": 0,
+        "highestBidder": None,
+        "active": True,
+        "status": "active",
+        "winner": None,
+        "winningBid": None,
+        "claimed": False,
+        "claimedBy": None,
+    }
+
+
+def _auction_from_bid(args, document):
+    return {"highestBid": args.get('amount'), "highestBidder": args.get('bidder'), "lastBidAt": args.get('timestamp')}
+
+
+def _auction_from_ended(args, document):
+    # Senza offerte il contratto emette il venditore come winner con winningBid 0: nessun vincitore
+    has_winner = int(args.get('winningBid') or 0) > 0
+    return {
+        "active": False,
+        "status": "ended",
+        "winner": args.get('winner') if has_winner else None,
+        "winningBid": args.get('winningBid'),
+        "endedAt": args.get('timestamp'),
+    }
+
+
+def _auction_from_claimed(args, document):
+    return {"claimed": True, "claimedBy": args.get('recipient'), "claimedAt": args.get('timestamp')}
+
+
+PROJECTION_HANDLERS = {
+    "Transfer": (TOKEN_OWNERSHIP_COLLECTION, _ownership_from_transfer),
+    "NFTMinted": (TOKEN_OWNERSHIP_COLLECTION, _ownership_from_mint),
+    "NFTListedForSale": (LISTINGS_COLLECTION, _listing_from_listed),
+    "NFTSaleRemoved": (LISTINGS_COLLECTION, _listing_from_removed),
+    "NFTPurchased": (LISTINGS_COLLECTION, _listing_from_purchased),
+    "AuctionStarted": (AUCTIONS_COLLECTION, _auction_from_started),
+    "NewBid": (AUCTIONS_COLLECTION, _auction_from_bid),
+    "AuctionEnded": (AUCTIONS_COLLECTION, _auction_from_ended),
+    "NFTClaimed": (AUCTIONS_COLLECTION, _auction_from_claimed),
+}
+
+PROJECTION_COLLECTIONS = (TOKEN_OWNERSHIP_COLLECTION, LISTINGS_COLLECTION, AUCTIONS_COLLECTION)
+
+
+def fold_projection_updates(documents):
+    """
+    Riduce gli eventi di un batch a un solo aggiornamento per documento di proiezione:
+    gli eventi vengono applicati in ordine di (blocco, logIndex) e per ogni token restano
+    i campi più recenti e la posizione dell'ultimo evento.
+    Restituisce {(collection, tokenId): (posizione, campi)}.
+    """
+    folded = {}
+    for document in sorted(documents, key=event_position):
+        handler = PROJECTION_HANDLERS.get(document.get('event'))
+        if handler is None or document.get('source') is not None:
+            continue
+        args = document.get('args') or {}
+        token_id = args.get('tokenId')
+        if token_id is None:
+            continue
+        collection_name, build_fields = handler
+        position = event_position(document)
+        _, fields = folded.get((collection_name, token_id), (None, {}))
+        fields.update(build_fields(args, document))
+        fields.update({
+            "tokenId": token_id,
+            "contract": document.get('address'),
+            "lastEvent": document.get('event'),
+            "lastTransactionHash": document.get('transactionHash'),
+            "lastBlockNumber": document.get('blockNumber'),
+            "lastEventAt": document.get('blockTimestamp'),
+        })
+        folded[(collection_name, token_id)] = (position, fields)
+    return folded
+
+
+async def apply_projections(database, documents):
+    """
+    Aggiorna le proiezioni con gli eventi di un batch (una bulk_write per collection).
+
+    L'aggiornamento è idempotente: il filtro richiede che la posizione salvata nel documento
+    sia precedente a quella dell'evento, quindi rielaborare eventi già applicati (batch
+    ritentati, duplicati, backfill sovrapposti) non altera lo stato; l'upsert di un documento
+    già più recente fallisce con chiave duplicata, che viene ignorata.
+    """
+    operations_by_collection = {}
+    for (collection_name, token_id), (position, fields) in fold_projection_updates(documents).items():
+        operations_by_collection.setdefault(collection_name, []).append(UpdateOne(
+            {"_id": token_id, "$or": [{"position": {"$lt": position}}, {"position": {"$exists": False}}]},
+            {"$set": {**fields, "position": position}},
+            upsert=True
+        ))
+
+    updated_count = 0
+    for collection_name, operations in operations_by_collection.items():
+        try:
+            result = await database.get_collection(collection_name).bulk_write(operations, ordered=False)
+            updated_count += result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            other_errors = [error for error in write_errors if error.get('code') != DUPLICATE_KEY_ERROR_CODE]
+            if other_errors or e.details.get('writeConcernErrors'):
+                logger.error(f"Errore nell'aggiornamento della proiezione '{collection_name}': {other_errors[:3] or e.details.get('writeConcernErrors')}")
+                raise
+            updated_count += e.details.get('nUpserted', 0) + e.details.get('nModified', 0)
+    return updated_count
+
+
+async def rebuild_projections(db_collection, token_ids=None, batch_size=1000):
+    """
+    Ricostruisce le proiezioni rileggendo gli eventi salvati in ordine di (blocco, logIndex):
+    da zero se `token_ids` è None, altrimenti solo per i token indicati (es. dopo un reorg
+    che ha eliminato alcuni eventi). Restituisce il numero di eventi rielaborati.
+    """
+    database = db_collection.database
+    event_filter = {"event": {"$in": list(PROJECTION_HANDLERS)}, "source": {"$exists": False}}
+    if token_ids is None:
+        for collection_name in PROJECTION_COLLECTIONS:
+            await database.drop_collection(collection_name)
+        await ensure_indexes(database, PROJECTION_COLLECTIONS)
+    else:
+        token_ids = [token_id for token_id in set(token_ids) if token_id is not None]
+        if not token_ids:
+            return 0
+        event_filter["args.tokenId"] = {"$in": token_ids}
+        for collection_name in PROJECTION_COLLECTIONS:
+            await database.get_collection(collection_name).delete_many({"_id": {"$in": token_ids}})
+
+    replayed_count = 0
+    batch = []
+    cursor = db_collection.find(event_filter).sort([("blockNumber", ASCENDING), ("logIndex", ASCENDING)])
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            await apply_projections(database, batch)
+            replayed_count += len(batch)
+            batch = []
+    if batch:
+        await apply_projections(database, batch)
+        replayed_count += len(batch)
+
+    scope = "tutti i token" if token_ids is None else f"{len(token_ids)} token"
+    logger.info(f"Proiezioni ricostruite per {scope}: {replayed_count} eventi rielaborati.")
+    return replayed_count
+
+
+async def main():
+    from mongo_client import get_mongo_client
+
+    collection = get_mongo_client().get_database(DB_NAME).get_collection(COLLECTION_NAME)
+    await rebuild_projections(collection)
+
+
+if __name__ == "__main__":
+    # Ricostruzione completa delle proiezioni (es. dopo aver cambiato la logica degli handler):
+    #   python projections.py
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+# backend-event-listener/reorg_guard.py
+
+import logging
+
+from web3 import Web3
+
+from config import ENABLE_STATE_PROJECTIONS, ENABLE_MARKETPLACE_ROLLUPS, LISTENER_STATE_COLLECTION
+from projections import rebuild_projections
+from rollups import ROLLUP_HANDLERS, subtract_rollups
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ID = "last_processed_block"
+
+
+def checkpoint_collection(db_collection):
+    """
+    Collection del checkpoint di scansione: lo stato del listener è separato dagli eventi,
+    così le query e gli indici della collection eventi non devono escluderlo.
+    """
+    return db_collection.database.get_collection(LISTENER_STATE_COLLECTION)
+
+
+async def migrate_legacy_checkpoint(db_collection):
+    """Sposta nella collection di stato il checkpoint salvato dalle versioni precedenti tra gli eventi."""
+    legacy_checkpoint = await db_collection.find_one({"_id": CHECKPOINT_ID})
+    if legacy_checkpoint is None:
+        return
+    state_collection = checkpoint_collection(db_collection)
+    if await state_collection.find_one({"_id": CHECKPOINT_ID}) is None:
+        await state_collection.insert_one(legacy_checkpoint)
+        logger.info(f"Checkpoint (blocco {legacy_checkpoint.get('block_number')}) spostato nella collection '{LISTENER_STATE_COLLECTION}'.")
+    await db_collection.delete_one({"_id": CHECKPOINT_ID})
+
+
+def listener_events_filter(block_filter):
+    """
+    Filtro sui soli documenti scritti dal listener blockchain: i record salvati dal
+    frontend nella stessa collection (frontend_tx_status, ...) hanno sempre il campo `source`.
+    """
+    return {"blockNumber": block_filter, "event": {"$exists": True}, "source": {"$exists": False}}
+
+
+async def refresh_projections(db_collection, token_ids):
+    """Ricalcola le proiezioni dei token i cui eventi sono stati eliminati da un reorg."""
+    if ENABLE_STATE_PROJECTIONS and token_ids:
+        await rebuild_projections(db_collection, token_ids)
+
+
+async def subtract_removed_rollups(db_collection, removed_filter):
+    """
+    Sottrae dai rollup gli eventi che stanno per essere eliminati da un reorg.
+    Va chiamata prima dell'eliminazione: se questa fallisce e viene ritentata, la sottrazione
+    dello stesso insieme di eventi non viene applicata due volte.
+    """
+    if not ENABLE_MARKETPLACE_ROLLUPS:
+        return
+    removed_events = await db_collection.find({**removed_filter, "event": {"$in": list(ROLLUP_HANDLERS)}}).to_list(length=None)
+    if removed_events:
+        await subtract_rollups(db_collection.database, removed_events)
+
+
+async def get_block_hash(w3, block_number):
+    block = await w3.eth.get_block(block_number)
+    return Web3.to_hex(block["hash"])
+
+
+async def detect_reorg(w3, db_collection, deep_reorg_rewind_blocks):
+    """
+    Confronta gli hash salvati nell'anello `recent_block_hashes` del checkpoint con quelli
+    attuali della catena, dal più recente al più vecchio.
+    Restituisce None se il blocco più recente è ancora canonico, altrimenti l'ultimo blocco
+    dell'anello rimasto canonico (antenato comune) da cui ripartire. Se nessun hash
+    dell'anello è ancora canonico si riparte `deep_reorg_rewind_blocks` blocchi prima
+    del più vecchio elemento dell'anello.
+    """
+    checkpoint_doc = await checkpoint_collection(db_collection).find_one({"_id": CHECKPOINT_ID})
+    ring = (checkpoint_doc or {}).get("recent_block_hashes") or []
+    if not ring:
+        return None
+
+    for position, entry in enumerate(reversed(ring)):
+        current_hash = await get_block_hash(w3, entry["block_number"])
+        if current_hash == entry["block_hash"]:
+            if position == 0:
+                return None
+            logger.warning(f"REORG rilevato: il blocco {entry['block_number']} è l'ultimo antenato comune ancora canonico.")
+            return entry["block_number"]
+        logger.warning(f"REORG: hash del blocco {entry['block_number']} cambiato ({entry['block_hash']} -> {current_hash}).")
+
+    rewind_block = max(0, ring[0]["block_number"] - deep_reorg_rewind_blocks)
+    logger.critical(f"REORG più profondo dell'anello di hash salvati: riparto dal blocco {rewind_block}.")
+    return rewind_block
+
+
+async def rollback_to_block(db_collection, ancestor_block):
+    """Elimina gli eventi successivi a `ancestor_block` e riporta lì il checkpoint."""
+    removed_filter = listener_events_filter({"$gt": ancestor_block})
+    affected_token_ids = await db_collection.distinct("args.tokenId", removed_filter)
+    await subtract_removed_rollups(db_collection, removed_filter)
+    result = await db_collection.delete_many(removed_filter)
+    await refresh_projections(db_collection, affected_token_ids)
+    await checkpoint_collection(db_collection).update_one(
+        {"_id": CHECKPOINT_ID},
+        {
+            "$set": {"block_number": ancestor_block},
+            "$pull": {"recent_block_hashes": {"block_number": {"$gt": ancestor_block}}}
+        }
+    )
+    logger.warning(f"Rollback completato: {result.deleted_count} eventi successivi al blocco {ancestor_block} eliminati, checkpoint riportato a {ancestor_block}.")
+
+
+async def delete_orphaned_events(db_collection, from_block, to_block, canonical_block_hashes):
+    """
+    Elimina gli eventi nell'intervallo che appartengono a blocchi non più canonici
+    (scritti in anticipo dalla sottoscrizione prima di un reorg non notificato).
+    """
+    orphaned_filter = {
+        **listener_events_filter({"$gte": from_block, "$lte": to_block}),
+        "blockHash": {"$nin": [bytes(block_hash) for block_hash in canonical_block_hashes]}
+    }
+    affected_token_ids = await db_collection.distinct("args.tokenId", orphaned_filter)
+    await subtract_removed_rollups(db_collection, orphaned_filter)
+    result = await db_collection.delete_many(orphaned_filter)
+    await refresh_projections(db_collection, affected_token_ids)
+    if result.deleted_count:
+        logger.warning(f"Eliminati {result.deleted_count} eventi orfani (reorg) nei blocchi {from_block}-{to_block}.")
+
+
+async def delete_removed_log(db_collection, log):
+    """Elimina l'evento corrispondente a un log notificato con removed=true."""
+    removed_filter = {
+        "blockNumber": log["blockNumber"],
+        "transactionHash": log["transactionHash"].hex(),
+        "logIndex": log["logIndex"],
+        "source": {"$exists": False}
+    }
+    await subtract_removed_rollups(db_collection, removed_filter)
+    removed_event = await db_collection.find_one_and_delete(removed_filter, projection={"args.tokenId": 1})
+    if removed_event is not None:
+        await refresh_projections(db_collection, [(removed_event.get("args") or {}).get("tokenId")])
+    logger.warning(f"Log rimosso dal reorg (blocco {log['blockNumber']}, logIndex {log['logIndex']}): {int(removed_event is not None)} evento eliminato.")
@@ -0,0 +1,273 @@
+# backend-event-listener/rollups.py
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+
+from bson.decimal128 import Decimal128
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from mongo_indexes import ensure_indexes
+
+from config import (
+    DB_NAME,
+    COLLECTION_NAME,
+    ROLLUPS_COLLECTION,
+    ROLLUP_GRANULARITIES
+)
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+# Chiavi degli ultimi batch applicati conservate in ogni documento (idempotenza dei ritentativi)
+APPLIED_BATCHES_KEPT = 16
+
+# Inizio dell'intervallo che contiene un istante, per ogni granularità supportata
+BUCKET_START = {
+    "minute": lambda moment: moment.replace(second=0, microsecond=0),
+    "hour": lambda moment: moment.replace(minute=0, second=0, microsecond=0),
+    "day": lambda moment: moment.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+GRANULARITIES = [granularity for granularity in ROLLUP_GRANULARITIES if granularity in BUCKET_START]
+if len(GRANULARITIES) != len(ROLLUP_GRANULARITIES):
+    logger.error(f"ROLLUP_GRANULARITIES contiene valori non supportati: {ROLLUP_GRANULARITIES}. Uso {GRANULARITIES}.")
+
+
+def _wei(value):
+    """Importo uint256 salvato come intero o, oltre il limite di BSON, come stringa."""
+    return int(value or 0)
+
+
+# ********************************************************************************
+# CONTATORI DERIVATI DA OGNI EVENTO
+# ********************************************************************************
+# Ogni funzione restituisce gli incrementi dei contatori del documento di rollup.
+# I campi *Wei sono somme di importi in wei, salvate come Decimal128 (una somma di prezzi
+# supera presto il limite dell'intero a 64 bit); la media si ottiene da volume / conteggio.
+
+def _counters_from_purchase(args):
+    return {"sales": 1, "salesVolumeWei": _wei(args.get('price')), "protocolFeesWei": _wei(args.get('protocolFee'))}
+
+
+def _counters_from_bid(args):
+    return {"bids": 1, "bidVolumeWei": _wei(args.get('amount'))}
+
+
+def _counters_from_auction_end(args):
+    winning_bid = _wei(args.get('winningBid'))
+    counters = {"auctionsEnded": 1}
+    if winning_bid:
+        counters.update({"auctionSales": 1, "auctionVolumeWei": winning_bid})
+    return counters
+
+
+def _counters_from_mint(args):
+    return {"mints": 1, "specialMints": int(bool(args.get('isSpecial')))}
+
+
+def _counters_from_fee_withdrawal(args):
+    return {"feeWithdrawals": 1, "feesWithdrawnWei": _wei(args.get('amount'))}
+
+
+ROLLUP_HANDLERS = {
+    "NFTPurchased": _counters_from_purchase,
+    "NewBid": _counters_from_bid,
+    "AuctionEnded": _counters_from_auction_end,
+    "NFTMinted": _counters_from_mint,
+    "ProtocolFeesWithdrawn": _counters_from_fee_withdrawal,
+}
+
+
+def rollup_events(documents):
+    """Eventi del listener (non i record del frontend, che hanno `source`) che alimentano i rollup."""
+    return [
+        document for document in documents
+        if document.get('event') in ROLLUP_HANDLERS and document.get('source') is None
+    ]
+
+
+def _event_time(document):
+    """Tempo della catena dell'evento: blockTimestamp o, in mancanza, l'argomento timestamp dell'evento."""
+    block_timestamp = document.get('blockTimestamp')
+    if isinstance(block_timestamp, datetime):
+        return block_timestamp.replace(tzinfo=None)
+    timestamp = (document.get('args') or {}).get('timestamp')
+    if timestamp is not None:
+        return datetime.utcfromtimestamp(int(timestamp))
+    return None
+
+
+def rollup_id(granularity, bucket, scope, key=None):
+    suffix = "" if key is None else f":{key}"
+    return f"{granularity}:{bucket:%Y-%m-%dT%H:%M}:{scope}{suffix}"
+
+
+def fold_rollup_increments(documents, content_ids, sign=1):
+    """
+    Riduce gli eventi di un batch a un solo incremento per documento di rollup.
+    Ogni evento conta nel rollup dell'intero marketplace e, se riferito a un token, in quelli
+    del token e del contenuto da cui è stato mintato (`content_ids`: tokenId -> contentId).
+    Non esiste un rollup per autore: l'autore compare solo in ContentRegistered del
+    ScientificContentRegistry, contratto che il listener non monitora. Il rollup per
+    contenuto ne fa le veci (ogni contenuto ha un solo autore): le statistiche di un autore
+    si ottengono sommando i rollup dei suoi contentId.
+    Con `sign` = -1 gli incrementi annullano quelli di eventi eliminati (reorg).
+    Restituisce {rollup_id: (dimensioni, contatori)}.
+    """
+    folded = {}
+    skipped_count = 0
+    for document in documents:
+        event_time = _event_time(document)
+        if event_time is None:
+            skipped_count += 1
+            continue
+        args = document.get('args') or {}
+        counters = ROLLUP_HANDLERS[document['event']](args)
+        token_id = args.get('tokenId')
+        content_id = args.get('contentId') if document['event'] == "NFTMinted" else content_ids.get(token_id)
+        dimensions = [("marketplace", None)]
+        if token_id is not None:
+            dimensions.append(("token", token_id))
+        if content_id is not None:
+            dimensions.append(("content", content_id))
+
+        for granularity in GRANULARITIES:
+            bucket = BUCKET_START[granularity](event_time)
+            for scope, key in dimensions:
+                _, totals = folded.setdefault(rollup_id(granularity, bucket, scope, key), (
+                    {"granularity": granularity, "bucket": bucket, "scope": scope, "key": key}, {}
+                ))
+                for name, amount in counters.items():
+                    totals[name] = totals.get(name, 0) + sign * amount
+    if skipped_count:
+        logger.warning(f"{skipped_count} eventi senza timestamp esclusi dai rollup.")
+    return folded
+
+
+async def _content_ids(database, documents):
+    """tokenId -> contentId dei token del batch, dai NFTMinted del batch o già salvati."""
+    content_ids = {
+        document['args']['tokenId']: document['args'].get('contentId')
+        for document in documents if document['event'] == "NFTMinted" and (document.get('args') or {}).get('tokenId') is not None
+    }
+    missing_token_ids = {
+        (document.get('args') or {}).get('tokenId') for document in documents
+    } - set(content_ids) - {None}
+    if missing_token_ids:
+        cursor = database.get_collection(COLLECTION_NAME).find(
+            {"event": "NFTMinted", "args.tokenId": {"$in": list(missing_token_ids)}, "source": {"$exists": False}},
+            projection={"args.tokenId": 1, "args.contentId": 1}
+        )
+        async for minted in cursor:
+            content_ids[minted['args']['tokenId']] = minted['args'].get('contentId')
+    return content_ids
+
+
+def _batch_key(documents, sign):
+    """
+    Chiave stabile di un insieme di eventi: lo stesso batch ritentato produce la stessa chiave.
+    L'hash del blocco la distingue da quella dello stesso log reincluso dopo un reorg.
+    """
+    digest = hashlib.sha1(str(sign).encode())
+    for position in sorted(
+        (document['blockNumber'], str(document.get('blockHash')), str(document.get('transactionHash')), document['logIndex'])
+        for document in documents
+    ):
+        digest.update(repr(position).encode())
+    return digest.hexdigest()[:20]
+
+
+async def apply_rollups(database, documents, sign=1):
+    """
+    Incrementa ($inc, una bulk_write) i rollup con gli eventi appena inseriti in un batch.
+
+    Va chiamata solo con eventi inseriti per la prima volta (i duplicati scartati dall'indice
+    unico verrebbero contati due volte): EventBatchWriter la riceve come `after_insert`.
+    Ogni documento conserva le chiavi degli ultimi batch applicati: se il batch viene
+    ritentato dopo un errore parziale, i documenti già incrementati non vengono toccati
+    (l'upsert fallisce con chiave duplicata, che viene ignorata).
+    Restituisce il numero di documenti di rollup aggiornati.
+    """
+    documents = rollup_events(documents)
+    if not documents:
+        return 0
+    content_ids = await _content_ids(database, documents)
+    batch_key = _batch_key(documents, sign)
+
+    operations = []
+    for document_id, (dimensions, totals) in fold_rollup_increments(documents, content_ids, sign).items():
+        increments = {
+            name: Decimal128(str(amount)) if name.endswith("Wei") else amount
+            for name, amount in totals.items()
+        }
+        operations.append(UpdateOne(
+            {"_id": document_id, "appliedBatches": {"$ne": batch_key}},
+            {
+                "$inc": increments,
+                "$setOnInsert": dimensions,
+                "$push": {"appliedBatches": {"$each": [batch_key], "$slice": -APPLIED_BATCHES_KEPT}},
+            },
+            upsert=True
+        ))
+    if not operations:
+        return 0
+
+    try:
+        result = await database.get_collection(ROLLUPS_COLLECTION).bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+    except BulkWriteError as e:
+        write_errors = e.details.get('writeErrors', [])
+        other_errors = [error for error in write_errors if error.get('code') != DUPLICATE_KEY_ERROR_CODE]
+        if other_errors or e.details.get('writeConcernErrors'):
+            logger.error(f"Errore nell'aggiornamento dei rollup: {other_errors[:3] or e.details.get('writeConcernErrors')}")
+            raise
+        return e.details.get('nUpserted', 0) + e.details.get('nModified', 0)
+
+
+async def subtract_rollups(database, removed_documents):
+    """Annulla il contributo ai rollup degli eventi eliminati da un reorg."""
+    return await apply_rollups(database, removed_documents, sign=-1)
+
+
+async def rebuild_rollups(db_collection, batch_size=1000):
+    """
+    Ricostruisce da zero i rollup rileggendo gli eventi salvati in ordine di (blocco, logIndex).
+    Restituisce il numero di eventi rielaborati.
+    """
+    database = db_collection.database
+    await database.drop_collection(ROLLUPS_COLLECTION)
+    await ensure_indexes(database, [ROLLUPS_COLLECTION])
+
+    replayed_count = 0
+    batch = []
+    cursor = db_collection.find(
+        {"event": {"$in": list(ROLLUP_HANDLERS)}, "source": {"$exists": False}}
+    ).sort([("blockNumber", ASCENDING), ("logIndex", ASCENDING)])
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            await apply_rollups(database, batch)
+            replayed_count += len(batch)
+            batch = []
+    if batch:
+        await apply_rollups(database, batch)
+        replayed_count += len(batch)
+
+    logger.info(f"Rollup ricostruiti ({', '.join(GRANULARITIES)}): {replayed_count} eventi rielaborati.")
+    return replayed_count
+
+
+async def main():
+    from mongo_client import get_mongo_client
+
+    collection = get_mongo_client().get_database(DB_NAME).get_collection(COLLECTION_NAME)
+    await rebuild_rollups(collection)
+
+
+if __name__ == "__main__":
+    # Ricostruzione completa dei rollup (es. dopo aver cambiato i contatori o le granularità):
+    #   python rollups.py
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,361 @@
+# backend-event-listener/rpc_pool.py
+
+import asyncio
+import logging
+import time
+import urllib.parse
+
+from aiohttp import ClientError, ClientTimeout
+from web3 import AsyncHTTPProvider
+from web3.providers.async_base import AsyncJSONBaseProvider
+
+from metrics import (
+    RPC_BATCH_SIZE,
+    RPC_ENDPOINT_HEALTHY,
+    RPC_ENDPOINT_REQUESTS,
+    RPC_FAILOVERS,
+    RPC_HEDGED_REQUESTS,
+    RPC_LATENCY,
+    RPC_REQUESTS
+)
+
+logger = logging.getLogger(__name__)
+
+# Frammenti dei messaggi d'errore JSON-RPC con cui i provider segnalano il superamento del
+# loro limite di richieste (diversi dai limiti sull'intervallo di eth_getLogs, che sono
+# deterministici e vanno restituiti al chiamante: li gestisce AdaptiveRangeController).
+RATE_LIMIT_ERROR_MARKERS = (
+    "rate limit",
+    "rate-limit",
+    "ratelimit",
+    "too many requests",
+    "request rate",
+    "compute units",
+    "capacity",
+    "throughput",
+)
+RATE_LIMIT_ERROR_CODES = {429}
+
+# Errori di trasporto per cui si passa a un altro endpoint (HTTP 429/5xx compresi)
+TRANSPORT_ERRORS = (ClientError, asyncio.TimeoutError, OSError)
+
+EWMA_ALPHA = 0.2
+
+
+def is_rate_limit_response(response):
+    """True se la risposta JSON-RPC (o una delle risposte di un batch) segnala un rate limit."""
+    responses = response if isinstance(response, list) else [response]
+    for item in responses:
+        error = item.get("error") if isinstance(item, dict) else None
+        if not isinstance(error, dict):
+            continue
+        if error.get("code") in RATE_LIMIT_ERROR_CODES:
+            return True
+        message = str(error.get("message", "")).lower()
+        if any(marker in message for marker in RATE_LIMIT_ERROR_MARKERS):
+            return True
+    return False
+
+
+def endpoint_label(index, url):
+    """Etichetta dell'endpoint per log e metriche: solo l'host (il path può contenere la API key)."""
+    return f"{index}:{urllib.parse.urlparse(url).hostname or 'rpc'}"
+
+
+class RateLimitedError(Exception):
+    """L'endpoint ha risposto con un errore di rate limit: la richiesta va ritentata altrove."""
+
+    def __init__(self, response):
+        super().__init__("rate limit dell'endpoint RPC")
+        self.response = response
+
+
+class RpcEndpoint:
+    """
+    Un endpoint JSON-RPC del pool con il suo stato: budget di richieste (token bucket di
+    `requests_per_second` richieste, 0 = illimitato), salute (pausa esponenziale dopo errori
+    consecutivi) e latenza media mobile delle risposte riuscite.
+    """
+
+    def __init__(self, index, url, requests_per_second, request_timeout_seconds):
+        self.url = url
+        self.label = endpoint_label(index, url)
+        # Nessun retry interno di web3: failover e hedging sono gestiti dal pool
+        self.provider = AsyncHTTPProvider(url, request_kwargs={"timeout": ClientTimeout(total=request_timeout_seconds)},
+                                          exception_retry_configuration=None)
+        self.requests_per_second = max(0.0, requests_per_second)
+        self._tokens = max(1.0, self.requests_per_second)
+        self._tokens_updated_at = time.monotonic()
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.latency_ewma = None
+        self.in_flight = 0
+        self.supports_batch = True
+
+    def is_healthy(self, now):
+        return now >= self.unhealthy_until
+
+    def _refill(self, now):
+        if self.requests_per_second:
+            burst = max(1.0, self.requests_per_second)
+            self._tokens = min(burst, self._tokens + (now - self._tokens_updated_at) * self.requests_per_second)
+        self._tokens_updated_at = now
+
+    def seconds_until_budget(self, cost, now):
+        """Secondi di attesa prima che il budget copra `cost` richieste (0 se già disponibile)."""
+        if not self.requests_per_second:
+            return 0.0
+        self._refill(now)
+        # Un batch più grande della raffica massima attende solo di averla piena
+        missing = min(cost, max(1.0, self.requests_per_second)) - self._tokens
+        return max(0.0, missing / self.requests_per_second)
+
+    def consume_budget(self, cost, now):
+        if self.requests_per_second:
+            self._refill(now)
+            self._tokens -= cost
+
+    def record_success(self, elapsed_seconds):
+        self.consecutive_failures = 0
+        self.latency_ewma = elapsed_seconds if self.latency_ewma is None else (
+            EWMA_ALPHA * elapsed_seconds + (1 - EWMA_ALPHA) * self.latency_ewma)
+        RPC_ENDPOINT_HEALTHY.labels(self.label).set(1)
+
+    def record_failure(self, base_cooldown_seconds, max_cooldown_seconds):
+        self.consecutive_failures += 1
+        cooldown = min(max_cooldown_seconds, base_cooldown_seconds * 2 ** (self.consecutive_failures - 1))
+        self.unhealthy_until = time.monotonic() + cooldown
+        RPC_ENDPOINT_HEALTHY.labels(self.label).set(0)
+        return cooldown
+
+    def score(self):
+        """Costo atteso di una nuova richiesta: latenza media pesata per le richieste in corso."""
+        return (self.latency_ewma or 0.0) * (1 + self.in_flight)
+
+
+class RpcProviderPool(AsyncJSONBaseProvider):
+    """
+    Provider web3 asincrono che distribuisce le chiamate su più endpoint JSON-RPC.
+
+    - Ogni richiesta va all'endpoint sano con budget disponibile e latenza attesa minore;
+      se fallisce (errore di trasporto, HTTP 429/5xx, rate limit JSON-RPC) l'endpoint entra
+      in pausa esponenziale e la richiesta passa al successivo (failover).
+    - Se la risposta tarda oltre la soglia di hedging (max di `hedge_after_seconds` e
+      `hedge_latency_factor` volte la latenza media del metodo) la stessa richiesta parte
+      anche verso un secondo endpoint: vince la prima risposta, l'altra viene annullata.
+      Tutte le chiamate del listener sono letture, quindi ripeterle è sicuro.
+    - Con `batch_window_seconds` > 0 le chiamate indipendenti fatte nello stesso intervallo
+      (numero di blocco, header, receipt, eth_getLogs degli shard) vengono unite in una
+      richiesta JSON-RPC batch di al massimo `max_batch_size` elementi.
+    """
+
+    def __init__(self, urls, requests_per_second=None, batch_window_seconds=0.0, max_batch_size=20,
+                 hedge_after_seconds=0.75, hedge_latency_factor=3.0, cooldown_seconds=2.0, max_cooldown_seconds=60.0,
+                 request_timeout_seconds=30.0):
+        super().__init__()
+        if not urls:
+            raise ValueError("Il pool RPC richiede almeno un endpoint.")
+        requests_per_second = list(requests_per_second or [])
+        self.endpoints = [
+            RpcEndpoint(index, url, requests_per_second[index] if index < len(requests_per_second) else 0.0,
+                        request_timeout_seconds)
+            for index, url in enumerate(urls)
+        ]
+        self.batch_window_seconds = max(0.0, batch_window_seconds)
+        self.max_batch_size = max(1, max_batch_size)
+        self.hedge_after_seconds = hedge_after_seconds
+        self.hedge_latency_factor = hedge_latency_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self._method_latency_ewma = {}
+        self._pending_requests = []
+        self._flush_handle = None
+        for endpoint in self.endpoints:
+            RPC_ENDPOINT_HEALTHY.labels(endpoint.label).set(1)
+
+    def __str__(self):
+        return f"RPC pool ({', '.join(endpoint.label for endpoint in self.endpoints)})"
+
+    # -- interfaccia del provider web3 -- #
+
+    async def make_request(self, method, params):
+        if self.batch_window_seconds <= 0 or self.max_batch_size == 1:
+            return await self._request_single(method, params)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_requests.append((method, params, future))
+        if len(self._pending_requests) >= self.max_batch_size:
+            self._flush_pending_requests()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window_seconds, self._flush_pending_requests)
+        return await future
+
+    async def make_batch_request(self, batch_requests):
+        return await self._request_batch(list(batch_requests))
+
+    async def disconnect(self):
+        for endpoint in self.endpoints:
+            await endpoint.provider.disconnect()
+
+    # -- unione delle chiamate indipendenti in batch -- #
+
+    def _flush_pending_requests(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending_requests, self._pending_requests = self._pending_requests, []
+        if pending_requests:
+            asyncio.get_running_loop().create_task(self._dispatch_pending_requests(pending_requests))
+
+    async def _dispatch_pending_requests(self, pending_requests):
+        try:
+            if len(pending_requests) == 1:
+                method, params, _ = pending_requests[0]
+                responses = [await self._request_single(method, params)]
+            else:
+                responses = await self._request_batch([(method, params) for method, params, _ in pending_requests])
+                if not isinstance(responses, list):
+                    responses = [responses] * len(pending_requests)
+        except Exception as e:
+            for _, _, future in pending_requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), response in zip(pending_requests, responses):
+            if not future.done():
+                future.set_result(response)
+
+    # -- esecuzione con failover e hedging -- #
+
+    async def _request_single(self, method, params):
+        started_at = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self._execute(method, 1, lambda endpoint: endpoint.provider.make_request(method, params))
+            outcome = "error" if "error" in response else "ok"
+            return response
+        finally:
+            RPC_LATENCY.labels(method).observe(time.perf_counter() - started_at)
+            RPC_REQUESTS.labels(method, outcome).inc()
+
+    async def _request_batch(self, batch_requests):
+        started_at = time.perf_counter()
+        outcome = "error"
+        RPC_BATCH_SIZE.observe(len(batch_requests))
+        try:
+            response = await self._execute("batch", len(batch_requests),
+                                           lambda endpoint: self._post_batch(endpoint, batch_requests))
+            outcome = "ok" if isinstance(response, list) else "error"
+            return response
+        finally:
+            RPC_LATENCY.labels("batch").observe(time.perf_counter() - started_at)
+            for method, _ in batch_requests:
+                RPC_REQUESTS.labels(method, outcome).inc()
+
+    async def _post_batch(self, endpoint, batch_requests):
+        if endpoint.supports_batch:
+            response = await endpoint.provider.make_batch_request(batch_requests)
+            if isinstance(response, list) or is_rate_limit_response(response):
+                return response
+            # Alcuni endpoint rifiutano le richieste batch: da qui in poi le chiamate partono singole
+            endpoint.supports_batch = False
+            logger.warning(f"L'endpoint RPC {endpoint.label} non accetta richieste batch ({response.get('error')}): invio singolo.")
+        return list(await asyncio.gather(*(endpoint.provider.make_request(method, params) for method, params in batch_requests)))
+
+    def _hedge_delay(self, method_key):
+        if self.hedge_after_seconds <= 0 or len(self.endpoints) < 2:
+            return None
+        return max(self.hedge_after_seconds, self.hedge_latency_factor * self._method_latency_ewma.get(method_key, 0.0))
+
+    def _select_endpoint(self, cost, exclude):
+        """
+        Sceglie l'endpoint per una richiesta di `cost` chiamate, escludendo quelli già provati.
+        Restituisce (endpoint, secondi di attesa del budget) o (None, None) se non ne restano.
+        """
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if not candidates:
+            return None, None
+        healthy = [endpoint for endpoint in candidates if endpoint.is_healthy(now)]
+        if not healthy:
+            # Tutti in pausa: si prova quello che ne esce per primo invece di fallire subito
+            return min(candidates, key=lambda endpoint: endpoint.unhealthy_until), 0.0
+        endpoint = min(healthy, key=lambda endpoint: (endpoint.seconds_until_budget(cost, now), endpoint.score()))
+        return endpoint, endpoint.seconds_until_budget(cost, now)
+
+    async def _call_endpoint(self, endpoint, cost, wait_seconds, call):
+        if wait_seconds:
+            await asyncio.sleep(wait_seconds)
+        endpoint.consume_budget(cost, time.monotonic())
+        endpoint.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            response = await call(endpoint)
+        except asyncio.CancelledError:
+            RPC_ENDPOINT_REQUESTS.labels(endpoint.label, "cancelled").inc()
+            raise
+        except TRANSPORT_ERRORS as e:
+            cooldown = endpoint.record_failure(self.cooldown_seconds, self.max_cooldown_seconds)
+            RPC_ENDPOINT_REQUESTS.labels(endpoint.label, "error").inc()
+            logger.warning(f"Endpoint RPC {endpoint.label} non disponibile ({type(e).__name__}: {e}): in pausa per {cooldown:.0f}s.")
+            raise
+        finally:
+            endpoint.in_flight -= 1
+        if is_rate_limit_response(response):
+            cooldown = endpoint.record_failure(self.cooldown_seconds, self.max_cooldown_seconds)
+            RPC_ENDPOINT_REQUESTS.labels(endpoint.label, "rate_limited").inc()
+            logger.warning(f"Endpoint RPC {endpoint.label} in rate limit: in pausa per {cooldown:.0f}s.")
+            raise RateLimitedError(response)
+        endpoint.record_success(time.perf_counter() - started_at)
+        RPC_ENDPOINT_REQUESTS.labels(endpoint.label, "ok").inc()
+        return response
+
+    async def _execute(self, method_key, cost, call):
+        """
+        Esegue `call(endpoint)` sul miglior endpoint, con hedging dopo la soglia del metodo e
+        failover sugli altri endpoint in caso di errore. Se tutti gli endpoint rispondono con
+        un rate limit viene restituita l'ultima di queste risposte (web3 solleva l'errore).
+        """
+        started_at = time.perf_counter()
+        tried = set()
+        tasks = set()
+        last_error = None
+        hedge_delay = self._hedge_delay(method_key)
+
+        endpoint, wait_seconds = self._select_endpoint(cost, tried)
+        tried.add(endpoint)
+        tasks.add(asyncio.ensure_future(self._call_endpoint(endpoint, cost, wait_seconds, call)))
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Risposta lenta: la stessa richiesta parte verso un secondo endpoint (una sola volta)
+                    hedge_delay = None
+                    hedge_endpoint, wait_seconds = self._select_endpoint(cost, tried)
+                    if hedge_endpoint is not None and not wait_seconds and hedge_endpoint.is_healthy(time.monotonic()):
+                        tried.add(hedge_endpoint)
+                        RPC_HEDGED_REQUESTS.inc()
+                        tasks.add(asyncio.ensure_future(self._call_endpoint(hedge_endpoint, cost, 0.0, call)))
+                    continue
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        elapsed_seconds = time.perf_counter() - started_at
+                        previous = self._method_latency_ewma.get(method_key)
+                        self._method_latency_ewma[method_key] = elapsed_seconds if previous is None else (
+                            EWMA_ALPHA * elapsed_seconds + (1 - EWMA_ALPHA) * previous)
+                        return task.result()
+                    last_error = task.exception()
+                if not tasks:
+                    next_endpoint, wait_seconds = self._select_endpoint(cost, tried)
+                    if next_endpoint is None:
+                        break
+                    tried.add(next_endpoint)
+                    RPC_FAILOVERS.inc()
+                    tasks.add(asyncio.ensure_future(self._call_endpoint(next_endpoint, cost, wait_seconds, call)))
+        finally:
+            for task in tasks:
+                task.cancel()
+        if isinstance(last_error, RateLimitedError):
+            return last_error.response
+        raise last_error
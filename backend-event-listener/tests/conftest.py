@@ -0,0 +1,49 @@
+# backend-event-listener/tests/conftest.py
+
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# I moduli del listener vengono importati come in main.py, dalla cartella del servizio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import COLLECTION_NAME  # noqa: E402
+from mongo_indexes import ensure_indexes  # noqa: E402
+
+NFT_ADDRESS = "0x" + "11" * 20
+SELLER = "0x" + "aa" * 20
+BUYER = "0x" + "bb" * 20
+
+
+@pytest.fixture
+def database():
+    """Database MongoDB in memoria (mongomock-motor), nuovo per ogni test."""
+    return AsyncMongoMockClient()["test_listener"]
+
+
+@pytest.fixture
+def events_collection(database):
+    return database.get_collection(COLLECTION_NAME)
+
+
+async def create_event_indexes(database):
+    """Indice unico (blocco, transazione, logIndex) su cui si basa la deduplicazione."""
+    await ensure_indexes(database, [COLLECTION_NAME])
+
+
+def make_event(name, block_number, log_index=0, block_hash=None, **args):
+    """Documento evento come prodotto da EventSpec.decode + build_event_document."""
+    return {
+        "event": name,
+        "args": args,
+        "blockNumber": block_number,
+        "logIndex": log_index,
+        "transactionIndex": 0,
+        "transactionHash": f"{block_number:060x}{log_index:04x}",
+        "address": NFT_ADDRESS,
+        "blockHash": block_hash or bytes([block_number % 256]) * 32,
+        "blockTimestamp": datetime(2024, 1, 1, 10, block_number % 60),
+    }
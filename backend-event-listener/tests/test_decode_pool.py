@@ -0,0 +1,115 @@
+# backend-event-listener/tests/test_decode_pool.py
+
+import asyncio
+
+import pytest
+from eth_abi import encode as abi_encode
+
+import decode_pool
+from conftest import BUYER, SELLER
+from decode_pool import LogDecodeStage, configured_decode_workers
+from event_decoder import EventSpec, checksum_address
+from log_scanner import decode_logs
+
+NFT_ADDRESS = "0x" + "11" * 20
+MARKETPLACE_ADDRESS = "0x" + "22" * 20
+
+TRANSFER_ABI = {
+    "type": "event",
+    "name": "Transfer",
+    "anonymous": False,
+    "inputs": [
+        {"name": "from", "type": "address", "indexed": True},
+        {"name": "to", "type": "address", "indexed": True},
+        {"name": "tokenId", "type": "uint256", "indexed": True},
+    ],
+}
+
+LISTED_ABI = {
+    "type": "event",
+    "name": "NFTListedForSale",
+    "anonymous": False,
+    "inputs": [
+        {"name": "tokenId", "type": "uint256", "indexed": True},
+        {"name": "seller", "type": "address", "indexed": True},
+        {"name": "price", "type": "uint256", "indexed": False},
+        {"name": "timestamp", "type": "uint256", "indexed": False},
+    ],
+}
+
+CONTRACTS = [
+    (NFT_ADDRESS, [TRANSFER_ABI], ["Transfer"]),
+    (MARKETPLACE_ADDRESS, [LISTED_ABI], ["NFTListedForSale"]),
+]
+
+
+def address_topic(address):
+    return bytes(12) + bytes.fromhex(address[2:])
+
+
+def synthetic_logs(count):
+    """Log grezzi alternati Transfer / NFTListedForSale (prezzi anche oltre int64) più un log non monitorato."""
+    transfer_topic0 = bytes.fromhex(EventSpec(NFT_ADDRESS, TRANSFER_ABI).topic0[2:])
+    listed_topic0 = bytes.fromhex(EventSpec(MARKETPLACE_ADDRESS, LISTED_ABI).topic0[2:])
+    logs = []
+    for n in range(count):
+        block_number, log_index = 100 + n // 4, n % 4
+        common = {
+            "blockNumber": block_number,
+            "logIndex": log_index,
+            "transactionIndex": log_index,
+            "transactionHash": n.to_bytes(32, "big"),
+            "blockHash": block_number.to_bytes(32, "big"),
+        }
+        if n % 2:
+            logs.append({**common, "address": MARKETPLACE_ADDRESS,
+                         "topics": [listed_topic0, n.to_bytes(32, "big"), address_topic(SELLER)],
+                         "data": abi_encode(["uint256", "uint256"], [n * 10 ** 17, 1_700_000_000 + n])})
+        else:
+            logs.append({**common, "address": NFT_ADDRESS,
+                         "topics": [transfer_topic0, address_topic(SELLER), address_topic(BUYER), n.to_bytes(32, "big")],
+                         "data": b""})
+    logs.append({**logs[0], "logIndex": 9, "topics": [b"\xee" * 32], "data": b""})
+    return logs
+
+
+def test_process_pool_decodes_exactly_like_the_inline_decoder():
+    raw_logs = synthetic_logs(101)
+    stage = LogDecodeStage(CONTRACTS, workers=2, chunk_size=7, min_pool_logs=1)
+    try:
+        pooled = asyncio.run(stage.decode(raw_logs))
+    finally:
+        stage.close()
+
+    assert pooled == decode_logs(raw_logs, stage.topic_map)
+    # Stesso risultato di EventSpec.decode applicato log per log (escluso il log non monitorato)
+    specs = stage.topic_map
+    assert pooled == [specs[(checksum_address(log["address"]), "0x" + log["topics"][0].hex())].decode(log)
+                      for log in raw_logs[:-1]]
+    assert len(pooled) == 101
+    # I blocchi riuniti mantengono l'ordine di catena
+    positions = [(document["blockNumber"], document["logIndex"]) for document in pooled]
+    assert positions == sorted(positions)
+    assert pooled[1]["args"]["price"] == 10 ** 17
+    assert pooled[99]["args"]["price"] == str(99 * 10 ** 17)
+
+
+def test_small_windows_are_decoded_inline():
+    raw_logs = synthetic_logs(10)
+    stage = LogDecodeStage(CONTRACTS, workers=0, min_pool_logs=500)
+
+    assert asyncio.run(stage.decode(raw_logs)) == decode_logs(raw_logs, stage.topic_map)
+
+
+@pytest.mark.parametrize("setting, expected", [("0", 0), ("3", 3), ("-2", 0), ("molti", 0)])
+def test_configured_decode_workers(monkeypatch, setting, expected):
+    monkeypatch.setattr(decode_pool, "DECODE_WORKERS", setting)
+
+    assert configured_decode_workers() == expected
+
+
+def test_auto_leaves_a_core_for_the_event_loop(monkeypatch):
+    monkeypatch.setattr(decode_pool, "DECODE_WORKERS", "auto")
+    monkeypatch.setattr(decode_pool.os, "cpu_count", lambda: 8)
+
+    assert configured_decode_workers() == 7
@@ -0,0 +1,71 @@
+# backend-event-listener/tests/test_event_decoder.py
+
+from eth_abi import encode as abi_encode
+
+from conftest import SELLER
+from event_decoder import BSON_INT64_MAX, EventSpec, checksum_address, normalize_value
+
+MARKETPLACE_ADDRESS = "0x" + "22" * 20
+
+LISTED_ABI = {
+    "type": "event",
+    "name": "NFTListedForSale",
+    "anonymous": False,
+    "inputs": [
+        {"name": "tokenId", "type": "uint256", "indexed": True},
+        {"name": "seller", "type": "address", "indexed": True},
+        {"name": "price", "type": "uint256", "indexed": False},
+        {"name": "timestamp", "type": "uint256", "indexed": False},
+    ],
+}
+
+
+def listed_log(spec, token_id, price, timestamp=1_700_000_000):
+    return {
+        "address": MARKETPLACE_ADDRESS,
+        "topics": [
+            bytes.fromhex(spec.topic0[2:]),
+            token_id.to_bytes(32, "big"),
+            bytes(12) + bytes.fromhex(SELLER[2:]),
+        ],
+        "data": abi_encode(["uint256", "uint256"], [price, timestamp]),
+        "blockNumber": 10,
+        "blockHash": b"\x0a" * 32,
+        "transactionHash": b"\xab" * 32,
+        "transactionIndex": 0,
+        "logIndex": 4,
+    }
+
+
+def test_uint256_values_outside_int64_are_stored_as_decimal_strings():
+    spec = EventSpec(MARKETPLACE_ADDRESS, LISTED_ABI)
+    price = 5 * 10 ** 30
+    token_id = 2 ** 256 - 1
+
+    document = spec.decode(listed_log(spec, token_id, price))
+
+    assert document["args"]["price"] == str(price)
+    assert document["args"]["tokenId"] == str(token_id)
+    assert document["args"]["timestamp"] == 1_700_000_000
+
+
+def test_values_at_the_int64_boundary():
+    assert normalize_value("uint256", BSON_INT64_MAX) == BSON_INT64_MAX
+    assert normalize_value("uint256", BSON_INT64_MAX + 1) == str(BSON_INT64_MAX + 1)
+    assert normalize_value("int256", -(2 ** 63)) == -(2 ** 63)
+    assert normalize_value("int256", -(2 ** 63) - 1) == str(-(2 ** 63) - 1)
+    assert normalize_value("uint256[]", [1, 2 ** 64]) == [1, str(2 ** 64)]
+
+
+def test_decoded_document_fields():
+    spec = EventSpec(MARKETPLACE_ADDRESS, LISTED_ABI)
+
+    document = spec.decode(listed_log(spec, 42, 10 ** 18))
+
+    assert document["event"] == "NFTListedForSale"
+    assert list(document["args"]) == ["tokenId", "seller", "price", "timestamp"]
+    assert document["args"]["tokenId"] == 42
+    assert document["args"]["seller"] == checksum_address(SELLER)
+    assert document["address"] == checksum_address(MARKETPLACE_ADDRESS)
+    assert document["transactionHash"] == "ab" * 32
+    assert (document["blockNumber"], document["logIndex"]) == (10, 4)
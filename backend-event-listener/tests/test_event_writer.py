@@ -0,0 +1,245 @@
+# backend-event-listener/tests/test_event_writer.py
+
+import asyncio
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from conftest import create_event_indexes, make_event
+from event_writer import EventBatchWriter
+
+
+class Recorder:
+    """Hook after_write/after_insert che registra i logIndex ricevuti e può fallire a comando."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    async def __call__(self, documents):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("hook non disponibile")
+        self.calls.append([document["logIndex"] for document in documents])
+
+    @property
+    def received(self):
+        return sorted(log_index for call in self.calls for log_index in call)
+
+
+def batch(count, block_number=1):
+    return [make_event("Transfer", block_number, log_index, tokenId=log_index) for log_index in range(count)]
+
+
+def writer_for(collection, checkpoints, max_batch_size=1000, **hooks):
+    async def save_checkpoint(db_collection, block_number, scan_range_size=None, block_hash=None):
+        checkpoints.append(block_number)
+    return EventBatchWriter(collection, save_checkpoint, max_batch_size=max_batch_size, max_batch_seconds=float("inf"), **hooks)
+
+
+async def add_all(writer, documents):
+    for document in documents:
+        await writer.add(dict(document))
+
+
+def test_replayed_batch_is_written_once_and_reaches_after_insert_once(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        after_write, after_insert = Recorder(), Recorder()
+        writer = writer_for(events_collection, [], after_write=after_write, after_insert=after_insert)
+        for _ in range(2):
+            await add_all(writer, batch(3))
+            await writer.flush()
+
+        assert await events_collection.count_documents({}) == 3
+        assert len(writer) == 0
+        # after_write riceve tutto (idempotente), after_insert solo i nuovi inserimenti
+        assert after_write.calls == [[0, 1, 2], [0, 1, 2]]
+        assert after_insert.calls == [[0, 1, 2]]
+
+    asyncio.run(scenario())
+
+
+def test_failed_after_write_is_retried_with_the_same_documents(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        calls = []
+
+        async def after_write(documents):
+            calls.append([document["logIndex"] for document in documents])
+            if len(calls) == 1:
+                raise RuntimeError("proiezioni non disponibili")
+
+        checkpoints = []
+        writer = writer_for(events_collection, checkpoints, after_write=after_write)
+        await add_all(writer, batch(2))
+        writer.set_checkpoint(1)
+        with pytest.raises(RuntimeError):
+            await writer.flush()
+        assert checkpoints == []
+
+        await writer.flush()
+        assert calls == [[0, 1], [0, 1]]
+        assert await events_collection.count_documents({}) == 2
+        assert checkpoints == [1]
+
+    asyncio.run(scenario())
+
+
+def test_failed_after_insert_is_retried_with_the_same_documents(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        after_insert = Recorder(failures=1)
+        checkpoints = []
+        writer = writer_for(events_collection, checkpoints, after_insert=after_insert)
+        await add_all(writer, batch(2))
+        writer.set_checkpoint(1)
+        with pytest.raises(RuntimeError):
+            await writer.flush()
+        assert checkpoints == []
+
+        await writer.flush()
+        assert after_insert.calls == [[0, 1]]
+        assert checkpoints == [1]
+
+    asyncio.run(scenario())
+
+
+def test_buffer_is_flushed_when_full_and_checkpoint_follows_the_write(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        checkpoints = []
+        writer = writer_for(events_collection, checkpoints, max_batch_size=2)
+        writer.set_checkpoint(5)
+        await writer.add(make_event("Transfer", 5, 0))
+        assert await events_collection.count_documents({}) == 0 and checkpoints == []
+
+        await writer.add(make_event("Transfer", 5, 1))
+        assert await events_collection.count_documents({}) == 2
+        assert checkpoints == [5]
+
+    asyncio.run(scenario())
+
+
+def test_producers_wait_for_the_running_flush_instead_of_growing_the_buffer(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        writer = writer_for(events_collection, [], max_batch_size=2)
+        insert_many = events_collection.insert_many
+        buffer_sizes = []
+
+        async def slow_insert_many(documents, ordered=False):
+            await asyncio.sleep(0.01)
+            return await insert_many(documents, ordered=ordered)
+
+        async def produce(producer):
+            for log_index in range(10):
+                await writer.add(make_event("Transfer", producer, log_index))
+                buffer_sizes.append(len(writer))
+
+        events_collection.insert_many = slow_insert_many
+        await asyncio.gather(*(produce(producer) for producer in range(3)))
+        await writer.flush()
+
+        # Al massimo max_batch_size documenti più uno per ogni altro produttore in attesa
+        assert max(buffer_sizes) <= 2 + 2
+        assert await events_collection.count_documents({}) == 30
+
+    asyncio.run(scenario())
+
+
+def test_failed_write_keeps_documents_and_checkpoint(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        checkpoints = []
+        writer = writer_for(events_collection, checkpoints)
+        insert_many = events_collection.insert_many
+
+        async def reject_with_validation_error(documents, ordered=False):
+            events_collection.insert_many = insert_many
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "Document failed validation"}],
+                                  "writeConcernErrors": [], "nInserted": 0})
+
+        events_collection.insert_many = reject_with_validation_error
+        await add_all(writer, batch(2))
+        writer.set_checkpoint(1)
+        with pytest.raises(BulkWriteError):
+            await writer.flush()
+        assert len(writer) == 2 and checkpoints == []
+
+        await writer.flush()
+        assert await events_collection.count_documents({}) == 2
+        assert checkpoints == [1]
+
+    asyncio.run(scenario())
+
+
+def test_document_not_encodable_in_bson_is_dropped_alone(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        writer = writer_for(events_collection, [])
+        documents = batch(3)
+        documents[1]["args"]["value"] = 2 ** 80
+        await add_all(writer, documents)
+        await writer.flush()
+
+        stored = await events_collection.find({}, {"logIndex": 1}).to_list(None)
+        assert sorted(document["logIndex"] for document in stored) == [0, 2]
+
+    asyncio.run(scenario())
+
+
+def test_partial_bulk_write_failure_passes_written_documents_to_after_insert(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        after_insert = Recorder()
+        writer = writer_for(events_collection, [], after_insert=after_insert)
+        insert_many = events_collection.insert_many
+
+        async def insert_all_but_second(documents, ordered=False):
+            # insert_many(ordered=False) scrive tutti i documenti tranne quello in errore
+            events_collection.insert_many = insert_many
+            await insert_many([document for index, document in enumerate(documents) if index != 1], ordered=False)
+            raise BulkWriteError({
+                "writeErrors": [{"index": 1, "code": 121, "errmsg": "Document failed validation"}],
+                "writeConcernErrors": [], "nInserted": len(documents) - 1,
+            })
+
+        events_collection.insert_many = insert_all_but_second
+        await add_all(writer, batch(3))
+        with pytest.raises(BulkWriteError):
+            await writer.flush()
+
+        await writer.flush()
+        assert await events_collection.count_documents({}) == 3
+        assert after_insert.received == [0, 1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_insert_with_unknown_outcome_is_verified_by_id(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        after_insert = Recorder()
+        writer = writer_for(events_collection, [], after_insert=after_insert)
+        insert_many = events_collection.insert_many
+
+        async def lose_connection_after_first(documents, ordered=False):
+            # Il driver assegna gli _id prima dell'invio; la connessione cade dopo il primo documento
+            events_collection.insert_many = insert_many
+            for document in documents:
+                document.setdefault("_id", ObjectId())
+            await insert_many(documents[:1], ordered=False)
+            raise AutoReconnect("connessione persa")
+
+        events_collection.insert_many = lose_connection_after_first
+        await add_all(writer, batch(3))
+        with pytest.raises(AutoReconnect):
+            await writer.flush()
+
+        await writer.flush()
+        assert await events_collection.count_documents({}) == 3
+        assert after_insert.received == [0, 1, 2]
+
+    asyncio.run(scenario())
@@ -0,0 +1,136 @@
+# backend-event-listener/tests/test_log_archive.py
+
+import os
+from datetime import datetime
+
+import pytest
+
+from log_archive import INDEX_FILE_NAME, LogArchive
+
+NFT_ADDRESS = "0x" + "11" * 20
+
+
+def raw_log(block_number, log_index=0, data=b""):
+    """Log grezzo come restituito da eth_getLogs (campi binari già in bytes)."""
+    return {
+        "address": NFT_ADDRESS,
+        "topics": [bytes([block_number % 256]) * 32, log_index.to_bytes(32, "big")],
+        "data": data,
+        "blockNumber": block_number,
+        "logIndex": log_index,
+        "transactionIndex": log_index,
+        "transactionHash": block_number.to_bytes(16, "big") + log_index.to_bytes(16, "big"),
+        "blockHash": bytes([block_number % 256]) * 32,
+    }
+
+
+def block_time(block_number):
+    return datetime(2024, 1, 1, 0, 0, block_number % 60)
+
+
+def open_archive(directory, compression_level=1):
+    return LogArchive(str(directory), segment_blocks=100, compression_level=compression_level).open()
+
+
+def archived(archive, from_block=None, to_block=None):
+    return [(log["blockNumber"], log["logIndex"]) for log, _ in archive.iter_logs(from_block, to_block)]
+
+
+def segment_paths(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".logseg"))
+
+
+@pytest.mark.parametrize("compression_level", [0, 1])
+def test_logs_round_trip_across_segments(tmp_path, compression_level):
+    archive = open_archive(tmp_path, compression_level)
+    logs = [raw_log(250, 1, data=b"\x01" * 64), raw_log(5), raw_log(150, 0, data=b"\x02"), raw_log(250, 0)]
+
+    assert archive.append_window(0, 299, logs, {n: block_time(n) for n in (5, 150, 250)}) == 4
+
+    items = list(archive.iter_logs())
+    assert [(log["blockNumber"], log["logIndex"]) for log, _ in items] == [(5, 0), (150, 0), (250, 0), (250, 1)]
+    expected = {(log["blockNumber"], log["logIndex"]): {**log, "removed": False} for log in logs}
+    for log, block_timestamp in items:
+        assert log == expected[(log["blockNumber"], log["logIndex"])]
+        assert block_timestamp == block_time(log["blockNumber"])
+    assert archived(archive, 100, 200) == [(150, 0)]
+    assert len(segment_paths(tmp_path)) == 3
+
+
+def test_covered_windows_are_not_written_twice(tmp_path):
+    archive = open_archive(tmp_path)
+    archive.append_window(0, 49, [raw_log(10)])
+
+    assert archive.append_window(0, 99, [raw_log(10), raw_log(60)]) == 1
+    assert archived(archive) == [(10, 0), (60, 0)]
+    assert archive.coverage() == [(0, 99)]
+
+
+def test_invalidated_blocks_are_hidden_and_can_be_archived_again(tmp_path):
+    archive = open_archive(tmp_path)
+    archive.append_window(0, 199, [raw_log(10), raw_log(50), raw_log(90), raw_log(120)])
+
+    archive.invalidate_after(49)
+    assert archived(archive) == [(10, 0)]
+    assert archive.coverage() == [(0, 49)]
+
+    # Il nuovo ramo del reorg viene ri-scansionato e archiviato dopo il TOMBSTONE
+    archive.append_window(50, 199, [raw_log(60, 3)])
+    assert archived(archive) == [(10, 0), (60, 3)]
+
+    reopened = open_archive(tmp_path)
+    assert archived(reopened) == [(10, 0), (60, 3)]
+    assert reopened.coverage() == [(0, 199)]
+
+
+def test_interrupted_write_beyond_the_index_is_truncated(tmp_path):
+    archive = open_archive(tmp_path)
+    archive.append_window(0, 99, [raw_log(10), raw_log(20)])
+    [segment_path] = segment_paths(tmp_path)
+    committed_size = os.path.getsize(segment_path)
+    with open(segment_path, "ab") as f:
+        f.write(b"\x00" * 17)  # parte di un record non committato
+
+    reopened = open_archive(tmp_path)
+
+    assert os.path.getsize(segment_path) == committed_size
+    assert archived(reopened) == [(10, 0), (20, 0)]
+    assert all(error is None for error in reopened.verify().values())
+
+
+def test_partial_last_record_is_dropped_when_the_index_is_rebuilt(tmp_path):
+    archive = open_archive(tmp_path)
+    archive.append_window(0, 49, [raw_log(10)])
+    [segment_path] = segment_paths(tmp_path)
+    complete_size = os.path.getsize(segment_path)
+    archive.append_window(50, 99, [raw_log(60, data=b"\x03" * 100)])
+    # Scrittura interrotta a metà dell'ultimo record, prima dell'aggiornamento dell'indice
+    with open(segment_path, "r+b") as f:
+        f.truncate(os.path.getsize(segment_path) - 10)
+    os.remove(os.path.join(tmp_path, INDEX_FILE_NAME))
+
+    reopened = open_archive(tmp_path)
+
+    assert os.path.getsize(segment_path) == complete_size
+    assert archived(reopened) == [(10, 0)]
+    assert reopened.coverage() == [(0, 49)]
+
+
+@pytest.mark.parametrize("index_content", [None, "{non json", '{"version": 99}'])
+def test_missing_or_invalid_index_is_rebuilt_from_the_segments(tmp_path, index_content):
+    archive = open_archive(tmp_path)
+    archive.append_window(0, 249, [raw_log(10), raw_log(150), raw_log(160)])
+    archive.invalidate_after(155)
+    stats = archive.stats()
+
+    index_path = os.path.join(tmp_path, INDEX_FILE_NAME)
+    os.remove(index_path)
+    if index_content is not None:
+        with open(index_path, "w") as f:
+            f.write(index_content)
+
+    rebuilt = open_archive(tmp_path)
+
+    assert rebuilt.stats() == stats
+    assert archived(rebuilt) == [(10, 0), (150, 0)]
+    assert os.path.exists(index_path)
@@ -0,0 +1,99 @@
+# backend-event-listener/tests/test_log_scanner.py
+
+import pytest
+
+from log_scanner import RANGE_LIMIT_ERROR_MARKERS, AdaptiveRangeController, is_range_limit_error
+
+
+def controller(initial_size=1000, min_size=10, max_size=8000, ceiling_windows=3):
+    return AdaptiveRangeController(initial_size, min_size, max_size, target_logs=1000, target_seconds=2.0,
+                                   ceiling_windows=ceiling_windows)
+
+
+def test_initial_size_is_clamped():
+    assert controller(initial_size=5).size == 10
+    assert controller(initial_size=10 ** 6).size == 8000
+    assert controller(min_size=0).min_size == 1
+
+
+def test_window_end_is_truncated_at_the_head():
+    range_controller = controller()
+    assert range_controller.window_end(100, 10 ** 6) == 1099
+    assert range_controller.window_end(100, 500) == 500
+
+
+def test_full_quiet_window_grows_up_to_the_maximum():
+    range_controller = controller(initial_size=3000)
+    range_controller.record_success(3000, 10, 0.1)
+    assert range_controller.size == 6000
+    range_controller.record_success(6000, 10, 0.1)
+    assert range_controller.size == 8000
+
+
+def test_window_truncated_by_the_head_does_not_grow():
+    range_controller = controller()
+    range_controller.record_success(200, 0, 0.1)
+    assert range_controller.size == 1000
+
+
+@pytest.mark.parametrize("log_count, elapsed_seconds", [(1001, 0.1), (10, 2.5)])
+def test_crowded_or_slow_window_halves(log_count, elapsed_seconds):
+    range_controller = controller()
+    range_controller.record_success(1000, log_count, elapsed_seconds)
+    assert range_controller.size == 500
+
+
+def test_moderate_window_keeps_its_size():
+    range_controller = controller()
+    range_controller.record_success(1000, 700, 0.1)
+    assert range_controller.size == 1000
+
+
+def test_shrink_stops_at_the_minimum():
+    range_controller = controller(initial_size=40)
+    assert range_controller.shrink(40) and range_controller.size == 20
+    assert range_controller.shrink(20) and range_controller.size == 10
+    assert not range_controller.shrink(10)
+    assert range_controller.size == 10
+
+
+def test_concurrent_rejections_of_the_same_span_halve_once():
+    range_controller = controller(initial_size=1000)
+    for _ in range(3):
+        assert range_controller.shrink(1000)
+    assert range_controller.size == 500
+
+
+def test_growth_is_capped_after_a_rejection_for_ceiling_windows():
+    range_controller = controller(initial_size=1000, ceiling_windows=3)
+    range_controller.shrink(1000)
+    for _ in range(2):
+        range_controller.record_success(500, 0, 0.1)
+        assert range_controller.size == 500
+    # Dopo `ceiling_windows` finestre il tetto viene rimosso
+    range_controller.record_success(500, 0, 0.1)
+    assert range_controller.size == 1000
+
+
+@pytest.mark.parametrize("marker", RANGE_LIMIT_ERROR_MARKERS)
+def test_each_marker_is_a_range_limit_error(marker):
+    assert is_range_limit_error(ValueError(f"provider error: {marker.upper()}"))
+
+
+def test_range_limit_error_from_provider_payload():
+    assert is_range_limit_error(ValueError({"code": -32005, "message": "query returned more than 10000 results"}))
+
+
+def test_range_limit_error_from_rpc_response_code():
+    error = ValueError("limit exceeded")
+    error.rpc_response = {"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "limit exceeded"}}
+    assert is_range_limit_error(error)
+
+
+def test_unrelated_errors_are_not_range_limits():
+    assert not is_range_limit_error(ValueError({"code": -32000, "message": "execution reverted"}))
+    assert not is_range_limit_error(ConnectionError("connection refused"))
+    # I timeout di trasporto vanno ritentati, non trattati come intervallo troppo ampio
+    assert not is_range_limit_error(TimeoutError())
+    assert not is_range_limit_error(TimeoutError("request timed out"))
+    assert not is_range_limit_error(ValueError("max fee per gas more than block base fee"))
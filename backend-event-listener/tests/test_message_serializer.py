@@ -0,0 +1,38 @@
+# backend-event-listener/tests/test_message_serializer.py
+
+import json
+from datetime import datetime
+
+import pytest
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+
+import message_serializer
+from message_serializer import serialize_message
+
+
+@pytest.fixture(params=["orjson", "json"])
+def serializer(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(message_serializer, "orjson", None)
+    elif message_serializer.orjson is None:
+        pytest.skip("orjson non installato")
+    return serialize_message
+
+
+def test_bytes_are_always_0x_prefixed_hex(serializer):
+    message = {"args": {"contentHash": b"\xab\xcd", "text": b"abc", "view": memoryview(b"\x00\x01")}}
+
+    assert json.loads(serializer(message))["args"] == {"contentHash": "0xabcd", "text": "0x616263", "view": "0x0001"}
+
+
+def test_bson_types_and_big_integers(serializer):
+    object_id = ObjectId()
+    message = {"_id": object_id, "at": datetime(2024, 1, 2, 3, 4, 5), "fee": Decimal128("12.5"), "price": 2 ** 80}
+
+    decoded = json.loads(serializer(message))
+
+    assert decoded["_id"] == str(object_id)
+    assert decoded["at"] == "2024-01-02T03:04:05"
+    assert decoded["fee"] == "12.5"
+    assert int(decoded["price"]) == 2 ** 80
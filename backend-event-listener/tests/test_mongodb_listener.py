@@ -0,0 +1,196 @@
+# backend-event-listener/tests/test_mongodb_listener.py
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from bson.timestamp import Timestamp
+from pymongo.errors import OperationFailure
+
+import mongodb_listener
+from config import LISTENER_STATE_COLLECTION
+from mongodb_listener import RESUME_TOKEN_STATE_ID, is_backlog_change
+
+
+class StopListener(BaseException):
+    """Interrompe il ciclo infinito di listen_for_db_changes alla riapertura del Change Stream."""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeChangeStream:
+    """Change Stream finto: un evento per try_next, con resume token numerato; `error` viene sollevato a fine eventi."""
+
+    def __init__(self, changes, clock, seconds_per_event, error=None):
+        self.changes = list(changes)
+        self.clock = clock
+        self.seconds_per_event = seconds_per_event
+        self.error = error
+        self.alive = True
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def try_next(self):
+        if not self.changes:
+            if self.error is not None:
+                raise self.error
+            self.alive = False
+            return None
+        self.clock.now += self.seconds_per_event
+        change = self.changes.pop(0)
+        self.resume_token = {"_data": change["fullDocument"]["n"]}
+        return change
+
+
+class FakeEventsCollection:
+    """Collection degli eventi: `watch()` restituisce gli stream preparati, poi interrompe il listener."""
+
+    def __init__(self, database, streams):
+        self.database = database
+        self.streams = list(streams)
+        self.start_after = []
+
+    def watch(self, pipeline, full_document, start_after, **options):
+        self.start_after.append(start_after)
+        if not self.streams:
+            raise StopListener()
+        return self.streams.pop(0)
+
+
+def changes(count):
+    return [{"operationType": "insert", "fullDocument": {"n": n}} for n in range(1, count + 1)]
+
+
+def run_listener(monkeypatch, database, streams, clock):
+    collection = FakeEventsCollection(database, streams)
+    saved_tokens = []
+    save_resume_token = mongodb_listener.save_resume_token
+
+    async def connect_to_mongodb_changestream():
+        return collection
+
+    async def connect_to_redis():
+        return object()
+
+    async def publish_changes(published, redis_client):
+        return len(published)
+
+    async def record_saved_token(state_collection, resume_token):
+        saved_tokens.append(resume_token and resume_token["_data"])
+        return await save_resume_token(state_collection, resume_token)
+
+    async def no_sleep(_):
+        pass
+
+    monkeypatch.setattr(mongodb_listener, "connect_to_mongodb_changestream", connect_to_mongodb_changestream)
+    monkeypatch.setattr(mongodb_listener, "connect_to_redis", connect_to_redis)
+    monkeypatch.setattr(mongodb_listener, "publish_changes", publish_changes)
+    monkeypatch.setattr(mongodb_listener, "save_resume_token", record_saved_token)
+    monkeypatch.setattr(mongodb_listener, "time", SimpleNamespace(monotonic=clock.monotonic, time=time.time))
+    monkeypatch.setattr(mongodb_listener.asyncio, "sleep", no_sleep)
+
+    async def scenario():
+        with pytest.raises(StopListener):
+            await mongodb_listener.listen_for_db_changes()
+
+    asyncio.run(scenario())
+    return collection, saved_tokens
+
+
+def test_resume_token_is_saved_every_100_events_and_when_the_stream_closes(monkeypatch, database):
+    clock = FakeClock()
+    stream = FakeChangeStream(changes(250), clock, seconds_per_event=0.001)
+
+    collection, saved_tokens = run_listener(monkeypatch, database, [stream], clock)
+
+    assert saved_tokens == [100, 200, 250]
+    # Alla riapertura il Change Stream riparte dopo l'ultimo evento pubblicato
+    assert collection.start_after == [None, {"_data": 250}]
+
+
+def test_resume_token_is_saved_every_5_seconds_in_quiet_periods(monkeypatch, database):
+    clock = FakeClock()
+    stream = FakeChangeStream(changes(7), clock, seconds_per_event=2)
+
+    _, saved_tokens = run_listener(monkeypatch, database, [stream], clock)
+
+    assert saved_tokens == [3, 6, 7]
+
+
+def test_saved_resume_token_is_used_at_startup(monkeypatch, database):
+    async def seed():
+        await database.get_collection(LISTENER_STATE_COLLECTION).insert_one(
+            {"_id": RESUME_TOKEN_STATE_ID, "resume_token": {"_data": 41}})
+
+    asyncio.run(seed())
+    clock = FakeClock()
+
+    collection, _ = run_listener(monkeypatch, database, [FakeChangeStream(changes(1), clock, 0)], clock)
+
+    assert collection.start_after[0] == {"_data": 41}
+
+
+@pytest.mark.parametrize("code", sorted(mongodb_listener.RESUME_TOKEN_UNUSABLE_ERROR_CODES))
+def test_unusable_resume_token_is_reset(monkeypatch, database, code):
+    clock = FakeClock()
+    stream = FakeChangeStream(changes(3), clock, 0, error=OperationFailure("resume token perso", code=code))
+
+    collection, saved_tokens = run_listener(monkeypatch, database, [stream], clock)
+
+    assert saved_tokens == [None]
+    assert collection.start_after == [None, None]
+
+    async def stored_token():
+        state = await database.get_collection(LISTENER_STATE_COLLECTION).find_one({"_id": RESUME_TOKEN_STATE_ID})
+        return state["resume_token"]
+
+    assert asyncio.run(stored_token()) is None
+
+
+def test_other_errors_resume_from_the_last_token(monkeypatch, database):
+    clock = FakeClock()
+    stream = FakeChangeStream(changes(3), clock, 0, error=OperationFailure("primario non disponibile", code=11600))
+
+    collection, saved_tokens = run_listener(monkeypatch, database, [stream], clock)
+
+    assert saved_tokens == [3]
+    assert collection.start_after == [None, {"_data": 3}]
+
+
+def test_backlog_change_is_older_than_the_catch_up_lag():
+    now = int(time.time())
+
+    assert is_backlog_change({"clusterTime": Timestamp(now - 60, 1)})
+    assert not is_backlog_change({"clusterTime": Timestamp(now, 1)})
+    assert not is_backlog_change({})
+
+
+def test_change_stream_projection_keeps_the_document_id(database):
+    async def scenario():
+        changes_collection = database.get_collection("changes")
+        await changes_collection.insert_one({
+            "operationType": "insert",
+            "documentKey": {"_id": "evento-1"},
+            "fullDocument": {"_id": "evento-1", "event": "Transfer", "args": {"tokenId": 7}, "unused": "x" * 100},
+        })
+        projection_stage = mongodb_listener.CHANGE_STREAM_PIPELINE[-1]
+        [change] = await changes_collection.aggregate([projection_stage]).to_list(None)
+        return change["fullDocument"]
+
+    full_document = asyncio.run(scenario())
+
+    assert full_document["_id"] == "evento-1"
+    assert full_document["event"] == "Transfer"
+    assert "unused" not in full_document
@@ -0,0 +1,88 @@
+# backend-event-listener/tests/test_parallel_backfill.py
+
+import asyncio
+
+import pytest
+
+import parallel_backfill
+from parallel_backfill import run_parallel_backfill, split_into_shards
+
+
+def test_shards_cover_the_range_contiguously():
+    assert split_into_shards(100, 124, 10) == [(100, 109), (110, 119), (120, 124)]
+
+
+def test_range_smaller_than_a_shard_is_a_single_shard():
+    assert split_into_shards(100, 104, 10) == [(100, 104)]
+
+
+def test_single_block_range():
+    assert split_into_shards(7, 7, 10) == [(7, 7)]
+    assert split_into_shards(7, 7, 0) == [(7, 7)]
+
+
+def test_empty_range_has_no_shards():
+    assert split_into_shards(8, 7, 10) == []
+
+
+@pytest.fixture
+def backfill_config(monkeypatch):
+    monkeypatch.setattr(parallel_backfill, "BACKFILL_SHARD_BLOCKS", 10)
+    monkeypatch.setattr(parallel_backfill, "BACKFILL_CONCURRENCY", 10)
+    monkeypatch.setattr(parallel_backfill, "BACKFILL_REQUESTS_PER_SECOND", 0)
+    monkeypatch.setattr(parallel_backfill, "BACKFILL_MAX_RETRIES", 0)
+    monkeypatch.setattr(parallel_backfill, "SCAN_RANGE_MIN_BLOCKS", 1)
+    monkeypatch.setattr(parallel_backfill, "SCAN_RANGE_MAX_BLOCKS", 10)
+
+
+def stub_fetch(monkeypatch, failing_block=None):
+    """eth_getLogs finto: un evento per finestra, errore permanente sulla finestra che contiene `failing_block`."""
+    async def fetch(async_w3, topic_map, from_block, to_block):
+        # Gli shard più vecchi terminano per ultimi, come con provider lenti sui blocchi storici
+        await asyncio.sleep((100 - from_block) / 10000)
+        if failing_block is not None and from_block <= failing_block <= to_block:
+            raise ValueError("execution reverted")
+        return [{"blockNumber": from_block}]
+    monkeypatch.setattr(parallel_backfill, "fetch_logs_in_range_async", fetch)
+    monkeypatch.setattr(parallel_backfill, "decode_logs", lambda raw_logs, topic_map: raw_logs)
+
+
+def run_backfill(start_block, end_block):
+    events, checkpoints = [], []
+
+    async def on_window(from_block, to_block, raw_logs, decoded_events):
+        events.extend(decoded_events)
+
+    def on_checkpoint(block_number, scan_range_size):
+        checkpoints.append(block_number)
+
+    safe_block = asyncio.run(run_parallel_backfill(None, {}, start_block, end_block, on_window, on_checkpoint, 10))
+    return safe_block, events, checkpoints
+
+
+def test_checkpoint_reaches_the_end_when_every_shard_completes(backfill_config, monkeypatch):
+    stub_fetch(monkeypatch)
+
+    safe_block, events, checkpoints = run_backfill(0, 99)
+
+    assert safe_block == 99
+    assert checkpoints == [99]
+    assert sorted(event["blockNumber"] for event in events) == list(range(0, 100, 10))
+
+
+def test_checkpoint_stops_before_a_failed_shard(backfill_config, monkeypatch):
+    stub_fetch(monkeypatch, failing_block=45)
+
+    safe_block, events, checkpoints = run_backfill(0, 99)
+
+    assert safe_block == 39
+    assert checkpoints and max(checkpoints) == 39
+    assert checkpoints == sorted(checkpoints)
+    # Gli shard successivi sono stati scansionati, ma non coperti dal checkpoint
+    assert {event["blockNumber"] for event in events} >= {50, 90}
+
+
+def test_empty_range_returns_the_previous_block(backfill_config, monkeypatch):
+    stub_fetch(monkeypatch)
+
+    assert run_backfill(10, 9) == (9, [], [])
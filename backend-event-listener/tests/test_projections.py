@@ -0,0 +1,82 @@
+# backend-event-listener/tests/test_projections.py
+
+import asyncio
+
+from conftest import BUYER, SELLER, make_event
+from config import AUCTIONS_COLLECTION, LISTINGS_COLLECTION, TOKEN_OWNERSHIP_COLLECTION
+from projections import apply_projections, rebuild_projections
+
+
+def listing_lifecycle():
+    return [
+        make_event("NFTListedForSale", 1, tokenId=7, seller=SELLER, price=10 ** 18, timestamp=1),
+        make_event("NFTPurchased", 2, tokenId=7, buyer=BUYER, seller=SELLER, price=10 ** 18, protocolFee=10, timestamp=2),
+    ]
+
+
+def test_replayed_events_do_not_change_the_projection(database):
+    async def scenario():
+        listed, purchased = listing_lifecycle()
+        await apply_projections(database, [listed, purchased])
+        first = await database.get_collection(LISTINGS_COLLECTION).find_one({"_id": 7})
+        await apply_projections(database, [listed, purchased])
+        await apply_projections(database, [listed])
+
+        assert await database.get_collection(LISTINGS_COLLECTION).find_one({"_id": 7}) == first
+        assert first["status"] == "sold" and first["active"] is False
+
+    asyncio.run(scenario())
+
+
+def test_older_event_arriving_after_a_newer_one_is_ignored(database):
+    async def scenario():
+        listed, purchased = listing_lifecycle()
+        await apply_projections(database, [purchased])
+        await apply_projections(database, [listed])
+
+        listing = await database.get_collection(LISTINGS_COLLECTION).find_one({"_id": 7})
+        assert listing["lastEvent"] == "NFTPurchased"
+        assert listing["active"] is False
+
+    asyncio.run(scenario())
+
+
+def test_events_in_one_batch_are_folded_in_chain_order(database):
+    async def scenario():
+        mint = make_event("Transfer", 1, tokenId=3, **{"from": "0x" + "00" * 20, "to": SELLER})
+        sale = make_event("Transfer", 2, tokenId=3, **{"from": SELLER, "to": BUYER})
+        await apply_projections(database, [sale, mint])
+
+        ownership = await database.get_collection(TOKEN_OWNERSHIP_COLLECTION).find_one({"_id": 3})
+        assert ownership["owner"] == BUYER
+        assert ownership["previousOwner"] == SELLER
+
+    asyncio.run(scenario())
+
+
+def test_auction_ended_without_bids_has_no_winner(database):
+    async def scenario():
+        await apply_projections(database, [
+            make_event("AuctionStarted", 1, tokenId=5, seller=SELLER, minPrice=1, startTime=1, endTime=100),
+            make_event("AuctionEnded", 2, tokenId=5, winner=SELLER, winningBid=0, timestamp=101),
+        ])
+        auction = await database.get_collection(AUCTIONS_COLLECTION).find_one({"_id": 5})
+        assert auction["status"] == "ended"
+        assert auction["winner"] is None
+
+    asyncio.run(scenario())
+
+
+def test_rebuild_recovers_from_out_of_order_batches(database, events_collection):
+    async def scenario():
+        listed, purchased = listing_lifecycle()
+        relisted = make_event("NFTListedForSale", 3, tokenId=7, seller=BUYER, price=2 * 10 ** 18, timestamp=3)
+        await events_collection.insert_many([dict(listed), dict(purchased), dict(relisted)])
+        await apply_projections(database, [relisted])
+        await apply_projections(database, [listed])
+
+        assert await rebuild_projections(events_collection, token_ids=[7]) == 3
+        listing = await database.get_collection(LISTINGS_COLLECTION).find_one({"_id": 7})
+        assert listing["seller"] == BUYER and listing["status"] == "active"
+
+    asyncio.run(scenario())
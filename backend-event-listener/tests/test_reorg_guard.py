@@ -0,0 +1,171 @@
+# backend-event-listener/tests/test_reorg_guard.py
+
+import asyncio
+
+import pytest
+
+import rollups
+from conftest import BUYER, SELLER, create_event_indexes, make_event
+from config import LISTINGS_COLLECTION, ROLLUPS_COLLECTION
+from event_writer import EventBatchWriter
+from projections import apply_projections
+from reorg_guard import (
+    CHECKPOINT_ID, checkpoint_collection, delete_orphaned_events, delete_removed_log, detect_reorg,
+    migrate_legacy_checkpoint, rollback_to_block
+)
+
+
+@pytest.fixture(autouse=True)
+def integer_wei_sums(monkeypatch):
+    # mongomock non supporta $inc su Decimal128 (MongoDB sì): nei test le somme restano interi
+    monkeypatch.setattr(rollups, "Decimal128", int)
+
+
+class FakeChain:
+    """Espone w3.eth.get_block con gli hash dei blocchi del ramo corrente."""
+
+    def __init__(self, block_hashes):
+        self.block_hashes = block_hashes
+        self.eth = self
+
+    async def get_block(self, block_number):
+        return {"hash": self.block_hashes[block_number]}
+
+
+def block_hash(block_number, fork=0):
+    return bytes([fork]) * 16 + block_number.to_bytes(16, "big")
+
+
+def ring(*block_numbers):
+    return [{"block_number": n, "block_hash": "0x" + block_hash(n).hex()} for n in block_numbers]
+
+
+def chain(fork):
+    """Listing al blocco 1, poi acquisto e nuovo listing nei blocchi 2-3 del ramo `fork`."""
+    return [
+        make_event("NFTListedForSale", 1, tokenId=7, seller=SELLER, price=10 ** 15),
+        make_event("NFTPurchased", 2, block_hash=fork * 32, tokenId=7, buyer=BUYER, seller=SELLER,
+                   price=10 ** 15, protocolFee=10 ** 13),
+        make_event("NFTListedForSale", 3, block_hash=fork * 32, tokenId=7, seller=BUYER, price=3 * 10 ** 15),
+    ]
+
+
+async def ingest(events_collection, documents):
+    async def keep_checkpoint(*_):
+        pass
+
+    database = events_collection.database
+    writer = EventBatchWriter(
+        events_collection, keep_checkpoint, max_batch_seconds=float("inf"),
+        after_write=lambda batch: apply_projections(database, batch),
+        after_insert=lambda batch: rollups.apply_rollups(database, batch)
+    )
+    for document in documents:
+        await writer.add(dict(document))
+    await writer.flush()
+
+
+async def daily_sales(database):
+    day = await database.get_collection(ROLLUPS_COLLECTION).find_one({"_id": "day:2024-01-01T00:00:marketplace"})
+    return day["sales"]
+
+
+def test_detect_reorg_returns_the_last_canonical_block(events_collection):
+    async def scenario():
+        await checkpoint_collection(events_collection).insert_one({"_id": CHECKPOINT_ID, "block_number": 3, "recent_block_hashes": ring(1, 2, 3)})
+        canonical = {n: block_hash(n) for n in (1, 2, 3)}
+
+        assert await detect_reorg(FakeChain(canonical), events_collection, 10) is None
+        assert await detect_reorg(FakeChain({**canonical, 3: block_hash(3, fork=1)}), events_collection, 10) == 2
+        forked = {n: block_hash(n, fork=1) for n in (1, 2, 3)}
+        assert await detect_reorg(FakeChain(forked), events_collection, 10) == 0
+
+    asyncio.run(scenario())
+
+
+def test_rollback_removes_listener_events_and_reverts_projections(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        await ingest(events_collection, chain(b"\x01"))
+        await events_collection.insert_one({"source": "frontend", "blockNumber": 3, "methodName": "purchaseNFT"})
+        await checkpoint_collection(events_collection).insert_one({"_id": CHECKPOINT_ID, "block_number": 3, "recent_block_hashes": ring(1, 2, 3)})
+
+        await rollback_to_block(events_collection, 1)
+
+        assert await events_collection.count_documents({"event": {"$exists": True}}) == 1
+        assert await events_collection.count_documents({"source": "frontend"}) == 1
+        listing = await database.get_collection(LISTINGS_COLLECTION).find_one({"_id": 7})
+        assert (listing["seller"], listing["status"], listing["lastBlockNumber"]) == (SELLER, "active", 1)
+        assert await daily_sales(database) == 0
+        checkpoint = await checkpoint_collection(events_collection).find_one({"_id": CHECKPOINT_ID})
+        assert checkpoint["block_number"] == 1
+        assert [entry["block_number"] for entry in checkpoint["recent_block_hashes"]] == [1]
+
+    asyncio.run(scenario())
+
+
+def test_reapplying_the_new_branch_after_a_rollback(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        await ingest(events_collection, chain(b"\x01"))
+        await rollback_to_block(events_collection, 1)
+        # Il nuovo ramo include le stesse transazioni agli stessi blocchi, con hash di blocco diversi
+        await ingest(events_collection, chain(b"\x02"))
+
+        assert await events_collection.count_documents({}) == 3
+        listing = await database.get_collection(LISTINGS_COLLECTION).find_one({"_id": 7})
+        assert (listing["seller"], listing["lastBlockNumber"]) == (BUYER, 3)
+        assert await daily_sales(database) == 1
+
+    asyncio.run(scenario())
+
+
+def test_orphaned_events_of_a_replaced_branch_are_deleted(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        await events_collection.insert_many(chain(b"\x01"))
+
+        await delete_orphaned_events(events_collection, 2, 3, {bytes(block_hash(2)), b"\x01" * 32})
+
+        stored = await events_collection.find({}, {"blockNumber": 1}).to_list(None)
+        assert sorted(document["blockNumber"] for document in stored) == [1, 2, 3]
+
+        await delete_orphaned_events(events_collection, 2, 3, {b"\x02" * 32})
+        stored = await events_collection.find({}, {"blockNumber": 1}).to_list(None)
+        assert [document["blockNumber"] for document in stored] == [1]
+
+    asyncio.run(scenario())
+
+
+def test_removed_log_deletes_the_event_and_its_rollup_contribution(database, events_collection):
+    async def scenario():
+        await create_event_indexes(database)
+        documents = chain(b"\x01")
+        await ingest(events_collection, documents)
+        purchase = documents[1]
+
+        await delete_removed_log(events_collection, {
+            "blockNumber": purchase["blockNumber"],
+            "transactionHash": bytes.fromhex(purchase["transactionHash"]),
+            "logIndex": purchase["logIndex"],
+        })
+
+        assert await events_collection.count_documents({"event": "NFTPurchased"}) == 0
+        assert await events_collection.count_documents({}) == 2
+        assert await daily_sales(database) == 0
+
+    asyncio.run(scenario())
+
+
+def test_legacy_checkpoint_moves_to_the_state_collection(events_collection):
+    async def scenario():
+        await events_collection.insert_one({"_id": CHECKPOINT_ID, "block_number": 42, "recent_block_hashes": ring(42)})
+
+        await migrate_legacy_checkpoint(events_collection)
+        await migrate_legacy_checkpoint(events_collection)
+
+        assert await events_collection.count_documents({}) == 0
+        checkpoint = await checkpoint_collection(events_collection).find_one({"_id": CHECKPOINT_ID})
+        assert checkpoint["block_number"] == 42
+
+    asyncio.run(scenario())
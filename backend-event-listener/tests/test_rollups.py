@@ -0,0 +1,93 @@
+# backend-event-listener/tests/test_rollups.py
+
+import asyncio
+
+import pytest
+
+import rollups
+from conftest import BUYER, SELLER, make_event
+from config import ROLLUPS_COLLECTION
+from rollups import apply_rollups, rebuild_rollups, subtract_rollups
+
+
+@pytest.fixture(autouse=True)
+def integer_wei_sums(monkeypatch):
+    # mongomock non supporta $inc su Decimal128 (MongoDB sì): nei test le somme restano interi
+    monkeypatch.setattr(rollups, "Decimal128", int)
+
+
+def mint(block_number, token_id=1, content_id=9):
+    return make_event("NFTMinted", block_number, tokenId=token_id, contentId=content_id, owner=SELLER, isSpecial=False)
+
+
+def purchase(block_number, token_id=1, price=10 ** 15, block_hash=None):
+    return make_event("NFTPurchased", block_number, block_hash=block_hash, tokenId=token_id, buyer=BUYER, seller=SELLER,
+                      price=price, protocolFee=price // 100, timestamp=0)
+
+
+async def rollup(database, document_id):
+    return await database.get_collection(ROLLUPS_COLLECTION).find_one({"_id": document_id}, {"appliedBatches": 0})
+
+
+def test_counters_per_marketplace_token_and_content(database):
+    async def scenario():
+        await apply_rollups(database, [mint(1), purchase(2)])
+
+        day = await rollup(database, "day:2024-01-01T00:00:marketplace")
+        assert (day["mints"], day["sales"], day["salesVolumeWei"], day["protocolFeesWei"]) == (1, 1, 10 ** 15, 10 ** 13)
+        assert (await rollup(database, "hour:2024-01-01T10:00:token:1"))["sales"] == 1
+        assert (await rollup(database, "minute:2024-01-01T10:02:content:9"))["sales"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_retried_batch_is_applied_once(database):
+    async def scenario():
+        documents = [mint(1), purchase(2)]
+        await apply_rollups(database, documents)
+        await apply_rollups(database, documents)
+
+        assert (await rollup(database, "day:2024-01-01T00:00:marketplace"))["sales"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_content_of_a_token_minted_in_an_earlier_batch(database, events_collection):
+    async def scenario():
+        await events_collection.insert_one(mint(1, token_id=4, content_id=12))
+        await apply_rollups(database, [purchase(2, token_id=4)])
+
+        assert (await rollup(database, "day:2024-01-01T00:00:content:12"))["sales"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_reorg_subtraction_and_reinclusion(database):
+    async def scenario():
+        orphaned = purchase(2, block_hash=b"\x01" * 32)
+        await apply_rollups(database, [mint(1), orphaned])
+        await subtract_rollups(database, [orphaned])
+        await subtract_rollups(database, [orphaned])
+        day = await rollup(database, "day:2024-01-01T00:00:marketplace")
+        assert (day["sales"], day["salesVolumeWei"], day["mints"]) == (0, 0, 1)
+
+        # La stessa transazione reinclusa nello stesso blocco del nuovo ramo viene contata di nuovo
+        await apply_rollups(database, [purchase(2, block_hash=b"\x02" * 32)])
+        assert (await rollup(database, "day:2024-01-01T00:00:marketplace"))["sales"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_rebuild_matches_incremental_rollups(database, events_collection):
+    async def scenario():
+        # Shard scritti fuori ordine: le vendite arrivano prima del mint e non trovano il contenuto
+        for shard in ([purchase(2), purchase(3, price=2 * 10 ** 15)], [mint(1)]):
+            await events_collection.insert_many([dict(document) for document in shard])
+            await apply_rollups(database, shard)
+        assert "sales" not in await rollup(database, "day:2024-01-01T00:00:content:9")
+
+        assert await rebuild_rollups(events_collection) == 3
+        content = await rollup(database, "day:2024-01-01T00:00:content:9")
+        assert (content["mints"], content["sales"], content["salesVolumeWei"]) == (1, 2, 3 * 10 ** 15)
+
+    asyncio.run(scenario())
@@ -0,0 +1,178 @@
+# backend-event-listener/tests/test_rpc_pool.py
+
+import asyncio
+import time
+
+import pytest
+from aiohttp import ClientConnectionError
+
+from rpc_pool import RpcProviderPool, is_rate_limit_response
+
+RATE_LIMITED = {"jsonrpc": "2.0", "id": 1, "error": {"code": 429, "message": "Too Many Requests"}}
+
+
+class StubProvider:
+    """Endpoint JSON-RPC finto: risponde con `result`, oppure fallisce, va in rate limit o resta in attesa."""
+
+    def __init__(self, result, error=None, rate_limited=False, delay=0.0, supports_batch=True):
+        self.result = result
+        self.error = error
+        self.rate_limited = rate_limited
+        self.delay = delay
+        self.supports_batch = supports_batch
+        self.requests = []
+        self.batches = []
+        self.cancelled = 0
+
+    async def make_request(self, method, params):
+        self.requests.append(method)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        if self.rate_limited:
+            return RATE_LIMITED
+        return {"jsonrpc": "2.0", "id": 1, "result": self.result}
+
+    async def make_batch_request(self, batch_requests):
+        self.batches.append([method for method, _ in batch_requests])
+        if not self.supports_batch:
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch requests not supported"}}
+        return [{"jsonrpc": "2.0", "id": index, "result": self.result} for index, _ in enumerate(batch_requests)]
+
+
+def pool_with(*providers, **options):
+    options.setdefault("hedge_after_seconds", 0)
+    pool = RpcProviderPool([f"https://rpc{index}.example/key" for index in range(len(providers))], **options)
+    for endpoint, provider in zip(pool.endpoints, providers):
+        endpoint.provider = provider
+    return pool
+
+
+def test_request_fails_over_after_a_transport_error():
+    async def scenario():
+        failing, healthy = StubProvider("0x1", error=ClientConnectionError("connessione rifiutata")), StubProvider("0x2")
+        pool = pool_with(failing, healthy, cooldown_seconds=2.0)
+
+        response = await pool.make_request("eth_blockNumber", [])
+
+        assert response["result"] == "0x2"
+        assert (failing.requests, healthy.requests) == (["eth_blockNumber"], ["eth_blockNumber"])
+        assert not pool.endpoints[0].is_healthy(time.monotonic())
+        # Durante la pausa la richiesta successiva va direttamente all'endpoint sano
+        await pool.make_request("eth_blockNumber", [])
+        assert len(failing.requests) == 1 and len(healthy.requests) == 2
+
+    asyncio.run(scenario())
+
+
+def test_error_is_raised_when_every_endpoint_fails():
+    async def scenario():
+        error = ClientConnectionError("rete non raggiungibile")
+        pool = pool_with(StubProvider(None, error=error), StubProvider(None, error=error))
+
+        with pytest.raises(ClientConnectionError):
+            await pool.make_request("eth_blockNumber", [])
+
+    asyncio.run(scenario())
+
+
+def test_slow_request_is_hedged_and_the_loser_is_cancelled():
+    async def scenario():
+        slow, fast = StubProvider("0xslow", delay=10), StubProvider("0xfast")
+        pool = pool_with(slow, fast, hedge_after_seconds=0.01)
+
+        response = await asyncio.wait_for(pool.make_request("eth_getLogs", [{}]), timeout=2)
+        await asyncio.sleep(0)
+
+        assert response["result"] == "0xfast"
+        assert slow.cancelled == 1
+        assert pool.endpoints[0].in_flight == 0
+        # L'endpoint lento non è penalizzato come se avesse fallito
+        assert pool.endpoints[0].consecutive_failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_rate_limited_endpoint_is_paused_with_exponential_cooldown():
+    async def scenario():
+        limited, healthy = StubProvider("0x1", rate_limited=True), StubProvider("0x2")
+        pool = pool_with(limited, healthy, cooldown_seconds=2.0, max_cooldown_seconds=3.0)
+
+        assert (await pool.make_request("eth_chainId", []))["result"] == "0x2"
+        endpoint = pool.endpoints[0]
+        first_pause = endpoint.unhealthy_until - time.monotonic()
+        assert 1.5 < first_pause <= 2.0
+
+        # Pausa raddoppiata al secondo errore consecutivo, entro il massimo
+        endpoint.unhealthy_until = 0.0
+        await pool.make_request("eth_chainId", [])
+        assert 2.5 < endpoint.unhealthy_until - time.monotonic() <= 3.0
+        assert endpoint.consecutive_failures == 2
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_response_is_returned_when_every_endpoint_is_limited():
+    async def scenario():
+        pool = pool_with(StubProvider(None, rate_limited=True), StubProvider(None, rate_limited=True))
+
+        assert await pool.make_request("eth_chainId", []) == RATE_LIMITED
+
+    asyncio.run(scenario())
+
+
+def test_request_goes_to_the_endpoint_with_budget_left():
+    async def scenario():
+        first, second = StubProvider("0x1"), StubProvider("0x2")
+        pool = pool_with(first, second, requests_per_second=[1, 1])
+
+        results = [(await pool.make_request("eth_blockNumber", []))["result"] for _ in range(2)]
+
+        # Il primo endpoint ha esaurito il budget: la seconda richiesta va al secondo senza attendere
+        assert results == ["0x1", "0x2"]
+        assert pool.endpoints[0].seconds_until_budget(1, time.monotonic()) > 0
+
+    asyncio.run(scenario())
+
+
+def test_endpoint_without_batch_support_falls_back_to_single_requests():
+    async def scenario():
+        provider = StubProvider("0x1", supports_batch=False)
+        pool = pool_with(provider)
+        batch_requests = [("eth_getBlockByNumber", ["0x1", False]), ("eth_getBlockByNumber", ["0x2", False])]
+
+        responses = await pool.make_batch_request(batch_requests)
+        await pool.make_batch_request(batch_requests)
+
+        assert [response["result"] for response in responses] == ["0x1", "0x1"]
+        assert pool.endpoints[0].supports_batch is False
+        # Dopo il primo rifiuto il batch non viene più tentato
+        assert len(provider.batches) == 1
+        assert len(provider.requests) == 4
+
+    asyncio.run(scenario())
+
+
+def test_independent_calls_in_the_batch_window_share_one_request():
+    async def scenario():
+        provider = StubProvider("0x1")
+        pool = pool_with(provider, batch_window_seconds=0.01, max_batch_size=20)
+
+        responses = await asyncio.gather(*(pool.make_request("eth_getBlockByNumber", [hex(n), False]) for n in range(3)))
+
+        assert [response["result"] for response in responses] == ["0x1"] * 3
+        assert provider.batches == [["eth_getBlockByNumber"] * 3]
+        assert provider.requests == []
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_detection():
+    assert is_rate_limit_response(RATE_LIMITED)
+    assert is_rate_limit_response([{"result": "0x1"}, {"error": {"code": -32005, "message": "Exceeded compute units"}}])
+    assert not is_rate_limit_response({"error": {"code": -32000, "message": "execution reverted"}})
+    assert not is_rate_limit_response({"result": "0x1"})
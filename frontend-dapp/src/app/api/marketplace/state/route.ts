@@ -0,0 +1,73 @@
+// frontend-dapp/src/app/api/marketplace/state/route.ts
+
+import { MongoClient } from 'mongodb';
+import { NextRequest, NextResponse } from 'next/server';
+import { getAddress, isAddress } from 'viem';
+
+// Route sempre dinamica (legge lo stato corrente dal database)
+export const dynamic = 'force-dynamic';
+
+const MONGODB_URI = process.env.MONGODB_URI;
+const DATABASE_NAME = "DnaContentMarketplaceDB";
+
+if (!MONGODB_URI) {
+  throw new Error('Please define the MONGODB_URI environment variable inside .env.local');
+}
+
+let cachedClient: MongoClient | null = null;
+
+async function connectToDatabase() {
+  if (cachedClient) {
+    return cachedClient;
+  }
+  const client = new MongoClient(MONGODB_URI!);
+  await client.connect();
+  cachedClient = client;
+  return client;
+}
+
+// Proiezioni mantenute dal backend-event-listener (projections.py), con _id = tokenId:
+//   GET /api/marketplace/state               -> vendite e aste attive
+//   GET /api/marketplace/state?owner=0x...   -> in più i token posseduti dall'indirizzo
+//   GET /api/marketplace/state?tokenId=12    -> proprietario, vendita e asta del token
+export async function GET(request: NextRequest) {
+  try {
+    const client = await connectToDatabase();
+    const db = client.db(DATABASE_NAME);
+    const ownership = db.collection('token_ownership');
+    const listings = db.collection('marketplace_listings');
+    const auctions = db.collection('marketplace_auctions');
+
+    const { searchParams } = new URL(request.url);
+    const owner = searchParams.get('owner');
+    const tokenIdParam = searchParams.get('tokenId');
+
+    if (tokenIdParam !== null) {
+      const tokenId = parseInt(tokenIdParam, 10);
+      if (Number.isNaN(tokenId)) {
+        return NextResponse.json({ error: 'Invalid tokenId' }, { status: 400 });
+      }
+      const [token, listing, auction] = await Promise.all([
+        ownership.findOne({ _id: tokenId as any }),
+        listings.findOne({ _id: tokenId as any }),
+        auctions.findOne({ _id: tokenId as any }),
+      ]);
+      return NextResponse.json({ token, listing, auction });
+    }
+
+    if (owner !== null && !isAddress(owner)) {
+      return NextResponse.json({ error: 'Invalid owner address' }, { status: 400 });
+    }
+
+    const [activeListings, activeAuctions, ownedTokens] = await Promise.all([
+      listings.find({ active: true }).toArray(),
+      auctions.find({ active: true }).sort({ endTime: 1 }).toArray(),
+      owner !== null ? ownership.find({ owner: getAddress(owner) }).toArray() : Promise.resolve(null),
+    ]);
+
+    return NextResponse.json({ listings: activeListings, auctions: activeAuctions, ownedTokens });
+  } catch (error) {
+    console.error('API Error:', error);
+    return NextResponse.json({ error: 'Failed to fetch marketplace state' }, { status: 500 });
+  }
+}
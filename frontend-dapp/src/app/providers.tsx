@@ -42,8 +42,30 @@ export interface EventData {
   operationType: 'insert' | 'update' | 'delete' | string;
   fullDocument?: FullDocument;
   wallClockTime?: string;
+  epoch?: string;
+  seq?: number;
 }
 
+// Messaggi di controllo del websocket-server (risposte a subscribe/replay)
+interface ControlMessage {
+  type: 'subscribed' | 'unsubscribed' | 'replayed' | 'error' | string;
+  complete?: boolean;
+  count?: number;
+  error?: string;
+}
+
+// Frame con più eventi consecutivi, inviato dopo il comando {"action": "batch"}
+interface BatchMessage {
+  type: 'batch';
+  epoch: string;
+  fromSeq: number;
+  toSeq: number;
+  count: number;
+  messages: EventData[];
+}
+
+const REPLAY_BACKLOG_SIZE = 10;
+
 const WebSocketContext = createContext<FullDocument[]>([]);
 
 export function useEventFeed() {
@@ -58,6 +80,7 @@ export function Providers({ children }: { children: React.ReactNode }) {
   const wsRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const reconnectAttemptsRef = useRef(0);
+  const lastSequenceRef = useRef<{ epoch: string; seq: number } | null>(null);
 
   const connectWebSocket = useCallback(() => {
     
@@ -79,23 +102,69 @@ export function Providers({ children }: { children: React.ReactNode }) {
         console.log('✅ Connessione WebSocket aperta con successo');
         setConnectionStatus('connected');
         reconnectAttemptsRef.current = 0; 
+
+        // Gli eventi già in coda sul server arrivano uniti in un unico frame (burst, replay)
+        ws.send(JSON.stringify({ action: 'batch', enabled: true }));
+
+        // Alla riconnessione si recuperano dalla memoria del server i messaggi persi;
+        // alla prima connessione si chiedono solo gli ultimi eventi
+        const lastSequence = lastSequenceRef.current;
+        ws.send(JSON.stringify(lastSequence
+          ? { action: 'replay', afterSeq: lastSequence.seq, epoch: lastSequence.epoch }
+          : { action: 'replay', limit: REPLAY_BACKLOG_SIZE }));
+      };
+
+      const handleEventMessage = (rawMessage: EventData) => {
+        if (rawMessage.epoch && typeof rawMessage.seq === 'number') {
+          lastSequenceRef.current = { epoch: rawMessage.epoch, seq: rawMessage.seq };
+        }
+        
+        if (rawMessage.fullDocument) {
+          console.log('✨ Aggiornamento eventi con:', rawMessage.fullDocument);
+          setEvents(prevEvents => {
+            const existingIndex = prevEvents.findIndex(event => event._id === rawMessage.fullDocument!._id);
+            if (existingIndex !== -1) {
+              // Gli update contengono solo i campi modificati: si uniscono al documento già noto.
+              // Un insert già presente è invece un duplicato (replay dopo il riavvio del server).
+              if (rawMessage.operationType !== 'update') {
+                return prevEvents;
+              }
+              const mergedEvents = [...prevEvents];
+              mergedEvents[existingIndex] = { ...prevEvents[existingIndex], ...rawMessage.fullDocument! };
+              return mergedEvents;
+            }
+            const newEvents = [rawMessage.fullDocument!, ...prevEvents].slice(0, REPLAY_BACKLOG_SIZE);
+            console.log('📊 Eventi totali dopo update:', newEvents.length);
+            return newEvents;
+          });
+        } else {
+          console.warn("⚠️ Messaggio WebSocket ricevuto senza 'fullDocument':", rawMessage);
+        }
       };
 
       ws.onmessage = (message) => {
         console.log('📨 Messaggio ricevuto via WebSocket:', message.data);
         try {
-          const rawMessage: EventData = JSON.parse(message.data);
-          
-          if (rawMessage.fullDocument) {
-            console.log('✨ Aggiornamento eventi con:', rawMessage.fullDocument);
-            setEvents(prevEvents => {
-              const newEvents = [rawMessage.fullDocument!, ...prevEvents].slice(0, 10);
-              console.log('📊 Eventi totali dopo update:', newEvents.length);
-              return newEvents;
-            });
-          } else {
-            console.warn("⚠️ Messaggio WebSocket ricevuto senza 'fullDocument':", rawMessage);
+          const parsedMessage = JSON.parse(message.data);
+
+          // Più eventi consecutivi uniti dal server in un unico frame
+          if (parsedMessage.type === 'batch') {
+            const batchMessage: BatchMessage = parsedMessage;
+            batchMessage.messages.forEach(handleEventMessage);
+            return;
+          }
+
+          if (parsedMessage.type && !parsedMessage.fullDocument) {
+            const controlMessage: ControlMessage = parsedMessage;
+            if (controlMessage.type === 'replayed' && controlMessage.complete === false) {
+              console.warn(`⚠️ Replay incompleto: ${controlMessage.count} eventi recuperati, alcuni potrebbero mancare.`);
+            } else if (controlMessage.type === 'error') {
+              console.error('❌ Errore dal WebSocket server:', controlMessage.error);
+            }
+            return;
           }
+
+          handleEventMessage(parsedMessage);
         } catch (e) {
           console.error("❌ Errore durante il parsing del messaggio JSON:", e);
         }
@@ -0,0 +1,197 @@
+import hre from "hardhat";
+import fs from "fs";
+import { Address, Hash, parseEther, parseEventLogs, TransactionReceipt } from "viem";
+import { time } from "@nomicfoundation/hardhat-network-helpers";
+import { deployMockVRFAndContracts } from "./deployWithMock";
+
+/**
+ * Generatore di carico per il benchmark end-to-end
+ * (backend-event-listener/benchmarks/e2e_pipeline.py). Richiede un nodo locale con
+ * automine già avviato (`npx hardhat node` o `anvil`) e si configura con variabili
+ * d'ambiente, perché `hardhat run` non inoltra argomenti allo script:
+ *
+ *   BENCH_MODE=deploy BENCH_DEPLOYMENT_FILE=/tmp/deployment.json \
+ *     npx hardhat run --network localhost scripts/benchmarkLoad.ts
+ *   BENCH_MODE=load BENCH_DEPLOYMENT_FILE=/tmp/deployment.json BENCH_MINTS=200 BENCH_LISTINGS=50 \
+ *     BENCH_BIDS=100 BENCH_TRANSFERS=100 npx hardhat run --network localhost scripts/benchmarkLoad.ts
+ *
+ * In modalità load ogni transazione che emette eventi monitorati dal listener viene
+ * stampata come riga `BENCH_TX {"hash", "kind", "block", "minedAtMs"}`; con l'automine
+ * l'invio ritorna quando il blocco è già stato prodotto, quindi minedAtMs è l'istante di
+ * inclusione nella catena. L'ultima riga è `BENCH_DONE {...}`.
+ */
+
+function envInt(name: string, defaultValue: number): number {
+  const value = process.env[name];
+  return value === undefined || value === "" ? defaultValue : parseInt(value, 10);
+}
+
+// Deploy di registry, NFT, marketplace e mock VRF; gli indirizzi vengono salvati per la fase di carico
+async function deploy(deploymentFile: string) {
+  const deployment = await deployMockVRFAndContracts();
+  const publicClient = await hre.viem.getPublicClient();
+  const result = {
+    chainId: await publicClient.getChainId(),
+    blockNumber: Number(await publicClient.getBlockNumber()),
+    registry: deployment.registry.address,
+    nft: deployment.nft.address,
+    marketplace: deployment.marketplace.address,
+    vrfMock: deployment.vrfMock.address,
+  };
+  fs.writeFileSync(deploymentFile, JSON.stringify(result, null, 2));
+  console.log(`📄 Deployment salvato in ${deploymentFile}`);
+}
+
+async function load(deploymentFile: string) {
+  const deployment = JSON.parse(fs.readFileSync(deploymentFile, "utf8"));
+  const mints = envInt("BENCH_MINTS", 100);
+  const listings = envInt("BENCH_LISTINGS", 25);
+  const bids = envInt("BENCH_BIDS", 50);
+  const bidsPerAuction = Math.max(1, envInt("BENCH_BIDS_PER_AUCTION", 5));
+  const transfers = envInt("BENCH_TRANSFERS", 50);
+  const copiesPerContent = Math.max(1, envInt("BENCH_COPIES_PER_CONTENT", 50));
+  const txPerSecond = envInt("BENCH_TX_PER_SECOND", 0); // 0 = il più velocemente possibile
+  const auctions = bids > 0 ? Math.ceil(bids / bidsPerAuction) : 0;
+
+  if (listings + auctions > mints) {
+    throw new Error(`Servono almeno ${listings + auctions} mint per ${listings} vendite e ${auctions} aste (BENCH_MINTS=${mints})`);
+  }
+
+  const publicClient = await hre.viem.getPublicClient();
+  const wallets = await hre.viem.getWalletClients();
+  const owner = wallets[0].account;
+  const participants = wallets.slice(1, 1 + envInt("BENCH_ACCOUNTS", 8)).map((wallet) => wallet.account);
+  if (participants.length < 2) {
+    throw new Error("Servono almeno 3 account sbloccati sul nodo (owner + 2 partecipanti)");
+  }
+
+  const registry = await hre.viem.getContractAt("ScientificContentRegistry", deployment.registry as Address);
+  const nft = await hre.viem.getContractAt("ScientificContentNFT", deployment.nft as Address);
+  const marketplace = await hre.viem.getContractAt("DnAContentMarketplace", deployment.marketplace as Address);
+  const vrfMock = await hre.viem.getContractAt("MockVRFCoordinatorV2Plus", deployment.vrfMock as Address);
+
+  const startedAt = Date.now();
+  const counts: Record<string, number> = {};
+  let sentTransactions = 0;
+
+  // Invia una transazione e, se `kind` è indicato, la registra come attesa dal listener
+  async function send(kind: string | null, write: () => Promise<Hash>): Promise<TransactionReceipt> {
+    if (txPerSecond > 0) {
+      const wait = startedAt + (sentTransactions * 1000) / txPerSecond - Date.now();
+      if (wait > 0) await new Promise((resolve) => setTimeout(resolve, wait));
+    }
+    const hash = await write();
+    sentTransactions++;
+    const minedAtMs = Date.now();
+    const receipt = await publicClient.waitForTransactionReceipt({ hash });
+    if (receipt.status !== "success") {
+      throw new Error(`Transazione ${kind ?? "di servizio"} ${hash} annullata`);
+    }
+    if (kind) {
+      counts[kind] = (counts[kind] ?? 0) + 1;
+      console.log(`BENCH_TX ${JSON.stringify({ hash, kind, block: Number(receipt.blockNumber), minedAtMs })}`);
+    }
+    return receipt;
+  }
+
+  const nextParticipant = (index: number, exclude?: Address) => {
+    const candidate = participants[index % participants.length];
+    return candidate.address === exclude ? participants[(index + 1) % participants.length] : candidate;
+  };
+
+  // 1. Contenuti (registry, non monitorato) e mint con fulfillment del mock VRF
+  const mintPrice = parseEther("0.01");
+  const tokenOwners = new Map<bigint, (typeof participants)[number]>();
+  const tokenIds: bigint[] = [];
+  for (let contentIndex = 0; contentIndex * copiesPerContent < mints; contentIndex++) {
+    await send(null, () => registry.write.registerContent(
+      [`Benchmark ${startedAt} #${contentIndex}`, `Contenuto di benchmark ${contentIndex}`, BigInt(copiesPerContent), `ipfs://bench${startedAt}/${contentIndex}`, mintPrice],
+      { account: owner }
+    ));
+  }
+  const firstContentId = (await registry.read.nextContentId()) - BigInt(Math.ceil(mints / copiesPerContent));
+  for (let i = 0; i < mints; i++) {
+    const minter = nextParticipant(i);
+    const contentId = firstContentId + BigInt(Math.floor(i / copiesPerContent));
+    const requestReceipt = await send(null, () => nft.write.mintNFT(
+      [contentId, `ipfs://bench${startedAt}/${contentId}/${i}.json`], { account: minter, value: mintPrice }
+    ));
+    const [request] = parseEventLogs({ abi: vrfMock.abi, logs: requestReceipt.logs, eventName: "RandomWordsRequested" });
+    const mintReceipt = await send("mint", () => vrfMock.write.fulfillRandomWords([request.args.requestId], { account: owner }));
+    const [minted] = parseEventLogs({ abi: nft.abi, logs: mintReceipt.logs, eventName: "NFTMinted" });
+    if (!minted) {
+      throw new Error(`Mint ${i} non riuscito (MintingFailed)`);
+    }
+    tokenOwners.set(minted.args.tokenId, minter);
+    tokenIds.push(minted.args.tokenId);
+  }
+
+  // Approvazione del marketplace (ApprovalForAll) per tutti i partecipanti
+  if (listings + auctions > 0) {
+    for (const participant of participants) {
+      await send("approval", () => nft.write.setApprovalForAll([marketplace.address, true], { account: participant }));
+    }
+  }
+
+  // 2. Vendite a prezzo fisso: messa in vendita e acquisto da un altro account (fee di protocollo)
+  const salePrice = parseEther("0.02");
+  for (let i = 0; i < listings; i++) {
+    const tokenId = tokenIds[i];
+    const seller = tokenOwners.get(tokenId)!;
+    await send("listing", () => marketplace.write.listNFTForSale([tokenId, salePrice], { account: seller }));
+    const buyer = nextParticipant(i + 1, seller.address);
+    await send("purchase", () => marketplace.write.purchaseNFT([tokenId], { account: buyer, value: salePrice }));
+    tokenOwners.set(tokenId, buyer);
+  }
+
+  // 3. Aste: avvio, offerte crescenti da account diversi dal venditore, chiusura dopo la scadenza
+  const minBid = parseEther("0.01");
+  const bidStep = parseEther("0.001");
+  const auctionTokenIds = tokenIds.slice(listings, listings + auctions);
+  for (const tokenId of auctionTokenIds) {
+    await send("auction_start", () => marketplace.write.startAuction([tokenId, minBid, 15n * 60n], { account: tokenOwners.get(tokenId)! }));
+  }
+  for (let i = 0; i < bids; i++) {
+    const tokenId = auctionTokenIds[i % auctions];
+    const round = Math.floor(i / auctions);
+    const bidder = nextParticipant(i + round, tokenOwners.get(tokenId)!.address);
+    await send("bid", () => marketplace.write.placeBid([tokenId], { account: bidder, value: minBid + bidStep * BigInt(round) }));
+  }
+  if (auctions > 0) {
+    await time.increase(15 * 60 + 1);
+    for (const tokenId of auctionTokenIds) {
+      const receipt = await send("auction_end", () => marketplace.write.endAuction([tokenId], { account: owner }));
+      const [ended] = parseEventLogs({ abi: marketplace.abi, logs: receipt.logs, eventName: "AuctionEnded" });
+      const winner = participants.find((participant) => participant.address.toLowerCase() === ended.args.winner.toLowerCase());
+      if (winner) tokenOwners.set(tokenId, winner);
+    }
+  }
+
+  // 4. Trasferimenti diretti tra partecipanti
+  for (let i = 0; i < transfers; i++) {
+    const tokenId = tokenIds[i % tokenIds.length];
+    const from = tokenOwners.get(tokenId)!;
+    const to = nextParticipant(i + 1, from.address);
+    await send("transfer", () => nft.write.transferFrom([from.address, to.address, tokenId], { account: from }));
+    tokenOwners.set(tokenId, to);
+  }
+
+  console.log(`BENCH_DONE ${JSON.stringify({ counts, seconds: (Date.now() - startedAt) / 1000 })}`);
+}
+
+async function main() {
+  const deploymentFile = process.env.BENCH_DEPLOYMENT_FILE || "benchmark-deployment.json";
+  const mode = process.env.BENCH_MODE || "load";
+  if (mode === "deploy") {
+    await deploy(deploymentFile);
+  } else if (mode === "load") {
+    await load(deploymentFile);
+  } else {
+    throw new Error(`BENCH_MODE non valido: ${mode} (deploy | load)`);
+  }
+}
+
+main().catch((error) => {
+  console.error("\n❌ Benchmark load failed:", error);
+  process.exitCode = 1;
+});
@@ -43,6 +43,8 @@ const networkConfig: NetworkConfigs = {
     subscriptionId: 1n, // ID di sottoscrizione di esempio per Hardhat
   },
 };
+// Nodo locale avviato a parte (`npx hardhat node` o anvil), usato da scripts/benchmarkLoad.ts
+networkConfig.localhost = networkConfig.hardhat;
 
 // Interfaccia per il risultato del deployment
 interface DeploymentResult {
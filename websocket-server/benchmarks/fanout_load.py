@@ -0,0 +1,228 @@
+# websocket-server/benchmarks/fanout_load.py
+"""
+Test di carico del fan-out: un publisher Redis, il server WebSocket (redis_listener +
+FanoutHub di main.py) e molti client simulati, di cui una parte volutamente lenta.
+
+Riporta messaggi ricevuti dai client veloci, latenza publish -> ricezione, profondità
+massima delle code, messaggi scartati, client lenti disconnessi e RSS del processo
+(server e client girano nello stesso processo: l'RSS è un limite superiore).
+Su loopback i buffer TCP del kernel assorbono diversi MB per connessione prima che
+un client lento faccia crescere la sua coda: servono messaggi grandi o numerosi.
+
+Con un redis-server locale:
+
+    python benchmarks/fanout_load.py --clients 1000 --slow-clients 50
+
+Senza Redis (richiede `pip install fakeredis`):
+
+    python benchmarks/fanout_load.py --fakeredis --clients 1000 --slow-clients 50
+
+Micro-batching sotto burst (frame e CPU a confronto, con e senza compressione):
+
+    python benchmarks/fanout_load.py --fakeredis --slow-clients 0 --burst 50 --compression none
+    python benchmarks/fanout_load.py --fakeredis --slow-clients 0 --burst 50 --compression none --batching --forward-window-ms 5
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+parser.add_argument("--fakeredis", action="store_true", help="usa fakeredis al posto di un redis-server")
+parser.add_argument("--clients", type=int, default=500, help="client WebSocket totali")
+parser.add_argument("--slow-clients", type=int, default=25, help="quanti client leggono lentamente")
+parser.add_argument("--slow-delay", type=float, default=0.2, help="pausa (s) dei client lenti dopo ogni messaggio")
+parser.add_argument("--messages", type=int, default=1000, help="messaggi pubblicati su Redis")
+parser.add_argument("--rate", type=float, default=200, help="messaggi pubblicati al secondo")
+parser.add_argument("--payload-bytes", type=int, default=1024, help="dimensione approssimativa del messaggio")
+parser.add_argument("--queue-size", type=int, default=256, help="CLIENT_SEND_QUEUE_SIZE")
+parser.add_argument("--policy", default="drop_oldest", help="SLOW_CONSUMER_POLICY")
+parser.add_argument("--max-drops", type=int, default=0, help="SLOW_CONSUMER_MAX_DROPS")
+parser.add_argument("--burst", type=int, default=1, help="messaggi pubblicati insieme a ogni intervallo (bulk mint, fine asta)")
+parser.add_argument("--batching", action="store_true", help="i client chiedono i frame batch ({\"action\": \"batch\"})")
+parser.add_argument("--forward-window-ms", type=float, default=0, help="REDIS_FORWARD_WINDOW_MS")
+parser.add_argument("--compression", choices=["deflate", "none"], default="deflate", help="WS_COMPRESSION")
+args = parser.parse_args()
+
+# main.py legge le variabili d'ambiente all'import: vanno impostate prima
+os.environ["REDIS_URL"] = args.redis_url
+os.environ["REDIS_CHANNEL"] = "benchmark_events"
+os.environ["CLIENT_SEND_QUEUE_SIZE"] = str(args.queue_size)
+os.environ["SLOW_CONSUMER_POLICY"] = args.policy
+os.environ["SLOW_CONSUMER_MAX_DROPS"] = str(args.max_drops)
+os.environ["REDIS_FORWARD_WINDOW_MS"] = str(args.forward_window_ms)
+os.environ["WS_COMPRESSION"] = args.compression
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websockets
+
+import main as server
+
+if args.fakeredis:
+    import fakeredis
+
+    fake_server = fakeredis.FakeServer()
+
+    def fake_from_url(url, health_check_interval=0, **kwargs):
+        # fakeredis non risponde ai PING di health check in modalità pub/sub
+        return fakeredis.FakeAsyncRedis(server=fake_server, **kwargs)
+
+    server.redis.from_url = fake_from_url
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def rss_megabytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_client(uri, slow, stats, connected):
+    compression = None if args.compression == "none" else "deflate"
+    async with websockets.connect(uri, max_queue=16, compression=compression) as websocket:
+        if args.batching:
+            await websocket.send(json.dumps({"action": "batch", "enabled": True}))
+        connected.release()
+        try:
+            async for frame in websocket:
+                stats["frames_received"] += 1
+                data = json.loads(frame)
+                if data.get("type") == "batch":
+                    messages = data["messages"]
+                elif "fullDocument" in data:
+                    messages = [data]
+                else:
+                    continue  # risposta a un comando
+                for message in messages:
+                    sent_at = message["fullDocument"]["bench_sent_at"]
+                    if slow:
+                        stats["slow_received"] += 1
+                    else:
+                        stats["fast_received"] += 1
+                        stats["latencies_ms"].append((time.time() - sent_at) * 1000)
+                if slow:
+                    await asyncio.sleep(args.slow_delay)
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def main():
+    raise_fd_limit()
+    stats = {"fast_received": 0, "slow_received": 0, "frames_received": 0, "latencies_ms": []}
+    peaks = {"max_queue_depth": 0, "queued_messages": 0, "rss_mb": rss_megabytes()}
+
+    async with websockets.serve(server.websocket_handler, "127.0.0.1", 0, write_limit=server.WS_WRITE_LIMIT,
+                                compression=None if args.compression == "none" else "deflate") as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        listener_task = asyncio.create_task(server.redis_listener())
+
+        connected = asyncio.Semaphore(0)
+        client_tasks = [
+            asyncio.create_task(run_client(f"ws://127.0.0.1:{port}", index < args.slow_clients, stats, connected))
+            for index in range(args.clients)
+        ]
+        for _ in range(args.clients):
+            await connected.acquire()
+        await asyncio.sleep(1)  # attende la sottoscrizione al canale Redis
+
+        publisher = server.redis.from_url(args.redis_url, decode_responses=True)
+        # Padding non comprimibile: con permessage-deflate (attivo di default) un padding
+        # ripetitivo si ridurrebbe a pochi byte e nessun client risulterebbe lento
+        padding = base64.b64encode(os.urandom(max(0, args.payload_bytes - 200) * 3 // 4)).decode()
+
+        async def sample_metrics():
+            while True:
+                metrics = server.fanout_hub.metrics()
+                peaks["max_queue_depth"] = max(peaks["max_queue_depth"], metrics["max_queue_depth"])
+                peaks["queued_messages"] = max(peaks["queued_messages"], metrics["queued_messages"])
+                peaks["rss_mb"] = max(peaks["rss_mb"], rss_megabytes())
+                await asyncio.sleep(0.1)
+
+        sampler_task = asyncio.create_task(sample_metrics())
+        started_at = time.monotonic()
+        cpu_started_at = cpu_seconds()
+        for first_index in range(0, args.messages, args.burst):
+            async with publisher.pipeline(transaction=False) as pipe:
+                for index in range(first_index, min(args.messages, first_index + args.burst)):
+                    payload = {"operationType": "insert", "fullDocument": {
+                        "event": "BenchEvent", "index": index, "bench_sent_at": time.time(), "padding": padding}}
+                    pipe.publish(server.REDIS_CHANNEL, json.dumps(payload))
+                await pipe.execute()
+            await asyncio.sleep(max(0.0, started_at + (first_index + args.burst) / args.rate - time.monotonic()))
+        publish_seconds = time.monotonic() - started_at
+
+        # Attende che i client veloci ricevano tutto (o al massimo 30s)
+        fast_clients = args.clients - args.slow_clients
+        deadline = time.monotonic() + 30
+        while stats["fast_received"] < fast_clients * args.messages and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        cpu_used = cpu_seconds() - cpu_started_at
+        sampler_task.cancel()
+        listener_task.cancel()
+        for task in client_tasks:
+            task.cancel()
+        await asyncio.gather(*client_tasks, return_exceptions=True)
+        await publisher.aclose()
+
+    latencies = stats["latencies_ms"]
+    result = {
+        "benchmark": "websocket_fanout_load",
+        "redis": "fakeredis" if args.fakeredis else args.redis_url,
+        "clients": args.clients,
+        "slow_clients": args.slow_clients,
+        "messages": args.messages,
+        "publish_rate": args.rate,
+        "publish_seconds": round(publish_seconds, 2),
+        "policy": args.policy,
+        "queue_size": args.queue_size,
+        "burst": args.burst,
+        "batching": args.batching,
+        "forward_window_ms": args.forward_window_ms,
+        "compression": args.compression,
+        "frames_received": stats["frames_received"],
+        "messages_per_frame": round((stats["fast_received"] + stats["slow_received"]) / max(1, stats["frames_received"]), 2),
+        "cpu_seconds": round(cpu_used, 2),
+        "fast_delivery_ratio": round(stats["fast_received"] / max(1, fast_clients * args.messages), 4),
+        "slow_messages_received": stats["slow_received"],
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "max": round(max(latencies), 2),
+        } if latencies else None,
+        "peak_max_queue_depth": peaks["max_queue_depth"],
+        "peak_queued_messages": peaks["queued_messages"],
+        "peak_rss_mb": peaks["rss_mb"],
+        "hub": server.fanout_hub.metrics(),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+# websocket-server/benchmarks/redis_listener_cpu.py
+"""
+Confronta il consumo del canale Redis prima e dopo il passaggio alla lettura bloccante:
+
+  poll     ciclo precedente: get_message() non bloccante + asyncio.sleep(0.01)
+  listen   redis_listener() di main.py: get_message(timeout=...) bloccante e
+           inoltro a gruppi di tutti i messaggi già arrivati
+
+Per ciascuna modalità misura la CPU consumata dal processo a canale inattivo e il
+tempo necessario a inoltrare una raffica di messaggi pubblicati tutti insieme a un
+client WebSocket simulato (che non introduce latenza di rete).
+
+    python benchmarks/redis_listener_cpu.py --redis-url redis://localhost:6379/0
+    python benchmarks/redis_listener_cpu.py --fakeredis
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+parser.add_argument("--fakeredis", action="store_true", help="usa fakeredis al posto di un redis-server")
+parser.add_argument("--idle-seconds", type=float, default=10, help="durata della misura a canale inattivo")
+parser.add_argument("--burst", type=int, default=5000, help="messaggi pubblicati nella raffica")
+parser.add_argument("--payload-bytes", type=int, default=512, help="dimensione approssimativa del messaggio")
+args = parser.parse_args()
+
+# main.py legge le variabili d'ambiente all'import: vanno impostate prima
+os.environ["REDIS_URL"] = args.redis_url
+os.environ["REDIS_CHANNEL"] = "benchmark_events"
+os.environ["CLIENT_SEND_QUEUE_SIZE"] = str(args.burst)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as server
+
+if args.fakeredis:
+    import fakeredis
+
+    fake_server = fakeredis.FakeServer()
+
+    def fake_from_url(url, health_check_interval=0, **kwargs):
+        # fakeredis non risponde ai PING di health check in modalità pub/sub
+        return fakeredis.FakeAsyncRedis(server=fake_server, **kwargs)
+
+    server.redis.from_url = fake_from_url
+
+
+class CountingWebSocket:
+    """Client WebSocket simulato: conta i messaggi e segnala l'arrivo dell'ultimo."""
+
+    remote_address = ("benchmark", 0)
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.all_received = asyncio.Event()
+
+    async def send(self, message):
+        self.received += 1
+        if self.received >= self.expected:
+            self.all_received.set()
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+async def polling_listener():
+    """Il ciclo di consumo precedente, riprodotto per confronto."""
+    redis_client = server.redis.from_url(args.redis_url, encoding="utf-8", decode_responses=True)
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(server.REDIS_CHANNEL)
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True)
+        if message and message['type'] == 'message':
+            server.fanout_hub.publish(message['data'])
+        await asyncio.sleep(0.01)
+
+
+async def measure(mode):
+    listener = polling_listener if mode == "poll" else server.redis_listener
+    listener_task = asyncio.create_task(listener())
+    await asyncio.sleep(1)  # connessione e sottoscrizione
+
+    cpu_started, wall_started = time.process_time(), time.monotonic()
+    await asyncio.sleep(args.idle_seconds)
+    idle_cpu_percent = 100 * (time.process_time() - cpu_started) / (time.monotonic() - wall_started)
+
+    websocket = CountingWebSocket(args.burst)
+    server.fanout_hub.register(websocket)
+    publisher = server.redis.from_url(args.redis_url, decode_responses=True)
+    payload = json.dumps({"operationType": "insert", "fullDocument": {"event": "BenchEvent", "padding": "x" * args.payload_bytes}})
+
+    started_at = time.monotonic()
+    async with publisher.pipeline(transaction=False) as pipe:
+        for _ in range(args.burst):
+            pipe.publish(server.REDIS_CHANNEL, payload)
+        await pipe.execute()
+    try:
+        await asyncio.wait_for(websocket.all_received.wait(), timeout=120)
+    except asyncio.TimeoutError:
+        pass
+    burst_seconds = time.monotonic() - started_at
+
+    await server.fanout_hub.unregister(websocket)
+    await publisher.aclose()
+    listener_task.cancel()
+    await asyncio.gather(listener_task, return_exceptions=True)
+    return {
+        "idle_cpu_percent": round(idle_cpu_percent, 3),
+        "burst_messages_delivered": websocket.received,
+        "burst_seconds": round(burst_seconds, 3),
+        "burst_messages_per_second": round(websocket.received / burst_seconds),
+    }
+
+
+async def main():
+    result = {
+        "benchmark": "redis_listener_idle_cpu_and_burst",
+        "redis": "fakeredis" if args.fakeredis else args.redis_url,
+        "idle_seconds": args.idle_seconds,
+        "burst": args.burst,
+        "poll": await measure("poll"),
+        "listen": await measure("listen"),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
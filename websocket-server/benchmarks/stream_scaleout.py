@@ -0,0 +1,135 @@
+# websocket-server/benchmarks/stream_scaleout.py
+"""
+Verifica di perdita messaggi con più istanze websocket-server (processi separati).
+
+Avvia `--instances` processi main.py sullo stesso Redis, collega a ciascuno un client
+che si comporta come il frontend (alla riconnessione chiede il replay dall'ultima
+sequenza ricevuta), pubblica `--messages` messaggi con il trasporto scelto e a metà
+riavvia la prima istanza restando giù per `--downtime` secondi. Alla fine riporta,
+per ogni istanza, quanti messaggi distinti il suo client ha ricevuto e quanti ne ha persi.
+
+    redis-server &
+    python benchmarks/stream_scaleout.py --transport stream
+    python benchmarks/stream_scaleout.py --transport pubsub
+
+Senza redis-server, con fakeredis >= 2.26 (server TCP in-process):
+
+    python benchmarks/stream_scaleout.py --fakeredis-tcp --transport stream
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+parser.add_argument("--fakeredis-tcp", action="store_true", help="avvia un server fakeredis TCP su una porta locale")
+parser.add_argument("--transport", choices=["stream", "pubsub"], default="stream")
+parser.add_argument("--instances", type=int, default=2)
+parser.add_argument("--base-port", type=int, default=18080)
+parser.add_argument("--messages", type=int, default=600)
+parser.add_argument("--rate", type=float, default=100, help="messaggi pubblicati al secondo")
+parser.add_argument("--downtime", type=float, default=1.5, help="secondi di inattività della prima istanza")
+parser.add_argument("--stream-key", default="benchmark_events_stream")
+args = parser.parse_args()
+
+import redis.asyncio as redis
+import websockets
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_fake_redis():
+    from fakeredis import TcpFakeServer
+
+    fake_server = TcpFakeServer(("127.0.0.1", 16379), server_type="redis")
+    threading.Thread(target=fake_server.serve_forever, daemon=True).start()
+    return "redis://127.0.0.1:16379/0"
+
+
+def start_instance(index, redis_url):
+    environment = dict(os.environ, PORT=str(args.base_port + index), REDIS_URL=redis_url,
+                       REDIS_TRANSPORT=args.transport, REDIS_STREAM_KEY=args.stream_key,
+                       REDIS_CHANNEL="benchmark_events", LOG_LEVEL="WARNING")
+    return subprocess.Popen([sys.executable, "main.py"], cwd=SERVER_DIR, env=environment)
+
+
+async def run_client(index, received, stop):
+    """Client che si riconnette e riprende con replay, come il provider del frontend."""
+    last_sequence = None
+    while not stop.is_set():
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{args.base_port + index}") as websocket:
+                command = {"action": "replay"}
+                if last_sequence:
+                    command.update(afterSeq=last_sequence[1], epoch=last_sequence[0])
+                await websocket.send(json.dumps(command))
+                async for raw_message in websocket:
+                    message = json.loads(raw_message)
+                    if "fullDocument" in message:
+                        received[index].add(message["fullDocument"]["bench_id"])
+                        last_sequence = (message["epoch"], message["seq"])
+        except (OSError, websockets.ConnectionClosed, asyncio.TimeoutError):
+            await asyncio.sleep(0.2)
+
+
+async def main():
+    redis_url = start_fake_redis() if args.fakeredis_tcp else args.redis_url
+    publisher = redis.from_url(redis_url, decode_responses=True)
+    await publisher.delete(args.stream_key)
+
+    instances = [start_instance(index, redis_url) for index in range(args.instances)]
+    received = [set() for _ in range(args.instances)]
+    stop = asyncio.Event()
+    await asyncio.sleep(2)  # avvio dei processi
+    client_tasks = [asyncio.create_task(run_client(index, received, stop)) for index in range(args.instances)]
+    await asyncio.sleep(1)
+
+    restart_at = args.messages // 2
+    started_at = time.monotonic()
+    for bench_id in range(args.messages):
+        if bench_id == restart_at:
+            instances[0].terminate()
+            instances[0].wait()
+            restart_deadline = time.monotonic() + args.downtime
+        if bench_id > restart_at and instances[0].poll() is not None and time.monotonic() >= restart_deadline:
+            instances[0] = start_instance(0, redis_url)
+        payload = json.dumps({"operationType": "insert", "eventName": "BenchEvent",
+                              "fullDocument": {"_id": str(bench_id), "bench_id": bench_id}})
+        if args.transport == "stream":
+            await publisher.xadd(args.stream_key, {"data": payload}, maxlen=10000, approximate=True)
+        else:
+            await publisher.publish("benchmark_events", payload)
+        await asyncio.sleep(max(0.0, started_at + (bench_id + 1) / args.rate - time.monotonic()))
+
+    await asyncio.sleep(3)  # consegna degli ultimi messaggi e dei replay
+    stop.set()
+    for task in client_tasks:
+        task.cancel()
+    await asyncio.gather(*client_tasks, return_exceptions=True)
+    for process in instances:
+        process.terminate()
+        process.wait()
+    await publisher.aclose()
+
+    result = {
+        "benchmark": "websocket_scaleout_message_loss",
+        "transport": args.transport,
+        "instances": args.instances,
+        "messages": args.messages,
+        "restarted_instance_downtime_seconds": args.downtime,
+        "per_instance": [
+            {"instance": index, "received": len(ids), "lost": args.messages - len(ids), "restarted": index == 0}
+            for index, ids in enumerate(received)
+        ],
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
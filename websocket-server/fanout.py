@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+
+from websockets.exceptions import ConnectionClosed
+
+from metrics import SEND_LATENCY
+from replay import ReplayBuffer, pack_batch, parse_sequence
+from subscriptions import MessageRouting, SubscriptionIndex
+
+
+logger = logging.getLogger(__name__)
+
+# Politiche per i client lenti quando la coda di invio è piena:
+# drop_oldest  scarta il messaggio più vecchio in coda (il client riceve i più recenti)
+# drop_newest  scarta il messaggio appena arrivato
+# close        chiude subito la connessione (il frontend si riconnette)
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "drop_newest", "close")
+
+# Codice di chiusura WebSocket "Try Again Later"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class ClientConnection:
+    """Connessione WebSocket con la sua coda di invio limitata e il task che la svuota."""
+
+    def __init__(self, websocket, max_queue_size):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.closing = False
+        self.sender_task = None
+        # Messaggi massimi per frame: 1 = un frame per messaggio (client che non hanno chiesto i batch)
+        self.batch_max_messages = 1
+
+
+class FanoutHub:
+    """
+    Inoltra ogni messaggio a tutti i client connessi tramite code di invio per-client.
+
+    `publish()` non attende mai la rete: accoda il messaggio (lo stesso oggetto stringa è
+    condiviso da tutte le code) e ogni client ha un task che lo invia con i tempi della
+    propria connessione. Un client lento riempie solo la sua coda, limitata a
+    `max_queue_size` messaggi; superato il limite si applica `slow_consumer_policy` e,
+    se `max_drops_before_close` > 0, il client viene chiuso dopo quel numero di scarti.
+
+    I client che hanno inviato un filtro di sottoscrizione ricevono solo i messaggi
+    corrispondenti, individuati tramite `SubscriptionIndex`; gli altri ricevono tutto.
+    Ogni messaggio riceve un numero di sequenza e gli ultimi `replay_buffer_size` restano
+    in memoria per `replay_to()` (backlog alla connessione e ripresa dopo una disconnessione).
+    Per i client che lo chiedono (`set_batching()`) i messaggi già in coda al momento
+    dell'invio vengono uniti in un unico frame "batch" di al massimo `batch_max_messages`.
+    """
+
+    def __init__(self, max_queue_size=256, slow_consumer_policy="drop_oldest", max_drops_before_close=0, replay_buffer_size=0,
+                 batch_max_messages=50):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Politica client lenti non valida: '{slow_consumer_policy}'. Valori ammessi: {', '.join(SLOW_CONSUMER_POLICIES)}")
+        self.max_queue_size = max(1, max_queue_size)
+        self.slow_consumer_policy = slow_consumer_policy
+        self.max_drops_before_close = max_drops_before_close
+        self.batch_max_messages = max(1, batch_max_messages)
+        self._clients = {}
+        self._subscriptions = SubscriptionIndex()
+        self.replay_buffer = ReplayBuffer(replay_buffer_size)
+        self.published_count = 0
+        self.dropped_count = 0
+        self.evicted_count = 0
+        self.batch_frames_count = 0
+        self.batched_messages_count = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def register(self, websocket):
+        """Registra una nuova connessione e avvia il suo task di invio."""
+        client = ClientConnection(websocket, self.max_queue_size)
+        client.sender_task = asyncio.create_task(self._send_queued_messages(client))
+        self._clients[websocket] = client
+        self._subscriptions.add(client)
+        return client
+
+    def set_filter(self, websocket, subscription_filter):
+        """Imposta (o azzera, con None) il filtro di sottoscrizione della connessione."""
+        client = self._clients.get(websocket)
+        if client is not None:
+            self._subscriptions.set_filter(client, subscription_filter)
+
+    def set_batching(self, websocket, enabled):
+        """Attiva o disattiva per la connessione l'unione dei messaggi in coda in frame "batch"."""
+        client = self._clients.get(websocket)
+        if client is not None:
+            client.batch_max_messages = self.batch_max_messages if enabled else 1
+
+    def send_to(self, websocket, message):
+        """Accoda un messaggio per una sola connessione (es. conferme del protocollo)."""
+        client = self._clients.get(websocket)
+        return client is not None and self._enqueue(client, message)
+
+    async def unregister(self, websocket):
+        """Rimuove la connessione e ferma il suo task di invio."""
+        client = self._clients.pop(websocket, None)
+        if client is None:
+            return
+        self._subscriptions.remove(client)
+        client.sender_task.cancel()
+        try:
+            await client.sender_task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    def publish(self, message):
+        """Accoda il messaggio per tutti i client. Restituisce il numero di client a cui è stato accodato."""
+        return self.publish_many([message])
+
+    def publish_many(self, messages):
+        """
+        Accoda un gruppo di messaggi (nell'ordine dato) per i client interessati.
+        Restituisce il numero di client che hanno ricevuto almeno un messaggio in coda.
+        """
+        self.published_count += len(messages)
+        messages = [self.replay_buffer.append(message) for message in messages]
+        enqueued_clients = set()
+        if not len(self._subscriptions):
+            # Nessun filtro attivo: ogni messaggio va a tutti, senza analizzarne il contenuto
+            for client in list(self._clients.values()):
+                for message in messages:
+                    if self._enqueue(client, message):
+                        enqueued_clients.add(client)
+            return len(enqueued_clients)
+
+        for message in messages:
+            recipients = self._subscriptions.unfiltered | self._subscriptions.match(MessageRouting.from_message(message))
+            for client in recipients:
+                if self._enqueue(client, message):
+                    enqueued_clients.add(client)
+        return len(enqueued_clients)
+
+    def replay_to(self, websocket, after_seq=None, epoch=None, limit=None):
+        """
+        Accoda per la connessione i messaggi dell'anello successivi a `after_seq` (tutto il
+        backlog se assente), rispettando il filtro del client e lo spazio libero nella sua
+        coda. Restituisce il riepilogo da inviare al client; `complete` è False se una parte
+        dell'intervallo richiesto non è più in memoria o non è stata accodata.
+        """
+        client = self._clients.get(websocket)
+        if client is None:
+            return None
+        messages, complete = self.replay_buffer.since(after_seq, epoch)
+        subscription_filter = self._subscriptions.filter_of(client)
+        if subscription_filter is not None:
+            messages = [(seq, message) for seq, message in messages
+                        if subscription_filter.matches(MessageRouting.from_message(message))]
+        # Un posto resta libero per il riepilogo "replayed" accodato subito dopo
+        capacity = max(0, client.queue.maxsize - client.queue.qsize() - 1)
+        if limit is not None:
+            capacity = min(capacity, max(0, limit))
+        if len(messages) > capacity:
+            messages = messages[len(messages) - capacity:] if capacity else []
+            complete = False
+        for _, message in messages:
+            client.queue.put_nowait(message)
+        return {
+            "type": "replayed",
+            "epoch": self.replay_buffer.epoch,
+            "count": len(messages),
+            "fromSeq": messages[0][0] if messages else None,
+            "toSeq": messages[-1][0] if messages else None,
+            "lastSeq": self.replay_buffer.last_seq,
+            "complete": complete,
+        }
+
+    def _enqueue(self, client, message):
+        if client.closing:
+            return False
+        try:
+            client.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.slow_consumer_policy == "close":
+            self._evict(client, "coda di invio piena")
+            return False
+
+        client.dropped_count += 1
+        self.dropped_count += 1
+        enqueued = False
+        if self.slow_consumer_policy == "drop_oldest":
+            client.queue.get_nowait()
+            client.queue.put_nowait(message)
+            enqueued = True
+
+        if self.max_drops_before_close and client.dropped_count >= self.max_drops_before_close:
+            self._evict(client, f"{client.dropped_count} messaggi scartati")
+            return False
+        return enqueued
+
+    def _evict(self, client, reason):
+        """Chiude un client lento liberando subito la memoria della sua coda."""
+        client.closing = True
+        self.evicted_count += 1
+        self._clients.pop(client.websocket, None)
+        self._subscriptions.remove(client)
+        client.sender_task.cancel()
+        while not client.queue.empty():
+            client.queue.get_nowait()
+        logger.warning(f"Client lento {client.websocket.remote_address} disconnesso ({reason}). Client attivi: {len(self._clients)}")
+        asyncio.create_task(client.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="slow consumer"))
+
+    def _coalesce_queued(self, client, first_message):
+        """
+        Unisce a `first_message` i messaggi con sequenza già presenti in coda, fino a
+        `client.batch_max_messages`. Restituisce (frame, numero di messaggi, messaggio estratto
+        dalla coda da inviare dopo il frame o None): un messaggio di controllo interrompe il
+        batch per conservare l'ordine.
+        """
+        first_sequence = parse_sequence(first_message)
+        if first_sequence is None:
+            return first_message, 1, None
+        epoch, first_seq = first_sequence
+        messages = [first_message]
+        last_seq = first_seq
+        pending = None
+        while len(messages) < client.batch_max_messages and not client.queue.empty():
+            message = client.queue.get_nowait()
+            sequence = parse_sequence(message)
+            if sequence is None or sequence[0] != epoch:
+                pending = message
+                break
+            messages.append(message)
+            last_seq = sequence[1]
+        if len(messages) == 1:
+            return first_message, 1, pending
+        self.batch_frames_count += 1
+        self.batched_messages_count += len(messages)
+        return pack_batch(epoch, first_seq, last_seq, messages), len(messages), pending
+
+    async def _send_queued_messages(self, client):
+        pending = None
+        try:
+            while True:
+                message = pending if pending is not None else await client.queue.get()
+                pending = None
+                message_count = 1
+                if client.batch_max_messages > 1 and not client.queue.empty():
+                    message, message_count, pending = self._coalesce_queued(client, message)
+                started_at = time.perf_counter()
+                await client.websocket.send(message)
+                SEND_LATENCY.observe(time.perf_counter() - started_at)
+                client.sent_count += message_count
+        except ConnectionClosed:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Errore nell'invio al client {client.websocket.remote_address}: {e}")
+
+    def metrics(self):
+        """Istantanea di code e scarti per log e monitoraggio."""
+        queue_depths = [client.queue.qsize() for client in self._clients.values()]
+        return {
+            "clients": len(queue_depths),
+            "filtered_clients": len(self._subscriptions),
+            "queued_messages": sum(queue_depths),
+            "max_queue_depth": max(queue_depths, default=0),
+            "published_messages": self.published_count,
+            "dropped_messages": self.dropped_count,
+            "evicted_clients": self.evicted_count,
+            "replay_buffer_messages": len(self.replay_buffer),
+            "last_seq": self.replay_buffer.last_seq,
+            "batch_frames": self.batch_frames_count,
+            "batched_messages": self.batched_messages_count,
+        }
@@ -2,11 +2,16 @@ import asyncio
 import os
 import json
 import logging
+import time
 import urllib.parse
 import redis.asyncio as redis
 import websockets
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 
+from fanout import FanoutHub
+from metrics import BROADCAST_LATENCY, REDIS_MESSAGES, register_fanout_metrics, serve_metrics
+from subscriptions import SubscriptionError, SubscriptionFilter
+
 
 logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "INFO").upper(),
@@ -32,12 +37,76 @@ else:
 REDIS_CHANNEL = os.getenv("REDIS_CHANNEL", "blockchain_events")
 logger.info(f"Canale Redis impostato su '{REDIS_CHANNEL}'.")
 
+# "pubsub" (canale REDIS_CHANNEL) oppure "stream": lettura dello Stream REDIS_STREAM_KEY con un
+# cursore proprio di questa istanza, senza perdite durante le riconnessioni a Redis.
+REDIS_TRANSPORT = os.getenv("REDIS_TRANSPORT", "pubsub")
+REDIS_STREAM_KEY = os.getenv("REDIS_STREAM_KEY", "blockchain_events_stream")
+logger.info(f"Trasporto Redis: '{REDIS_TRANSPORT}'.")
+
 
 WS_PORT = int(os.getenv("PORT", 8080))
 logger.info(f"Porta WebSocket impostata su {WS_PORT}.")
 
+# Coda di invio per-client: oltre CLIENT_SEND_QUEUE_SIZE messaggi si applica SLOW_CONSUMER_POLICY
+# (drop_oldest, drop_newest o close); con SLOW_CONSUMER_MAX_DROPS > 0 il client viene chiuso dopo tanti scarti.
+CLIENT_SEND_QUEUE_SIZE = int(os.getenv("CLIENT_SEND_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "drop_oldest")
+SLOW_CONSUMER_MAX_DROPS = int(os.getenv("SLOW_CONSUMER_MAX_DROPS", "1000"))
+# Byte massimi nel buffer di scrittura del socket prima che l'invio al client attenda
+WS_WRITE_LIMIT = int(os.getenv("WS_WRITE_LIMIT", "65536"))
+# Dimensione massima dei messaggi inviati dai client (solo comandi di sottoscrizione)
+WS_MAX_CLIENT_MESSAGE_BYTES = int(os.getenv("WS_MAX_CLIENT_MESSAGE_BYTES", "65536"))
+FANOUT_METRICS_LOG_INTERVAL_SECONDS = float(os.getenv("FANOUT_METRICS_LOG_INTERVAL_SECONDS", "60"))
+logger.info(f"Coda di invio per client: {CLIENT_SEND_QUEUE_SIZE} messaggi, politica client lenti: '{SLOW_CONSUMER_POLICY}' "
+            f"(chiusura dopo {SLOW_CONSUMER_MAX_DROPS} scarti).")
+
+
+# Lettura del canale Redis: attesa bloccante con timeout e inoltro a gruppi di al massimo REDIS_FORWARD_BATCH_SIZE messaggi
+REDIS_READ_TIMEOUT_SECONDS = float(os.getenv("REDIS_READ_TIMEOUT_SECONDS", "30"))
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+REDIS_FORWARD_BATCH_SIZE = int(os.getenv("REDIS_FORWARD_BATCH_SIZE", "500"))
+# Finestra di micro-batching: dopo il primo messaggio si attendono fino a REDIS_FORWARD_WINDOW_MS
+# millisecondi (o REDIS_FORWARD_BATCH_SIZE messaggi) prima dell'inoltro. 0 = solo i messaggi già arrivati.
+REDIS_FORWARD_WINDOW_MS = float(os.getenv("REDIS_FORWARD_WINDOW_MS", "0"))
+
+# Messaggi massimi per frame "batch" per i client che li richiedono ({"action": "batch", "enabled": true})
+WS_BATCH_MAX_MESSAGES = int(os.getenv("WS_BATCH_MAX_MESSAGES", "50"))
+# Compressione permessage-deflate ("deflate", default di websockets) o "none": la compressione
+# riduce i byte in uscita (molto per i frame batch) ma costa CPU per ogni client.
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", "deflate")
+if WS_COMPRESSION not in ("deflate", "none"):
+    logger.warning(f"WS_COMPRESSION non valido: '{WS_COMPRESSION}'. Valori ammessi: deflate, none. Uso 'deflate'.")
+    WS_COMPRESSION = "deflate"
+
+# Ultimi messaggi tenuti in memoria (con numero di sequenza) per il replay alla connessione
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "200"))
+
+# Metriche Prometheus in GET http://METRICS_HOST:METRICS_PORT/metrics (porta separata da quella
+# pubblica dei WebSocket); 0 = disattivate
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9091"))
+
+
+fanout_hub = FanoutHub(CLIENT_SEND_QUEUE_SIZE, SLOW_CONSUMER_POLICY, SLOW_CONSUMER_MAX_DROPS, REPLAY_BUFFER_SIZE,
+                       WS_BATCH_MAX_MESSAGES)
+register_fanout_metrics(fanout_hub)
+
+def forward_redis_messages(messages):
+    """Accoda per tutti i client WebSocket i messaggi ricevuti da Redis in un singolo risveglio."""
+    if not messages:
+        return
+    if logger.isEnabledFor(logging.DEBUG):
+        for data in messages:
+            logger.debug("Ricevuto messaggio da Redis: %s...", data[:200])
+    if not len(fanout_hub):
+        # I messaggi entrano comunque nell'anello di replay per i client che si connetteranno
+        logger.debug("Nessun client WebSocket connesso nel momento della ricezione di %s messaggi Redis.", len(messages))
+    REDIS_MESSAGES.inc(len(messages))
+    started_at = time.perf_counter()
+    enqueued_count = fanout_hub.publish_many(messages)
+    BROADCAST_LATENCY.observe(time.perf_counter() - started_at)
+    logger.debug("Inoltrati %s messaggi da Redis a %s client.", len(messages), enqueued_count)
 
-websocket_clients = set()
 
 async def redis_listener():
     if not REDIS_ENABLED:
@@ -54,7 +123,8 @@ async def redis_listener():
         try:
             if redis_client is None:
                 logger.info("Tentativo di connessione a Redis...")
-                redis_client = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+                redis_client = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True,
+                                              health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS)
                 await redis_client.ping()
                 logger.info("Connessione a Redis riuscita per il listener.")
 
@@ -64,21 +134,24 @@ async def redis_listener():
                 logger.info(f"Iscritto al canale Redis '{REDIS_CHANNEL}'. In attesa di messaggi...")
             
             while True:
-                message = await pubsub.get_message(ignore_subscribe_messages=True) 
-                
-                if message and message['type'] == 'message':
-                    data = message['data']
-                    logger.info(f"Ricevuto messaggio da Redis: {data[:200]}...")
-
-                    logger.info(f"Tentativo di inoltrare il messaggio. Client attivi: {len(websocket_clients)}")
-                    if not websocket_clients:
-                        logger.warning("Nessun client WebSocket connesso nel momento della ricezione del messaggio Redis.")
-                    
-                    
-                    websockets.broadcast(websocket_clients, data)
-                    logger.info(f"Messaggio inoltrato a {len(websocket_clients)} client.")
-                
-                await asyncio.sleep(0.01)
+                # Attesa bloccante (nessun polling): il task si risveglia solo quando arriva un messaggio
+                # o alla scadenza del timeout, usata dal client per i PING di health check.
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=REDIS_READ_TIMEOUT_SECONDS)
+                if message is None:
+                    continue
+
+                # A ogni risveglio si svuotano tutti i messaggi già ricevuti e, con la finestra
+                # di micro-batching, quelli che arrivano entro REDIS_FORWARD_WINDOW_MS
+                batch = [message]
+                window_deadline = time.monotonic() + REDIS_FORWARD_WINDOW_MS / 1000
+                while len(batch) < REDIS_FORWARD_BATCH_SIZE:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True,
+                                                       timeout=max(0.0, window_deadline - time.monotonic()))
+                    if message is None:
+                        break
+                    batch.append(message)
+
+                forward_redis_messages([message['data'] for message in batch if message['type'] == 'message'])
 
         except redis.ConnectionError as e:
             logger.error(f"Errore di connessione/comunicazione a Redis: {e}. Riprovo tra 5 secondi...", exc_info=True)
@@ -97,20 +170,150 @@ async def redis_listener():
             pubsub = None 
             await asyncio.sleep(5)
 
+async def redis_stream_listener():
+    """
+    Legge lo Stream Redis con XREAD bloccante e un cursore locale a questa istanza.
+
+    All'avvio l'anello di replay viene riempito con gli ultimi REPLAY_BUFFER_SIZE messaggi
+    dello Stream e la lettura prosegue dall'ultimo ID ricevuto: dopo una riconnessione a
+    Redis si riparte esattamente da lì. Ogni istanza riceve tutti i messaggi (nessun
+    consumer group), quindi più istanze possono stare dietro lo stesso load balancer.
+    Lo Stream è limitato da REDIS_STREAM_MAXLEN lato produttore: un'istanza ferma più a
+    lungo di quanto basta a riempirlo perde i messaggi più vecchi.
+    """
+    if not REDIS_ENABLED:
+        logger.warning("Redis non configurato. Listener disabilitato.")
+
+        await asyncio.Event().wait()
+        return
+
+    logger.info(f"Avvio del listener Redis Stream su '{REDIS_STREAM_KEY}'...")
+    redis_client = None
+    last_id = None
+
+    while True:
+        try:
+            if redis_client is None:
+                logger.info("Tentativo di connessione a Redis...")
+                redis_client = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+                await redis_client.ping()
+                logger.info("Connessione a Redis riuscita per il listener dello Stream.")
+
+            if last_id is None:
+                recent_entries = list(reversed(await redis_client.xrevrange(REDIS_STREAM_KEY, count=REPLAY_BUFFER_SIZE))) if REPLAY_BUFFER_SIZE else []
+                if recent_entries:
+                    forward_redis_messages([fields["data"] for _, fields in recent_entries if "data" in fields])
+                    last_id = recent_entries[-1][0]
+                else:
+                    # Con REPLAY_BUFFER_SIZE=0 o Stream vuoto si parte dall'ultimo ID esistente
+                    last_entries = await redis_client.xrevrange(REDIS_STREAM_KEY, count=1)
+                    last_id = last_entries[0][0] if last_entries else "0-0"
+                logger.info(f"Lettura dello Stream '{REDIS_STREAM_KEY}' dall'ID {last_id} ({len(recent_entries)} messaggi nel replay).")
+
+            response = await redis_client.xread({REDIS_STREAM_KEY: last_id}, count=REDIS_FORWARD_BATCH_SIZE,
+                                                block=int(REDIS_READ_TIMEOUT_SECONDS * 1000))
+            entries = [entry for _, stream_entries in response for entry in stream_entries]
+            if not entries:
+                continue
+            # Finestra di micro-batching: si leggono altri messaggi fino alla scadenza della finestra
+            window_deadline = time.monotonic() + REDIS_FORWARD_WINDOW_MS / 1000
+            while len(entries) < REDIS_FORWARD_BATCH_SIZE:
+                remaining_ms = int((window_deadline - time.monotonic()) * 1000)
+                if remaining_ms < 1:
+                    break
+                response = await redis_client.xread({REDIS_STREAM_KEY: entries[-1][0]},
+                                                    count=REDIS_FORWARD_BATCH_SIZE - len(entries), block=remaining_ms)
+                more_entries = [entry for _, stream_entries in response for entry in stream_entries]
+                if not more_entries:
+                    break
+                entries.extend(more_entries)
+            last_id = entries[-1][0]
+            forward_redis_messages([fields["data"] for _, fields in entries if "data" in fields])
+
+        except redis.ConnectionError as e:
+            logger.error(f"Errore di connessione/comunicazione a Redis: {e}. Riprovo tra 5 secondi dall'ID {last_id}...", exc_info=True)
+            if redis_client:
+                try: await redis_client.close()
+                except Exception: pass
+            redis_client = None
+            await asyncio.sleep(5)
+        except Exception as e:
+            logger.error(f"Errore critico nel redis_stream_listener: {e}. Riprovo tra 5 secondi...", exc_info=True)
+            if redis_client:
+                try: await redis_client.close()
+                except Exception: pass
+            redis_client = None
+            await asyncio.sleep(5)
+
+def handle_client_command(websocket, raw_message):
+    """
+    Gestisce i comandi inviati dal client:
+      {"action": "subscribe", "filter": {"events": [...], "tokenIds": [...], "contracts": [...], "addresses": [...]}}
+      {"action": "unsubscribe"}  -> torna a ricevere tutti i messaggi
+      {"action": "replay", "afterSeq": 41, "epoch": "...", "limit": 50}
+                                 -> messaggi recenti dalla memoria (tutti i campi sono opzionali)
+      {"action": "batch", "enabled": true}
+                                 -> i messaggi in coda arrivano uniti in frame
+                                    {"type": "batch", "fromSeq", "toSeq", "messages": [...]}
+    Senza alcun comando il client riceve tutti i messaggi, come in precedenza.
+    Ogni messaggio inoltrato contiene "epoch" e "seq": per riprendere dopo una disconnessione
+    il client invia l'ultima coppia ricevuta; se la risposta "replayed" ha complete=false
+    l'intervallo mancante non è più in memoria e va recuperato dallo storico.
+    """
+    try:
+        command = json.loads(raw_message)
+        if not isinstance(command, dict):
+            raise SubscriptionError("Il comando deve essere un oggetto JSON.")
+        action = command.get("action")
+        if action == "subscribe":
+            subscription_filter = SubscriptionFilter.from_client(command.get("filter", {}))
+            fanout_hub.set_filter(websocket, subscription_filter)
+            logger.info(f"Client {websocket.remote_address} sottoscritto con filtro {subscription_filter.to_dict()}.")
+            response = {"type": "subscribed", "filter": subscription_filter.to_dict()}
+        elif action == "unsubscribe":
+            fanout_hub.set_filter(websocket, None)
+            response = {"type": "unsubscribed"}
+        elif action == "replay":
+            after_seq, limit = command.get("afterSeq"), command.get("limit")
+            for name, value in (("afterSeq", after_seq), ("limit", limit)):
+                if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+                    raise SubscriptionError(f"'{name}' deve essere un intero.")
+            response = fanout_hub.replay_to(websocket, after_seq, command.get("epoch"), limit)
+            logger.info(f"Replay per il client {websocket.remote_address}: {response}")
+        elif action == "batch":
+            enabled = command.get("enabled", True)
+            if not isinstance(enabled, bool):
+                raise SubscriptionError("'enabled' deve essere un booleano.")
+            fanout_hub.set_batching(websocket, enabled)
+            response = {"type": "batching", "enabled": enabled, "maxMessages": WS_BATCH_MAX_MESSAGES if enabled else 1}
+        else:
+            raise SubscriptionError(f"Azione non supportata: {action!r}")
+    except ValueError as e:  # JSON non valido o SubscriptionError
+        logger.warning(f"Comando non valido dal client {websocket.remote_address}: {e}")
+        response = {"type": "error", "error": str(e)}
+    fanout_hub.send_to(websocket, json.dumps(response))
+
 async def websocket_handler(websocket):
     
-    logger.info(f"Nuova connessione WebSocket da: {websocket.remote_address}. Client attivi prima dell'aggiunta: {len(websocket_clients)}")
-    websocket_clients.add(websocket)
-    logger.info(f"Client {websocket.remote_address} aggiunto. Client attivi totali: {len(websocket_clients)}")
+    logger.info(f"Nuova connessione WebSocket da: {websocket.remote_address}. Client attivi prima dell'aggiunta: {len(fanout_hub)}")
+    fanout_hub.register(websocket)
+    logger.info(f"Client {websocket.remote_address} aggiunto. Client attivi totali: {len(fanout_hub)}")
     try:
         
-        await websocket.wait_closed()
+        async for raw_message in websocket:
+            handle_client_command(websocket, raw_message)
+    except (ConnectionClosedOK, ConnectionClosedError):
+        pass
     except Exception as e:
         logger.error(f"Errore nel websocket_handler per {websocket.remote_address}: {e}")
     finally:
-        if websocket in websocket_clients:
-            websocket_clients.remove(websocket)
-            logger.info(f"Client {websocket.remote_address} rimosso. Client attivi: {len(websocket_clients)}")
+        await fanout_hub.unregister(websocket)
+        logger.info(f"Client {websocket.remote_address} rimosso. Client attivi: {len(fanout_hub)}")
+
+async def log_fanout_metrics():
+    while True:
+        await asyncio.sleep(FANOUT_METRICS_LOG_INTERVAL_SECONDS)
+        logger.info(f"Metriche fan-out: {fanout_hub.metrics()}")
 
 async def main():
     logger.info("Avvio del WebSocket server e del listener Redis.")
@@ -120,14 +323,22 @@ async def main():
         websocket_handler, 
         "0.0.0.0", 
         WS_PORT, 
+        write_limit=WS_WRITE_LIMIT,
+        max_size=WS_MAX_CLIENT_MESSAGE_BYTES,
+        compression=None if WS_COMPRESSION == "none" else "deflate",
     ):
-        logger.info(f"Server WebSocket avviato con successo su porta {WS_PORT}")
+        logger.info(f"Server WebSocket avviato con successo su porta {WS_PORT} (compressione: {WS_COMPRESSION})")
         
 
-        redis_task = asyncio.create_task(redis_listener())
+        listener = redis_stream_listener if REDIS_TRANSPORT == "stream" else redis_listener
+        redis_task = asyncio.create_task(listener())
         logger.info("Task per il listener Redis creato.")
-        
-        await asyncio.Future()
+
+        metrics_task = asyncio.create_task(log_fanout_metrics())
+        metrics_server_task = asyncio.create_task(serve_metrics(METRICS_HOST, METRICS_PORT)) if METRICS_PORT else None
+
+        # I task girano finché il server è attivo: un errore non gestito in uno di essi arresta il server
+        await asyncio.gather(*(task for task in (redis_task, metrics_task, metrics_server_task) if task is not None))
 
 if __name__ == "__main__":
     logger.info("Script main.py per websocket-server avviato.")
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+logger = logging.getLogger(__name__)
+
+# Metriche Prometheus esposte da serve_metrics su /metrics. I contatori del fan-out restano
+# in FanoutHub (usati anche dai log periodici) e vengono letti al momento dello scrape.
+REDIS_MESSAGES = Counter(
+    "ws_redis_messages_total", "Messaggi ricevuti da Redis e inoltrati al fan-out")
+BROADCAST_LATENCY = Histogram(
+    "ws_broadcast_seconds", "Durata dell'inoltro di un gruppo di messaggi Redis alle code di tutti i client",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+SEND_LATENCY = Histogram(
+    "ws_send_seconds", "Durata dell'invio di un frame a un client (attesa compresa se il socket è pieno)",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+
+class FanoutCollector:
+    """Espone come metriche l'istantanea di FanoutHub.metrics() (client, code, scarti, batch)."""
+
+    GAUGES = {
+        "clients": ("ws_connected_clients", "Client WebSocket connessi"),
+        "filtered_clients": ("ws_filtered_clients", "Client con un filtro di sottoscrizione"),
+        "queued_messages": ("ws_queued_messages", "Messaggi in attesa nelle code di invio"),
+        "max_queue_depth": ("ws_max_queue_depth", "Coda di invio più lunga"),
+        "replay_buffer_messages": ("ws_replay_buffer_messages", "Messaggi nell'anello di replay"),
+    }
+    COUNTERS = {
+        "published_messages": ("ws_published_messages", "Messaggi pubblicati nel fan-out"),
+        "dropped_messages": ("ws_dropped_messages", "Messaggi scartati per client lenti"),
+        "evicted_clients": ("ws_evicted_clients", "Client lenti disconnessi"),
+        "batch_frames": ("ws_batch_frames", "Frame batch inviati"),
+        "batched_messages": ("ws_batched_messages", "Messaggi inviati dentro frame batch"),
+    }
+
+    def __init__(self, fanout_hub):
+        self.fanout_hub = fanout_hub
+
+    def collect(self):
+        snapshot = self.fanout_hub.metrics()
+        for key, (name, documentation) in self.GAUGES.items():
+            yield GaugeMetricFamily(name, documentation, value=snapshot[key])
+        for key, (name, documentation) in self.COUNTERS.items():
+            yield CounterMetricFamily(name, documentation, value=snapshot[key])
+
+
+def register_fanout_metrics(fanout_hub):
+    REGISTRY.register(FanoutCollector(fanout_hub))
+
+
+async def _handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass  # intestazioni ignorate
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE_LATEST, generate_latest()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host, port):
+    """
+    Espone le metriche in GET /metrics con un server HTTP minimo nello stesso event loop
+    del fan-out: lo stato di FanoutHub viene letto senza thread concorrenti.
+    """
+    try:
+        server = await asyncio.start_server(_handle_metrics_request, host, port)
+    except OSError as e:
+        logger.error(f"Impossibile esporre le metriche su {host}:{port}: {e}")
+        return
+    logger.info(f"Metriche esposte su http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
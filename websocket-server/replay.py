@@ -0,0 +1,79 @@
+import re
+import uuid
+from collections import deque
+from itertools import islice
+
+
+def stamp_sequence(message, epoch, seq):
+    """
+    Aggiunge `epoch` e `seq` in testa all'oggetto JSON del messaggio senza rianalizzarlo.
+    I client esistenti ignorano i campi sconosciuti; i messaggi che non sono oggetti
+    JSON vengono inoltrati invariati.
+    """
+    if not message.startswith("{"):
+        return message
+    body = message[1:].lstrip()
+    separator = "" if body.startswith("}") else ", "
+    return f'{{"epoch": "{epoch}", "seq": {seq}{separator}{body}'
+
+
+# Prefisso scritto da stamp_sequence: permette di leggere epoca e sequenza senza json.loads
+_SEQUENCE_PATTERN = re.compile(r'\{"epoch": "([0-9a-f]+)", "seq": (\d+)')
+
+
+def parse_sequence(message):
+    """(epoch, seq) di un messaggio marcato da stamp_sequence, None per gli altri (es. messaggi di controllo)."""
+    match = _SEQUENCE_PATTERN.match(message)
+    return (match.group(1), int(match.group(2))) if match else None
+
+
+def pack_batch(epoch, from_seq, to_seq, messages):
+    """
+    Unisce messaggi già marcati in un unico frame JSON
+    {"type": "batch", "epoch", "fromSeq", "toSeq", "count", "messages": [...]}
+    per concatenazione, senza rianalizzarli. Ogni elemento conserva il proprio "seq".
+    """
+    return (f'{{"type": "batch", "epoch": "{epoch}", "fromSeq": {from_seq}, "toSeq": {to_seq}, '
+            f'"count": {len(messages)}, "messages": [{", ".join(messages)}]}}')
+
+
+class ReplayBuffer:
+    """
+    Anello limitato degli ultimi `max_size` messaggi pubblicati, con numero di sequenza.
+
+    Le sequenze sono locali all'istanza: `epoch` cambia a ogni avvio, così un client che
+    riprende con la sequenza di un'altra istanza (o di prima di un riavvio) riceve l'intero
+    backlog disponibile invece di un intervallo sbagliato.
+    """
+
+    def __init__(self, max_size=500):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.last_seq = 0
+        self._messages = deque(maxlen=max(0, max_size))
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def first_seq(self):
+        return self._messages[0][0] if self._messages else self.last_seq + 1
+
+    def append(self, message):
+        """Assegna la sequenza successiva, salva il messaggio e restituisce la versione marcata."""
+        self.last_seq += 1
+        stamped = stamp_sequence(message, self.epoch, self.last_seq)
+        if self._messages.maxlen:
+            self._messages.append((self.last_seq, stamped))
+        return stamped
+
+    def since(self, after_seq=None, epoch=None):
+        """
+        Messaggi con sequenza > `after_seq`, più un flag che indica se l'intervallo richiesto
+        è completo. Senza `after_seq` (o con un'epoca diversa) restituisce tutto il backlog:
+        in quel caso è completo solo se l'anello non ha ancora scartato messaggi.
+        """
+        if after_seq is None or epoch != self.epoch or after_seq > self.last_seq:
+            return list(self._messages), self.first_seq == 1
+        first_seq = self.first_seq
+        # Le sequenze nell'anello sono contigue: si salta direttamente alla posizione richiesta
+        return list(islice(self._messages, max(0, after_seq + 1 - first_seq), None)), after_seq + 1 >= first_seq
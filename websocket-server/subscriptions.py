@@ -0,0 +1,196 @@
+import json
+
+
+# Dimensioni di un filtro, dalla più selettiva alla meno selettiva: un filtro viene
+# indicizzato solo sulla prima dimensione non vuota, le altre si verificano sui candidati.
+FILTER_DIMENSIONS = ("tokenIds", "addresses", "contracts", "events")
+
+# Numero massimo di valori per un singolo filtro (protegge memoria e indice)
+MAX_FILTER_VALUES = 200
+
+
+class SubscriptionError(ValueError):
+    """Messaggio di sottoscrizione non valido inviato da un client."""
+
+
+def _normalize_address(value):
+    if not isinstance(value, str) or not value.startswith("0x") or len(value) != 42:
+        raise SubscriptionError(f"Indirizzo non valido nel filtro: {value!r}")
+    return value.lower()
+
+
+def _normalize_token_id(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit():
+        raise SubscriptionError(f"tokenId non valido nel filtro: {value!r}")
+    return str(int(value))
+
+
+def _normalize_event_name(value):
+    if not isinstance(value, str) or not value:
+        raise SubscriptionError(f"Nome evento non valido nel filtro: {value!r}")
+    return value
+
+
+_NORMALIZERS = {
+    "tokenIds": _normalize_token_id,
+    "addresses": _normalize_address,
+    "contracts": _normalize_address,
+    "events": _normalize_event_name,
+}
+
+
+class SubscriptionFilter:
+    """
+    Filtro di un client: per ogni dimensione un insieme di valori ammessi (vuoto = qualsiasi).
+    Un messaggio corrisponde se soddisfa tutte le dimensioni specificate (AND tra dimensioni,
+    OR tra i valori della stessa dimensione).
+    """
+
+    __slots__ = FILTER_DIMENSIONS
+
+    def __init__(self, tokenIds=(), addresses=(), contracts=(), events=()):
+        self.tokenIds = frozenset(tokenIds)
+        self.addresses = frozenset(addresses)
+        self.contracts = frozenset(contracts)
+        self.events = frozenset(events)
+
+    @classmethod
+    def from_client(cls, raw_filter):
+        """Valida e normalizza il campo `filter` inviato dal client."""
+        if not isinstance(raw_filter, dict):
+            raise SubscriptionError("Il campo 'filter' deve essere un oggetto.")
+        unknown = set(raw_filter) - set(FILTER_DIMENSIONS)
+        if unknown:
+            raise SubscriptionError(f"Campi del filtro non supportati: {', '.join(sorted(unknown))}")
+        values = {}
+        for dimension in FILTER_DIMENSIONS:
+            raw_values = raw_filter.get(dimension) or []
+            if not isinstance(raw_values, list):
+                raw_values = [raw_values]
+            if len(raw_values) > MAX_FILTER_VALUES:
+                raise SubscriptionError(f"Troppi valori per '{dimension}' (massimo {MAX_FILTER_VALUES}).")
+            values[dimension] = [_NORMALIZERS[dimension](value) for value in raw_values]
+        return cls(**values)
+
+    def is_empty(self):
+        return not any(getattr(self, dimension) for dimension in FILTER_DIMENSIONS)
+
+    def index_keys(self):
+        """Chiavi (dimensione, valore) sotto cui indicizzare il filtro."""
+        for dimension in FILTER_DIMENSIONS:
+            values = getattr(self, dimension)
+            if values:
+                return [(dimension, value) for value in values]
+        return []
+
+    def matches(self, routing):
+        return ((not self.tokenIds or routing.token_id in self.tokenIds)
+                and (not self.addresses or not self.addresses.isdisjoint(routing.addresses))
+                and (not self.contracts or routing.contract in self.contracts)
+                and (not self.events or routing.event in self.events))
+
+    def to_dict(self):
+        return {dimension: sorted(getattr(self, dimension)) for dimension in FILTER_DIMENSIONS}
+
+
+class MessageRouting:
+    """Chiavi di instradamento estratte una sola volta da un messaggio Redis."""
+
+    __slots__ = ("event", "token_id", "contract", "addresses")
+
+    def __init__(self, event=None, token_id=None, contract=None, addresses=frozenset()):
+        self.event = event
+        self.token_id = token_id
+        self.contract = contract
+        self.addresses = addresses
+
+    @classmethod
+    def from_message(cls, data):
+        """Estrae evento, tokenId, contratto emittente e indirizzi coinvolti dal messaggio JSON."""
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return cls()
+        if not isinstance(message, dict):
+            return cls()
+        document = message.get("fullDocument") or {}
+        args = document.get("args") if isinstance(document.get("args"), dict) else {}
+
+        token_id = args.get("tokenId", document.get("tokenId"))
+        if isinstance(token_id, dict):  # es. {"$numberLong": "12"}
+            token_id = next(iter(token_id.values()), None)
+        contract = document.get("address")
+        addresses = frozenset(
+            value.lower() for value in args.values()
+            if isinstance(value, str) and value.startswith("0x") and len(value) == 42
+        )
+        return cls(
+            event=message.get("eventName") or document.get("event"),
+            token_id=str(token_id) if token_id is not None else None,
+            contract=contract.lower() if isinstance(contract, str) else None,
+            addresses=addresses,
+        )
+
+    def index_keys(self):
+        keys = [("events", self.event)]
+        if self.token_id is not None:
+            keys.append(("tokenIds", self.token_id))
+        if self.contract is not None:
+            keys.append(("contracts", self.contract))
+        keys.extend(("addresses", address) for address in self.addresses)
+        return keys
+
+
+class SubscriptionIndex:
+    """
+    Indice chiave di filtro -> connessioni. I client senza filtro ricevono tutto;
+    per gli altri `match()` visita solo i candidati indicizzati sotto le chiavi del
+    messaggio, quindi il costo dipende dalle corrispondenze e non dal numero di client.
+    """
+
+    def __init__(self):
+        self._filters = {}
+        self._index = {}
+        self.unfiltered = set()
+
+    def __len__(self):
+        return len(self._filters)
+
+    def add(self, subscriber):
+        self.unfiltered.add(subscriber)
+
+    def remove(self, subscriber):
+        self.unfiltered.discard(subscriber)
+        subscription_filter = self._filters.pop(subscriber, None)
+        if subscription_filter is None:
+            return
+        for key in subscription_filter.index_keys():
+            subscribers = self._index.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._index[key]
+
+    def filter_of(self, subscriber):
+        return self._filters.get(subscriber)
+
+    def set_filter(self, subscriber, subscription_filter):
+        """Sostituisce il filtro del client (un filtro vuoto equivale a ricevere tutto)."""
+        self.remove(subscriber)
+        if subscription_filter is None or subscription_filter.is_empty():
+            self.unfiltered.add(subscriber)
+            return
+        self._filters[subscriber] = subscription_filter
+        for key in subscription_filter.index_keys():
+            self._index.setdefault(key, set()).add(subscriber)
+
+    def match(self, routing):
+        """Client filtrati a cui inviare il messaggio (esclusi quelli senza filtro)."""
+        if not self._filters:
+            return set()
+        candidates = set()
+        for key in routing.index_keys():
+            subscribers = self._index.get(key)
+            if subscribers:
+                candidates.update(subscribers)
+        return {subscriber for subscriber in candidates if self._filters[subscriber].matches(routing)}
@@ -0,0 +1,23 @@
+# websocket-server/tests/conftest.py
+
+import json
+import os
+import sys
+
+# I moduli del server vengono importati come in main.py, dalla cartella del servizio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NFT_ADDRESS = "0x" + "11" * 20
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+
+
+def event_message(event, token_id=None, **args):
+    """Messaggio Redis come pubblicato da mongodb_listener.build_change_message."""
+    if token_id is not None:
+        args["tokenId"] = token_id
+    return json.dumps({
+        "operationType": "insert",
+        "fullDocument": {"_id": f"{event}-{token_id}", "event": event, "address": NFT_ADDRESS, "args": args},
+        "eventName": event,
+    })
@@ -0,0 +1,172 @@
+# websocket-server/tests/test_fanout.py
+
+import asyncio
+import json
+
+import pytest
+
+from conftest import event_message
+from fanout import SLOW_CONSUMER_CLOSE_CODE, FanoutHub
+from subscriptions import SubscriptionFilter
+
+
+class FakeWebSocket:
+    """Connessione finta: registra i frame inviati; con `blocked` l'invio resta in attesa."""
+
+    def __init__(self, blocked=False):
+        self.remote_address = ("127.0.0.1", 0)
+        self.frames = []
+        self.closed_with = None
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send(self, message):
+        await self.unblocked.wait()
+        self.frames.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+    @property
+    def messages(self):
+        """Messaggi ricevuti, con i frame "batch" espansi."""
+        received = []
+        for frame in self.frames:
+            decoded = json.loads(frame)
+            received.extend(decoded["messages"] if decoded.get("type") == "batch" else [decoded])
+        return received
+
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_every_client_receives_every_message_in_order():
+    async def scenario():
+        hub = FanoutHub()
+        websockets = [FakeWebSocket() for _ in range(3)]
+        for websocket in websockets:
+            hub.register(websocket)
+
+        assert hub.publish_many([event_message("Transfer", n) for n in range(4)]) == 3
+        await drain()
+
+        for websocket in websockets:
+            assert [message["seq"] for message in websocket.messages] == [1, 2, 3, 4]
+
+    asyncio.run(scenario())
+
+
+def test_slow_client_keeps_the_newest_messages_without_blocking_others():
+    async def scenario():
+        hub = FanoutHub(max_queue_size=2, slow_consumer_policy="drop_oldest")
+        slow, fast = FakeWebSocket(blocked=True), FakeWebSocket()
+        hub.register(slow)
+        hub.register(fast)
+
+        for n in range(5):
+            hub.publish(event_message("Transfer", n))
+            await drain()
+        assert len(fast.messages) == 5
+
+        slow.unblocked.set()
+        await drain()
+        # Il primo messaggio era già in invio; dei successivi restano gli ultimi due
+        assert [message["seq"] for message in slow.messages] == [1, 4, 5]
+        assert hub.metrics()["dropped_messages"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_close_policy_evicts_a_slow_client():
+    async def scenario():
+        hub = FanoutHub(max_queue_size=1, slow_consumer_policy="close")
+        slow = FakeWebSocket(blocked=True)
+        hub.register(slow)
+
+        for n in range(3):
+            hub.publish(event_message("Transfer", n))
+            await drain()
+
+        assert slow.closed_with == SLOW_CONSUMER_CLOSE_CODE
+        assert len(hub) == 0
+        assert hub.metrics()["evicted_clients"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_filtered_client_receives_only_matching_messages():
+    async def scenario():
+        hub = FanoutHub()
+        filtered, unfiltered = FakeWebSocket(), FakeWebSocket()
+        hub.register(filtered)
+        hub.register(unfiltered)
+        hub.set_filter(filtered, SubscriptionFilter.from_client({"tokenIds": [7]}))
+
+        hub.publish_many([event_message("Transfer", 6), event_message("NewBid", 7), event_message("Transfer", 8)])
+        await drain()
+
+        assert [message["seq"] for message in filtered.messages] == [2]
+        assert len(unfiltered.messages) == 3
+
+    asyncio.run(scenario())
+
+
+def test_replay_after_reconnect_respects_filter_and_cursor():
+    async def scenario():
+        hub = FanoutHub(replay_buffer_size=10)
+        hub.publish_many([event_message("Transfer", n % 2) for n in range(6)])
+        epoch = hub.replay_buffer.epoch
+
+        websocket = FakeWebSocket()
+        hub.register(websocket)
+        hub.set_filter(websocket, SubscriptionFilter.from_client({"tokenIds": [1]}))
+        summary = hub.replay_to(websocket, after_seq=2, epoch=epoch)
+        await drain()
+
+        assert [message["seq"] for message in websocket.messages] == [4, 6]
+        assert (summary["count"], summary["lastSeq"], summary["complete"]) == (2, 6, True)
+
+    asyncio.run(scenario())
+
+
+def test_replay_is_limited_by_the_free_space_in_the_queue():
+    async def scenario():
+        hub = FanoutHub(max_queue_size=3, replay_buffer_size=10)
+        hub.publish_many([event_message("Transfer", n) for n in range(5)])
+
+        websocket = FakeWebSocket(blocked=True)
+        hub.register(websocket)
+        summary = hub.replay_to(websocket)
+
+        # Un posto resta libero per il riepilogo: arrivano i due messaggi più recenti
+        assert (summary["fromSeq"], summary["toSeq"], summary["complete"]) == (4, 5, False)
+
+    asyncio.run(scenario())
+
+
+def test_queued_messages_are_coalesced_into_batch_frames():
+    async def scenario():
+        hub = FanoutHub(batch_max_messages=3)
+        websocket = FakeWebSocket(blocked=True)
+        hub.register(websocket)
+        hub.set_batching(websocket, True)
+        await drain()
+
+        hub.publish_many([event_message("Transfer", n) for n in range(7)])
+        await drain()
+        websocket.unblocked.set()
+        await drain()
+
+        frames = [json.loads(frame) for frame in websocket.frames]
+        assert [frame.get("count", 1) for frame in frames] == [3, 3, 1]
+        assert [message["seq"] for message in websocket.messages] == list(range(1, 8))
+
+    asyncio.run(scenario())
+
+
+def test_unknown_slow_consumer_policy_is_rejected():
+    with pytest.raises(ValueError):
+        FanoutHub(slow_consumer_policy="block")
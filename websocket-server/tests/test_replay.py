@@ -0,0 +1,57 @@
+# websocket-server/tests/test_replay.py
+
+import json
+
+from replay import ReplayBuffer, pack_batch, parse_sequence, stamp_sequence
+
+
+def test_stamped_message_keeps_its_fields():
+    stamped = stamp_sequence('{"eventName": "Transfer"}', "abc123", 5)
+
+    assert json.loads(stamped) == {"epoch": "abc123", "seq": 5, "eventName": "Transfer"}
+    assert parse_sequence(stamped) == ("abc123", 5)
+    assert json.loads(stamp_sequence("{}", "abc123", 1)) == {"epoch": "abc123", "seq": 1}
+    assert stamp_sequence("pong", "abc123", 1) == "pong"
+    assert parse_sequence('{"type": "replayed"}') is None
+
+
+def test_packed_batch_is_valid_json():
+    messages = [stamp_sequence(f'{{"n": {n}}}', "e", n) for n in (3, 4)]
+
+    frame = json.loads(pack_batch("e", 3, 4, messages))
+
+    assert (frame["type"], frame["fromSeq"], frame["toSeq"], frame["count"]) == ("batch", 3, 4, 2)
+    assert [message["n"] for message in frame["messages"]] == [3, 4]
+
+
+def test_resume_from_a_sequence_in_the_ring():
+    buffer = ReplayBuffer(max_size=3)
+    for n in range(1, 6):
+        buffer.append(f'{{"n": {n}}}')
+
+    messages, complete = buffer.since(3, buffer.epoch)
+    assert [seq for seq, _ in messages] == [4, 5]
+    assert complete
+
+    messages, complete = buffer.since(1, buffer.epoch)
+    assert [seq for seq, _ in messages] == [3, 4, 5]
+    assert not complete
+
+
+def test_unknown_epoch_or_no_cursor_returns_the_whole_backlog():
+    buffer = ReplayBuffer(max_size=10)
+    for n in range(1, 4):
+        buffer.append(f'{{"n": {n}}}')
+
+    for after_seq, epoch in ((None, None), (2, "another-instance"), (99, buffer.epoch)):
+        messages, complete = buffer.since(after_seq, epoch)
+        assert [seq for seq, _ in messages] == [1, 2, 3]
+        assert complete
+
+
+def test_disabled_buffer_still_assigns_sequences():
+    buffer = ReplayBuffer(max_size=0)
+
+    assert parse_sequence(buffer.append("{}")) == (buffer.epoch, 1)
+    assert len(buffer) == 0
+    assert buffer.since(0, buffer.epoch) == ([], False)
@@ -0,0 +1,66 @@
+# websocket-server/tests/test_subscriptions.py
+
+import pytest
+
+from conftest import ALICE, BOB, NFT_ADDRESS, event_message
+from subscriptions import MAX_FILTER_VALUES, MessageRouting, SubscriptionError, SubscriptionFilter, SubscriptionIndex
+
+
+def test_filter_values_are_normalized():
+    subscription_filter = SubscriptionFilter.from_client({"tokenIds": [7, "08"], "addresses": ALICE.upper().replace("0X", "0x")})
+
+    assert subscription_filter.tokenIds == {"7", "8"}
+    assert subscription_filter.addresses == {ALICE}
+
+
+@pytest.mark.parametrize("raw_filter", [
+    [],
+    {"unknown": [1]},
+    {"tokenIds": [True]},
+    {"tokenIds": ["-1"]},
+    {"addresses": ["0x1234"]},
+    {"events": [""]},
+    {"tokenIds": list(range(MAX_FILTER_VALUES + 1))},
+])
+def test_invalid_filters_are_rejected(raw_filter):
+    with pytest.raises(SubscriptionError):
+        SubscriptionFilter.from_client(raw_filter)
+
+
+def test_routing_keys_extracted_from_the_message():
+    routing = MessageRouting.from_message(event_message("Transfer", 7, **{"from": ALICE, "to": BOB}))
+
+    assert routing.event == "Transfer"
+    assert routing.token_id == "7"
+    assert routing.contract == NFT_ADDRESS
+    assert routing.addresses == {ALICE, BOB}
+    assert MessageRouting.from_message("non json").event is None
+
+
+def test_dimensions_are_combined_with_and_values_with_or():
+    subscription_filter = SubscriptionFilter.from_client({"tokenIds": [7, 8], "events": ["Transfer"]})
+
+    assert subscription_filter.matches(MessageRouting.from_message(event_message("Transfer", 8)))
+    assert not subscription_filter.matches(MessageRouting.from_message(event_message("NewBid", 7)))
+    assert not subscription_filter.matches(MessageRouting.from_message(event_message("Transfer", 9)))
+
+
+def test_index_returns_only_matching_filtered_subscribers():
+    index = SubscriptionIndex()
+    for subscriber in ("all", "token7", "alice", "bids"):
+        index.add(subscriber)
+    index.set_filter("token7", SubscriptionFilter.from_client({"tokenIds": [7]}))
+    index.set_filter("alice", SubscriptionFilter.from_client({"addresses": [ALICE]}))
+    index.set_filter("bids", SubscriptionFilter.from_client({"events": ["NewBid"]}))
+
+    routing = MessageRouting.from_message(event_message("Transfer", 7, **{"from": ALICE, "to": BOB}))
+    assert index.match(routing) == {"token7", "alice"}
+    assert index.unfiltered == {"all"}
+
+    index.set_filter("token7", SubscriptionFilter())
+    assert index.match(routing) == {"alice"}
+    assert "token7" in index.unfiltered
+
+    index.remove("alice")
+    assert index.match(routing) == set()
+    assert len(index) == 1